@@ -2,6 +2,7 @@ package common
 
 import (
 	"encoding/csv"
+	"errors"
 	"fmt"
 	"os"
 	"strconv"
@@ -33,22 +34,52 @@ func NewBetBatchReader(agencyID uint32, batchSize int) (*BetBatchReader, error)
 
 // NextBatch devuelve el próximo batch de apuestas
 func (b *BetBatchReader) NextBatch() ([]Bet, error) {
-	if b.closed {
-		// Si ya fue cerrado, devolvemos slice vacío y sin error
-		return []Bet{}, nil
-	}
 	bets := make([]Bet, 0, b.batchSize)
 
 	for len(bets) < b.batchSize {
+		bet, ok, err := b.nextBet()
+		if err != nil {
+			return nil, err
+		}
+		if !ok {
+			break
+		}
+		bets = append(bets, bet)
+	}
+	return bets, nil
+}
+
+// Skip descarta las próximas n apuestas validas, p. ej. las que el servidor ya
+// almacenó antes de que el cliente se reconectara
+func (b *BetBatchReader) Skip(n int) error {
+	for i := 0; i < n; i++ {
+		_, ok, err := b.nextBet()
+		if err != nil {
+			return err
+		}
+		if !ok {
+			return errors.New("agency file has fewer bets than the server already stored")
+		}
+	}
+	return nil
+}
+
+// nextBet devuelve la próxima apuesta valida, o ok en false si ya no hay más
+func (b *BetBatchReader) nextBet() (bet Bet, ok bool, err error) {
+	for {
+		if b.closed {
+			// Si ya fue cerrado, no hay más apuestas y no hay error
+			return Bet{}, false, nil
+		}
 		record, err := b.reader.Read()
 		if err != nil {
 			b.Close() // Cierra el archivo si termina o hay error
-			// Si es EOF, devolvemos los bets que hayamos leído, y no devuelvo error
+			// Si es EOF, no hay más apuestas, y no devuelvo error
 			if err == os.ErrClosed || err.Error() == "EOF" {
-				return bets, nil
+				return Bet{}, false, nil
 			}
 			// Solo devolvemos error si es irrecuperable
-			return nil, err
+			return Bet{}, false, err
 		}
 		if len(record) < 5 {
 			fmt.Printf("Warning: invalid data in record: %v (expected 5 fields, got %d)\n", record, len(record))
@@ -60,10 +91,8 @@ func (b *BetBatchReader) NextBatch() ([]Bet, error) {
 			fmt.Printf("Warning: invalid data in record: %v (document_int err: %v, number_int err: %v)\n", record, errDoc, errNum)
 			continue
 		}
-		bet := NewBet(b.agencyID, record[0], record[1], uint32(document_int), record[3], uint32(number_int))
-		bets = append(bets, bet)
+		return NewBet(b.agencyID, record[0], record[1], uint32(document_int), record[3], uint32(number_int)), true, nil
 	}
-	return bets, nil
 }
 
 // Close cierra el file descriptor si no fue cerrado antes
@@ -9,6 +9,12 @@ import (
 
 var log = logging.MustGetLogger("log")
 
+// Reintentos de conexion cuando el servidor responde CONEXION_RECHAZADA
+const (
+	maxRejectedAttempts = 6
+	initialRejectedWait = 200 * time.Millisecond
+)
+
 // ClientConfig Configuration used by the client
 type ClientConfig struct {
 	ID              uint32
@@ -16,6 +22,14 @@ type ClientConfig struct {
 	LoopAmount      int
 	LoopPeriod      time.Duration
 	MaxBetsPerBatch int
+	// Cantidad maxima de batches enviados sin confirmar. Con 1 se espera la
+	// confirmacion de cada batch antes de enviar el siguiente
+	BatchWindow int
+	// Espera maxima de cada suscripcion a los ganadores. Con 0 se consulta
+	// periodicamente con SOLICITUD_GANADORES
+	WinnersWait time.Duration
+	// Enviar los batches comprimidos con zlib, si el servidor lo acepta
+	BatchCompression bool
 }
 
 // Client Entity that encapsulates how
@@ -23,6 +37,9 @@ type Client struct {
 	config  ClientConfig
 	comm    *Communication
 	stopped bool
+	// Modo pipelined: ultima secuencia enviada y batches sin confirmar
+	sequence uint32
+	inFlight int
 }
 
 // NewClient Initializes a new client receiving the configuration
@@ -69,18 +86,16 @@ func (c *Client) StartClientLoop() error {
 	}
 	defer reader.Close()
 
-	err = c.createClientCommunication()
+	bets_made, completed, err := c.connectAndResume(reader)
 	if err != nil {
-		log.Errorf("action: crear_comunicacion | result: fail | client_id: %v | error: %v",
+		log.Errorf("action: retomar_envio | result: fail | client_id: %v | error: %v",
 			c.config.ID,
 			err,
 		)
 		return err
 	}
 
-	bets_made := 0
-
-	for {
+	for !completed {
 		if c.stopped {
 			log.Infof("action: loop_finished | result: stopped | client_id: %v", c.config.ID)
 			return nil
@@ -100,7 +115,11 @@ func (c *Client) StartClientLoop() error {
 			break
 		}
 
-		err = c.MakeBetBatch(batch)
+		if c.config.BatchWindow > 1 {
+			err = c.MakePipelinedBetBatch(batch)
+		} else {
+			err = c.MakeBetBatch(batch)
+		}
 		if err != nil {
 			log.Errorf("action: loop_finished | result: fail | client_id: %v | error: %v",
 				c.config.ID,
@@ -116,18 +135,23 @@ func (c *Client) StartClientLoop() error {
 		time.Sleep(c.config.LoopPeriod)
 	}
 
-	err = c.SendBetBatchEnd()
-	if err != nil {
-		log.Errorf("action: send_bet_batch_end | result: fail | client_id: %v | error: %v",
-			c.config.ID,
-			err,
-		)
-		return err
+	if !completed {
+		err = c.WaitPipelinedConfirmations(0)
+		if err == nil {
+			err = c.SendBetBatchEnd()
+		}
+		if err != nil {
+			log.Errorf("action: send_bet_batch_end | result: fail | client_id: %v | error: %v",
+				c.config.ID,
+				err,
+			)
+			return err
+		}
 	}
 
 	log.Infof("action: apuesta_enviada | result: success | cantidad_total: %v", bets_made)
 
-	result, err := c.comm.GetLotteryResult(c.config.ID)
+	result, err := c.comm.GetLotteryResult(c.config.ID, c.config.WinnersWait)
 	if err != nil {
 		log.Errorf("action: get_lottery_result | result: fail | client_id: %v | error: %v",
 			c.config.ID,
@@ -141,6 +165,77 @@ func (c *Client) StartClientLoop() error {
 	return nil
 }
 
+// connectAndResume se conecta al servidor y retoma el envio. Si el servidor rechaza la
+// conexion, reintenta con una espera que se duplica en cada intento
+func (c *Client) connectAndResume(reader *BetBatchReader) (int, bool, error) {
+	wait := initialRejectedWait
+	for attempt := 1; ; attempt++ {
+		err := c.createClientCommunication()
+		if err != nil {
+			log.Errorf("action: crear_comunicacion | result: fail | client_id: %v | error: %v",
+				c.config.ID,
+				err,
+			)
+			return 0, false, err
+		}
+
+		err = c.negotiateCompression()
+		bets_made, completed := 0, false
+		if err == nil {
+			bets_made, completed, err = c.resumeFromServer(reader)
+		}
+		if !errors.Is(err, ErrConnectionRejected) || attempt == maxRejectedAttempts || c.stopped {
+			return bets_made, completed, err
+		}
+		log.Warningf("action: connect | result: rejected | client_id: %v | attempt: %v | error: %v",
+			c.config.ID,
+			attempt,
+			err,
+		)
+		c.comm.Close()
+		c.comm = nil
+		time.Sleep(wait)
+		wait *= 2
+	}
+}
+
+// negotiateCompression pide enviar los batches comprimidos, si está configurado
+func (c *Client) negotiateCompression() error {
+	if !c.config.BatchCompression {
+		return nil
+	}
+	accepted, err := c.comm.NegotiateCompression()
+	if err != nil {
+		return err
+	}
+	log.Infof("action: negociar_compresion | result: success | client_id: %v | aceptada: %v", c.config.ID, accepted)
+	return nil
+}
+
+// resumeFromServer consulta el progreso de la agencia en el servidor y saltea las
+// apuestas que ya almacenó, p. ej. si el cliente se reinició a mitad del envio.
+// Devuelve la cantidad de apuestas salteadas, y si la agencia ya completó su envio
+func (c *Client) resumeFromServer(reader *BetBatchReader) (int, bool, error) {
+	cumulative, bets, completed, err := c.comm.GetProgress(c.config.ID)
+	if err != nil {
+		return 0, false, err
+	}
+	if cumulative == 0 && !completed {
+		return 0, false, nil
+	}
+	if !completed {
+		err = reader.Skip(int(bets))
+		if err != nil {
+			return 0, false, err
+		}
+		// Los batches siguientes continuan la secuencia de los ya almacenados
+		c.sequence = cumulative
+	}
+	log.Infof("action: retomar_envio | result: success | client_id: %v | batches: %v | apuestas: %v | completado: %v",
+		c.config.ID, cumulative, bets, completed)
+	return int(bets), completed, nil
+}
+
 func (c *Client) MakeBetBatch(bets []Bet) error {
 	if c.comm == nil {
 		return errors.New("communication not initialized")
@@ -162,6 +257,44 @@ func (c *Client) MakeBetBatch(bets []Bet) error {
 	return nil
 }
 
+// MakePipelinedBetBatch envia un batch sin esperar su confirmacion, salvo que ya haya
+// BatchWindow batches sin confirmar: en ese caso primero espera una confirmacion
+func (c *Client) MakePipelinedBetBatch(bets []Bet) error {
+	if c.comm == nil {
+		return errors.New("communication not initialized")
+	}
+
+	err := c.WaitPipelinedConfirmations(c.config.BatchWindow - 1)
+	if err != nil {
+		return err
+	}
+
+	c.sequence++
+	err = c.comm.SendBetsBatchSequenced(bets, c.config.ID, c.sequence)
+	if err != nil {
+		return errors.New("failed to send bet batch to server")
+	}
+	c.inFlight++
+
+	return nil
+}
+
+// WaitPipelinedConfirmations lee confirmaciones hasta que queden a lo sumo maxInFlight
+// batches sin confirmar
+func (c *Client) WaitPipelinedConfirmations(maxInFlight int) error {
+	for c.inFlight > maxInFlight {
+		_, _, resp, err := c.comm.RecieveSequenceConfirmation()
+		if err != nil {
+			return errors.New("failed to receive response from server")
+		}
+		if resp != 0 {
+			return errors.New("server returned error code")
+		}
+		c.inFlight--
+	}
+	return nil
+}
+
 func (c *Client) SendBetBatchEnd() error {
 	if c.comm == nil {
 		return errors.New("communication not initialized")
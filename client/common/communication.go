@@ -1,8 +1,11 @@
 package common
 
 import (
+	"bytes"
+	"compress/zlib"
 	"encoding/binary"
 	"errors"
+	"fmt"
 	"net"
 	"time"
 )
@@ -11,6 +14,9 @@ type Communication struct {
 	conn               net.Conn
 	max_bets_per_batch int
 	server_address     string
+	// Con compresion negociada, un unico stream zlib para todos los batches de la conexion
+	compressor *zlib.Writer
+	compressed bytes.Buffer
 }
 
 const (
@@ -19,8 +25,30 @@ const (
 	SOLICITUD_GANADORES    byte = 3
 	SORTEO_NO_REALIZADO    byte = 4
 	RESPUESTA_GANADORES    byte = 5
+	// Modo pipelined: batches con numero de secuencia y confirmaciones por secuencia
+	ENVIO_BATCH_SECUENCIADO byte = 7
+	CONFIRMACION_SECUENCIA  byte = 8
+	// SOLICITUD_GANADORES que el servidor retiene hasta que se realice el sorteo
+	SUSCRIPCION_GANADORES byte = 9
+	// Progreso del envio de la agencia, para retomarlo despues de reconectarse
+	CONSULTA_PROGRESO byte = 12
+	PROGRESO          byte = 13
+	// El servidor no atiende la conexion: está saturado, o la agencia ya tiene demasiadas conexiones
+	CONEXION_RECHAZADA byte = 14
+	// Compresion de los batches, negociada por conexion
+	NEGOCIACION_COMPRESION byte = 15
+	FRAME_COMPRIMIDO       byte = 16
 )
 
+// Codecs de NEGOCIACION_COMPRESION
+const (
+	COMPRESION_NINGUNA byte = 0
+	COMPRESION_ZLIB    byte = 1
+)
+
+// ErrConnectionRejected indica que el servidor respondió CONEXION_RECHAZADA y cerró la conexion
+var ErrConnectionRejected = errors.New("connection rejected by server")
+
 func CreateCommunication(server_address string, max_bets_per_batch int) (*Communication, error) {
 	conn, err := net.Dial("tcp", server_address)
 	if err != nil {
@@ -48,6 +76,8 @@ func (comm *Communication) stopConnection() {
 		comm.conn.Close()
 		comm.conn = nil
 	}
+	// El stream zlib es propio de la conexion: una nueva conexion tiene que volver a negociarlo
+	comm.compressor = nil
 }
 
 func (comm *Communication) ResetConnection() error {
@@ -65,8 +95,93 @@ func (comm *Communication) SendBetsBatch(bets []Bet, agencyId uint32) error {
 	}
 
 	serializedBets := SerializeBetsBatchMessage(bets, agencyId)
-	err := writeAll(comm.conn, serializedBets)
-	return err
+	return comm.writeBatch(serializedBets)
+}
+
+// SendBetsBatchSequenced envia un batch del modo pipelined, sin esperar su confirmacion
+func (comm *Communication) SendBetsBatchSequenced(bets []Bet, agencyId uint32, sequence uint32) error {
+	if comm.conn == nil {
+		return errors.New("there is no connection")
+	}
+
+	if len(bets) > comm.max_bets_per_batch {
+		return errors.New("too many bets")
+	}
+
+	serializedBets := SerializeSequencedBetsBatchMessage(bets, agencyId, sequence)
+	return comm.writeBatch(serializedBets)
+}
+
+// NegotiateCompression le pide al servidor enviar los batches comprimidos con zlib.
+// Devuelve si el servidor la aceptó; si no, los batches se siguen enviando sin comprimir
+func (comm *Communication) NegotiateCompression() (bool, error) {
+	if comm.conn == nil {
+		return false, errors.New("there is no connection")
+	}
+
+	err := writeAll(comm.conn, []byte{NEGOCIACION_COMPRESION, COMPRESION_ZLIB})
+	if err != nil {
+		return false, err
+	}
+
+	buffer := make([]byte, 2)
+	err = readAll(comm.conn, buffer)
+	if err != nil {
+		return false, err
+	}
+	// Es la primera respuesta de la conexion: si el servidor no la atiende, responde el rechazo
+	if buffer[0] == CONEXION_RECHAZADA {
+		return false, fmt.Errorf("%w: reason %v", ErrConnectionRejected, buffer[1])
+	}
+	if buffer[0] != NEGOCIACION_COMPRESION {
+		return false, errors.New("invalid compression negotiation response")
+	}
+	if buffer[1] != COMPRESION_ZLIB {
+		return false, nil
+	}
+	comm.compressed.Reset()
+	comm.compressor = zlib.NewWriter(&comm.compressed)
+	return true, nil
+}
+
+// writeBatch envia un batch serializado, dentro de un FRAME_COMPRIMIDO si se negoció
+// compresion. Cada frame termina en un sync flush, para que el servidor lo pueda
+// decodificar sin esperar al siguiente
+func (comm *Communication) writeBatch(serialized []byte) error {
+	if comm.compressor == nil {
+		return writeAll(comm.conn, serialized)
+	}
+
+	comm.compressed.Reset()
+	comm.compressed.Write([]byte{FRAME_COMPRIMIDO, 0, 0, 0, 0})
+	if _, err := comm.compressor.Write(serialized); err != nil {
+		return err
+	}
+	if err := comm.compressor.Flush(); err != nil {
+		return err
+	}
+	frame := comm.compressed.Bytes()
+	binary.BigEndian.PutUint32(frame[1:5], uint32(len(frame)-5))
+	return writeAll(comm.conn, frame)
+}
+
+// RecieveSequenceConfirmation lee la confirmacion de un batch pipelined. cumulative es la
+// mayor secuencia tal que esa y todas las anteriores ya fueron almacenadas por el servidor
+func (comm *Communication) RecieveSequenceConfirmation() (sequence uint32, cumulative uint32, resp byte, err error) {
+	if comm.conn == nil {
+		return 0, 0, 0, errors.New("there is no connection")
+	}
+	buffer := make([]byte, 10)
+
+	err = readAll(comm.conn, buffer)
+	if err != nil {
+		return 0, 0, 0, err
+	}
+
+	if buffer[0] != CONFIRMACION_SECUENCIA {
+		return 0, 0, 0, errors.New("invalid sequence confirmation")
+	}
+	return binary.BigEndian.Uint32(buffer[1:5]), binary.BigEndian.Uint32(buffer[5:9]), buffer[9], nil
 }
 
 func (comm *Communication) RecieveConfirmation() (resp byte, err error) {
@@ -87,6 +202,39 @@ func (comm *Communication) RecieveConfirmation() (resp byte, err error) {
 	return buffer[1], nil
 }
 
+// GetProgress consulta hasta donde llegó el envio de la agencia: cumulative es la mayor
+// secuencia tal que esa y todas las anteriores ya están almacenadas, bets la cantidad de
+// apuestas de esos batches, y completed si la agencia ya completó su envio
+func (comm *Communication) GetProgress(agencyId uint32) (cumulative uint32, bets uint32, completed bool, err error) {
+	if comm.conn == nil {
+		return 0, 0, false, errors.New("there is no connection")
+	}
+
+	msg := append([]byte{CONSULTA_PROGRESO}, uint32ToBytes(agencyId)...)
+	err = writeAll(comm.conn, msg)
+	if err != nil {
+		return 0, 0, false, err
+	}
+
+	buffer := make([]byte, 10)
+	err = readAll(comm.conn, buffer[:2])
+	if err != nil {
+		return 0, 0, false, err
+	}
+	// Es la primera respuesta de la conexion: si el servidor no la atiende, responde el rechazo
+	if buffer[0] == CONEXION_RECHAZADA {
+		return 0, 0, false, fmt.Errorf("%w: reason %v", ErrConnectionRejected, buffer[1])
+	}
+	if buffer[0] != PROGRESO {
+		return 0, 0, false, errors.New("invalid progress response")
+	}
+	err = readAll(comm.conn, buffer[2:])
+	if err != nil {
+		return 0, 0, false, err
+	}
+	return binary.BigEndian.Uint32(buffer[1:5]), binary.BigEndian.Uint32(buffer[5:9]), buffer[9] != 0, nil
+}
+
 func (comm *Communication) Close() {
 	comm.stopConnection()
 }
@@ -135,17 +283,36 @@ func SerializeBetsBatchMessage(bets []Bet, agencyId uint32) []byte {
 		return nil
 	}
 
+	header_body := make([]byte, 5)
+	binary.BigEndian.PutUint32(header_body[:4], agencyId)
+	header_body[4] = byte(len(bets))
+
+	return serializeBatch(ENVIO_BATCH, header_body, bets)
+}
+
+// SerializeSequencedBetsBatchMessage es igual a SerializeBetsBatchMessage, pero con el
+// numero de secuencia despues de la agencia
+func SerializeSequencedBetsBatchMessage(bets []Bet, agencyId uint32, sequence uint32) []byte {
+	if len(bets) > 255 {
+		return nil
+	}
+
+	header_body := make([]byte, 9)
+	binary.BigEndian.PutUint32(header_body[:4], agencyId)
+	binary.BigEndian.PutUint32(header_body[4:8], sequence)
+	header_body[8] = byte(len(bets))
+
+	return serializeBatch(ENVIO_BATCH_SECUENCIADO, header_body, bets)
+}
+
+func serializeBatch(messageType byte, header_body []byte, bets []Bet) []byte {
 	serializedBets := make([][]byte, len(bets))
 	for i, bet := range bets {
 		serializedBets[i] = serializeSingleBet(bet)
 	}
 
 	header_msg := make([]byte, 1)
-	header_msg[0] = ENVIO_BATCH
-
-	header_body := make([]byte, 5)
-	binary.BigEndian.PutUint32(header_body[:4], agencyId)
-	header_body[4] = byte(len(bets))
+	header_msg[0] = messageType
 
 	result := append(header_msg, header_body...)
 
@@ -169,11 +336,18 @@ func stringToNullEndedBytes(s string, max_size int) []byte {
 	return append([]byte(s), 0)
 }
 
-func (comm *Communication) GetLotteryResult(agencyId uint32) ([]uint32, error) {
+// Con wait mayor a 0 se suscribe a los ganadores: el servidor responde recien
+// cuando se realiza el sorteo, o cuando pasa wait (acotado por el servidor)
+func (comm *Communication) GetLotteryResult(agencyId uint32, wait time.Duration) ([]uint32, error) {
 
 	var ganadores []uint32 = nil
 	for {
-		err := comm.sendWinnersRequest(agencyId)
+		var err error
+		if wait > 0 {
+			err = comm.sendWinnersSubscription(agencyId, wait)
+		} else {
+			err = comm.sendWinnersRequest(agencyId)
+		}
 		if err != nil {
 			return nil, err
 		}
@@ -188,8 +362,11 @@ func (comm *Communication) GetLotteryResult(agencyId uint32) ([]uint32, error) {
 		}
 
 		//Si sigue siendo nil, tengo que reiniciar la conexion,
-		// esperar un tiempo, y volver a consultar por ganadores
-		time.Sleep(100 * time.Millisecond)
+		// esperar un tiempo, y volver a consultar por ganadores.
+		// Una suscripcion vencida ya esperó en el servidor: se renueva sin demora
+		if wait <= 0 {
+			time.Sleep(100 * time.Millisecond)
+		}
 		log.Infof("action: consulta_ganadores | result: in_progress | client_id: %v", agencyId)
 	}
 
@@ -212,6 +389,14 @@ func (comm *Communication) sendWinnersRequest(agencyId uint32) error {
 	return nil
 }
 
+func (comm *Communication) sendWinnersSubscription(agencyId uint32, wait time.Duration) error {
+	msg := []byte{SUSCRIPCION_GANADORES}
+	msg = append(msg, uint32ToBytes(agencyId)...)
+	msg = append(msg, uint32ToBytes(uint32(wait.Milliseconds()))...)
+
+	return writeAll(comm.conn, msg)
+}
+
 // Devuelve null en caso de que la lotería no se haya realizado,
 // Devuelve un array vacio en caso de que la lotería se haya realizado, pero no hay ningun ganador
 func (comm *Communication) receiveWinnersResponse() ([]uint32, error) {
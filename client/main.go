@@ -39,6 +39,9 @@ func InitConfig() (*viper.Viper, error) {
 	v.BindEnv("loop", "period")
 	v.BindEnv("loop", "amount")
 	v.BindEnv("log", "level")
+	v.BindEnv("batch", "window")
+	v.BindEnv("batch", "compression")
+	v.BindEnv("winners", "wait")
 
 	// Try to read configuration from config file. If config file
 	// does not exists then ReadInConfig will fail but configuration
@@ -110,11 +113,14 @@ func main() {
 	PrintConfig(v)
 
 	clientConfig := common.ClientConfig{
-		ServerAddress:   v.GetString("server.address"),
-		ID:              v.GetUint32("id"),
-		LoopAmount:      v.GetInt("loop.amount"),
-		LoopPeriod:      v.GetDuration("loop.period"),
-		MaxBetsPerBatch: v.GetInt("batch.maxAmount"),
+		ServerAddress:    v.GetString("server.address"),
+		ID:               v.GetUint32("id"),
+		LoopAmount:       v.GetInt("loop.amount"),
+		LoopPeriod:       v.GetDuration("loop.period"),
+		MaxBetsPerBatch:  v.GetInt("batch.maxAmount"),
+		BatchWindow:      v.GetInt("batch.window"),
+		WinnersWait:      v.GetDuration("winners.wait"),
+		BatchCompression: v.GetBool("batch.compression"),
 	}
 
 	client := common.NewClient(clientConfig)
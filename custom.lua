@@ -17,16 +17,48 @@ local f_conf = ProtoField.uint8("custom.confirmacion", "Confirmación", base.DEC
 -- SOLICITUD_GANADORES
 local f_solicitud_id = ProtoField.uint32("custom.solicitud.id_agencia", "ID Agencia", base.DEC)
 
+-- NEGOCIACION_PROTOCOLO
+local f_version = ProtoField.uint8("custom.negociacion.version", "Versión de protocolo", base.DEC)
+
 -- RESPUESTA_GANADORES
 local f_cant_ganadores = ProtoField.uint32("custom.respuesta.cant", "Cantidad de ganadores", base.DEC)
 local f_dni_ganador    = ProtoField.uint32("custom.respuesta.dni", "DNI Ganador", base.DEC)
 
+-- ENVIO_BATCH_SECUENCIADO y CONFIRMACION_SECUENCIA
+local f_secuencia = ProtoField.uint32("custom.secuencia", "Secuencia", base.DEC)
+local f_acumulada = ProtoField.uint32("custom.acumulada", "Acumulada", base.DEC)
+
+-- SUSCRIPCION_GANADORES
+local f_espera_ms = ProtoField.uint32("custom.suscripcion.espera_ms", "Espera (ms)", base.DEC)
+
+-- SOLICITUD_GANADORES_RONDA
+local f_ronda = ProtoField.uint32("custom.ronda", "Ronda", base.DEC)
+
+-- PROGRESO
+local f_apuestas   = ProtoField.uint32("custom.progreso.apuestas", "Apuestas", base.DEC)
+local f_completada = ProtoField.uint8("custom.progreso.completada", "Completada", base.DEC)
+
+-- CONEXION_RECHAZADA
+local f_motivo = ProtoField.uint8("custom.rechazo.motivo", "Motivo", base.DEC)
+
+-- NEGOCIACION_COMPRESION y FRAME_COMPRIMIDO
+local f_codec     = ProtoField.uint8("custom.compresion.codec", "Codec", base.DEC)
+local f_longitud  = ProtoField.uint32("custom.comprimido.longitud", "Longitud", base.DEC)
+local f_comprimido = ProtoField.bytes("custom.comprimido.datos", "Datos comprimidos")
+
 p_custom.fields = {
     f_tipo,
     f_id_agencia, f_num_apuestas, f_nombre, f_apellido, f_dni, f_cumple, f_numero,
     f_conf,
     f_solicitud_id,
-    f_cant_ganadores, f_dni_ganador
+    f_cant_ganadores, f_dni_ganador,
+    f_version,
+    f_secuencia, f_acumulada,
+    f_espera_ms,
+    f_ronda,
+    f_apuestas, f_completada,
+    f_motivo,
+    f_codec, f_longitud, f_comprimido
 }
 
 -- Helper: lee stringz con límite de longitud
@@ -52,7 +84,71 @@ local function read_stringz_bounded(buffer, offset, max_len)
     return str, offset + consumed, consumed
 end
 
--- Función principal
+-- Helper: agrega los campos de ancho fijo que entren en el buffer
+local function add_fixed(buffer, subtree, offset, fields)
+    for _, field in ipairs(fields) do
+        local f, size = field[1], field[2]
+        if offset + size > buffer:len() then return offset end
+        subtree:add(f, buffer(offset, size))
+        offset = offset + size
+    end
+    return offset
+end
+
+-- Helper: decodifica las apuestas de un ENVIO_BATCH o ENVIO_BATCH_SECUENCIADO
+local function dissect_apuestas(buffer, subtree, offset)
+    -- num_apuestas
+    if offset + 1 > buffer:len() then return end
+    local num_apuestas = buffer(offset,1):uint()
+    subtree:add(f_num_apuestas, buffer(offset,1))
+    offset = offset + 1
+
+    -- Apuestas
+    for i = 1, num_apuestas do
+        if offset >= buffer:len() then break end
+
+        local apuesta_tree = subtree:add(p_custom, buffer(offset), "Apuesta " .. i)
+
+        -- nombre (stringz, max 30)
+        local s_off = offset
+        local nombre, new_off, consumed = read_stringz_bounded(buffer, offset, 30)
+        if nombre ~= nil and consumed > 0 then
+            apuesta_tree:add(f_nombre, buffer(s_off, consumed))
+            offset = new_off
+        end
+
+        -- apellido (stringz, max 30)
+        s_off = offset
+        local apellido, new_off, consumed = read_stringz_bounded(buffer, offset, 30)
+        if apellido ~= nil and consumed > 0 then
+            apuesta_tree:add(f_apellido, buffer(s_off, consumed))
+            offset = new_off
+        end
+
+        -- dni (4 bytes)
+        if offset + 4 <= buffer:len() then
+            apuesta_tree:add(f_dni, buffer(offset,4))
+            offset = offset + 4
+        else break end
+
+        -- cumple (stringz, max 11)
+        s_off = offset
+        local cumple, new_off, consumed = read_stringz_bounded(buffer, offset, 11)
+        if cumple ~= nil and consumed > 0 then
+            apuesta_tree:add(f_cumple, buffer(s_off, consumed))
+            offset = new_off
+        end
+
+        -- numero (4 bytes)
+        if offset + 4 <= buffer:len() then
+            apuesta_tree:add(f_numero, buffer(offset,4))
+            offset = offset + 4
+        else break end
+    end
+end
+
+-- Función principal. Decodifica los mensajes de la version 1 del protocolo:
+-- los frames v2 empiezan con su longitud y no con el tipo de mensaje.
 function p_custom.dissector(buffer, pinfo, tree)
     if buffer:len() < 1 then return end
 
@@ -72,54 +168,7 @@ function p_custom.dissector(buffer, pinfo, tree)
         subtree:add(f_id_agencia, buffer(offset,4))
         offset = offset + 4
 
-        -- num_apuestas
-        if offset + 1 > buffer:len() then return end
-        local num_apuestas = buffer(offset,1):uint()
-        subtree:add(f_num_apuestas, buffer(offset,1))
-        offset = offset + 1
-
-        -- Apuestas
-        for i = 1, num_apuestas do
-            if offset >= buffer:len() then break end
-
-            local apuesta_tree = subtree:add(p_custom, buffer(offset), "Apuesta " .. i)
-
-            -- nombre (stringz, max 30)
-            local s_off = offset
-            local nombre, new_off, consumed = read_stringz_bounded(buffer, offset, 30)
-            if nombre ~= nil and consumed > 0 then
-                apuesta_tree:add(f_nombre, buffer(s_off, consumed))
-                offset = new_off
-            end
-
-            -- apellido (stringz, max 30)
-            s_off = offset
-            local apellido, new_off, consumed = read_stringz_bounded(buffer, offset, 30)
-            if apellido ~= nil and consumed > 0 then
-                apuesta_tree:add(f_apellido, buffer(s_off, consumed))
-                offset = new_off
-            end
-
-            -- dni (4 bytes)
-            if offset + 4 <= buffer:len() then
-                apuesta_tree:add(f_dni, buffer(offset,4))
-                offset = offset + 4
-            else break end
-
-            -- cumple (stringz, max 11)
-            s_off = offset
-            local cumple, new_off, consumed = read_stringz_bounded(buffer, offset, 11)
-            if cumple ~= nil and consumed > 0 then
-                apuesta_tree:add(f_cumple, buffer(s_off, consumed))
-                offset = new_off
-            end
-
-            -- numero (4 bytes)
-            if offset + 4 <= buffer:len() then
-                apuesta_tree:add(f_numero, buffer(offset,4))
-                offset = offset + 4
-            else break end
-        end
+        dissect_apuestas(buffer, subtree, offset)
 
     elseif tipo == 2 then
         pinfo.cols.info = "CONFIRMACION_RECEPCION"
@@ -150,6 +199,60 @@ function p_custom.dissector(buffer, pinfo, tree)
                 offset = offset + 4
             end
         end
+    elseif tipo == 6 then
+        pinfo.cols.info = "NEGOCIACION_PROTOCOLO"
+        if offset + 1 <= buffer:len() then
+            subtree:add(f_version, buffer(offset,1))
+        end
+
+    elseif tipo == 7 then
+        pinfo.cols.info = "ENVIO_BATCH_SECUENCIADO"
+        offset = add_fixed(buffer, subtree, offset, {{f_id_agencia, 4}, {f_secuencia, 4}})
+        dissect_apuestas(buffer, subtree, offset)
+
+    elseif tipo == 8 then
+        pinfo.cols.info = "CONFIRMACION_SECUENCIA"
+        add_fixed(buffer, subtree, offset, {{f_secuencia, 4}, {f_acumulada, 4}, {f_conf, 1}})
+
+    elseif tipo == 9 then
+        pinfo.cols.info = "SUSCRIPCION_GANADORES"
+        add_fixed(buffer, subtree, offset, {{f_solicitud_id, 4}, {f_espera_ms, 4}})
+
+    elseif tipo == 10 then
+        pinfo.cols.info = "SOLICITUD_GANADORES_RONDA"
+        add_fixed(buffer, subtree, offset, {{f_solicitud_id, 4}, {f_ronda, 4}})
+
+    elseif tipo == 11 then
+        pinfo.cols.info = "RONDA_NO_DISPONIBLE"
+        -- sin body
+
+    elseif tipo == 12 then
+        pinfo.cols.info = "CONSULTA_PROGRESO"
+        add_fixed(buffer, subtree, offset, {{f_solicitud_id, 4}})
+
+    elseif tipo == 13 then
+        pinfo.cols.info = "PROGRESO"
+        add_fixed(buffer, subtree, offset, {{f_acumulada, 4}, {f_apuestas, 4}, {f_completada, 1}})
+
+    elseif tipo == 14 then
+        pinfo.cols.info = "CONEXION_RECHAZADA"
+        add_fixed(buffer, subtree, offset, {{f_motivo, 1}})
+
+    elseif tipo == 15 then
+        pinfo.cols.info = "NEGOCIACION_COMPRESION"
+        add_fixed(buffer, subtree, offset, {{f_codec, 1}})
+
+    elseif tipo == 16 then
+        -- Los datos son un stream zlib de toda la conexion: no se descomprimen
+        pinfo.cols.info = "FRAME_COMPRIMIDO"
+        if offset + 4 > buffer:len() then return end
+        local longitud = buffer(offset,4):uint()
+        subtree:add(f_longitud, buffer(offset,4))
+        offset = offset + 4
+        local disponibles = math.min(longitud, buffer:len() - offset)
+        if disponibles > 0 then
+            subtree:add(f_comprimido, buffer(offset, disponibles))
+        end
     else
         pinfo.cols.info = "Tipo desconocido ("..tipo..")"
     end
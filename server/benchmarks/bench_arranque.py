@@ -0,0 +1,126 @@
+"""
+Benchmark del arranque del servidor, contra un presupuesto en milisegundos.
+
+Mide, como mediana de varias repeticiones:
+- el arranque del interprete solo (python -c pass), el piso de cualquier arranque;
+- el tiempo de importar main, con el detalle de -X importtime de los modulos
+  que más tardan;
+- el tiempo desde que se lanza main.py hasta que responde el primer mensaje
+  (una CONSULTA_PROGRESO), en un directorio sin apuestas.
+
+Termina con error si el arranque hasta responder supera --presupuesto-ms.
+Los modulos de common tienen que estar compilados (__pycache__), como en la
+imagen de Docker: si no, cada importacion incluye compilar el modulo.
+
+Uso (desde server/):
+    python -m benchmarks.bench_arranque [--repeticiones 10] [--presupuesto-ms 150] [--modulos 10]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+DIRECTORIO_SERVIDOR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONSULTA_PROGRESO = 12
+PROGRESO = 13
+
+
+def tiempo_interprete() -> float:
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - inicio
+
+
+def tiempos_de_importacion() -> dict:
+    """Tiempo propio y acumulado de cada modulo al importar main, en microsegundos, según -X importtime."""
+    resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=DIRECTORIO_SERVIDOR,
+                               env=_entorno(0), capture_output=True, text=True, check=True)
+    tiempos = {}
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, acumulado, modulo = linea[len('import time:'):].split('|')
+        tiempos[modulo.strip()] = (int(propio), int(acumulado))
+    return tiempos
+
+
+def tiempo_hasta_responder(directorio: str) -> float:
+    """Lanza main.py y mide hasta recibir la respuesta a una CONSULTA_PROGRESO."""
+    puerto = _puerto_libre()
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen([sys.executable, os.path.join(DIRECTORIO_SERVIDOR, 'main.py')], cwd=directorio,
+                               env=_entorno(puerto), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                conexion = socket.create_connection(('127.0.0.1', puerto))
+                break
+            except ConnectionRefusedError:
+                if proceso.poll() is not None:
+                    raise RuntimeError("el servidor terminó sin aceptar conexiones")
+                time.sleep(0.001)
+        with conexion:
+            conexion.sendall(bytes([CONSULTA_PROGRESO]) + (1).to_bytes(4, 'big'))
+            respuesta = conexion.recv(10)
+        duracion = time.perf_counter() - inicio
+        if not respuesta or respuesta[0] != PROGRESO:
+            raise RuntimeError(f"respuesta inesperada del servidor: {respuesta!r}")
+        return duracion
+    finally:
+        proceso.kill()
+        proceso.wait()
+
+
+def _entorno(puerto: int) -> dict:
+    entorno = dict(os.environ, PYTHONPATH=DIRECTORIO_SERVIDOR, SERVER_PORT=str(puerto), SERVER_LISTEN_BACKLOG='5',
+                   LOGGING_LEVEL='WARNING', CLIENT_AMOUNT='1')
+    entorno.pop('PYTHONPROFILEIMPORTTIME', None)
+    return entorno
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--presupuesto-ms', type=float, default=150)
+    parser.add_argument('--modulos', type=int, default=10)
+    args = parser.parse_args()
+
+    interprete = statistics.median(tiempo_interprete() for _ in range(args.repeticiones))
+
+    propios = defaultdict(list)
+    importacion = []
+    for _ in range(args.repeticiones):
+        tiempos = tiempos_de_importacion()
+        importacion.append(tiempos['main'][1])
+        for modulo, (propio, _) in tiempos.items():
+            propios[modulo].append(propio)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        arranques = [tiempo_hasta_responder(directorio) for _ in range(args.repeticiones)]
+    arranque = statistics.median(arranques)
+
+    print(f"interprete:            {interprete * 1000:7.1f}ms")
+    print(f"importar main:         {statistics.median(importacion) / 1000:7.1f}ms")
+    print(f"hasta responder:       {arranque * 1000:7.1f}ms (presupuesto: {args.presupuesto_ms:.0f}ms)")
+    print("modulos con más tiempo propio al importar main:")
+    for modulo, muestras in sorted(propios.items(), key=lambda item: -statistics.median(item[1]))[:args.modulos]:
+        print(f"  {modulo:<36} {statistics.median(muestras) / 1000:6.2f}ms")
+
+    if arranque * 1000 > args.presupuesto_ms:
+        sys.exit(f"el arranque supera el presupuesto: {arranque * 1000:.1f}ms > {args.presupuesto_ms:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
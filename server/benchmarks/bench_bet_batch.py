@@ -0,0 +1,78 @@
+"""
+Compara la representacion de los batches recibidos: una lista de Bet (como
+los armaba antes el decodificador, con documento y numero pasados a string y
+vueltos a parsear) contra el BetBatch columnar. Mide tiempo de armado, memoria
+retenida, formateo para bets.csv y busqueda de ganadores, con el dataset.
+
+Uso (desde server/):
+    python -m benchmarks.bench_bet_batch [--apuestas-por-batch 101]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.dataset import filas_por_agencia
+from common.utils import Bet, BetBatch, format_bets, has_won
+
+
+def armar_listas(batches):
+    return [[Bet(agencia, nombre, apellido, str(documento), nacimiento, str(numero))
+             for agencia, nombre, apellido, documento, nacimiento, numero in batch]
+            for batch in batches]
+
+
+def armar_columnares(batches):
+    resultado = []
+    for batch in batches:
+        columnar = BetBatch()
+        for agencia, nombre, apellido, documento, nacimiento, numero in batch:
+            columnar.append(agencia, nombre, apellido, documento, nacimiento, numero)
+        resultado.append(columnar)
+    return resultado
+
+
+def medir_armado(armar, batches):
+    gc.collect()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    armados = armar(batches)
+    duracion = time.perf_counter() - inicio
+    memoria, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return armados, duracion, memoria
+
+
+def medir(funcion) -> float:
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apuestas-por-batch', type=int, default=101)
+    args = parser.parse_args()
+
+    # Campos tal como los entrega el decodificador: documento y numero enteros.
+    # Los strings se copian para que no compartan objetos con el dataset.
+    filas = [(agencia, ''.join(nombre), ''.join(apellido), int(documento), ''.join(nacimiento), int(numero))
+             for agencia, filas_agencia in filas_por_agencia()
+             for nombre, apellido, documento, nacimiento, numero in filas_agencia]
+    n = args.apuestas_por_batch
+    batches = [filas[i:i + n] for i in range(0, len(filas), n)]
+    print(f"apuestas: {len(filas)} | batches: {len(batches)}")
+
+    for nombre, armar, ganadores in (
+            ('list[Bet]', armar_listas, lambda batch: [(bet.agency, int(bet.document)) for bet in batch if has_won(bet)]),
+            ('BetBatch', armar_columnares, lambda batch: list(batch.winners()))):
+        armados, armado, memoria = medir_armado(armar, batches)
+        formateo = medir(lambda: [format_bets(batch) for batch in armados])
+        sorteo = medir(lambda: [ganadores(batch) for batch in armados])
+        print(f"{nombre:<10} armado: {armado * 1000:8.1f}ms | memoria: {memoria / 1024 / 1024:7.2f}MiB | "
+              f"format_bets: {formateo * 1000:8.1f}ms | ganadores: {sorteo * 1000:7.2f}ms")
+        del armados
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compara el almacenamiento en bets.csv contra el log binario (common.bet_log)
+con las apuestas del dataset: tamaño en disco, tiempo de escritura, tiempo de
+carga completa y tiempo del recorrido que reconstruye el indice de ganadores
+al iniciar el servidor.
+
+Uso (desde server/):
+    python -m benchmarks.bench_bet_log [--repeticiones 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.dataset import cargar_bets
+from common.bet_log import MAGIC, format_bets_binary, load_bets_binary, scan_bets_binary, scan_bets_csv
+from common.utils import format_bets, load_bets
+from common.winners import IndiceGanadores
+
+
+def medir(funcion, repeticiones: int) -> float:
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def escribir_csv(path: str, bets):
+    with open(path, 'w') as file:
+        file.write(format_bets(bets))
+
+
+def escribir_binario(path: str, bets):
+    with open(path, 'wb') as file:
+        file.write(MAGIC + format_bets_binary(bets))
+
+
+def reconstruir_indice(scan_bets):
+    def reconstruir(path: str) -> int:
+        indice = IndiceGanadores()
+        indice.reconstruir_desde_registros(scan_bets(path))
+        return sum(len(dnis) for dnis in indice.ganadores_por_agencia().values())
+    return reconstruir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    bets = list(cargar_bets())
+    print(f"apuestas: {len(bets)}")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        formatos = (
+            ('csv', os.path.join(directorio, 'bets.csv'), escribir_csv, lambda path: list(load_bets(path)), reconstruir_indice(scan_bets_csv)),
+            ('binary', os.path.join(directorio, 'bets.bin'), escribir_binario, lambda path: list(load_bets_binary(path)), reconstruir_indice(scan_bets_binary)),
+        )
+        for nombre, path, escribir, cargar, ganadores in formatos:
+            escritura = medir(lambda: escribir(path, bets), args.repeticiones)
+            carga = medir(lambda: cargar(path), args.repeticiones)
+            sorteo = medir(lambda: ganadores(path), args.repeticiones)
+            print(f"{nombre:<7} tamaño: {os.path.getsize(path) / 1024:9.1f}KiB | escritura: {escritura * 1000:8.1f}ms | "
+                  f"carga: {carga * 1000:8.1f}ms | indice: {sorteo * 1000:8.1f}ms | ganadores: {ganadores(path)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Generador de carga reproducible: reproduce las apuestas del dataset
+(.data/dataset.zip) con N agencias simuladas contra main.py, todo en
+localhost, y escribe un reporte JSON para comparar corridas.
+
+Cada agencia es una conexion (el servidor atiende CLIENT_AMOUNT conexiones)
+y reenvia el CSV de una agencia del dataset, ciclando entre ellos: la
+agencia 7 reenvia agency-2.csv si el dataset tiene 5 agencias. Con ventana 1
+envia ENVIO_BATCH esperando cada confirmacion, como el cliente Go; con una
+ventana mayor envia ENVIO_BATCH_SECUENCIADO con esa cantidad de batches en
+vuelo. Despues avisa que terminó y se suscribe a los ganadores.
+
+El reporte tiene:
+- apuestas_por_segundo: apuestas enviadas sobre el tiempo hasta que la
+  ultima agencia completó su envio.
+- latencia_confirmacion_ms: p50/p99/max desde que se envia cada batch hasta
+  que llega su confirmacion.
+- espera_sorteo_s: desde que la ultima agencia completó su envio hasta que
+  la ultima recibió los ganadores.
+- rss_maximo_servidor_kib: suma de los picos de memoria residente (VmHWM)
+  del servidor y de sus workers, y rss_maximo_generador_kib el del propio
+  generador. El del servidor se lee de /proc, así que solo se reporta en Linux.
+
+Uso (desde server/):
+    python -m benchmarks.bench_carga [--agencias 5] [--apuestas-por-batch 101] [--ventana 1]
+        [--motor threads|asyncio|workers:N] [--max-apuestas 0] [--env FSYNC_POLICY=always] [--salida reporte.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.bench_engines import DIRECTORIO_SERVIDOR, esperar_servidor_listo
+from benchmarks.dataset import DATASET_PATH, filas_por_agencia
+from benchmarks.protocolo import (RESPUESTA_GANADORES, ApuestaCruda, serializar_envio_batch,
+                                  serializar_envio_batch_secuenciado, serializar_suscripcion_ganadores)
+
+CONFIRMACION_OK = bytes([2, 0])
+TAMANIO_CONFIRMACION_SECUENCIA = 10  # tipo, secuencia, acumulada, confirmacion
+ESPERA_SUSCRIPCION_MS = 30000
+# ENVIO_BATCH lleva la cantidad de apuestas en un byte
+MAXIMO_APUESTAS_POR_BATCH = 255
+
+
+def cargar_dataset(path: str, max_apuestas: int) -> List[List[ApuestaCruda]]:
+    """Apuestas de cada CSV del dataset, en orden de agencia, limitadas a max_apuestas (0 = todas)."""
+    agencias = []
+    for _, filas in filas_por_agencia(path):
+        apuestas = []
+        for nombre, apellido, documento, nacimiento, numero in filas:
+            if max_apuestas and len(apuestas) == max_apuestas:
+                break
+            apuestas.append((nombre, apellido, int(documento), nacimiento, int(numero)))
+        agencias.append(apuestas)
+    return agencias
+
+
+def serializar_batches(apuestas: List[ApuestaCruda], apuestas_por_batch: int, ventana: int) -> List[bytes]:
+    """
+    Frames de los batches de un CSV con id de agencia 0. El id ocupa los bytes
+    1 a 4 en ENVIO_BATCH y en ENVIO_BATCH_SECUENCIADO, y cada agencia lo
+    reemplaza al enviar, así que cada CSV se serializa una sola vez.
+    """
+    frames = []
+    for inicio in range(0, len(apuestas), apuestas_por_batch):
+        batch = apuestas[inicio:inicio + apuestas_por_batch]
+        if ventana == 1:
+            frames.append(serializar_envio_batch(0, batch))
+        else:
+            frames.append(serializar_envio_batch_secuenciado(0, len(frames) + 1, batch))
+    return frames
+
+
+class Agencia:
+    """Una agencia simulada y sus mediciones, en segundos de time.perf_counter()."""
+
+    def __init__(self, id_agencia: int, frames: List[bytes], apuestas: int):
+        self.id_agencia = id_agencia
+        self.id_bytes = id_agencia.to_bytes(4, 'big')
+        self.frames = frames
+        self.apuestas = apuestas
+        self.latencias: List[float] = []
+        self.completada = 0.0
+        self.ganadores_recibidos = 0.0
+        self.ganadores = 0
+
+    def _frame(self, frame: bytes) -> bytes:
+        return frame[:1] + self.id_bytes + frame[5:]
+
+    async def enviar(self, puerto: int, ventana: int):
+        reader, writer = await asyncio.open_connection('127.0.0.1', puerto)
+        try:
+            if ventana == 1:
+                await self._enviar_esperando_confirmacion(reader, writer)
+            else:
+                await self._enviar_pipelined(reader, writer, ventana)
+
+            writer.write(serializar_envio_batch(self.id_agencia, []))
+            if await reader.readexactly(2) != CONFIRMACION_OK:
+                raise RuntimeError(f"fin de envio rechazado para la agencia {self.id_agencia}")
+            self.completada = time.perf_counter()
+
+            await self._esperar_ganadores(reader, writer)
+        finally:
+            writer.close()
+
+    async def _enviar_esperando_confirmacion(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        for frame in self.frames:
+            inicio = time.perf_counter()
+            writer.write(self._frame(frame))
+            if await reader.readexactly(2) != CONFIRMACION_OK:
+                raise RuntimeError(f"batch rechazado para la agencia {self.id_agencia}")
+            self.latencias.append(time.perf_counter() - inicio)
+
+    async def _enviar_pipelined(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, ventana: int):
+        enviados: Dict[int, float] = {}
+
+        async def recibir_confirmacion():
+            confirmacion = await reader.readexactly(TAMANIO_CONFIRMACION_SECUENCIA)
+            if confirmacion[-1] != 0:
+                raise RuntimeError(f"batch rechazado para la agencia {self.id_agencia}")
+            secuencia = int.from_bytes(confirmacion[1:5], 'big')
+            self.latencias.append(time.perf_counter() - enviados.pop(secuencia))
+
+        for secuencia, frame in enumerate(self.frames, start=1):
+            if len(enviados) == ventana:
+                await recibir_confirmacion()
+            enviados[secuencia] = time.perf_counter()
+            writer.write(self._frame(frame))
+        while enviados:
+            await recibir_confirmacion()
+
+    async def _esperar_ganadores(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            writer.write(serializar_suscripcion_ganadores(self.id_agencia, ESPERA_SUSCRIPCION_MS))
+            if (await reader.readexactly(1))[0] == RESPUESTA_GANADORES:
+                break
+        self.ganadores_recibidos = time.perf_counter()
+        self.ganadores = int.from_bytes(await reader.readexactly(4), 'big')
+        await reader.readexactly(4 * self.ganadores)
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class MonitorMemoria(threading.Thread):
+    """
+    Lee periodicamente el pico de memoria residente del servidor y de sus
+    procesos hijos. No alcanza con getrusage(RUSAGE_CHILDREN): en Linux un
+    proceso creado con fork hereda como pico la memoria de este generador.
+    """
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self._pid = pid
+        self._picos: Dict[int, int] = {}
+        self._detenido = threading.Event()
+
+    def _leer(self):
+        pids = [self._pid]
+        try:
+            with open(f'/proc/{self._pid}/task/{self._pid}/children') as hijos:
+                pids.extend(int(pid) for pid in hijos.read().split())
+        except OSError:
+            pass
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/status') as status:
+                    for linea in status:
+                        if linea.startswith('VmHWM:'):
+                            self._picos[pid] = max(self._picos.get(pid, 0), int(linea.split()[1]))
+            except OSError:
+                # El proceso ya terminó
+                pass
+
+    def run(self):
+        while not self._detenido.wait(0.02):
+            self._leer()
+
+    def detener(self) -> Optional[int]:
+        self._detenido.set()
+        self.join()
+        return sum(self._picos.values()) if self._picos else None
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=DIRECTORIO_SERVIDOR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def correr(args, agencias: List[Agencia]) -> Dict:
+    engine, _, workers = args.motor.partition(':')
+    if engine == 'workers':
+        engine = 'threads'
+    with tempfile.TemporaryDirectory() as directorio:
+        log_path = os.path.join(directorio, 'server.log')
+        env = dict(os.environ,
+                   SERVER_PORT=str(args.puerto),
+                   SERVER_LISTEN_BACKLOG=str(max(len(agencias), 1)),
+                   LOGGING_LEVEL=args.log_level,
+                   CLIENT_AMOUNT=str(len(agencias)),
+                   SERVER_ENGINE=engine,
+                   SERVER_WORKERS=workers or '1',
+                   PYTHONUNBUFFERED='1')
+        env.update(variable.split('=', 1) for variable in args.env)
+        with open(log_path, 'w') as log:
+            proceso = subprocess.Popen([sys.executable, os.path.join(DIRECTORIO_SERVIDOR, 'main.py')],
+                                       cwd=directorio, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            esperar_servidor_listo(log_path, proceso)
+            monitor = MonitorMemoria(proceso.pid)
+            monitor.start()
+
+            async def simular():
+                await asyncio.gather(*(agencia.enviar(args.puerto, args.ventana) for agencia in agencias))
+
+            inicio = time.perf_counter()
+            asyncio.run(simular())
+            proceso.wait(timeout=60)
+            rss_servidor = monitor.detener()
+        finally:
+            if proceso.poll() is None:
+                proceso.kill()
+                proceso.wait()
+
+    fin_envio = max(agencia.completada for agencia in agencias)
+    fin = max(agencia.ganadores_recibidos for agencia in agencias)
+    latencias = sorted(latencia for agencia in agencias for latencia in agencia.latencias)
+    apuestas = sum(agencia.apuestas for agencia in agencias)
+    return {
+        'apuestas': apuestas,
+        'batches': len(latencias),
+        'ganadores': sum(agencia.ganadores for agencia in agencias),
+        'duracion_envio_s': round(fin_envio - inicio, 4),
+        'duracion_total_s': round(fin - inicio, 4),
+        'apuestas_por_segundo': round(apuestas / (fin_envio - inicio), 1),
+        'latencia_confirmacion_ms': {
+            'p50': round(percentil(latencias, 0.50) * 1000, 3),
+            'p99': round(percentil(latencias, 0.99) * 1000, 3),
+            'max': round(latencias[-1] * 1000, 3),
+        } if latencias else None,
+        'espera_sorteo_s': round(fin - fin_envio, 4),
+        'rss_maximo_servidor_kib': rss_servidor,
+        'rss_maximo_generador_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agencias', type=int, default=5)
+    parser.add_argument('--apuestas-por-batch', type=int, default=101)
+    parser.add_argument('--ventana', type=int, default=1)
+    parser.add_argument('--motor', default='threads')
+    parser.add_argument('--max-apuestas', type=int, default=0, help="apuestas por agencia (0 = todo su CSV)")
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--env', action='append', default=[], help="variable extra del servidor, p. ej. FSYNC_POLICY=always")
+    parser.add_argument('--puerto', type=int, default=12397)
+    parser.add_argument('--log-level', default='INFO', help="INFO o DEBUG: se detecta que el servidor está listo por su log")
+    parser.add_argument('--salida', help="archivo del reporte JSON (por defecto, la salida estandar)")
+    args = parser.parse_args()
+
+    if args.agencias < 1 or args.ventana < 1:
+        parser.error("--agencias y --ventana deben ser al menos 1")
+    if not 1 <= args.apuestas_por_batch <= MAXIMO_APUESTAS_POR_BATCH:
+        parser.error(f"--apuestas-por-batch debe estar entre 1 y {MAXIMO_APUESTAS_POR_BATCH}")
+    if any('=' not in variable for variable in args.env):
+        parser.error("--env espera VARIABLE=valor")
+
+    # Cada agencia usa un file descriptor en este proceso y otro en el servidor
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+
+    dataset = cargar_dataset(args.dataset, args.max_apuestas)
+    frames = [serializar_batches(apuestas, args.apuestas_por_batch, args.ventana) for apuestas in dataset]
+    agencias = [Agencia(i + 1, frames[i % len(dataset)], len(dataset[i % len(dataset)])) for i in range(args.agencias)]
+
+    reporte = {
+        'parametros': {
+            'agencias': args.agencias,
+            'apuestas_por_batch': args.apuestas_por_batch,
+            'ventana': args.ventana,
+            'motor': args.motor,
+            'max_apuestas': args.max_apuestas,
+            'dataset': os.path.basename(args.dataset),
+            'env': dict(variable.split('=', 1) for variable in args.env),
+        },
+        'entorno': {
+            'commit': commit_actual(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'resultados': correr(args, agencias),
+    }
+
+    texto = json.dumps(reporte, indent=2, sort_keys=True)
+    if args.salida:
+        with open(args.salida, 'w') as salida:
+            salida.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
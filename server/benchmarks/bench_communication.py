@@ -0,0 +1,131 @@
+"""
+Micro-benchmark del decodificador de mensajes de Communication.
+
+Compara la lectura anterior (un recv por cada byte de los strings) contra la
+lectura con buffer, y el formato v1 contra el v2 con batches grandes, contando
+syscalls de lectura y mensajes/apuestas por segundo.
+
+Uso (desde server/):
+    python -m benchmarks.bench_communication [--mensajes N] [--apuestas N] [--apuestas-v2 N]
+"""
+import argparse
+import socket
+import threading
+import time
+
+from benchmarks.protocolo import apuestas_sinteticas, serializar_envio_batch, serializar_envio_batch_v2, serializar_negociacion
+from common.communication import Communication, EnvioBatchMessage
+from common.utils import Bet
+
+
+class SocketContador:
+    """Envuelve un socket contando las llamadas de lectura."""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self.lecturas = 0
+
+    def recv(self, n):
+        self.lecturas += 1
+        return self._sock.recv(n)
+
+    def recv_into(self, buffer):
+        self.lecturas += 1
+        return self._sock.recv_into(buffer)
+
+    def sendall(self, data):
+        self._sock.sendall(data)
+
+    def shutdown(self, how):
+        self._sock.shutdown(how)
+
+    def close(self):
+        self._sock.close()
+
+
+class LectorByteAByte:
+    """Copia del decodificador anterior, conservada como referencia."""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def leer_mensaje_socket(self):
+        self._recvall(1)
+        id_agencia = int.from_bytes(self._recvall(4), byteorder='big')
+        numero_apuestas = self._recvall(1)[0]
+        apuestas = [self._recibir_apuesta(id_agencia) for _ in range(numero_apuestas)]
+        return EnvioBatchMessage(id_agencia=id_agencia, numero_apuestas=numero_apuestas, apuestas=apuestas)
+
+    def _recibir_apuesta(self, agency):
+        nombre = self._leer_string()
+        apellido = self._leer_string()
+        documento = int.from_bytes(self._recvall(4), byteorder='big')
+        fecha_nacimiento = self._leer_string()
+        numero = int.from_bytes(self._recvall(4), byteorder='big')
+        return Bet(agency, nombre, apellido, str(documento), fecha_nacimiento, str(numero))
+
+    def _leer_string(self):
+        string_bytes = bytearray()
+        while True:
+            byte = self._recvall(1)
+            if byte == b'\x00':
+                break
+            string_bytes.extend(byte)
+        return string_bytes.decode("utf-8")
+
+    def _recvall(self, n):
+        data = bytearray()
+        while len(data) < n:
+            packet = self._sock.recv(n - len(data))
+            if not packet:
+                raise ValueError("Failed to read all bytes")
+            data.extend(packet)
+        return data
+
+
+def medir(nombre, crear_lector, frame: bytes, mensajes: int, apuestas_por_mensaje: int, preambulo: bytes = b''):
+    emisor, receptor = socket.socketpair()
+    contador = SocketContador(receptor)
+    lector = crear_lector(contador)
+
+    def enviar():
+        emisor.sendall(preambulo)
+        for _ in range(mensajes):
+            emisor.sendall(frame)
+
+    hilo = threading.Thread(target=enviar)
+    inicio = time.perf_counter()
+    hilo.start()
+    for _ in range(mensajes):
+        lector.leer_mensaje_socket()
+    duracion = time.perf_counter() - inicio
+    hilo.join()
+    emisor.close()
+    receptor.close()
+
+    print(f"{nombre:<16} mensajes/s: {mensajes / duracion:>10.1f} | "
+          f"apuestas/s: {mensajes * apuestas_por_mensaje / duracion:>10.1f} | "
+          f"lecturas: {contador.lecturas:>8} | lecturas/mensaje: {contador.lecturas / mensajes:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mensajes', type=int, default=2000)
+    parser.add_argument('--apuestas', type=int, default=101)
+    parser.add_argument('--apuestas-v2', type=int, default=5000)
+    args = parser.parse_args()
+
+    frame = serializar_envio_batch(1, apuestas_sinteticas(args.apuestas))
+    print(f"frame ENVIO_BATCH v1: {len(frame)} bytes, {args.apuestas} apuestas, {args.mensajes} mensajes")
+    medir("byte_a_byte", LectorByteAByte, frame, args.mensajes, args.apuestas)
+    medir("buffer_v1", Communication, frame, args.mensajes, args.apuestas)
+
+    # Mismo volumen total de apuestas, en pocos frames v2 grandes
+    mensajes_v2 = max(1, args.mensajes * args.apuestas // args.apuestas_v2)
+    frame_v2 = serializar_envio_batch_v2(1, apuestas_sinteticas(args.apuestas_v2))
+    print(f"frame ENVIO_BATCH v2: {len(frame_v2)} bytes, {args.apuestas_v2} apuestas, {mensajes_v2} mensajes")
+    medir("buffer_v2", Communication, frame_v2, mensajes_v2, args.apuestas_v2, preambulo=serializar_negociacion(2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark de la compresion de los batches: bytes enviados por apuesta y costo
+de CPU por apuesta, del lado cliente (serializar y comprimir) y del lado
+servidor (descomprimir y decodificar con DecodificadorMensajes), con las
+apuestas de las agencias de .data/dataset.zip.
+
+Compara los batches sin comprimir contra zlib con distintos niveles, en v1
+(el formato del cliente Go) y en v2. El nivel 1 es la opcion rapida; no hay
+otros codecs porque el servidor solo depende de la biblioteca estandar.
+
+Uso (desde server/):
+    python -m benchmarks.bench_compresion [--apuestas-por-batch 101] [--niveles 1 6 9]
+"""
+import argparse
+import time
+
+from benchmarks.dataset import filas_por_agencia
+from benchmarks.protocolo import (COMPRESION_ZLIB, CompresorBatches, serializar_envio_batch, serializar_envio_batch_v2,
+                                  serializar_negociacion, serializar_negociacion_compresion)
+from common.communication import PROTOCOLO_V2, TIPOS_NEGOCIACION, DecodificadorMensajes
+
+# Lo que lee cada recv_into del servidor
+TAMANIO_LECTURA = 64 * 1024
+
+
+def batches_del_dataset(apuestas_por_batch: int):
+    batches = []
+    for agencia, filas in filas_por_agencia():
+        apuestas = [(nombre, apellido, int(documento), nacimiento, int(numero)) for nombre, apellido, documento, nacimiento, numero in filas]
+        for inicio in range(0, len(apuestas), apuestas_por_batch):
+            batches.append((agencia, apuestas[inicio:inicio + apuestas_por_batch]))
+    return batches
+
+
+def enviar(batches, v2: bool, nivel):
+    """Bytes de cada agencia como los enviaria el cliente, con una conexion por agencia."""
+    serializar = serializar_envio_batch_v2 if v2 else serializar_envio_batch
+    conexiones = {}
+    compresores = {}
+    for agencia, apuestas in batches:
+        if agencia not in conexiones:
+            # Las negociaciones se envian en v1, antes de pasar a v2
+            conexiones[agencia] = []
+            if nivel is not None:
+                conexiones[agencia].append(serializar_negociacion_compresion(COMPRESION_ZLIB))
+                compresores[agencia] = CompresorBatches(nivel, v2)
+            if v2:
+                conexiones[agencia].append(serializar_negociacion(PROTOCOLO_V2))
+        frame = serializar(agencia, apuestas)
+        if nivel is not None:
+            frame = compresores[agencia].comprimir(frame)
+        conexiones[agencia].append(frame)
+    return [b''.join(frames) for frames in conexiones.values()]
+
+
+def recibir(datos: bytes) -> int:
+    """Decodifica lo recibido por una conexion como el servidor, y devuelve la cantidad de apuestas."""
+    decodificador = DecodificadorMensajes()
+    apuestas = 0
+    pos = 0
+    while pos < len(datos):
+        with decodificador.espacio_libre() as espacio:
+            leidos = min(len(espacio), TAMANIO_LECTURA, len(datos) - pos)
+            espacio[:leidos] = datos[pos:pos + leidos]
+        decodificador.datos_recibidos(leidos)
+        pos += leidos
+        while True:
+            mensaje = decodificador.siguiente_mensaje()
+            if mensaje is None:
+                break
+            if mensaje.tipo_mensaje in TIPOS_NEGOCIACION:
+                decodificador.negociar(mensaje)
+            else:
+                apuestas += mensaje.numero_apuestas
+    return apuestas
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apuestas-por-batch', type=int, default=101)
+    parser.add_argument('--niveles', type=int, nargs='+', default=[1, 6, 9])
+    args = parser.parse_args()
+
+    batches = batches_del_dataset(args.apuestas_por_batch)
+    cantidad = sum(len(apuestas) for _, apuestas in batches)
+    print(f"apuestas: {cantidad} | batches: {len(batches)} | apuestas por batch: {args.apuestas_por_batch}")
+
+    for v2 in (False, True):
+        referencia = None
+        for nivel in [None] + args.niveles:
+            inicio = time.perf_counter()
+            conexiones = enviar(batches, v2, nivel)
+            duracion_cliente = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            recibidas = sum(recibir(datos) for datos in conexiones)
+            duracion_servidor = time.perf_counter() - inicio
+            if recibidas != cantidad:
+                raise RuntimeError(f"se decodificaron {recibidas} apuestas de {cantidad}")
+
+            enviados = sum(len(datos) for datos in conexiones)
+            referencia = referencia or enviados
+            nombre = f"{'v2' if v2 else 'v1'} {'sin comprimir' if nivel is None else f'zlib {nivel}'}"
+            print(f"{nombre:<18} bytes: {enviados:>10} | por apuesta: {enviados / cantidad:6.1f} | "
+                  f"ratio: {enviados / referencia:5.2f} | cliente: {duracion_cliente / cantidad * 1e6:5.2f}us/apuesta | "
+                  f"servidor: {duracion_servidor / cantidad * 1e6:5.2f}us/apuesta")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Prueba de carga comparando los motores del servidor (SERVER_ENGINE=threads,
+SERVER_ENGINE=asyncio y SERVER_WORKERS=N, indicado como workers:N) con muchas
+agencias simuladas concurrentes.
+
+Levanta main.py como subproceso en un directorio temporal, y simula las
+agencias desde un unico event loop: cada una envia sus batches esperando la
+confirmacion de cada uno, avisa que terminó, y consulta los ganadores hasta
+que el sorteo se realiza (igual que el cliente Go).
+
+Uso (desde server/):
+    python -m benchmarks.bench_engines [--agencias 1000] [--batches 5] [--apuestas 101] [--motores threads,asyncio,workers:4]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.protocolo import apuestas_sinteticas, serializar_envio_batch, serializar_solicitud_ganadores
+
+CONFIRMACION_OK = bytes([2, 0])
+SORTEO_NO_REALIZADO = 4
+
+DIRECTORIO_SERVIDOR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def simular_agencia(id_agencia: int, puerto: int, batches: int, apuestas: int, latencias: list):
+    frame = serializar_envio_batch(id_agencia, apuestas_sinteticas(apuestas, desde=id_agencia * apuestas))
+    reader, writer = await asyncio.open_connection('127.0.0.1', puerto)
+
+    for _ in range(batches):
+        inicio = time.perf_counter()
+        writer.write(frame)
+        if await reader.readexactly(2) != CONFIRMACION_OK:
+            raise RuntimeError(f"batch rechazado para la agencia {id_agencia}")
+        latencias.append(time.perf_counter() - inicio)
+
+    writer.write(serializar_envio_batch(id_agencia, []))
+    await reader.readexactly(2)
+
+    while True:
+        writer.write(serializar_solicitud_ganadores(id_agencia))
+        tipo = (await reader.readexactly(1))[0]
+        if tipo != SORTEO_NO_REALIZADO:
+            cantidad = int.from_bytes(await reader.readexactly(4), 'big')
+            await reader.readexactly(4 * cantidad)
+            break
+        await asyncio.sleep(0.1)
+
+    writer.close()
+
+
+async def simular_agencias(args, puerto: int, latencias: list):
+    await asyncio.gather(*(simular_agencia(i + 1, puerto, args.batches, args.apuestas, latencias) for i in range(args.agencias)))
+
+
+def esperar_servidor_listo(log_path: str, proceso: subprocess.Popen):
+    while proceso.poll() is None:
+        with open(log_path) as log:
+            if 'accept_connections | result: in_progress' in log.read():
+                return
+        time.sleep(0.05)
+    raise RuntimeError("el servidor terminó antes de aceptar conexiones")
+
+
+def medir_motor(motor: str, args, puerto: int):
+    engine, _, workers = motor.partition(':')
+    if engine == 'workers':
+        engine = 'threads'
+    with tempfile.TemporaryDirectory() as directorio:
+        log_path = os.path.join(directorio, 'server.log')
+        env = dict(os.environ,
+                   SERVER_PORT=str(puerto),
+                   SERVER_LISTEN_BACKLOG='1024',
+                   LOGGING_LEVEL=args.log_level,
+                   CLIENT_AMOUNT=str(args.agencias),
+                   SERVER_ENGINE=engine,
+                   SERVER_WORKERS=workers or '1',
+                   PYTHONUNBUFFERED='1')
+        with open(log_path, 'w') as log:
+            proceso = subprocess.Popen([sys.executable, os.path.join(DIRECTORIO_SERVIDOR, 'main.py')],
+                                       cwd=directorio, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            esperar_servidor_listo(log_path, proceso)
+            latencias = []
+            inicio = time.perf_counter()
+            asyncio.run(simular_agencias(args, puerto, latencias))
+            duracion = time.perf_counter() - inicio
+            proceso.wait(timeout=60)
+        finally:
+            if proceso.poll() is None:
+                proceso.kill()
+
+    latencias.sort()
+    total_apuestas = args.agencias * args.batches * args.apuestas
+    print(f"{motor:<10} agencias: {args.agencias} | duracion: {duracion:7.2f}s | "
+          f"apuestas/s: {total_apuestas / duracion:>10.1f} | "
+          f"ack p50: {statistics.median(latencias) * 1000:7.2f}ms | "
+          f"ack p99: {latencias[int(len(latencias) * 0.99) - 1] * 1000:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agencias', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--apuestas', type=int, default=101)
+    parser.add_argument('--puerto', type=int, default=12399)
+    parser.add_argument('--motores', default='threads,asyncio')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    # Cada agencia usa un file descriptor en este proceso y otro en el servidor
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+
+    for motor in args.motores.split(','):
+        medir_motor(motor, args, args.puerto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark de la reconstruccion del indice de ganadores desde bets.csv: el
+recorrido secuencial con csv.reader (StorageFormat.scan_bets), contra
+common.escaneo en un solo proceso y en paralelo con distintas cantidades de
+procesos. Genera un bets.csv temporal con las apuestas pedidas.
+
+Uso (desde server/):
+    python -m benchmarks.bench_escaneo [--apuestas 10000000] [--agencias 5] [--procesos 1 2 4]
+"""
+import argparse
+import dataclasses
+import os
+import random
+import tempfile
+import time
+
+from common import escaneo
+from common.bet_log import CSV_STORAGE
+from common.sorteo import ColumnasApuestas, evaluar_sorteo
+from common.utils import BetBatch, format_bets
+
+
+def generar_csv(filepath: str, apuestas: int, agencias: int):
+    aleatorio = random.Random(0)
+    with open(filepath, 'w') as archivo:
+        for inicio in range(0, apuestas, 100_000):
+            batch = BetBatch()
+            for i in range(inicio, min(apuestas, inicio + 100_000)):
+                batch.append(i % agencias + 1, 'Nombre', 'Apellido', 10000000 + i, '2000-01-01', aleatorio.randrange(10000))
+            archivo.write(format_bets(batch))
+
+
+def recorrido_secuencial(formato):
+    columnas = ColumnasApuestas.desde_registros(formato.scan_bets(formato.filepath))
+    return len(columnas), {agencia: list(dnis) for agencia, dnis in evaluar_sorteo(columnas).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apuestas', type=int, default=10_000_000)
+    parser.add_argument('--agencias', type=int, default=5)
+    parser.add_argument('--procesos', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        formato = dataclasses.replace(CSV_STORAGE, filepath=os.path.join(directorio, 'bets.csv'))
+        generar_csv(formato.filepath, args.apuestas, args.agencias)
+        print(f"archivo: {os.path.getsize(formato.filepath) / 2 ** 20:.1f}MiB | cpus: {os.cpu_count()}")
+
+        # El umbral de tamaño se baja para que el paralelismo se use aunque el archivo sea chico
+        escaneo.TAMANIO_MINIMO_PARALELO = 0
+        escaneo.TAMANIO_MINIMO_PORCION = 1
+        caminos = [('csv.reader', recorrido_secuencial)]
+        caminos += [(f"escaneo x{procesos}", lambda f, p=procesos: escaneo.escanear_ganadores(f, p)) for procesos in args.procesos]
+
+        referencia = None
+        for nombre, escanear in caminos:
+            inicio = time.perf_counter()
+            cantidad, ganadores = escanear(formato)
+            duracion = time.perf_counter() - inicio
+            if referencia is None:
+                referencia = (cantidad, ganadores)
+            elif (cantidad, ganadores) != referencia:
+                raise RuntimeError(f"{nombre} no coincide con el recorrido con csv.reader")
+            print(f"{nombre:<14} apuestas: {cantidad} | duracion: {duracion * 1000:9.1f}ms | "
+                  f"ganadores: {sum(len(dnis) for dnis in ganadores.values())}")
+
+
+if __name__ == '__main__':
+    main()
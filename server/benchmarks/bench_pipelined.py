@@ -0,0 +1,142 @@
+"""
+Compara el envio de batches esperando cada confirmacion (ENVIO_BATCH) con el
+modo pipelined (ENVIO_BATCH_SECUENCIADO) con distintas ventanas, sobre un
+enlace con latencia simulada.
+
+Levanta main.py como subproceso en un directorio temporal y un proxy TCP que
+demora cada tramo la mitad del RTT indicado en cada sentido. Cada medicion
+usa un servidor nuevo con una unica agencia.
+
+Uso (desde server/):
+    python -m benchmarks.bench_pipelined [--rtt-ms 20] [--batches 200] [--apuestas 101] [--ventanas 1,4,16,64]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_engines import DIRECTORIO_SERVIDOR, esperar_servidor_listo
+from benchmarks.protocolo import apuestas_sinteticas, serializar_envio_batch, serializar_envio_batch_secuenciado
+
+CONFIRMACION_OK = bytes([2, 0])
+TAMANIO_CONFIRMACION_SECUENCIA = 10  # tipo, secuencia, acumulada, confirmacion
+
+
+async def _reenviar_con_demora(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, demora: float):
+    # Cada tramo se entrega demora segundos despues de leido, sin frenar la lectura
+    # de los siguientes: simula la latencia de un enlace sin limitar su ancho de banda
+    loop = asyncio.get_running_loop()
+    pendientes: asyncio.Queue = asyncio.Queue()
+
+    async def entregar():
+        while True:
+            entrega, datos = await pendientes.get()
+            await asyncio.sleep(max(0.0, entrega - loop.time()))
+            if not datos:
+                writer.close()
+                return
+            writer.write(datos)
+            await writer.drain()
+
+    tarea = asyncio.ensure_future(entregar())
+    while True:
+        datos = await reader.read(64 * 1024)
+        pendientes.put_nowait((loop.time() + demora, datos))
+        if not datos:
+            break
+    await tarea
+
+
+async def _levantar_proxy(puerto_servidor: int, demora: float) -> asyncio.AbstractServer:
+    async def atender(cliente_reader, cliente_writer):
+        servidor_reader, servidor_writer = await asyncio.open_connection('127.0.0.1', puerto_servidor)
+        try:
+            await asyncio.gather(_reenviar_con_demora(cliente_reader, servidor_writer, demora),
+                                 _reenviar_con_demora(servidor_reader, cliente_writer, demora))
+        except (asyncio.CancelledError, ConnectionError):
+            # El benchmark termina sin esperar que se cierren las conexiones
+            pass
+
+    return await asyncio.start_server(atender, '127.0.0.1', 0)
+
+
+async def _enviar(puerto: int, args, ventana: int) -> float:
+    apuestas = list(apuestas_sinteticas(args.apuestas))
+    reader, writer = await asyncio.open_connection('127.0.0.1', puerto)
+    inicio = time.perf_counter()
+    if ventana == 1:
+        frame = serializar_envio_batch(1, apuestas)
+        for _ in range(args.batches):
+            writer.write(frame)
+            if await reader.readexactly(2) != CONFIRMACION_OK:
+                raise RuntimeError("batch rechazado")
+    else:
+        en_vuelo = 0
+        for secuencia in range(1, args.batches + 1):
+            if en_vuelo == ventana:
+                await reader.readexactly(TAMANIO_CONFIRMACION_SECUENCIA)
+                en_vuelo -= 1
+            writer.write(serializar_envio_batch_secuenciado(1, secuencia, apuestas))
+            en_vuelo += 1
+        for _ in range(en_vuelo):
+            await reader.readexactly(TAMANIO_CONFIRMACION_SECUENCIA)
+    duracion = time.perf_counter() - inicio
+
+    writer.write(serializar_envio_batch(1, []))
+    await reader.readexactly(2)
+    writer.close()
+    return duracion
+
+
+async def _medir(puerto_servidor: int, args, ventana: int) -> float:
+    proxy = await _levantar_proxy(puerto_servidor, args.rtt_ms / 2000)
+    try:
+        return await _enviar(proxy.sockets[0].getsockname()[1], args, ventana)
+    finally:
+        proxy.close()
+
+
+def medir_ventana(ventana: int, args, puerto: int):
+    with tempfile.TemporaryDirectory() as directorio:
+        log_path = os.path.join(directorio, 'server.log')
+        env = dict(os.environ,
+                   SERVER_PORT=str(puerto),
+                   SERVER_LISTEN_BACKLOG='1',
+                   LOGGING_LEVEL=args.log_level,
+                   CLIENT_AMOUNT='1',
+                   PYTHONUNBUFFERED='1')
+        with open(log_path, 'w') as log:
+            proceso = subprocess.Popen([sys.executable, os.path.join(DIRECTORIO_SERVIDOR, 'main.py')],
+                                       cwd=directorio, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            esperar_servidor_listo(log_path, proceso)
+            duracion = asyncio.run(_medir(puerto, args, ventana))
+        finally:
+            proceso.kill()
+            proceso.wait()
+
+    total_apuestas = args.batches * args.apuestas
+    print(f"ventana {ventana:>3} rtt: {args.rtt_ms}ms | duracion: {duracion:7.2f}s | "
+          f"batches/s: {args.batches / duracion:>8.1f} | apuestas/s: {total_apuestas / duracion:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt-ms', type=float, default=20)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--apuestas', type=int, default=101)
+    parser.add_argument('--ventanas', default='1,4,16,64')
+    parser.add_argument('--puerto', type=int, default=12398)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    # Un puerto por medicion: el del servidor anterior puede seguir en TIME_WAIT
+    for i, ventana in enumerate(args.ventanas.split(',')):
+        medir_ventana(int(ventana), args, args.puerto + i)
+
+
+if __name__ == '__main__':
+    main()
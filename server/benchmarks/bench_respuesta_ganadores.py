@@ -0,0 +1,49 @@
+"""
+Benchmark del armado de las respuestas RESPUESTA_GANADORES: serializar cada
+DNI con to_bytes en cada consulta (como antes), serializarlos juntos con
+array('I') en cada consulta, y reutilizar el frame que ResultadoSorteo
+serializa una unica vez al realizar el sorteo.
+
+Uso (desde server/):
+    python -m benchmarks.bench_respuesta_ganadores [--consultas 100000] [--ganadores 2000]
+"""
+import argparse
+import time
+from types import MappingProxyType
+
+from common.communication import MessageType, serializar_respuesta_ganadores
+from common.winners import ResultadoSorteo
+
+
+def serializar_por_dni(dnis) -> bytes:
+    """Serializacion anterior de RespuestaGanadoresMessage, conservada como referencia."""
+    return (MessageType.RESPUESTA_GANADORES.to_bytes(1, byteorder='big') + len(dnis).to_bytes(4, byteorder='big')
+            + b''.join(dni.to_bytes(4, byteorder='big') for dni in dnis))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consultas', type=int, default=100_000)
+    parser.add_argument('--ganadores', type=int, default=2000)
+    args = parser.parse_args()
+
+    dnis = tuple(range(30000000, 30000000 + args.ganadores))
+    resultado = ResultadoSorteo(MappingProxyType({1: dnis}))
+    caminos = [('por dni', lambda: serializar_por_dni(resultado.ganadores(1))),
+               ('array', lambda: serializar_respuesta_ganadores(resultado.ganadores(1))),
+               ('cacheada', lambda: resultado.respuesta(1))]
+
+    referencia = serializar_por_dni(dnis)
+    for nombre, responder in caminos:
+        if responder() != referencia:
+            raise RuntimeError(f"{nombre} no coincide con la serializacion por dni")
+        inicio = time.perf_counter()
+        for _ in range(args.consultas):
+            responder()
+        duracion = time.perf_counter() - inicio
+        print(f"{nombre:<10} consultas: {args.consultas} | ganadores: {args.ganadores} | "
+              f"duracion: {duracion * 1000:9.1f}ms | por consulta: {duracion / args.consultas * 1e6:8.2f}us")
+
+
+if __name__ == '__main__':
+    main()
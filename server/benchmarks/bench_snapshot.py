@@ -0,0 +1,76 @@
+"""
+Benchmark de contencion del estado compartido del servidor: muchos threads
+haciendo las lecturas del camino caliente de los handlers (agencia_completo_envio,
+sorteo_fue_realizado, obtener_ganadores_de_agencia) sobre el ThreadSafeValue
+anterior (lock + deepcopy) y sobre SnapshotValue (sin lock ni copia).
+
+Uso (desde server/):
+    python -m benchmarks.bench_snapshot [--threads 64] [--lecturas 20] [--agencias 1000]
+"""
+import argparse
+import copy
+import threading
+import time
+from types import MappingProxyType
+
+from common.server import SnapshotValue
+
+
+class ThreadSafeValue:
+    """Copia del contenedor anterior, conservada como referencia."""
+
+    def __init__(self, value):
+        self._value = value
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            return copy.deepcopy(self._value)
+
+
+def estado_con_thread_safe_value(agencias: int, ganadores: int):
+    return (ThreadSafeValue(set(range(agencias // 2))),
+            ThreadSafeValue(True),
+            ThreadSafeValue({a: [a * 1000 + i for i in range(ganadores)] for a in range(agencias)}))
+
+
+def estado_con_snapshot(agencias: int, ganadores: int):
+    return (SnapshotValue(frozenset(range(agencias // 2))),
+            SnapshotValue(True),
+            SnapshotValue(MappingProxyType({a: tuple(a * 1000 + i for i in range(ganadores)) for a in range(agencias)})))
+
+
+def medir(nombre, estado, threads: int, lecturas: int, agencias: int):
+    completaron, sorteo_realizado, ganadores = estado
+
+    def handler(agencia):
+        for _ in range(lecturas):
+            agencia in completaron.get()
+            sorteo_realizado.get()
+            ganadores.get().get(agencia, ())
+
+    hilos = [threading.Thread(target=handler, args=(i % agencias,)) for i in range(threads)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<16} consultas/s: {threads * lecturas / duracion:>12.1f} | duracion: {duracion:7.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--lecturas', type=int, default=20)
+    parser.add_argument('--agencias', type=int, default=1000)
+    parser.add_argument('--ganadores', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.lecturas} consultas, {args.agencias} agencias con {args.ganadores} ganadores")
+    medir("thread_safe_value", estado_con_thread_safe_value(args.agencias, args.ganadores), args.threads, args.lecturas, args.agencias)
+    medir("snapshot_value", estado_con_snapshot(args.agencias, args.ganadores), args.threads, args.lecturas, args.agencias)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark de la evaluacion del sorteo sobre todas las apuestas: has_won()
+apuesta por apuesta agrupando con un dict (como lo hacia antes el sorteo),
+contra common.sorteo con columnas, en su camino puro Python y con NumPy si
+está instalado.
+
+Uso (desde server/):
+    python -m benchmarks.bench_sorteo [--apuestas 10000000] [--agencias 5]
+"""
+import argparse
+import random
+import time
+from array import array
+
+from common.sorteo import ColumnasApuestas, evaluar_sorteo, numpy
+from common.utils import LOTTERY_WINNER_NUMBER
+
+
+def generar_columnas(apuestas: int, agencias: int) -> ColumnasApuestas:
+    aleatorio = random.Random(0)
+    columnas = ColumnasApuestas()
+    columnas.agencias = array('I', (i % agencias + 1 for i in range(apuestas)))
+    columnas.documentos = array('I', range(10000000, 10000000 + apuestas))
+    columnas.numeros = array('I', (aleatorio.randrange(10000) for _ in range(apuestas)))
+    return columnas
+
+
+def evaluar_por_apuesta(columnas: ColumnasApuestas):
+    ganadores = {}
+    for agencia, documento, numero in zip(columnas.agencias, columnas.documentos, columnas.numeros):
+        if numero == LOTTERY_WINNER_NUMBER:
+            ganadores.setdefault(agencia, []).append(documento)
+    return {agencia: tuple(dnis) for agencia, dnis in ganadores.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apuestas', type=int, default=10_000_000)
+    parser.add_argument('--agencias', type=int, default=5)
+    args = parser.parse_args()
+
+    columnas = generar_columnas(args.apuestas, args.agencias)
+    caminos = [('por apuesta', evaluar_por_apuesta),
+               ('columnas', lambda c: evaluar_sorteo(c, usar_numpy=False))]
+    if numpy is not None:
+        caminos.append(('numpy', lambda c: evaluar_sorteo(c, usar_numpy=True)))
+
+    referencia = None
+    for nombre, evaluar in caminos:
+        inicio = time.perf_counter()
+        ganadores = evaluar(columnas)
+        duracion = time.perf_counter() - inicio
+        if referencia is None:
+            referencia = ganadores
+        elif ganadores != referencia:
+            raise RuntimeError(f"{nombre} no coincide con la evaluacion por apuesta")
+        print(f"{nombre:<12} apuestas: {len(columnas)} | duracion: {duracion * 1000:9.1f}ms | "
+              f"ganadores: {sum(len(dnis) for dnis in ganadores.values())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark de throughput del almacenamiento de apuestas: el camino anterior
+(lock global + store_bets, que reabre el archivo en cada batch) contra el
+BetWriter con group commit, para cada politica de fsync.
+
+Uso (desde server/):
+    python -m benchmarks.bench_store_bets [--threads 50] [--batches 40] [--apuestas 101]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.protocolo import apuestas_sinteticas
+from common.bet_writer import FSYNC_POLICIES, BetWriter
+from common.utils import STORAGE_FILEPATH, Bet, store_bets
+
+
+def generar_batches(threads: int, batches: int, apuestas: int):
+    return [[[Bet(agencia, nombre, apellido, str(documento), nacimiento, numero)
+              for nombre, apellido, documento, nacimiento, numero in apuestas_sinteticas(apuestas, desde=b * apuestas)]
+             for b in range(batches)]
+            for agencia in range(threads)]
+
+
+def correr_handlers(batches_por_thread, almacenar) -> float:
+    def handler(batches):
+        for batch in batches:
+            almacenar(batch)
+
+    hilos = [threading.Thread(target=handler, args=(batches,)) for batches in batches_por_thread]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return time.perf_counter() - inicio
+
+
+def camino_con_lock(fsync: bool):
+    lock = threading.Lock()
+
+    def almacenar(bets):
+        with lock:
+            store_bets(bets)
+            if fsync:
+                with open(STORAGE_FILEPATH, 'a') as file:
+                    os.fsync(file.fileno())
+    return almacenar, lambda: None
+
+
+def camino_bet_writer(politica: str):
+    writer = BetWriter(fsync_policy=politica, fsync_interval_ms=5)
+    writer.start()
+    return (lambda bets: writer.encolar(bets).result()), writer.cerrar
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=40)
+    parser.add_argument('--apuestas', type=int, default=101)
+    args = parser.parse_args()
+
+    batches_por_thread = generar_batches(args.threads, args.batches, args.apuestas)
+    total_batches = args.threads * args.batches
+    caminos = [
+        ("lock+store_bets", lambda: camino_con_lock(fsync=False)),
+        ("lock+store_bets+fsync", lambda: camino_con_lock(fsync=True)),
+    ] + [(f"bet_writer[{politica}]", lambda politica=politica: camino_bet_writer(politica)) for politica in FSYNC_POLICIES]
+
+    print(f"{args.threads} threads x {args.batches} batches x {args.apuestas} apuestas")
+    directorio_original = os.getcwd()
+    for nombre, crear in caminos:
+        with tempfile.TemporaryDirectory() as directorio:
+            os.chdir(directorio)
+            try:
+                almacenar, cerrar = crear()
+                duracion = correr_handlers(batches_por_thread, almacenar)
+                cerrar()
+            finally:
+                os.chdir(directorio_original)
+        print(f"{nombre:<24} batches/s: {total_batches / duracion:>9.1f} | apuestas/s: {total_batches * args.apuestas / duracion:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Lectura del dataset de apuestas reales (.data/dataset.zip), con un CSV por
+agencia: agency-<n>.csv con filas nombre,apellido,documento,nacimiento,numero.
+"""
+import csv
+import io
+import os
+import zipfile
+from typing import Iterator, Tuple
+
+from common.utils import Bet
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.data', 'dataset.zip')
+
+
+def filas_por_agencia(path: str = DATASET_PATH) -> Iterator[Tuple[int, Iterator[list]]]:
+    """Devuelve (agencia, filas) para cada CSV del dataset, en orden de agencia."""
+    with zipfile.ZipFile(path) as dataset:
+        nombres = sorted(nombre for nombre in dataset.namelist() if nombre.startswith('agency-') and nombre.endswith('.csv'))
+        for nombre in nombres:
+            agencia = int(nombre[len('agency-'):-len('.csv')])
+            with dataset.open(nombre) as archivo:
+                yield agencia, csv.reader(io.TextIOWrapper(archivo, encoding='utf-8'))
+
+
+def cargar_bets(path: str = DATASET_PATH) -> Iterator[Bet]:
+    for agencia, filas in filas_por_agencia(path):
+        for nombre, apellido, documento, nacimiento, numero in filas:
+            yield Bet(str(agencia), nombre, apellido, documento, nacimiento, numero)
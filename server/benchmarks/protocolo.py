@@ -0,0 +1,113 @@
+"""
+Serializacion del lado cliente del protocolo, equivalente a la del cliente Go
+(client/common/communication.go). La usan los benchmarks para generar trafico
+identico al de las agencias reales.
+"""
+import struct
+import zlib
+from typing import Iterable, Tuple
+
+# (nombre, apellido, documento, nacimiento, numero)
+ApuestaCruda = Tuple[str, str, int, str, int]
+
+ENVIO_BATCH = 1
+SOLICITUD_GANADORES = 3
+RESPUESTA_GANADORES = 5
+NEGOCIACION_PROTOCOLO = 6
+ENVIO_BATCH_SECUENCIADO = 7
+SUSCRIPCION_GANADORES = 9
+NEGOCIACION_COMPRESION = 15
+FRAME_COMPRIMIDO = 16
+
+COMPRESION_ZLIB = 1
+
+_UINT32 = struct.Struct('>I')
+_HEADER_FRAME_V2 = struct.Struct('>IB')  # longitud, tipo
+_HEADER_ENVIO_BATCH_V2 = struct.Struct('>II')  # id_agencia, numero_apuestas
+_APUESTA_V2 = struct.Struct('>IIBBB')  # documento, numero, len nombre, len apellido, len nacimiento
+
+
+def _string_terminado_en_null(s: str, max_size: int) -> bytes:
+    return s.encode('utf-8')[:max_size] + b'\x00'
+
+
+def serializar_envio_batch(id_agencia: int, apuestas: Iterable[ApuestaCruda]) -> bytes:
+    apuestas = list(apuestas)
+    if len(apuestas) > 255:
+        raise ValueError("too many bets")
+
+    partes = [bytes([ENVIO_BATCH]), _UINT32.pack(id_agencia), bytes([len(apuestas)])]
+    for nombre, apellido, documento, nacimiento, numero in apuestas:
+        partes.append(_string_terminado_en_null(nombre, 29))
+        partes.append(_string_terminado_en_null(apellido, 29))
+        partes.append(_UINT32.pack(documento))
+        partes.append(_string_terminado_en_null(nacimiento, 10))
+        partes.append(_UINT32.pack(numero))
+    return b''.join(partes)
+
+
+def serializar_solicitud_ganadores(id_agencia: int) -> bytes:
+    return bytes([SOLICITUD_GANADORES]) + _UINT32.pack(id_agencia)
+
+
+def serializar_suscripcion_ganadores(id_agencia: int, espera_ms: int) -> bytes:
+    return bytes([SUSCRIPCION_GANADORES]) + _UINT32.pack(id_agencia) + _UINT32.pack(espera_ms)
+
+
+def serializar_negociacion(version: int) -> bytes:
+    return bytes([NEGOCIACION_PROTOCOLO, version])
+
+
+def _frame_v2(tipo: int, body: bytes) -> bytes:
+    return _HEADER_FRAME_V2.pack(len(body) + 1, tipo) + body
+
+
+def serializar_envio_batch_v2(id_agencia: int, apuestas: Iterable[ApuestaCruda]) -> bytes:
+    partes = []
+    for nombre, apellido, documento, nacimiento, numero in apuestas:
+        nombre_bytes = nombre.encode('utf-8')[:255]
+        apellido_bytes = apellido.encode('utf-8')[:255]
+        nacimiento_bytes = nacimiento.encode('utf-8')[:255]
+        partes.append(_APUESTA_V2.pack(documento, numero, len(nombre_bytes), len(apellido_bytes), len(nacimiento_bytes)))
+        partes.append(nombre_bytes)
+        partes.append(apellido_bytes)
+        partes.append(nacimiento_bytes)
+    body = _HEADER_ENVIO_BATCH_V2.pack(id_agencia, len(partes) // 4) + b''.join(partes)
+    return _frame_v2(ENVIO_BATCH, body)
+
+
+def serializar_solicitud_ganadores_v2(id_agencia: int) -> bytes:
+    return _frame_v2(SOLICITUD_GANADORES, _UINT32.pack(id_agencia))
+
+
+def apuestas_sinteticas(cantidad: int, desde: int = 0):
+    for i in range(desde, desde + cantidad):
+        yield ('Nombre%d' % (i % 1000), 'Apellido%d' % (i % 5000), 20000000 + i, '1990-%02d-%02d' % (i % 12 + 1, i % 28 + 1), i % 10000)
+
+
+def serializar_envio_batch_secuenciado(id_agencia: int, secuencia: int, apuestas: Iterable[ApuestaCruda]) -> bytes:
+    # Mismo cuerpo que ENVIO_BATCH, con la secuencia despues del id de agencia
+    frame = serializar_envio_batch(id_agencia, apuestas)
+    return bytes([ENVIO_BATCH_SECUENCIADO]) + frame[1:5] + _UINT32.pack(secuencia) + frame[5:]
+
+
+def serializar_negociacion_compresion(codec: int) -> bytes:
+    return bytes([NEGOCIACION_COMPRESION, codec])
+
+
+class CompresorBatches:
+    """
+    Compresion de los batches de una conexion: un unico stream zlib, con un
+    Z_SYNC_FLUSH al final de cada frame para que el servidor pueda
+    decodificarlo sin esperar al siguiente.
+    """
+
+    def __init__(self, nivel: int = zlib.Z_DEFAULT_COMPRESSION, v2: bool = False):
+        self._compresor = zlib.compressobj(nivel)
+        self._v2 = v2
+
+    def comprimir(self, frame: bytes) -> bytes:
+        datos = self._compresor.compress(frame) + self._compresor.flush(zlib.Z_SYNC_FLUSH)
+        if self._v2:
+            return _frame_v2(FRAME_COMPRIMIDO, datos)
+        return bytes([FRAME_COMPRIMIDO]) + _UINT32.pack(len(datos)) + datos
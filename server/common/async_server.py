@@ -0,0 +1,375 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import signal
+import time
+from collections import deque
+from typing import Deque, List, Optional, Sequence, Set
+
+from common import metricas, perfilador
+from common.client_handler import FASES_DE_MENSAJES, MAX_BATCHES_EN_VUELO
+from common.communication import ConfirmacionRecepcionMessage, ConsultaProgresoMessage, ProgresoMessage, ConfirmacionSecuenciaMessage, DecodificadorMensajes, EnvioBatchMessage, EnvioBatchSecuenciadoMessage, Message, MessageType, SolicitudGanadoresMessage, RondaNoDisponible, RondaNoDisponibleMessage, SolicitudGanadoresRondaMessage, SorteoNoRealizadoMessage, SuscripcionGanadoresMessage, TIPOS_NEGOCIACION
+from common.server import Server
+from common.utils import Bet, exception_origin
+
+# Cantidad de mensajes decodificados sin procesar a partir de la cual se deja
+# de leer la conexion, para que un cliente rapido no acumule memoria sin limite.
+MAX_MENSAJES_PENDIENTES = 8
+
+
+class AsyncClientHandler(asyncio.BufferedProtocol):
+    """
+    Equivalente de ClientHandler para el motor asyncio: atiende una conexion
+    desde el event loop, sin un thread propio.
+
+    El transporte lee directamente en el buffer del DecodificadorMensajes, y
+    los mensajes completos se procesan en orden en una unica tarea por conexion,
+    para que las confirmaciones salgan en el mismo orden que los batches.
+    """
+
+    def __init__(self, server: "AsyncServer", numero: int):
+        self.server = server
+        self.name = f"conexion-{numero}"
+        self.decodificador = DecodificadorMensajes()
+        self.transport: Optional[asyncio.Transport] = None
+        self._mensajes: Deque[Message] = deque()
+        self._tarea: Optional[asyncio.Task] = None
+        self._lectura_pausada = False
+        # Tareas que envian la confirmacion de un batch pipelined cuando es durable
+        self._en_vuelo: Set[asyncio.Task] = set()
+        # Respuestas escritas en esta vuelta del event loop, que se envian juntas al terminarla
+        self._salida: List[bytes] = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        metricas.HANDLERS_ACTIVOS.inc()
+        self.server.conexion_abierta(self)
+        self.actualizar_lectura()
+
+    def connection_lost(self, exc):
+        metricas.HANDLERS_ACTIVOS.dec()
+        self.server.conexion_cerrada(self)
+
+    def get_buffer(self, sizehint):
+        return self.decodificador.espacio_libre()
+
+    def buffer_updated(self, nbytes):
+        self.decodificador.datos_recibidos(nbytes)
+        try:
+            while True:
+                mensaje = self.decodificador.siguiente_mensaje()
+                if mensaje is None:
+                    break
+                # Las negociaciones son propias de la conexion, igual que en Communication
+                if mensaje.tipo_mensaje in TIPOS_NEGOCIACION:
+                    self.escribir_mensaje(self.decodificador.negociar(mensaje))
+                    continue
+                self._mensajes.append(mensaje)
+        except Exception as e:
+            self._fallar(e)
+            return
+
+        self.actualizar_lectura()
+        if self._mensajes and self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._procesar_mensajes())
+
+    def actualizar_lectura(self):
+        """
+        Pausa la lectura con demasiados mensajes sin procesar en la conexion, o
+        con demasiado pendiente de almacenar en el servidor (su control de
+        flujo), y la reanuda cuando no pasa ninguna de las dos cosas.
+        """
+        pausar = len(self._mensajes) >= MAX_MENSAJES_PENDIENTES or self.server.control_flujo.pausado
+        if pausar == self._lectura_pausada or self.transport.is_closing():
+            return
+        self._lectura_pausada = pausar
+        if pausar:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+    def eof_received(self):
+        if self.decodificador.hay_datos_pendientes:
+            self._fallar(ValueError("Failed to read all bytes"))
+        else:
+            logging.info(f"action: conexion_cerrada | result: success | thread: {self.name}")
+        # Las respuestas de los mensajes pendientes ya no tienen a quien llegar,
+        # pero se siguen procesando (p. ej. el batch vacio que completa una agencia).
+        return False
+
+    def escribir_mensaje(self, mensaje: Message):
+        self.escribir_bytes(mensaje.serialize())
+
+    def escribir_bytes(self, datos: bytes):
+        if self.transport.is_closing():
+            return
+        if not self._salida:
+            asyncio.get_running_loop().call_soon(self._vaciar_salida)
+        self._salida.append(datos)
+
+    def _vaciar_salida(self):
+        """
+        Envia juntas las respuestas de la vuelta del event loop (p. ej. las
+        confirmaciones de varios batches que se volvieron durables a la vez).
+        """
+        salida, self._salida = self._salida, []
+        if salida and not self.transport.is_closing():
+            self.transport.writelines(salida)
+
+    async def _procesar_mensajes(self):
+        try:
+            while self._mensajes:
+                mensaje = self._mensajes.popleft()
+                # Los spans de cada conexion van en su propia pista, porque comparten el thread del event loop
+                with perfilador.fase(FASES_DE_MENSAJES.get(mensaje.tipo_mensaje, "otros"), self.name):
+                    if mensaje.tipo_mensaje == MessageType.ENVIO_BATCH:
+                        await self.procesar_envio_batch(mensaje)
+                    elif mensaje.tipo_mensaje == MessageType.ENVIO_BATCH_SECUENCIADO:
+                        await self.procesar_envio_batch_secuenciado(mensaje)
+                    elif mensaje.tipo_mensaje == MessageType.SOLICITUD_GANADORES:
+                        self.procesar_solicitud_ganadores(mensaje)
+                    elif mensaje.tipo_mensaje == MessageType.SUSCRIPCION_GANADORES:
+                        await self.procesar_suscripcion_ganadores(mensaje)
+                    elif mensaje.tipo_mensaje == MessageType.SOLICITUD_GANADORES_RONDA:
+                        self.procesar_solicitud_ganadores_ronda(mensaje)
+                    elif mensaje.tipo_mensaje == MessageType.CONSULTA_PROGRESO:
+                        self.procesar_consulta_progreso(mensaje)
+
+                if self._lectura_pausada:
+                    self.actualizar_lectura()
+        except Exception as e:
+            self._mensajes.clear()
+            self._fallar(e)
+        finally:
+            self._tarea = None
+
+    async def procesar_envio_batch(self, mensaje: EnvioBatchMessage) -> bool:
+        # Si ya completó envio, o el servidor ya hizo el sorteo, no debería enviarme más apuestas
+        if not self.server.acepta_apuestas_de(mensaje.id_agencia):
+            self.escribir_mensaje(ConfirmacionRecepcionMessage(confirmacion=1))
+            return False
+
+        # Si recibo 0 bets, quiere decir que ya no envian más apuestas
+        if mensaje.numero_apuestas == 0:
+            await self._esperar_confirmaciones()
+            await self.server.marcar_agencia_completada_async(mensaje.id_agencia)
+            self.escribir_mensaje(ConfirmacionRecepcionMessage(confirmacion=0))
+            return False
+
+        if not self.server.admite_bets(mensaje.apuestas):
+            logging.warning(f"action: apuesta_recibida | result: fail | motivo: no_almacenable | cantidad: {mensaje.numero_apuestas} | thread: {self.name}")
+            self.escribir_mensaje(ConfirmacionRecepcionMessage(confirmacion=1))
+            return False
+
+        logging.info("action: apuesta_recibida | result: success | cantidad: %s | thread: %s", mensaje.numero_apuestas, self.name)
+        await self.server.almacenar_bets_async(mensaje.apuestas, mensaje.tamanio)
+
+        self.escribir_mensaje(ConfirmacionRecepcionMessage(confirmacion=0))
+        return True
+
+    async def procesar_envio_batch_secuenciado(self, mensaje: EnvioBatchSecuenciadoMessage) -> bool:
+        """Equivalente de ClientHandler.procesar_envio_batch_secuenciado: no espera a que el batch sea durable."""
+        if not self.server.acepta_apuestas_de(mensaje.id_agencia):
+            self.escribir_mensaje(ConfirmacionSecuenciaMessage(secuencia=mensaje.secuencia, acumulada=self.server.secuencia_acumulada(mensaje.id_agencia), confirmacion=1))
+            return False
+
+        if mensaje.numero_apuestas == 0:
+            await self._esperar_confirmaciones()
+            acumulada = self.server.secuencia_acumulada(mensaje.id_agencia)
+            await self.server.marcar_agencia_completada_async(mensaje.id_agencia)
+            self.escribir_mensaje(ConfirmacionSecuenciaMessage(secuencia=mensaje.secuencia, acumulada=acumulada, confirmacion=0))
+            return False
+
+        if not self.server.admite_bets(mensaje.apuestas):
+            logging.warning(f"action: apuesta_recibida | result: fail | motivo: no_almacenable | secuencia: {mensaje.secuencia} | thread: {self.name}")
+            self.escribir_mensaje(ConfirmacionSecuenciaMessage(secuencia=mensaje.secuencia, acumulada=self.server.secuencia_acumulada(mensaje.id_agencia), confirmacion=1))
+            return False
+
+        futuro, duplicado = self.server.reservar_secuencia(mensaje.id_agencia, mensaje.secuencia, mensaje.numero_apuestas)
+        if duplicado:
+            logging.info("action: apuesta_recibida | result: duplicada | secuencia: %s | thread: %s", mensaje.secuencia, self.name)
+        else:
+            logging.info("action: apuesta_recibida | result: success | cantidad: %s | secuencia: %s | thread: %s", mensaje.numero_apuestas, mensaje.secuencia, self.name)
+            await self.server.almacenar_bets_secuenciadas_async(mensaje.id_agencia, mensaje.secuencia, mensaje.apuestas, mensaje.tamanio)
+
+        tarea = asyncio.get_running_loop().create_task(self._confirmar(mensaje.id_agencia, mensaje.secuencia, futuro))
+        self._en_vuelo.add(tarea)
+        tarea.add_done_callback(self._en_vuelo.discard)
+        if len(self._en_vuelo) >= MAX_BATCHES_EN_VUELO:
+            await asyncio.wait(set(self._en_vuelo), return_when=asyncio.FIRST_COMPLETED)
+        return not duplicado
+
+    async def _confirmar(self, agencia: int, secuencia: int, futuro: concurrent.futures.Future):
+        try:
+            await asyncio.wrap_future(futuro)
+            confirmacion = 0
+        except Exception as e:
+            logging.error(f"action: apuesta_recibida | result: fail | secuencia: {secuencia} | error: {e} | thread: {self.name}")
+            confirmacion = 1
+        self.escribir_mensaje(ConfirmacionSecuenciaMessage(secuencia=secuencia, acumulada=self.server.secuencia_acumulada(agencia), confirmacion=confirmacion))
+
+    async def _esperar_confirmaciones(self):
+        if self._en_vuelo:
+            await asyncio.wait(set(self._en_vuelo))
+
+    def procesar_solicitud_ganadores(self, mensaje: SolicitudGanadoresMessage) -> bool:
+        if not self.server.sorteo_fue_realizado(mensaje.id_agencia):
+            self.escribir_mensaje(SorteoNoRealizadoMessage())
+            return False
+
+        self.escribir_bytes(self.server.obtener_respuesta_ganadores(mensaje.id_agencia))
+        return False
+
+    async def procesar_suscripcion_ganadores(self, mensaje: SuscripcionGanadoresMessage) -> bool:
+        # Solo se retiene esta conexion: el resto sigue atendiendose desde el event loop
+        await self.server.esperar_sorteo_async(mensaje.id_agencia, mensaje.espera_ms)
+        return self.procesar_solicitud_ganadores(SolicitudGanadoresMessage(id_agencia=mensaje.id_agencia))
+
+    def procesar_solicitud_ganadores_ronda(self, mensaje: SolicitudGanadoresRondaMessage) -> bool:
+        try:
+            respuesta = self.server.obtener_respuesta_ganadores_de_ronda(mensaje.id_agencia, mensaje.ronda)
+        except RondaNoDisponible:
+            self.escribir_mensaje(RondaNoDisponibleMessage())
+            return False
+        if respuesta is None:
+            self.escribir_mensaje(SorteoNoRealizadoMessage())
+            return False
+
+        self.escribir_bytes(respuesta)
+        return False
+
+    def procesar_consulta_progreso(self, mensaje: ConsultaProgresoMessage) -> bool:
+        acumulada, apuestas, completada = self.server.progreso_agencia(mensaje.id_agencia)
+        logging.info("action: consulta_progreso | result: success | agencia: %s | acumulada: %s | apuestas: %s | completada: %s | thread: %s", mensaje.id_agencia, acumulada, apuestas, completada, self.name)
+        self.escribir_mensaje(ProgresoMessage(acumulada=acumulada, apuestas=apuestas, completada=completada))
+        return False
+
+    def _fallar(self, e: Exception):
+        archivo, linea = exception_origin(e)
+        logging.error(f"action: apuesta_recibida | result: fail | cantidad: 0 | error: {e} | file: {archivo} | line: {linea} | thread: {self.name}")
+        self.escribir_mensaje(ConfirmacionRecepcionMessage(confirmacion=1))
+        self._vaciar_salida()
+        self.transport.close()
+
+
+class AsyncServer(Server):
+    """
+    Motor alternativo del servidor (SERVER_ENGINE=asyncio): todas las conexiones
+    se atienden desde un unico event loop en vez de un thread por conexion.
+
+    Comparte con Server el estado del sorteo y sus operaciones (almacenar_bets,
+    marcar_agencia_completada, obtener_ganadores_de_agencia, etc.), por lo que
+    la semantica del sorteo es la misma. El almacenamiento lo hace el thread
+    del BetWriter, y el event loop solo espera su Future.
+    """
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._conexiones: Set[AsyncClientHandler] = set()
+        self._clientes_atendidos = 0
+        # Se setea cuando se puede realizar el sorteo, o cuando hay que detenerse
+        self._evento_sorteo = asyncio.Event()
+        # Se setea cuando el sorteo ya se realizó, o cuando hay que detenerse
+        self._evento_sorteo_realizado = asyncio.Event()
+        # Se setea cuando ya se atendieron todos los clientes y se cerraron sus conexiones
+        self._evento_sin_conexiones = asyncio.Event()
+
+        # El control de flujo cambia de estado desde el thread que encola o desde el BetWriter
+        self.control_flujo.suscribir(lambda: loop.call_soon_threadsafe(self._aplicar_control_flujo))
+
+        self._servidor = await loop.create_server(lambda: AsyncClientHandler(self, self._clientes_atendidos), sock=self._server_socket)
+        self._server_socket = None
+        loop.add_signal_handler(signal.SIGTERM, self._detener)
+        logging.info('action: accept_connections | result: in_progress')
+
+        await self._evento_sorteo.wait()
+
+        if not self._stopped:
+            logging.info("action: realizar_sorteo | result: in_progress")
+            inicio_sorteo = time.perf_counter()
+            with perfilador.fase("sorteo"):
+                await loop.run_in_executor(None, self._realizar_sorteo)
+            metricas.SORTEO.observar(time.perf_counter() - inicio_sorteo)
+            self._sorteo_realizado.set(True)
+            self._evento_sorteo_realizado.set()
+            logging.info("action: realizar_sorteo | result: success")
+
+        # Al salir, espero a que se cierren todas las conexiones restantes
+        await self._evento_sin_conexiones.wait()
+        self._servidor.close()
+        await self._servidor.wait_closed()
+        loop.remove_signal_handler(signal.SIGTERM)
+        self._cerrar_almacenamiento()
+        logging.info("action: stop_server | result: success")
+
+    def _detener(self):
+        logging.info("action: stop_server | result: in_progress")
+        self._stopped = True
+        self._servidor.close()
+        for conexion in list(self._conexiones):
+            conexion.transport.abort()
+        self._evento_sorteo.set()
+        self._evento_sorteo_realizado.set()
+        self._evento_sin_conexiones.set()
+
+    def conexion_abierta(self, conexion: AsyncClientHandler):
+        self._clientes_atendidos += 1
+        self._conexiones.add(conexion)
+        ip = conexion.transport.get_extra_info('peername')[0]
+        logging.info(f'action: accept_connections | result: success | ip: {ip}')
+
+        # Igual que el motor con threads, solo se aceptan CLIENT_AMOUNT conexiones
+        if self._clientes_atendidos >= self._agencias_totales:
+            self._servidor.close()
+
+    def _aplicar_control_flujo(self):
+        """Pausa o reanuda la lectura de todas las conexiones, segun el control de flujo."""
+        for conexion in self._conexiones:
+            conexion.actualizar_lectura()
+
+    def conexion_cerrada(self, conexion: AsyncClientHandler):
+        self._conexiones.discard(conexion)
+        if self._clientes_atendidos >= self._agencias_totales and not self._conexiones:
+            self._evento_sin_conexiones.set()
+
+    async def marcar_agencia_completada_async(self, agencia: int):
+        """Equivalente de Server.marcar_agencia_completada que espera el checkpoint en el event loop."""
+        try:
+            futuro = self.persistir_agencia_completada(agencia, bloquear=False)
+        except queue.Full:
+            futuro = await asyncio.get_running_loop().run_in_executor(None, self.persistir_agencia_completada, agencia)
+        if futuro is not None:
+            await asyncio.wrap_future(futuro)
+        self._publicar_agencia_completada(agencia)
+
+    def _publicar_agencia_completada(self, agencia: int):
+        super()._publicar_agencia_completada(agencia)
+        if len(self._agencias_que_completaron_envio.get()) >= self._agencias_totales:
+            self._evento_sorteo.set()
+
+    async def esperar_sorteo_async(self, agencia: int, espera_ms: int) -> bool:
+        """Equivalente de Server.esperar_sorteo que espera en el event loop en vez de bloquear un thread."""
+        if not self.sorteo_fue_realizado(agencia):
+            espera = min(espera_ms, self._max_espera_ganadores_ms) / 1000
+            try:
+                await asyncio.wait_for(self._evento_sorteo_realizado.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+        return self._sorteo_realizado.get()
+
+    async def almacenar_bets_async(self, bets: Sequence[Bet], tamanio: int = 0):
+        secuencia, futuro = self.reservar_siguiente_secuencia(bets)
+        await self.almacenar_bets_secuenciadas_async(bets[0].agency, secuencia, bets, tamanio)
+        await asyncio.wrap_future(futuro)
+
+    async def almacenar_bets_secuenciadas_async(self, agencia: int, secuencia: int, bets: Sequence[Bet], tamanio: int = 0):
+        # Solo si la cola del BetWriter está llena se encola desde el executor,
+        # para no bloquear el event loop esperando lugar.
+        try:
+            self.almacenar_bets_secuenciadas(agencia, secuencia, bets, bloquear=False, tamanio=tamanio)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self.almacenar_bets_secuenciadas, agencia, secuencia, bets, True, tamanio)
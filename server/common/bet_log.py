@@ -0,0 +1,230 @@
+"""
+Log binario de apuestas, alternativo a bets.csv (BETS_STORAGE_FORMAT=binary).
+
+El archivo empieza con un magic de 8 bytes, seguido de registros append-only:
+
+    | agencia (uint32) | documento (uint32) | numero (uint32) |
+    | nacimiento (int32, dias desde 1970-01-01) |
+    | len nombre (uint8) | len apellido (uint8) |
+    | nombre (utf-8) | apellido (utf-8) |
+
+Todos los enteros son little-endian. El header de cada registro es de ancho
+fijo, por lo que un recorrido que solo necesita agencia, documento y numero
+(como el sorteo) salta los nombres sin decodificarlos.
+
+Tambien se puede usar como conversor desde/hacia el formato CSV:
+
+    python -m common.bet_log csv-a-binario bets.csv bets.bin
+    python -m common.bet_log binario-a-csv bets.bin bets.csv
+"""
+import datetime
+import functools
+import itertools
+import logging
+import mmap
+import os
+import struct
+import dataclasses
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+from common.utils import STORAGE_FILEPATH, Bet, BetBatch, format_bets, load_bets
+
+""" Binary bets storage location. """
+BINARY_STORAGE_FILEPATH = "./bets.bin"
+
+MAGIC = b'BETLOG\x00\x01'
+
+# Largo maximo en bytes utf-8 de un nombre o un apellido: el registro lo guarda en un uint8
+MAX_BYTES_NOMBRE = 255
+
+_HEADER_REGISTRO = struct.Struct('<IIIiBB')  # agencia, documento, numero, nacimiento, len nombre, len apellido
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# agencia, nombre, apellido, documento, nacimiento (dias desde epoch), numero
+Registro = Tuple[int, str, str, int, int, int]
+
+
+def _dias_desde_epoch(fecha: datetime.date) -> int:
+    return fecha.toordinal() - _EPOCH_ORDINAL
+
+
+@functools.lru_cache(maxsize=64 * 1024)
+def _fecha_iso_desde_epoch(dias: int) -> str:
+    # Las fechas de nacimiento se repiten mucho: se convierte cada una una sola vez
+    return datetime.date.fromordinal(dias + _EPOCH_ORDINAL).isoformat()
+
+
+@functools.lru_cache(maxsize=64 * 1024)
+def _dias_desde_iso(fecha: str) -> int:
+    return _dias_desde_epoch(datetime.date.fromisoformat(fecha))
+
+
+def format_bets_binary(bets: Sequence[Bet]) -> bytes:
+    """Serializa las apuestas como registros del log binario, para escribirlas con un unico write."""
+    if isinstance(bets, BetBatch):
+        # Se recorren las columnas del batch sin construir un Bet por apuesta
+        filas = ((agencia, nombre, apellido, documento, _dias_desde_iso(nacimiento), numero)
+                 for agencia, nombre, apellido, documento, nacimiento, numero in bets.rows())
+    else:
+        filas = ((bet.agency, bet.first_name, bet.last_name, int(bet.document), _dias_desde_epoch(bet.birthdate), bet.number)
+                 for bet in bets)
+    partes = []
+    for agencia, nombre, apellido, documento, nacimiento, numero in filas:
+        nombre = nombre.encode('utf-8')
+        apellido = apellido.encode('utf-8')
+        if len(nombre) > MAX_BYTES_NOMBRE or len(apellido) > MAX_BYTES_NOMBRE:
+            raise ValueError("Names longer than 255 bytes can not be stored in the binary log")
+        partes.append(_HEADER_REGISTRO.pack(agencia, documento, numero, nacimiento, len(nombre), len(apellido)))
+        partes.append(nombre)
+        partes.append(apellido)
+    return b''.join(partes)
+
+
+def admite_bets_binary(bets: Sequence[Bet]) -> bool:
+    """Si todos los nombres de las apuestas entran en un registro del log binario."""
+    if isinstance(bets, BetBatch):
+        nombres = itertools.chain(bets.first_names, bets.last_names)
+    else:
+        nombres = (nombre for bet in bets for nombre in (bet.first_name, bet.last_name))
+    # Un caracter ocupa como mucho 4 bytes en utf-8: solo se codifican los nombres largos
+    return all(len(nombre) <= MAX_BYTES_NOMBRE // 4 or len(nombre.encode('utf-8')) <= MAX_BYTES_NOMBRE for nombre in nombres)
+
+
+def _admite_todas(bets: Sequence[Bet]) -> bool:
+    return True
+
+
+def iter_registros(filepath: str = BINARY_STORAGE_FILEPATH, con_nombres: bool = True) -> Iterator[Registro]:
+    """
+    Recorre los registros del log mapeando el archivo en memoria, sin leerlo
+    ni copiarlo completo. Con con_nombres=False los nombres se devuelven vacios
+    y no se decodifican.
+
+    Si el ultimo registro quedó incompleto (p. ej. el proceso murió a mitad de
+    una escritura), se ignora y se informa por log.
+    """
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            if datos[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{filepath} is not a binary bet log")
+            pos = len(MAGIC)
+            fin = len(datos)
+            unpack_from = _HEADER_REGISTRO.unpack_from
+            tamanio_header = _HEADER_REGISTRO.size
+            while pos < fin:
+                if pos + tamanio_header > fin:
+                    break
+                agencia, documento, numero, nacimiento, len_nombre, len_apellido = unpack_from(datos, pos)
+                pos_nombres = pos + tamanio_header
+                pos = pos_nombres + len_nombre + len_apellido
+                if pos > fin:
+                    break
+                if con_nombres:
+                    nombre = datos[pos_nombres:pos_nombres + len_nombre].decode('utf-8')
+                    apellido = datos[pos_nombres + len_nombre:pos].decode('utf-8')
+                else:
+                    nombre = apellido = ''
+                yield agencia, nombre, apellido, documento, nacimiento, numero
+            if pos != fin:
+                logging.warning(f"action: leer_log_apuestas | result: fail | error: registro final incompleto | file: {filepath}")
+
+
+def load_bets_binary(filepath: str = BINARY_STORAGE_FILEPATH) -> Iterator[Bet]:
+    """Equivalente a load_bets() para el log binario."""
+    for agencia, nombre, apellido, documento, nacimiento, numero in iter_registros(filepath):
+        yield Bet(agencia, nombre, apellido, str(documento), _fecha_iso_desde_epoch(nacimiento), numero)
+
+
+def scan_bets_csv(filepath: str = STORAGE_FILEPATH) -> Iterator[Tuple[int, int, int]]:
+    """Recorre bets.csv devolviendo solo (agencia, documento, numero), sin construir un Bet por fila."""
+    import csv
+    with open(filepath, 'r') as file:
+        for row in csv.reader(file, quoting=csv.QUOTE_MINIMAL):
+            yield int(row[0]), int(row[3]), int(row[5])
+
+
+def scan_bets_binary(filepath: str = BINARY_STORAGE_FILEPATH) -> Iterator[Tuple[int, int, int]]:
+    """Recorre el log binario devolviendo solo (agencia, documento, numero), salteando los nombres."""
+    for agencia, _, _, documento, _, numero in iter_registros(filepath, con_nombres=False):
+        yield agencia, documento, numero
+
+
+@dataclass(frozen=True)
+class StorageFormat:
+    """Formato del archivo donde el BetWriter persiste las apuestas."""
+    name: str
+    filepath: str
+    binary: bool
+    header: bytes
+    format_bets: Callable[[Sequence[Bet]], Union[str, bytes]]
+    load_bets: Callable[[str], Iterator[Bet]]
+    scan_bets: Callable[[str], Iterator[Tuple[int, int, int]]]
+    # Si el formato puede guardar las apuestas de un batch, para rechazarlo antes de encolarlo
+    admite_bets: Callable[[Sequence[Bet]], bool] = _admite_todas
+
+    def shard(self, numero: int) -> 'StorageFormat':
+        """El mismo formato, escrito en el shard numero (p. ej. ./bets.2.csv) en vez del archivo unico."""
+        raiz, extension = os.path.splitext(self.filepath)
+        return dataclasses.replace(self, filepath=f"{raiz}.{numero}{extension}")
+
+    def ronda(self, numero: int) -> 'StorageFormat':
+        """El mismo formato, escrito en el archivo de la ronda numero (p. ej. ./bets.ronda-3.csv)."""
+        raiz, extension = os.path.splitext(self.filepath)
+        return dataclasses.replace(self, filepath=f"{raiz}.ronda-{numero}{extension}")
+
+
+CSV_STORAGE = StorageFormat("csv", STORAGE_FILEPATH, False, b'', format_bets, load_bets, scan_bets_csv)
+BINARY_STORAGE = StorageFormat("binary", BINARY_STORAGE_FILEPATH, True, MAGIC, format_bets_binary, load_bets_binary, scan_bets_binary, admite_bets_binary)
+STORAGE_FORMATS: Dict[str, StorageFormat] = {formato.name: formato for formato in (CSV_STORAGE, BINARY_STORAGE)}
+
+
+# Cantidad de apuestas que el conversor escribe por cada write
+_APUESTAS_POR_ESCRITURA = 4096
+
+
+def _convertir(bets: Iterator[Bet], salida, formatear: Callable[[List[Bet]], Union[str, bytes]]) -> int:
+    cantidad = 0
+    pendientes: List[Bet] = []
+    for bet in bets:
+        pendientes.append(bet)
+        if len(pendientes) == _APUESTAS_POR_ESCRITURA:
+            salida.write(formatear(pendientes))
+            cantidad += len(pendientes)
+            pendientes = []
+    salida.write(formatear(pendientes))
+    return cantidad + len(pendientes)
+
+
+def convertir_csv_a_binario(origen: str, destino: str) -> int:
+    import csv
+    with open(origen, 'r') as entrada, open(destino, 'wb') as salida:
+        salida.write(MAGIC)
+        bets = (Bet(row[0], row[1], row[2], row[3], row[4], row[5]) for row in csv.reader(entrada, quoting=csv.QUOTE_MINIMAL))
+        return _convertir(bets, salida, format_bets_binary)
+
+
+def convertir_binario_a_csv(origen: str, destino: str) -> int:
+    with open(destino, 'w') as salida:
+        return _convertir(load_bets_binary(origen), salida, format_bets)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Conversor entre bets.csv y el log binario de apuestas")
+    parser.add_argument('conversion', choices=('csv-a-binario', 'binario-a-csv'))
+    parser.add_argument('origen')
+    parser.add_argument('destino')
+    args = parser.parse_args()
+
+    if args.conversion == 'csv-a-binario':
+        cantidad = convertir_csv_a_binario(args.origen, args.destino)
+    else:
+        cantidad = convertir_binario_a_csv(args.origen, args.destino)
+    print(f"action: convertir_apuestas | result: success | cantidad: {cantidad}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import concurrent.futures
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from common import metricas
+from common.bet_log import CSV_STORAGE, StorageFormat
+from common.checkpoint import Progreso, formatear_registros, ruta_checkpoint
+from common.control_flujo import ControlFlujo
+from common.utils import Bet
+
+# Politicas de fsync del archivo de apuestas
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+FSYNC_NONE = "none"
+FSYNC_POLICIES = (FSYNC_BATCH, FSYNC_INTERVAL, FSYNC_NONE)
+
+# Cantidad de batches que pueden esperar en la cola antes de que encolar() bloquee
+MAX_BATCHES_ENCOLADOS = 1024
+# Cantidad maxima de batches que se agrupan en una misma escritura
+MAX_BATCHES_POR_GRUPO = 256
+
+# Marca de fin que se encola al cerrar el writer
+_FIN = None
+
+# apuestas, Future que se resuelve al escribirlas, su registro para el checkpoint, y cuando se encoló
+BatchEncolado = Tuple[Sequence[Bet], concurrent.futures.Future, Optional[Progreso], float]
+
+
+class BetWriter(threading.Thread):
+    """
+    Etapa de escritura de apuestas con group commit.
+
+    Los handlers encolan los batches ya decodificados con encolar(), que
+    devuelve un Future. Un unico thread mantiene abierto el archivo de
+    apuestas, toma todos los batches acumulados en la cola y los escribe con un
+    solo write (y un solo fsync). Recien despues resuelve los Futures, por lo
+    que quien espera el Future sabe que su batch ya es durable.
+
+    Politicas de fsync:
+    - batch: fsync despues de cada escritura agrupada.
+    - interval: fsync como mucho cada fsync_interval_ms. Los batches ya
+      escritos se resuelven con el siguiente fsync.
+    - none: sin fsync. El batch se resuelve cuando llegó al sistema operativo.
+
+    El formato del archivo (bets.csv o el log binario) lo decide storage_format.
+
+    Con checkpoint, cada escritura agrupada agrega tambien al checkpoint
+    (common/checkpoint.py) el progreso de los batches encolados con uno, y
+    ambos archivos se sincronizan antes de resolver sus Futures.
+
+    Con control_flujo, cada batch cuenta como pendiente desde que se encola
+    hasta que se resuelve su Future (common/control_flujo.py).
+    """
+
+    def __init__(self, filepath: Optional[str] = None, fsync_policy: str = FSYNC_BATCH, fsync_interval_ms: int = 10, max_batches_encolados: int = MAX_BATCHES_ENCOLADOS, storage_format: StorageFormat = CSV_STORAGE, checkpoint: bool = False, control_flujo: Optional[ControlFlujo] = None):
+        super().__init__(name="bet-writer", daemon=True)
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}, got '{fsync_policy}'")
+        self._filepath = filepath if filepath is not None else storage_format.filepath
+        self._storage_format = storage_format
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval_ms / 1000
+        self._checkpoint_filepath = ruta_checkpoint(self._filepath) if checkpoint else None
+        # Archivo del checkpoint, abierto mientras corre el writer
+        self._checkpoint = None
+        self._cola: "queue.Queue[Optional[BatchEncolado]]" = queue.Queue(maxsize=max_batches_encolados)
+        self._control_flujo = control_flujo
+        # Batches tomados de la cola que todavía no se resolvieron, para fallarlos si el writer termina con un error
+        self._grupo: List[BatchEncolado] = []
+        self._sin_sincronizar: List[concurrent.futures.Future] = []
+
+    def encolar(self, bets: Sequence[Bet], bloquear: bool = True, progreso: Optional[Progreso] = None, tamanio: int = 0) -> concurrent.futures.Future:
+        """
+        Encola un batch para escribirlo. Si la cola está llena bloquea hasta que
+        haya lugar, o eleva queue.Full si bloquear es False. Con checkpoint, el
+        progreso se registra en la misma escritura agrupada que las apuestas.
+        tamanio son los bytes del mensaje del batch, para el control de flujo.
+        """
+        futuro = concurrent.futures.Future()
+        control = self._control_flujo
+        if control is None or not bets:
+            self._cola.put((bets, futuro, progreso, time.perf_counter()), block=bloquear)
+            return futuro
+
+        # Cuenta desde antes de esperar lugar en la cola: un handler bloqueado acá tambien retiene su batch
+        apuestas = len(bets)
+        control.agregar(tamanio, apuestas)
+        try:
+            self._cola.put((bets, futuro, progreso, time.perf_counter()), block=bloquear)
+        except queue.Full:
+            control.quitar(tamanio, apuestas)
+            raise
+        futuro.add_done_callback(lambda _: control.quitar(tamanio, apuestas))
+        return futuro
+
+    def cerrar(self):
+        """Escribe y sincroniza todo lo encolado, y termina el thread."""
+        self._cola.put(_FIN)
+        self.join()
+
+    def run(self):
+        try:
+            self._escribir_hasta_cerrar()
+        except Exception as e:
+            # Sin el archivo no se puede confirmar ningun batch: fallo todos los
+            # que se encolen de acá en más, para que ningun handler quede esperando.
+            logging.error(f"action: escribir_apuestas | result: fail | error: {e}")
+            for futuro in self._sin_sincronizar + [futuro for _, futuro, *_ in self._grupo]:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            while True:
+                encolado = self._cola.get()
+                if encolado is _FIN:
+                    break
+                encolado[1].set_exception(e)
+
+    def _escribir_hasta_cerrar(self):
+        # Futures de batches ya escritos que esperan el proximo fsync (politica interval)
+        sin_sincronizar = self._sin_sincronizar
+        proximo_fsync = 0.0
+
+        with open(self._filepath, 'ab' if self._storage_format.binary else 'a+') as file, self._abrir_checkpoint():
+            if self._storage_format.header and file.tell() == 0:
+                file.write(self._storage_format.header)
+            terminar = False
+            while not terminar:
+                timeout = max(0.0, proximo_fsync - time.monotonic()) if sin_sincronizar else None
+                grupo = self._grupo = self._tomar_grupo(timeout)
+                if grupo and grupo[-1] is _FIN:
+                    grupo.pop()
+                    terminar = True
+
+                inicio_escritura = time.perf_counter()
+                escritos = self._escribir(file, grupo)
+
+                if self._fsync_policy == FSYNC_NONE:
+                    self._resolver(escritos)
+                elif self._fsync_policy == FSYNC_BATCH:
+                    if escritos:
+                        self._resolver(escritos, self._sincronizar(file))
+                else:
+                    if escritos and not sin_sincronizar:
+                        proximo_fsync = time.monotonic() + self._fsync_interval
+                    sin_sincronizar.extend(escritos)
+                    if sin_sincronizar and (terminar or time.monotonic() >= proximo_fsync):
+                        self._resolver(sin_sincronizar, self._sincronizar(file))
+                        sin_sincronizar.clear()
+                self._grupo = []
+
+                if escritos:
+                    metricas.ESCRITURA_AGRUPADA.observar(time.perf_counter() - inicio_escritura)
+                    metricas.BATCHES_POR_ESCRITURA.observar(len(escritos))
+
+    def _abrir_checkpoint(self):
+        if self._checkpoint_filepath is None:
+            return contextlib.nullcontext()
+        self._checkpoint = open(self._checkpoint_filepath, 'ab')
+        return self._checkpoint
+
+    def _tomar_grupo(self, timeout: Optional[float]) -> List[Optional[BatchEncolado]]:
+        """Espera el primer batch (o hasta timeout), y toma sin esperar los que ya estén encolados."""
+        try:
+            grupo = [self._cola.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(grupo) < MAX_BATCHES_POR_GRUPO and grupo[-1] is not _FIN:
+            try:
+                grupo.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return grupo
+
+    def _escribir(self, file, grupo: List[BatchEncolado]) -> List[concurrent.futures.Future]:
+        if not grupo:
+            return []
+        tomado = time.perf_counter()
+        for *_, encolado in grupo:
+            metricas.ESPERA_COLA_WRITER.observar(tomado - encolado)
+        # Un batch que no se puede formatear se falla solo, y el resto del grupo se escribe igual
+        formatear = self._storage_format.format_bets
+        partes = []
+        formateados: List[BatchEncolado] = []
+        for encolado in grupo:
+            try:
+                partes.append(formatear(encolado[0]))
+            except Exception as e:
+                logging.error(f"action: escribir_apuestas | result: fail | cantidad: {len(encolado[0])} | error: {e}")
+                encolado[1].set_exception(e)
+                continue
+            formateados.append(encolado)
+        if not formateados:
+            return []
+        try:
+            file.write((b'' if self._storage_format.binary else '').join(partes))
+            file.flush()
+            if self._checkpoint is not None:
+                progresos = [progreso for _, _, progreso, _ in formateados if progreso is not None]
+                if progresos:
+                    self._checkpoint.write(formatear_registros(progresos, os.fstat(file.fileno()).st_size))
+                    self._checkpoint.flush()
+        except Exception as e:
+            for _, futuro, *_ in formateados:
+                futuro.set_exception(e)
+            return []
+        return [futuro for _, futuro, *_ in formateados]
+
+    def _sincronizar(self, file) -> Optional[OSError]:
+        try:
+            # Primero las apuestas. Si un registro del checkpoint llega al disco antes que sus
+            # apuestas, al recuperar se descarta porque su fin del log supera el del archivo
+            os.fsync(file.fileno())
+            if self._checkpoint is not None:
+                os.fsync(self._checkpoint.fileno())
+        except OSError as e:
+            return e
+        return None
+
+    def _resolver(self, futuros: List[concurrent.futures.Future], error: Optional[OSError] = None):
+        for futuro in futuros:
+            if error is None:
+                futuro.set_result(None)
+            else:
+                futuro.set_exception(error)
@@ -0,0 +1,96 @@
+"""
+Checkpoint del progreso de cada agencia, para retomar la ingesta despues de
+una caida del servidor (BETS_CHECKPOINT=true).
+
+En cada escritura agrupada, el BetWriter agrega al checkpoint (p. ej.
+./bets.checkpoint, junto a ./bets.csv) un registro por cada batch escrito y
+por cada agencia que completó su envio:
+
+    | tipo (uint8) | agencia (uint32) | secuencia (uint32) | apuestas (uint32) | fin del log (uint64) |
+
+fin del log es el tamaño del archivo de apuestas despues de la escritura que
+contiene al batch. Ambos archivos se sincronizan antes de resolver los
+batches, así que todo batch confirmado tiene su registro en el checkpoint.
+
+Al iniciar se descartan los registros cuyo fin del log supera el tamaño del
+archivo de apuestas (esas apuestas no llegaron al disco), y el archivo de
+apuestas se trunca al mayor fin del log restante: lo que sigue nunca se
+confirmó, y el cliente lo va a reenviar.
+"""
+import logging
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+_REGISTRO = struct.Struct('<BIIIQ')  # tipo, agencia, secuencia, apuestas, fin del log
+
+# Tipos de registro
+BATCH = 1
+COMPLETADA = 2
+
+# tipo, agencia, secuencia, apuestas
+Progreso = Tuple[int, int, int, int]
+
+
+def ruta_checkpoint(filepath: str) -> str:
+    """Ruta del checkpoint de un archivo de apuestas: bets.csv -> bets.checkpoint."""
+    return os.path.splitext(filepath)[0] + '.checkpoint'
+
+
+def progreso_batch(agencia: int, secuencia: int, apuestas: int) -> Progreso:
+    return BATCH, agencia, secuencia, apuestas
+
+
+def progreso_completada(agencia: int) -> Progreso:
+    return COMPLETADA, agencia, 0, 0
+
+
+def formatear_registros(progresos: Iterable[Progreso], fin_log: int) -> bytes:
+    return b''.join(_REGISTRO.pack(tipo, agencia, secuencia, apuestas, fin_log) for tipo, agencia, secuencia, apuestas in progresos)
+
+
+@dataclass
+class EstadoRecuperado:
+    # Tamaño del archivo de apuestas que cubren los registros validos
+    fin_log: int = 0
+    # Secuencias almacenadas de cada agencia, con su cantidad de apuestas
+    secuencias: Dict[int, Dict[int, int]] = field(default_factory=dict)
+    completadas: Set[int] = field(default_factory=set)
+
+
+def leer_checkpoint(filepath: str, tamanio_log: int) -> EstadoRecuperado:
+    """Lee los registros completos del checkpoint cuyas apuestas están en el archivo de tamaño tamanio_log."""
+    estado = EstadoRecuperado()
+    with open(filepath, 'rb') as archivo:
+        datos = archivo.read()
+    # Un registro incompleto al final es una escritura interrumpida: se ignora
+    completos = len(datos) - len(datos) % _REGISTRO.size
+    for tipo, agencia, secuencia, apuestas, fin_log in _REGISTRO.iter_unpack(datos[:completos]):
+        if fin_log > tamanio_log:
+            continue
+        estado.fin_log = max(estado.fin_log, fin_log)
+        if tipo == BATCH:
+            estado.secuencias.setdefault(agencia, {})[secuencia] = apuestas
+        elif tipo == COMPLETADA:
+            estado.completadas.add(agencia)
+    return estado
+
+
+def recuperar(filepath: str) -> Optional[EstadoRecuperado]:
+    """
+    Recupera el progreso del checkpoint del archivo de apuestas filepath, y
+    trunca de ese archivo las apuestas que nunca se confirmaron. Devuelve None
+    si no hay checkpoint.
+    """
+    checkpoint = ruta_checkpoint(filepath)
+    if not os.path.exists(checkpoint):
+        return None
+    tamanio_log = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+    estado = leer_checkpoint(checkpoint, tamanio_log)
+    if estado.fin_log < tamanio_log:
+        with open(filepath, 'r+b') as archivo:
+            archivo.truncate(estado.fin_log)
+            os.fsync(archivo.fileno())
+        logging.info(f"action: truncar_apuestas_sin_confirmar | result: success | bytes: {tamanio_log - estado.fin_log}")
+    return estado
@@ -1,29 +1,68 @@
 from socket import socket
+import concurrent.futures
+import queue
 import threading
 import logging
 
-from common.communication import Communication, ConexionCerradaPorCliente, EnvioBatchMessage, MessageType, SolicitudGanadoresMessage
-from typing import TYPE_CHECKING
+from common import metricas, perfilador
+
+from common.communication import RECHAZO_LIMITE_AGENCIA, Communication, ConexionCerradaPorCliente, ConexionInactiva, ConsultaProgresoMessage, RondaNoDisponible, EnvioBatchMessage, EnvioBatchSecuenciadoMessage, MessageType, SolicitudGanadoresMessage, SolicitudGanadoresRondaMessage, SuscripcionGanadoresMessage
+from common.utils import exception_origin
+from typing import TYPE_CHECKING, Optional, Tuple
 if TYPE_CHECKING:
     from common.server import Server
 
-class ClientHandler(threading.Thread):
-    def __init__(self, client_socket: socket, server: "Server"):
-        super().__init__()
-        self.communication: Communication = Communication(client_socket)
+# Cantidad maxima de batches pipelined de una conexion esperando su confirmacion.
+# Si el cliente envia más, se deja de leer la conexion hasta que se confirme alguno.
+MAX_BATCHES_EN_VUELO = 64
+
+# Fase de cada tipo de mensaje, para los spans del perfilador
+FASES_DE_MENSAJES = {
+    MessageType.ENVIO_BATCH: "ingesta",
+    MessageType.ENVIO_BATCH_SECUENCIADO: "ingesta",
+    MessageType.SOLICITUD_GANADORES: "ganadores",
+    MessageType.SUSCRIPCION_GANADORES: "ganadores",
+    MessageType.SOLICITUD_GANADORES_RONDA: "ganadores",
+    MessageType.CONSULTA_PROGRESO: "progreso",
+}
+
+# agencia, secuencia, y el Future que se resuelve cuando el batch es durable
+ConfirmacionPendiente = Tuple[int, int, concurrent.futures.Future]
+
+class ClientHandler:
+    """
+    Atiende una conexion hasta que se cierra. Corre en un thread del
+    PoolHandlers del servidor, cuyo nombre recibe para los logs.
+    """
+
+    def __init__(self, client_socket: socket, server: "Server", name: str, espera_inactividad: Optional[float] = None, espera_lectura: Optional[float] = None):
+        self.name = name
+        self.communication: Communication = Communication(client_socket, espera_inactividad, espera_lectura)
         self.server: "Server" = server
         self.stopped: bool = False
+        # Agencia del primer mensaje de la conexion, a la que se le cuenta la conexion
+        self._agencia: Optional[int] = None
+        # Confirmaciones de batches pipelined, que envia en orden el thread confirmador
+        self._confirmaciones: "queue.Queue[Optional[ConfirmacionPendiente]]" = queue.Queue(maxsize=MAX_BATCHES_EN_VUELO)
+        self._confirmador: Optional[threading.Thread] = None
 
     def run(self):
+        metricas.HANDLERS_ACTIVOS.inc()
         try:
             logging.info(f"action: esperando_recibir_mensaje | result: in_progress | thread: {self.name}")
             self.recibir_mensajes()
         except Exception as e:
-            import traceback
-            logging.error(f"action: apuesta_recibida | result: fail | cantidad: 0 | error: {e} | file: {traceback.extract_tb(e.__traceback__)[-1].filename} | line: {traceback.extract_tb(e.__traceback__)[-1].lineno} | thread: {self.name}")
+            archivo, linea = exception_origin(e)
+            logging.error(f"action: apuesta_recibida | result: fail | cantidad: 0 | error: {e} | file: {archivo} | line: {linea} | thread: {self.name}")
             self.communication.send_confirmacion_recepcion_error()
         finally:
+            if self._confirmador is not None:
+                self._confirmaciones.put(None)
+                self._confirmador.join()
+            if self._agencia is not None:
+                self.server.liberar_conexion_de_agencia(self._agencia)
             self.communication.close()
+            metricas.HANDLERS_ACTIVOS.dec()
 
     def stop(self):
         self.stopped = True
@@ -34,46 +73,209 @@ class ClientHandler(threading.Thread):
 
     def recibir_mensajes(self):
         while not self.stopped:
+            # Con demasiado pendiente de almacenar no se lee la conexion: el cliente queda frenado por TCP
+            self.server.control_flujo.esperar_reanudacion()
+            if self.stopped:
+                break
             try:
                 mensaje = self.communication.leer_mensaje_socket()
             except ConexionCerradaPorCliente:
                 logging.info(f"action: conexion_cerrada | result: success | thread: {self.name}")
                 self.stopped = True
                 break
-                
-            if mensaje.tipo_mensaje == MessageType.ENVIO_BATCH:
-                self.procesar_envio_batch(mensaje)
-            elif mensaje.tipo_mensaje == MessageType.SOLICITUD_GANADORES:
-                self.procesar_solicitud_ganadores(mensaje)
+            except ConexionInactiva as e:
+                logging.warning(f"action: conexion_cerrada | result: fail | error: {e} | thread: {self.name}")
+                self.stopped = True
+                break
+
+            if self._agencia is None and not self._admitir_agencia(mensaje.id_agencia):
+                self.stopped = True
+                break
+
+            with perfilador.fase(FASES_DE_MENSAJES.get(mensaje.tipo_mensaje, "otros")):
+                self.procesar_mensaje(mensaje)
+
+    def procesar_mensaje(self, mensaje):
+        if mensaje.tipo_mensaje == MessageType.ENVIO_BATCH:
+            self.procesar_envio_batch(mensaje)
+        elif mensaje.tipo_mensaje == MessageType.ENVIO_BATCH_SECUENCIADO:
+            self.procesar_envio_batch_secuenciado(mensaje)
+        elif mensaje.tipo_mensaje == MessageType.SOLICITUD_GANADORES:
+            self.procesar_solicitud_ganadores(mensaje)
+        elif mensaje.tipo_mensaje == MessageType.SUSCRIPCION_GANADORES:
+            self.procesar_suscripcion_ganadores(mensaje)
+        elif mensaje.tipo_mensaje == MessageType.SOLICITUD_GANADORES_RONDA:
+            self.procesar_solicitud_ganadores_ronda(mensaje)
+        elif mensaje.tipo_mensaje == MessageType.CONSULTA_PROGRESO:
+            self.procesar_consulta_progreso(mensaje)
 
 
+    def _admitir_agencia(self, agencia: int) -> bool:
+        """Cuenta la conexion para la agencia, o la rechaza si la agencia ya tiene demasiadas."""
+        if not self.server.registrar_conexion_de_agencia(agencia):
+            logging.warning(f"action: admitir_conexion | result: fail | motivo: limite_agencia | agencia: {agencia} | thread: {self.name}")
+            self.communication.send_conexion_rechazada(RECHAZO_LIMITE_AGENCIA)
+            return False
+        self._agencia = agencia
+        return True
+
     def procesar_envio_batch(self, mensaje: EnvioBatchMessage) -> bool:
         # Si ya completó envio, o el servidor ya hizo el sorteo, no debería enviarme más apuestas
-        if (self.server.agencia_completo_envio(mensaje.id_agencia) or self.server.sorteo_fue_realizado()):
+        if not self.server.acepta_apuestas_de(mensaje.id_agencia):
             self.communication.send_confirmacion_recepcion_error()
             return False
 
         # Si recibo 0 bets, quiere decir que ya no envian más apuestas
         if mensaje.numero_apuestas == 0:
+            self._esperar_confirmaciones()
             self.server.marcar_agencia_completada(mensaje.id_agencia)
             self.communication.send_confirmacion_recepcion_ok()
             return False
         
         apuestas = mensaje.apuestas
+        if not self.server.admite_bets(apuestas):
+            logging.warning(f"action: apuesta_recibida | result: fail | motivo: no_almacenable | cantidad: {mensaje.numero_apuestas} | thread: {self.name}")
+            self.communication.send_confirmacion_recepcion_error()
+            return False
 
-        logging.info(f"action: apuesta_recibida | result: success | cantidad: {mensaje.numero_apuestas} | thread: {self.name}")
-        self.server.almacenar_bets(apuestas)
+        logging.info("action: apuesta_recibida | result: success | cantidad: %s | thread: %s", mensaje.numero_apuestas, self.name)
+        self.server.almacenar_bets(apuestas, mensaje.tamanio)
         
         self.communication.send_confirmacion_recepcion_ok()
         return True
     
+    def procesar_envio_batch_secuenciado(self, mensaje: EnvioBatchSecuenciadoMessage) -> bool:
+        """
+        Batch del modo pipelined: se encola para almacenar y se sigue leyendo
+        sin esperar a que sea durable. El thread confirmador envia la
+        confirmacion cuando lo es.
+        """
+        if not self.server.acepta_apuestas_de(mensaje.id_agencia):
+            rechazo = concurrent.futures.Future()
+            rechazo.set_exception(ValueError("agency already completed or draw already done"))
+            self._encolar_confirmacion(mensaje.id_agencia, mensaje.secuencia, rechazo)
+            return False
+
+        # El batch vacio completa la agencia, recien cuando todos los anteriores son durables
+        if mensaje.numero_apuestas == 0:
+            self._esperar_confirmaciones()
+            # La acumulada es la de la ronda que se completa: se lee antes de completarla
+            acumulada = self.server.secuencia_acumulada(mensaje.id_agencia)
+            self.server.marcar_agencia_completada(mensaje.id_agencia)
+            self.communication.send_confirmacion_secuencia(mensaje.secuencia, acumulada)
+            return False
+
+        if not self.server.admite_bets(mensaje.apuestas):
+            logging.warning(f"action: apuesta_recibida | result: fail | motivo: no_almacenable | secuencia: {mensaje.secuencia} | thread: {self.name}")
+            rechazo = concurrent.futures.Future()
+            rechazo.set_exception(ValueError("batch can not be stored"))
+            self._encolar_confirmacion(mensaje.id_agencia, mensaje.secuencia, rechazo)
+            return False
+
+        futuro, duplicado = self.server.reservar_secuencia(mensaje.id_agencia, mensaje.secuencia, mensaje.numero_apuestas)
+        if duplicado:
+            logging.info("action: apuesta_recibida | result: duplicada | secuencia: %s | thread: %s", mensaje.secuencia, self.name)
+        else:
+            logging.info("action: apuesta_recibida | result: success | cantidad: %s | secuencia: %s | thread: %s", mensaje.numero_apuestas, mensaje.secuencia, self.name)
+            self.server.almacenar_bets_secuenciadas(mensaje.id_agencia, mensaje.secuencia, mensaje.apuestas, tamanio=mensaje.tamanio)
+        self._encolar_confirmacion(mensaje.id_agencia, mensaje.secuencia, futuro)
+        return not duplicado
+
+    def _encolar_confirmacion(self, agencia: int, secuencia: int, futuro: concurrent.futures.Future):
+        if self._confirmador is None:
+            self._confirmador = threading.Thread(target=self._confirmar_batches, name=f"{self.name}-confirmador", daemon=True)
+            self._confirmador.start()
+        self._confirmaciones.put((agencia, secuencia, futuro))
+
+    def _esperar_confirmaciones(self):
+        """Bloquea hasta que se hayan enviado las confirmaciones de todos los batches pipelined."""
+        if self._confirmador is not None:
+            self._confirmaciones.join()
+
+    def _confirmar_batches(self):
+        """
+        Envia en orden las confirmaciones de los batches pipelined. Las de los
+        batches que ya son durables se juntan y se envian con un unico sendmsg,
+        en vez de una escritura por batch.
+        """
+        while True:
+            pendiente = self._confirmaciones.get()
+            # Confirmaciones encoladas en la salida que todavía no se enviaron
+            sin_enviar = 0
+            while True:
+                if pendiente is None:
+                    self._enviar_confirmaciones(sin_enviar + 1)
+                    return
+                agencia, secuencia, futuro = pendiente
+                if sin_enviar and not futuro.done():
+                    # Antes de esperar al siguiente batch se envian las que ya están listas
+                    self._enviar_confirmaciones(sin_enviar)
+                    sin_enviar = 0
+                self._encolar_confirmacion_de_batch(agencia, secuencia, futuro)
+                sin_enviar += 1
+                try:
+                    pendiente = self._confirmaciones.get_nowait()
+                except queue.Empty:
+                    break
+            self._enviar_confirmaciones(sin_enviar)
+
+    def _encolar_confirmacion_de_batch(self, agencia: int, secuencia: int, futuro: concurrent.futures.Future):
+        """Espera a que el batch sea durable y encola su confirmacion en la salida, sin enviarla."""
+        try:
+            futuro.result()
+            confirmacion = 0
+        except Exception as e:
+            logging.error(f"action: apuesta_recibida | result: fail | secuencia: {secuencia} | error: {e} | thread: {self.name}")
+            confirmacion = 1
+        self.communication.encolar_confirmacion_secuencia(secuencia, self.server.secuencia_acumulada(agencia), confirmacion)
+
+    def _enviar_confirmaciones(self, cantidad: int):
+        try:
+            self.communication.vaciar_salida()
+        except Exception as e:
+            logging.error(f"action: confirmar_batch | result: fail | confirmaciones: {cantidad} | error: {e} | thread: {self.name}")
+        finally:
+            for _ in range(cantidad):
+                self._confirmaciones.task_done()
+
     def procesar_solicitud_ganadores(self, mensaje: SolicitudGanadoresMessage) -> bool:
-        if not self.server.sorteo_fue_realizado():
+        if not self.server.sorteo_fue_realizado(mensaje.id_agencia):
             self.communication.send_sorteo_no_realizado()
             return False
 
-        agencia = mensaje.id_agencia
-        dnis_ganadores = self.server.obtener_ganadores_de_agencia(agencia)
-        
-        self.communication.send_ganadores_sorteo(dnis_ganadores)
-        return False
\ No newline at end of file
+        # La respuesta se serializó una unica vez al realizar el sorteo
+        self.communication.send_ganadores_serializados(self.server.obtener_respuesta_ganadores(mensaje.id_agencia))
+        return False
+
+    def procesar_suscripcion_ganadores(self, mensaje: SuscripcionGanadoresMessage) -> bool:
+        """
+        Como procesar_solicitud_ganadores, pero si el sorteo no se realizó espera
+        a que se realice (o a que venza la espera) antes de responder, en vez de
+        que el cliente tenga que volver a consultar.
+        """
+        if not self.server.esperar_sorteo(mensaje.id_agencia, mensaje.espera_ms):
+            self.communication.send_sorteo_no_realizado()
+            return False
+
+        self.communication.send_ganadores_serializados(self.server.obtener_respuesta_ganadores(mensaje.id_agencia))
+        return False
+
+    def procesar_solicitud_ganadores_ronda(self, mensaje: SolicitudGanadoresRondaMessage) -> bool:
+        try:
+            respuesta = self.server.obtener_respuesta_ganadores_de_ronda(mensaje.id_agencia, mensaje.ronda)
+        except RondaNoDisponible:
+            self.communication.send_ronda_no_disponible()
+            return False
+        if respuesta is None:
+            self.communication.send_sorteo_no_realizado()
+            return False
+
+        self.communication.send_ganadores_serializados(respuesta)
+        return False
+
+    def procesar_consulta_progreso(self, mensaje: ConsultaProgresoMessage) -> bool:
+        # Los batches pipelined de esta conexion que se estén escribiendo todavía no cuentan
+        acumulada, apuestas, completada = self.server.progreso_agencia(mensaje.id_agencia)
+        logging.info("action: consulta_progreso | result: success | agencia: %s | acumulada: %s | apuestas: %s | completada: %s | thread: %s", mensaje.id_agencia, acumulada, apuestas, completada, self.name)
+        self.communication.send_progreso(acumulada, apuestas, completada)
+        return False
@@ -1,10 +1,17 @@
 from abc import ABC, abstractmethod
+from array import array
 import logging
 import socket
-from common.utils import Bet
+import struct
+import sys
+import threading
+import time
+import zlib
+from common import metricas
+from common.utils import BetBatch
 from enum import IntEnum
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 
 
 class SocketNotInitializedError(Exception):
@@ -25,6 +32,14 @@ class EOFError(Exception):
     """Elevada cuando se alcanza el final del archivo."""
     pass
 
+class ConexionInactiva(Exception):
+    """Elevada cuando el cliente no envia nada durante la espera de inactividad o de lectura."""
+    pass
+
+class RondaNoDisponible(Exception):
+    """Elevada al pedir los ganadores de una ronda que no existe o que ya se descartó."""
+    pass
+
 
 class MessageType(IntEnum):
     ENVIO_BATCH = 1
@@ -32,6 +47,42 @@ class MessageType(IntEnum):
     SOLICITUD_GANADORES = 3
     SORTEO_NO_REALIZADO = 4
     RESPUESTA_GANADORES = 5
+    NEGOCIACION_PROTOCOLO = 6
+    ENVIO_BATCH_SECUENCIADO = 7
+    CONFIRMACION_SECUENCIA = 8
+    SUSCRIPCION_GANADORES = 9
+    SOLICITUD_GANADORES_RONDA = 10
+    RONDA_NO_DISPONIBLE = 11
+    CONSULTA_PROGRESO = 12
+    PROGRESO = 13
+    CONEXION_RECHAZADA = 14
+    NEGOCIACION_COMPRESION = 15
+    FRAME_COMPRIMIDO = 16
+
+# Motivos de CONEXION_RECHAZADA
+RECHAZO_SERVIDOR_SATURADO = 1
+RECHAZO_LIMITE_AGENCIA = 2
+
+
+# Versiones del protocolo. Una conexion arranca siempre en v1 (la que habla el
+# cliente Go), y pasa a v2 solo si el cliente lo pide con NEGOCIACION_PROTOCOLO.
+PROTOCOLO_V1 = 1
+PROTOCOLO_V2 = 2
+PROTOCOLO_VERSION_MAXIMA = PROTOCOLO_V2
+
+# Un header v2 corrupto no debe poder hacer que el servidor reserve memoria arbitraria.
+MAX_TAMANIO_FRAME_V2 = 64 * 1024 * 1024
+
+# Compresion de los batches, que el cliente pide con NEGOCIACION_COMPRESION. Despues
+# envia cada batch dentro de un FRAME_COMPRIMIDO, con un unico stream zlib por
+# conexion terminado en Z_SYNC_FLUSH en cada frame: así cada batch aprovecha los
+# nombres, apellidos y fechas repetidos de los anteriores.
+COMPRESION_NINGUNA = 0
+COMPRESION_ZLIB = 1
+CODECS_COMPRESION = frozenset({COMPRESION_ZLIB})
+
+# Mensajes que resuelve la conexion misma, sin llegar al ClientHandler
+TIPOS_NEGOCIACION = frozenset({MessageType.NEGOCIACION_PROTOCOLO, MessageType.NEGOCIACION_COMPRESION})
     
 
 class Message(ABC):
@@ -45,23 +96,51 @@ class Message(ABC):
 class EnvioBatchMessage(Message):
     id_agencia: int
     numero_apuestas: int
-    apuestas: List[Bet]
+    apuestas: BetBatch
     tipo_mensaje: int = MessageType.ENVIO_BATCH
+    # Bytes del mensaje recibido, descomprimido, para el control de flujo
+    tamanio: int = 0
 
     def serialize(self) -> bytes:
         raise InvalidServerMessage("Server should not send ENVIO_BATCH messages")
 
 
+@dataclass
+class EnvioBatchSecuenciadoMessage(Message):
+    """ENVIO_BATCH del modo pipelined: el cliente no espera la confirmacion antes del siguiente."""
+    id_agencia: int
+    secuencia: int
+    numero_apuestas: int
+    apuestas: BetBatch
+    tipo_mensaje: int = MessageType.ENVIO_BATCH_SECUENCIADO
+    tamanio: int = 0
+
+    def serialize(self) -> bytes:
+        raise InvalidServerMessage("Server should not send ENVIO_BATCH_SECUENCIADO messages")
+
+
 @dataclass
 class ConfirmacionRecepcionMessage(Message):
     confirmacion: int  # 0=exito, 1=error
     tipo_mensaje: int = MessageType.CONFIRMACION_RECEPCION
 
     def serialize(self) -> bytes:
-        tipo_mensaje_byte = self.tipo_mensaje.to_bytes(1, byteorder='big')
-        confirmacion_byte = self.confirmacion.to_bytes(1, byteorder='big')
+        return _CONFIRMACIONES_RECEPCION[self.confirmacion]
 
-        return tipo_mensaje_byte + confirmacion_byte
+@dataclass
+class ConfirmacionSecuenciaMessage(Message):
+    """
+    Confirmacion de un batch pipelined: | tipo | secuencia | acumulada | confirmacion |.
+    acumulada es la mayor secuencia de la agencia tal que esa y todas las
+    anteriores ya están almacenadas.
+    """
+    secuencia: int
+    acumulada: int
+    confirmacion: int  # 0=exito, 1=error
+    tipo_mensaje: int = MessageType.CONFIRMACION_SECUENCIA
+
+    def serialize(self) -> bytes:
+        return bytes((self.tipo_mensaje,)) + _CONFIRMACION_SECUENCIA.pack(self.secuencia, self.acumulada, self.confirmacion)
 
 @dataclass
 class SolicitudGanadoresMessage(Message):
@@ -71,52 +150,630 @@ class SolicitudGanadoresMessage(Message):
     def serialize(self) -> bytes:
         raise InvalidServerMessage("Server should not send SOLICITUD_GANADORES messages")
 
+@dataclass
+class SuscripcionGanadoresMessage(Message):
+    """
+    SOLICITUD_GANADORES con espera: si el sorteo no se realizó, el servidor
+    retiene la respuesta hasta que se realice o pasen espera_ms milisegundos.
+    """
+    id_agencia: int
+    espera_ms: int
+    tipo_mensaje: int = MessageType.SUSCRIPCION_GANADORES
+
+    def serialize(self) -> bytes:
+        raise InvalidServerMessage("Server should not send SUSCRIPCION_GANADORES messages")
+
+@dataclass
+class SolicitudGanadoresRondaMessage(Message):
+    """SOLICITUD_GANADORES de una ronda en particular del servidor con multiples rondas."""
+    id_agencia: int
+    ronda: int
+    tipo_mensaje: int = MessageType.SOLICITUD_GANADORES_RONDA
+
+    def serialize(self) -> bytes:
+        raise InvalidServerMessage("Server should not send SOLICITUD_GANADORES_RONDA messages")
+
+@dataclass
+class RondaNoDisponibleMessage(Message):
+    """Respuesta a SOLICITUD_GANADORES_RONDA si la ronda no existe o sus ganadores ya se descartaron."""
+    tipo_mensaje: int = MessageType.RONDA_NO_DISPONIBLE
+
+    def serialize(self) -> bytes:
+        return _RONDA_NO_DISPONIBLE
+
+@dataclass
+class ConsultaProgresoMessage(Message):
+    """Pregunta hasta donde llegó el envio de la agencia, para retomarlo despues de reconectarse."""
+    id_agencia: int
+    tipo_mensaje: int = MessageType.CONSULTA_PROGRESO
+
+    def serialize(self) -> bytes:
+        raise InvalidServerMessage("Server should not send CONSULTA_PROGRESO messages")
+
+@dataclass
+class ProgresoMessage(Message):
+    """
+    Respuesta a CONSULTA_PROGRESO: | tipo | acumulada | apuestas | completada |.
+    acumulada es la mayor secuencia tal que esa y todas las anteriores ya
+    están almacenadas, y apuestas la cantidad de apuestas de esos batches.
+    """
+    acumulada: int
+    apuestas: int
+    completada: bool
+    tipo_mensaje: int = MessageType.PROGRESO
+
+    def serialize(self) -> bytes:
+        return bytes((self.tipo_mensaje,)) + _PROGRESO.pack(self.acumulada, self.apuestas, self.completada)
+
+@dataclass
+class ConexionRechazadaMessage(Message):
+    """
+    El servidor no atiende la conexion y la cierra: | tipo | motivo |, con
+    motivo RECHAZO_SERVIDOR_SATURADO o RECHAZO_LIMITE_AGENCIA.
+    """
+    motivo: int
+    tipo_mensaje: int = MessageType.CONEXION_RECHAZADA
+
+    def serialize(self) -> bytes:
+        return bytes((self.tipo_mensaje, self.motivo))
+
 @dataclass
 class SorteoNoRealizadoMessage(Message):
     tipo_mensaje: int = MessageType.SORTEO_NO_REALIZADO
 
     def serialize(self) -> bytes:
-        return self.tipo_mensaje.to_bytes(1, byteorder='big')
+        return _SORTEO_NO_REALIZADO
 
 @dataclass
 class RespuestaGanadoresMessage(Message):
     cant_ganadores: int
-    dnis_ganadores: List[int]
+    dnis_ganadores: Sequence[int]
     tipo_mensaje: int = MessageType.RESPUESTA_GANADORES
 
     def serialize(self) -> bytes:
-        tipo_mensaje_byte = self.tipo_mensaje.to_bytes(1, byteorder='big')
-        cant_ganadores_byte = self.cant_ganadores.to_bytes(4, byteorder='big')
-        dnis_ganadores_bytes = b''.join(dni.to_bytes(4, byteorder='big') for dni in self.dnis_ganadores)
+        return serializar_respuesta_ganadores(self.dnis_ganadores)
+
+
+def serializar_respuesta_ganadores(dnis_ganadores: Sequence[int]) -> bytes:
+    """
+    Frame RESPUESTA_GANADORES completo. Los DNIs se serializan juntos en un
+    array('I'), pasado a big-endian, en vez de uno por uno con to_bytes.
+    """
+    dnis = array('I', dnis_ganadores)
+    if sys.byteorder == 'little':
+        dnis.byteswap()
+    return bytes((MessageType.RESPUESTA_GANADORES,)) + len(dnis).to_bytes(4, byteorder='big') + dnis.tobytes()
+
+@dataclass
+class NegociacionProtocoloMessage(Message):
+    version: int
+    tipo_mensaje: int = MessageType.NEGOCIACION_PROTOCOLO
+
+    def serialize(self) -> bytes:
+        return bytes((self.tipo_mensaje, self.version))
+
+@dataclass
+class NegociacionCompresionMessage(Message):
+    codec: int
+    tipo_mensaje: int = MessageType.NEGOCIACION_COMPRESION
+
+    def serialize(self) -> bytes:
+        return bytes((self.tipo_mensaje, self.codec))
+
+
+@dataclass
+class _FrameComprimido:
+    """Datos comprimidos de un FRAME_COMPRIMIDO, como posiciones del buffer de lectura."""
+    inicio: int
+    fin: int
+    tipo_mensaje: int = MessageType.FRAME_COMPRIMIDO
+
+# Tamaño inicial del buffer de lectura de cada conexion. Un batch de 101 apuestas
+# ocupa a lo sumo ~8kB, por lo que en el caso comun entran varios frames completos.
+TAMANIO_BUFFER_LECTURA = 64 * 1024
+
+_UINT32 = struct.Struct('>I')
+_HEADER_ENVIO_BATCH = struct.Struct('>IB')  # id_agencia, numero_apuestas
+_HEADER_ENVIO_BATCH_V2 = struct.Struct('>II')  # id_agencia, numero_apuestas
+_APUESTA_V2 = struct.Struct('>IIBBB')  # documento, numero, len nombre, len apellido, len nacimiento
+_HEADER_ENVIO_BATCH_SECUENCIADO = struct.Struct('>IIB')  # id_agencia, secuencia, numero_apuestas
+_HEADER_ENVIO_BATCH_SECUENCIADO_V2 = struct.Struct('>III')  # id_agencia, secuencia, numero_apuestas
+_CONFIRMACION_SECUENCIA = struct.Struct('>IIB')  # secuencia, acumulada, confirmacion
+_SUSCRIPCION_GANADORES = struct.Struct('>II')  # id_agencia, espera_ms
+_SOLICITUD_GANADORES_RONDA = struct.Struct('>II')  # id_agencia, ronda
+_PROGRESO = struct.Struct('>II?')  # acumulada, apuestas, completada
+
+# Frames de las respuestas de largo fijo sin campos variables, armados una unica vez
+_CONFIRMACIONES_RECEPCION = tuple(bytes((MessageType.CONFIRMACION_RECEPCION, confirmacion)) for confirmacion in range(256))
+_SORTEO_NO_REALIZADO = bytes((MessageType.SORTEO_NO_REALIZADO,))
+_RONDA_NO_DISPONIBLE = bytes((MessageType.RONDA_NO_DISPONIBLE,))
+
+# Buffers por llamada a sendmsg, dentro del IOV_MAX de Linux y macOS
+_MAX_BUFFERS_SENDMSG = 1024
+
+
+class DecodificadorMensajes:
+    """
+    Decodificador incremental de los mensajes que recibe el servidor por una conexion.
+
+    Es dueño del buffer de lectura, pero no realiza ninguna lectura por si
+    mismo: quien tenga el socket (Communication, o el protocolo asyncio) pide
+    el espacio libre con espacio_libre(), lee ahí con recv_into, e informa la
+    cantidad de bytes leidos con datos_recibidos(). Luego siguiente_mensaje()
+    devuelve un mensaje cada vez que hay un frame completo en el buffer.
+
+    Guarda la version de protocolo negociada, que decide el formato del frame,
+    y el descompresor de la conexion si se negoció compresion.
+    """
+
+    def __init__(self, tamanio_buffer: int = TAMANIO_BUFFER_LECTURA):
+        # Los datos validos sin consumir son self._buffer[self._inicio:self._fin].
+        self._buffer = bytearray(tamanio_buffer)
+        self._inicio = 0
+        self._fin = 0
+        self.version = PROTOCOLO_V1
+        self.compresion = COMPRESION_NINGUNA
+        self._descompresor = None
+        # Recorrido del batch v1 incompleto que empieza en self._inicio: (desplazamiento, apuestas recorridas)
+        self._recorrido_v1: Optional[Tuple[int, int]] = None
+
+    @property
+    def hay_datos_pendientes(self) -> bool:
+        return self._inicio < self._fin
+
+    def siguiente_mensaje(self) -> Optional[Message]:
+        inicio_decodificacion = time.perf_counter()
+        if self.version == PROTOCOLO_V1:
+            if not self._batch_v1_completo():
+                return None
+            resultado = decodificar_mensaje(self._buffer, self._inicio, self._fin)
+        else:
+            resultado = decodificar_mensaje_v2(self._buffer, self._inicio, self._fin)
+        if resultado is None:
+            return None
+
+        # Solo se mide la decodificacion que termina en un mensaje completo
+        metricas.DECODIFICACION.observar(time.perf_counter() - inicio_decodificacion)
+        mensaje, fin_mensaje = resultado
+        if isinstance(mensaje, _FrameComprimido):
+            mensaje = self._descomprimir(mensaje)
+        elif isinstance(mensaje, (EnvioBatchMessage, EnvioBatchSecuenciadoMessage)):
+            mensaje.tamanio = fin_mensaje - self._inicio
+        id_agencia = getattr(mensaje, 'id_agencia', None)
+        if id_agencia is not None:
+            metricas.BYTES_RECIBIDOS.inc(fin_mensaje - self._inicio, (id_agencia,))
+        self._inicio = fin_mensaje
+        self._recorrido_v1 = None
+        if self._inicio == self._fin:
+            self._inicio = self._fin = 0
+        return mensaje
+
+    def _batch_v1_completo(self) -> bool:
+        """
+        Un batch v1 no tiene longitud, así que solo se sabe que está completo
+        recorriendo sus apuestas. El recorrido continúa desde donde quedó en la
+        llamada anterior, y el batch se decodifica una unica vez cuando llegó
+        entero. Con cualquier otro mensaje devuelve True.
+        """
+        if self._inicio >= self._fin:
+            return True
+        tipo_mensaje = self._buffer[self._inicio]
+        if tipo_mensaje == MessageType.ENVIO_BATCH:
+            header = _HEADER_ENVIO_BATCH
+        elif tipo_mensaje == MessageType.ENVIO_BATCH_SECUENCIADO:
+            header = _HEADER_ENVIO_BATCH_SECUENCIADO
+        else:
+            return True
+        if self._inicio + 1 + header.size > self._fin:
+            return False
+
+        # numero_apuestas es el ultimo campo del header
+        numero_apuestas = header.unpack_from(self._buffer, self._inicio + 1)[-1]
+        desplazamiento, recorridas = self._recorrido_v1 or (1 + header.size, 0)
+        pos, nuevas = _recorrer_apuestas(self._buffer, self._inicio + desplazamiento, self._fin, numero_apuestas - recorridas)
+        self._recorrido_v1 = (pos - self._inicio, recorridas + nuevas)
+        return recorridas + nuevas == numero_apuestas
+
+    def negociar(self, mensaje: Message) -> Message:
+        """Acepta una negociacion de version o de compresion, y devuelve la respuesta para el cliente."""
+        if isinstance(mensaje, NegociacionCompresionMessage):
+            return self._negociar_compresion(mensaje)
+        version = min(mensaje.version, PROTOCOLO_VERSION_MAXIMA)
+        if version < PROTOCOLO_V1:
+            raise ValueError(f"Unsupported protocol version: {mensaje.version}")
+        self.version = version
+        return NegociacionProtocoloMessage(version=version)
+
+    def _negociar_compresion(self, mensaje: NegociacionCompresionMessage) -> NegociacionCompresionMessage:
+        # Un codec desconocido no es un error: se responde sin compresion y el cliente envia sin comprimir
+        if self.compresion != COMPRESION_NINGUNA:
+            raise InvalidServerMessage("Compression was already negotiated")
+        if mensaje.codec in CODECS_COMPRESION:
+            self.compresion = mensaje.codec
+            self._descompresor = zlib.decompressobj()
+        return NegociacionCompresionMessage(codec=self.compresion)
+
+    def _descomprimir(self, frame: _FrameComprimido) -> Message:
+        """
+        Descomprime un FRAME_COMPRIMIDO, que contiene un unico batch con el
+        formato de la version negociada, y lo decodifica. zlib no descomprime
+        en un buffer existente: cada frame se descomprime en un bytes nuevo, de
+        a lo sumo MAX_TAMANIO_FRAME_V2, y el batch se decodifica de ese objeto.
+        Copiarlo al buffer de lectura no ahorraria esa reserva, solo sumaria
+        una copia.
+        """
+        if self._descompresor is None:
+            raise InvalidServerMessage("Compression was not negotiated")
+        with memoryview(self._buffer) as vista:
+            try:
+                contenido = self._descompresor.decompress(vista[frame.inicio:frame.fin], MAX_TAMANIO_FRAME_V2)
+            except zlib.error as e:
+                raise ValueError(f"Invalid compressed frame: {e}")
+        if self._descompresor.unconsumed_tail:
+            raise ValueError("Compressed frame exceeds the maximum frame size")
+
+        pos_tipo = 0 if self.version == PROTOCOLO_V1 else _UINT32.size
+        if len(contenido) <= pos_tipo or contenido[pos_tipo] not in (MessageType.ENVIO_BATCH, MessageType.ENVIO_BATCH_SECUENCIADO):
+            raise ValueError("Only bet batches can be compressed")
+        if self.version == PROTOCOLO_V1:
+            resultado = decodificar_mensaje(contenido, 0, len(contenido))
+        else:
+            resultado = decodificar_mensaje_v2(contenido, 0, len(contenido))
+        # Cada frame termina en un Z_SYNC_FLUSH, por lo que trae el batch completo y nada más
+        if resultado is None or resultado[1] != len(contenido):
+            raise ValueError("Malformed compressed frame")
+        mensaje = resultado[0]
+        mensaje.tamanio = len(contenido)
+        return mensaje
+
+    def espacio_libre(self) -> memoryview:
+        """
+        Devuelve la porcion libre del buffer, donde leer con un unico recv_into.
+        Si el frame pendiente no entra, primero compacta los datos sin consumir
+        al comienzo del buffer, y si aun asi no hay lugar agranda el buffer: al
+        tamaño del frame si se conoce (v2), o al doble.
+        """
+        if self._inicio > 0:
+            pendientes = self._fin - self._inicio
+            self._buffer[:pendientes] = self._buffer[self._inicio:self._fin]
+            self._inicio, self._fin = 0, pendientes
+
+        nuevo_tamanio = len(self._buffer)
+        tamanio_frame = self._tamanio_frame()
+        if tamanio_frame is not None and tamanio_frame > nuevo_tamanio:
+            nuevo_tamanio = tamanio_frame
+        elif self._fin == nuevo_tamanio:
+            nuevo_tamanio *= 2
+        if nuevo_tamanio > len(self._buffer):
+            self._buffer.extend(bytes(nuevo_tamanio - len(self._buffer)))
+
+        return memoryview(self._buffer)[self._fin:]
+
+    def datos_recibidos(self, cantidad: int):
+        self._fin += cantidad
+
+    def _tamanio_frame(self) -> Optional[int]:
+        """Tamaño total del proximo frame, si se puede conocer sin tenerlo completo."""
+        if self.version == PROTOCOLO_V1:
+            # En v1 solo el FRAME_COMPRIMIDO tiene longitud
+            if self._fin - self._inicio < 1 + _UINT32.size or self._buffer[self._inicio] != MessageType.FRAME_COMPRIMIDO:
+                return None
+            return 1 + _UINT32.size + _UINT32.unpack_from(self._buffer, self._inicio + 1)[0]
+        if self._fin - self._inicio < _UINT32.size:
+            return None
+        return _UINT32.size + _UINT32.unpack_from(self._buffer, self._inicio)[0]
+
+
+def decodificar_mensaje(buffer: bytearray, inicio: int, fin: int) -> Optional[Tuple[Message, int]]:
+    """Decodifica un mensaje con el formato v1: | tipo (1byte) | body |."""
+    if inicio >= fin:
+        return None
+
+    tipo_mensaje = buffer[inicio]
+    if tipo_mensaje == MessageType.ENVIO_BATCH:
+        return _decodificar_envio_batch(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.ENVIO_BATCH_SECUENCIADO:
+        return _decodificar_envio_batch_secuenciado(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.SOLICITUD_GANADORES:
+        return _decodificar_solicitud_ganadores(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.SUSCRIPCION_GANADORES:
+        return _decodificar_suscripcion_ganadores(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.SOLICITUD_GANADORES_RONDA:
+        return _decodificar_solicitud_ganadores_ronda(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.CONSULTA_PROGRESO:
+        return _decodificar_consulta_progreso(buffer, inicio + 1, fin)
+    elif tipo_mensaje == MessageType.NEGOCIACION_PROTOCOLO:
+        if inicio + 2 > fin:
+            return None
+        return NegociacionProtocoloMessage(version=buffer[inicio + 1]), inicio + 2
+    elif tipo_mensaje == MessageType.NEGOCIACION_COMPRESION:
+        if inicio + 2 > fin:
+            return None
+        return NegociacionCompresionMessage(codec=buffer[inicio + 1]), inicio + 2
+    elif tipo_mensaje == MessageType.FRAME_COMPRIMIDO:
+        return _decodificar_frame_comprimido(buffer, inicio + 1, fin)
+
+    _rechazar_tipo_mensaje(tipo_mensaje)
+
+
+def decodificar_mensaje_v2(buffer: bytearray, inicio: int, fin: int) -> Optional[Tuple[Message, int]]:
+    """
+    Decodifica un mensaje con el formato v2: | longitud (4bytes) | tipo (1byte) | body |,
+    donde la longitud cuenta el tipo y el body. Como el frame se decodifica
+    recien cuando llegó completo, el body se recorre una unica vez.
+    """
+    if fin - inicio < _UINT32.size:
+        return None
+    longitud = _UINT32.unpack_from(buffer, inicio)[0]
+    if longitud == 0 or longitud > MAX_TAMANIO_FRAME_V2:
+        raise ValueError(f"Invalid frame length: {longitud}")
+    fin_frame = inicio + _UINT32.size + longitud
+    if fin_frame > fin:
+        return None
+
+    tipo_mensaje = buffer[inicio + _UINT32.size]
+    pos = inicio + _UINT32.size + 1
+    if tipo_mensaje == MessageType.ENVIO_BATCH:
+        mensaje = _decodificar_envio_batch_v2(buffer, pos, fin_frame)
+    elif tipo_mensaje == MessageType.ENVIO_BATCH_SECUENCIADO:
+        mensaje = _decodificar_envio_batch_secuenciado_v2(buffer, pos, fin_frame)
+    elif tipo_mensaje == MessageType.SOLICITUD_GANADORES:
+        resultado = _decodificar_solicitud_ganadores(buffer, pos, fin_frame)
+        if resultado is None or resultado[1] != fin_frame:
+            raise ValueError("Malformed SOLICITUD_GANADORES frame")
+        mensaje = resultado[0]
+    elif tipo_mensaje == MessageType.SUSCRIPCION_GANADORES:
+        resultado = _decodificar_suscripcion_ganadores(buffer, pos, fin_frame)
+        if resultado is None or resultado[1] != fin_frame:
+            raise ValueError("Malformed SUSCRIPCION_GANADORES frame")
+        mensaje = resultado[0]
+    elif tipo_mensaje == MessageType.SOLICITUD_GANADORES_RONDA:
+        resultado = _decodificar_solicitud_ganadores_ronda(buffer, pos, fin_frame)
+        if resultado is None or resultado[1] != fin_frame:
+            raise ValueError("Malformed SOLICITUD_GANADORES_RONDA frame")
+        mensaje = resultado[0]
+    elif tipo_mensaje == MessageType.CONSULTA_PROGRESO:
+        resultado = _decodificar_consulta_progreso(buffer, pos, fin_frame)
+        if resultado is None or resultado[1] != fin_frame:
+            raise ValueError("Malformed CONSULTA_PROGRESO frame")
+        mensaje = resultado[0]
+    elif tipo_mensaje == MessageType.NEGOCIACION_PROTOCOLO:
+        raise InvalidServerMessage("Protocol version was already negotiated")
+    elif tipo_mensaje == MessageType.NEGOCIACION_COMPRESION:
+        if pos + 1 != fin_frame:
+            raise ValueError("Malformed NEGOCIACION_COMPRESION frame")
+        mensaje = NegociacionCompresionMessage(codec=buffer[pos])
+    elif tipo_mensaje == MessageType.FRAME_COMPRIMIDO:
+        mensaje = _FrameComprimido(pos, fin_frame)
+    else:
+        _rechazar_tipo_mensaje(tipo_mensaje)
+
+    return mensaje, fin_frame
+
+
+def _rechazar_tipo_mensaje(tipo_mensaje: int):
+    if tipo_mensaje == MessageType.CONFIRMACION_RECEPCION:
+        raise InvalidServerMessage("Server should not receive CONFIRMACION_RECEPCION messages")
+    elif tipo_mensaje == MessageType.SORTEO_NO_REALIZADO:
+        raise InvalidServerMessage("Server should not receive SORTEO_NO_REALIZADO messages")
+    elif tipo_mensaje == MessageType.RESPUESTA_GANADORES:
+        raise InvalidServerMessage("Server should not receive RESPUESTA_GANADORES messages")
+    elif tipo_mensaje == MessageType.CONFIRMACION_SECUENCIA:
+        raise InvalidServerMessage("Server should not receive CONFIRMACION_SECUENCIA messages")
+    elif tipo_mensaje == MessageType.RONDA_NO_DISPONIBLE:
+        raise InvalidServerMessage("Server should not receive RONDA_NO_DISPONIBLE messages")
+    elif tipo_mensaje == MessageType.PROGRESO:
+        raise InvalidServerMessage("Server should not receive PROGRESO messages")
+    elif tipo_mensaje == MessageType.CONEXION_RECHAZADA:
+        raise InvalidServerMessage("Server should not receive CONEXION_RECHAZADA messages")
+    else:
+        raise ValueError("Unknown message type")
+
+
+def _decodificar_envio_batch(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[EnvioBatchMessage, int]]:
+    if pos + _HEADER_ENVIO_BATCH.size > fin:
+        return None
+    id_agencia, numero_apuestas = _HEADER_ENVIO_BATCH.unpack_from(buffer, pos)
+    resultado = _decodificar_apuestas(buffer, pos + _HEADER_ENVIO_BATCH.size, fin, id_agencia, numero_apuestas)
+    if resultado is None:
+        return None
+    apuestas, pos = resultado
+    return EnvioBatchMessage(id_agencia=id_agencia, numero_apuestas=numero_apuestas, apuestas=apuestas), pos
+
+
+def _decodificar_envio_batch_secuenciado(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[EnvioBatchSecuenciadoMessage, int]]:
+    if pos + _HEADER_ENVIO_BATCH_SECUENCIADO.size > fin:
+        return None
+    id_agencia, secuencia, numero_apuestas = _HEADER_ENVIO_BATCH_SECUENCIADO.unpack_from(buffer, pos)
+    resultado = _decodificar_apuestas(buffer, pos + _HEADER_ENVIO_BATCH_SECUENCIADO.size, fin, id_agencia, numero_apuestas)
+    if resultado is None:
+        return None
+    apuestas, pos = resultado
+    return EnvioBatchSecuenciadoMessage(id_agencia=id_agencia, secuencia=secuencia, numero_apuestas=numero_apuestas, apuestas=apuestas), pos
+
+
+def _decodificar_frame_comprimido(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[_FrameComprimido, int]]:
+    """FRAME_COMPRIMIDO v1: | longitud (4bytes) | datos comprimidos |."""
+    if pos + _UINT32.size > fin:
+        return None
+    longitud = _UINT32.unpack_from(buffer, pos)[0]
+    if longitud > MAX_TAMANIO_FRAME_V2:
+        raise ValueError(f"Invalid compressed frame length: {longitud}")
+    fin_frame = pos + _UINT32.size + longitud
+    if fin_frame > fin:
+        return None
+    return _FrameComprimido(pos + _UINT32.size, fin_frame), fin_frame
+
+
+def _recorrer_apuestas(buffer: bytearray, pos: int, fin: int, numero_apuestas: int) -> Tuple[int, int]:
+    """
+    Recorre hasta numero_apuestas apuestas v1 sin decodificarlas. Devuelve la
+    posicion siguiente a la ultima apuesta completa y cuantas se recorrieron.
+    """
+    for recorridas in range(numero_apuestas):
+        fin_nombre = buffer.find(0, pos, fin)
+        if fin_nombre < 0:
+            return pos, recorridas
+        fin_apellido = buffer.find(0, fin_nombre + 1, fin)
+        if fin_apellido < 0 or fin_apellido + 5 > fin:
+            return pos, recorridas
+        fin_fecha = buffer.find(0, fin_apellido + 5, fin)
+        if fin_fecha < 0 or fin_fecha + 5 > fin:
+            return pos, recorridas
+        pos = fin_fecha + 5
+    return pos, numero_apuestas
+
+
+def _decodificar_apuestas(buffer: bytearray, pos: int, fin: int, id_agencia: int, numero_apuestas: int) -> Optional[Tuple[BetBatch, int]]:
+    """Apuestas de un batch v1: | nombre\0 | apellido\0 | documento | nacimiento\0 | numero |."""
+    apuestas = BetBatch()
+    with memoryview(buffer) as vista:
+        for _ in range(numero_apuestas):
+            fin_nombre = buffer.find(0, pos, fin)
+            if fin_nombre < 0:
+                return None
+            fin_apellido = buffer.find(0, fin_nombre + 1, fin)
+            if fin_apellido < 0:
+                return None
+            pos_documento = fin_apellido + 1
+            if pos_documento + 4 > fin:
+                return None
+            fin_fecha = buffer.find(0, pos_documento + 4, fin)
+            if fin_fecha < 0 or fin_fecha + 5 > fin:
+                return None
+
+            nombre = str(vista[pos:fin_nombre], 'utf-8')
+            apellido = str(vista[fin_nombre + 1:fin_apellido], 'utf-8')
+            documento = _UINT32.unpack_from(buffer, pos_documento)[0]
+            fecha_nacimiento = str(vista[pos_documento + 4:fin_fecha], 'utf-8')
+            numero = _UINT32.unpack_from(buffer, fin_fecha + 1)[0]
+            pos = fin_fecha + 5
+
+            apuestas.append(id_agencia, nombre, apellido, documento, fecha_nacimiento, numero)
+
+    return apuestas, pos
+
+
+def _decodificar_envio_batch_v2(buffer: bytearray, pos: int, fin: int) -> EnvioBatchMessage:
+    if pos + _HEADER_ENVIO_BATCH_V2.size > fin:
+        raise ValueError("Malformed ENVIO_BATCH frame")
+    id_agencia, numero_apuestas = _HEADER_ENVIO_BATCH_V2.unpack_from(buffer, pos)
+    apuestas = _decodificar_apuestas_v2(buffer, pos + _HEADER_ENVIO_BATCH_V2.size, fin, id_agencia, numero_apuestas)
+    return EnvioBatchMessage(id_agencia=id_agencia, numero_apuestas=numero_apuestas, apuestas=apuestas)
+
+
+def _decodificar_envio_batch_secuenciado_v2(buffer: bytearray, pos: int, fin: int) -> EnvioBatchSecuenciadoMessage:
+    if pos + _HEADER_ENVIO_BATCH_SECUENCIADO_V2.size > fin:
+        raise ValueError("Malformed ENVIO_BATCH_SECUENCIADO frame")
+    id_agencia, secuencia, numero_apuestas = _HEADER_ENVIO_BATCH_SECUENCIADO_V2.unpack_from(buffer, pos)
+    apuestas = _decodificar_apuestas_v2(buffer, pos + _HEADER_ENVIO_BATCH_SECUENCIADO_V2.size, fin, id_agencia, numero_apuestas)
+    return EnvioBatchSecuenciadoMessage(id_agencia=id_agencia, secuencia=secuencia, numero_apuestas=numero_apuestas, apuestas=apuestas)
+
+
+def _decodificar_apuestas_v2(buffer: bytearray, pos: int, fin: int, id_agencia: int, numero_apuestas: int) -> BetBatch:
+    """Apuestas de un frame v2, que deben ocupar exactamente hasta el fin del frame."""
+    apuestas = BetBatch()
+    with memoryview(buffer) as vista:
+        for _ in range(numero_apuestas):
+            if pos + _APUESTA_V2.size > fin:
+                raise ValueError("Malformed ENVIO_BATCH frame")
+            documento, numero, len_nombre, len_apellido, len_fecha = _APUESTA_V2.unpack_from(buffer, pos)
+            fin_nombre = pos + _APUESTA_V2.size + len_nombre
+            fin_apellido = fin_nombre + len_apellido
+            fin_fecha = fin_apellido + len_fecha
+            if fin_fecha > fin:
+                raise ValueError("Malformed ENVIO_BATCH frame")
+
+            nombre = str(vista[pos + _APUESTA_V2.size:fin_nombre], 'utf-8')
+            apellido = str(vista[fin_nombre:fin_apellido], 'utf-8')
+            fecha_nacimiento = str(vista[fin_apellido:fin_fecha], 'utf-8')
+            pos = fin_fecha
+
+            apuestas.append(id_agencia, nombre, apellido, documento, fecha_nacimiento, numero)
+
+    if pos != fin:
+        raise ValueError("Malformed ENVIO_BATCH frame")
+    return apuestas
+
+
+def _decodificar_solicitud_ganadores(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[SolicitudGanadoresMessage, int]]:
+    if pos + _UINT32.size > fin:
+        return None
+    id_agencia = _UINT32.unpack_from(buffer, pos)[0]
+    return SolicitudGanadoresMessage(id_agencia=id_agencia), pos + _UINT32.size
+
+
+def _decodificar_suscripcion_ganadores(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[SuscripcionGanadoresMessage, int]]:
+    if pos + _SUSCRIPCION_GANADORES.size > fin:
+        return None
+    id_agencia, espera_ms = _SUSCRIPCION_GANADORES.unpack_from(buffer, pos)
+    return SuscripcionGanadoresMessage(id_agencia=id_agencia, espera_ms=espera_ms), pos + _SUSCRIPCION_GANADORES.size
+
+
+def _decodificar_solicitud_ganadores_ronda(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[SolicitudGanadoresRondaMessage, int]]:
+    if pos + _SOLICITUD_GANADORES_RONDA.size > fin:
+        return None
+    id_agencia, ronda = _SOLICITUD_GANADORES_RONDA.unpack_from(buffer, pos)
+    return SolicitudGanadoresRondaMessage(id_agencia=id_agencia, ronda=ronda), pos + _SOLICITUD_GANADORES_RONDA.size
+
+
+def _decodificar_consulta_progreso(buffer: bytearray, pos: int, fin: int) -> Optional[Tuple[ConsultaProgresoMessage, int]]:
+    if pos + _UINT32.size > fin:
+        return None
+    id_agencia = _UINT32.unpack_from(buffer, pos)[0]
+    return ConsultaProgresoMessage(id_agencia=id_agencia), pos + _UINT32.size
+
+
+def _descartar_enviados(buffers: List[bytes], enviados: int) -> List[bytes]:
+    """Los buffers que quedan por enviar despues de un envio parcial de enviados bytes."""
+    indice = 0
+    while indice < len(buffers) and enviados >= len(buffers[indice]):
+        enviados -= len(buffers[indice])
+        indice += 1
+    restantes = buffers[indice:]
+    if enviados:
+        restantes[0] = memoryview(restantes[0])[enviados:]
+    return restantes
 
-        return tipo_mensaje_byte + cant_ganadores_byte + dnis_ganadores_bytes
 
 class Communication:
-    def __init__(self, socket):
+    def __init__(self, socket, espera_inactividad: Optional[float] = None, espera_lectura: Optional[float] = None):
+        """
+        espera_inactividad es cuántos segundos puede pasar el cliente sin
+        empezar un mensaje, y espera_lectura cuántos sin enviar nada con un
+        mensaje a medio recibir. None espera indefinidamente.
+        """
         self.__socket = socket
+        self.__decodificador = DecodificadorMensajes()
+        # En modo pipelined las confirmaciones se envian desde otro thread
+        self.__lock_envio = threading.Lock()
+        # Respuestas ya serializadas que todavía no se enviaron, en orden
+        self.__salida: List[bytes] = []
+        self.__espera_inactividad = espera_inactividad
+        self.__espera_lectura = espera_lectura
+        self.__espera_actual: Optional[float] = None
+
+    @property
+    def version_protocolo(self) -> int:
+        return self.__decodificador.version
         
     def leer_mensaje_socket(self) -> Message:
         self.__ensure_socket()
-        try:
-            tipo_mensaje = self.__read_one_byte()
-        except EOFError:
-            raise ConexionCerradaPorCliente("Connection closed by the client")
-
-        if tipo_mensaje == MessageType.ENVIO_BATCH:
-            return self._leer_mensaje_envio_batch()
-        elif tipo_mensaje == MessageType.SOLICITUD_GANADORES:
-            return self._leer_mensaje_solicitud_ganadores()
-        
-        elif tipo_mensaje == MessageType.CONFIRMACION_RECEPCION:
-            raise InvalidServerMessage("Server should not receive CONFIRMACION_RECEPCION messages")
-        elif tipo_mensaje == MessageType.SORTEO_NO_REALIZADO:
-            raise InvalidServerMessage("Server should not receive SORTEO_NO_REALIZADO messages")
-        elif tipo_mensaje == MessageType.RESPUESTA_GANADORES:
-            raise InvalidServerMessage("Server should not receive RESPUESTA_GANADORES messages")
-        else:
-            raise ValueError("Unknown message type")
+        while True:
+            mensaje = self.__decodificador.siguiente_mensaje()
+            if mensaje is None:
+                self.__llenar_buffer()
+                continue
+
+            # Las negociaciones son propias de la conexion, no llegan al ClientHandler
+            if mensaje.tipo_mensaje in TIPOS_NEGOCIACION:
+                self.escribir_mensaje_socket(self.__decodificador.negociar(mensaje))
+                logging.debug("action: negociar_protocolo | result: success | version: %s | compresion: %s",
+                              self.__decodificador.version, self.__decodificador.compresion)
+                continue
+            return mensaje
         
-    def receive_bet_batch(self) -> list[Bet]:
+    def receive_bet_batch(self) -> BetBatch:
         mensaje = self.leer_mensaje_socket()
         if isinstance(mensaje, EnvioBatchMessage):
             return mensaje.apuestas
@@ -129,43 +786,62 @@ class Communication:
         raise InvalidMessageType("Expected SolicitudGanadoresMessage")
 
     def escribir_mensaje_socket(self, mensaje: Message):
+        self.escribir_bytes_socket(mensaje.serialize())
+
+    def escribir_bytes_socket(self, datos: bytes):
+        """Envia uno o más mensajes ya serializados, después de los que estén encolados."""
         self.__ensure_socket()
-        self.__socket.sendall(mensaje.serialize())
+        with self.__lock_envio:
+            self.__salida.append(datos)
+            self.__enviar_salida()
+
+    def encolar_bytes_socket(self, datos: bytes):
+        """
+        Agrega mensajes ya serializados a la salida sin enviarlos: se envian
+        juntos con el proximo vaciar_salida() o escribir_*_socket().
+        """
+        with self.__lock_envio:
+            self.__salida.append(datos)
+
+    def vaciar_salida(self):
+        self.__ensure_socket()
+        with self.__lock_envio:
+            self.__enviar_salida()
+
+    def __enviar_salida(self):
+        """Envia la salida encolada con sendmsg (scatter-gather), sin concatenar los mensajes."""
+        pendientes = self.__salida
+        if not pendientes:
+            return
+        try:
+            if not hasattr(self.__socket, 'sendmsg'):
+                self.__socket.sendall(b''.join(pendientes))
+                return
+            while pendientes:
+                enviados = self.__socket.sendmsg(pendientes[:_MAX_BUFFERS_SENDMSG])
+                pendientes = _descartar_enviados(pendientes, enviados)
+        finally:
+            self.__salida = []
 
     def send_sorteo_no_realizado(self):
         mensaje = SorteoNoRealizadoMessage()
         self.escribir_mensaje_socket(mensaje)
 
-    def send_ganadores_sorteo(self, ganadores: List[int]):
+    def send_ronda_no_disponible(self):
+        self.escribir_mensaje_socket(RondaNoDisponibleMessage())
+
+    def send_ganadores_sorteo(self, ganadores: Sequence[int]):
         mensaje = RespuestaGanadoresMessage(cant_ganadores=len(ganadores), dnis_ganadores=ganadores)
         self.escribir_mensaje_socket(mensaje)
 
-    def _leer_mensaje_envio_batch(self):
-        id_agencia = self.__read_uint32()
-        numero_apuestas = self.__read_one_byte()
-        apuestas = [self.__recieve_single_bet(id_agencia) for _ in range(numero_apuestas)]
-        return EnvioBatchMessage(id_agencia=id_agencia, numero_apuestas=numero_apuestas, apuestas=apuestas)
-
-    def _leer_mensaje_solicitud_ganadores(self):
-        id_agencia = self.__read_uint32()
-        return SolicitudGanadoresMessage(id_agencia=id_agencia)
+    def send_ganadores_serializados(self, respuesta: bytes):
+        """Envia un frame RESPUESTA_GANADORES armado con serializar_respuesta_ganadores."""
+        self.escribir_bytes_socket(respuesta)
 
     def __ensure_socket(self):
         if self.__socket is None:
             raise SocketNotInitializedError("Socket is not initialized")
 
-    
-
-    def __recieve_single_bet(self, agency) -> Bet:        
-        nombre = self.__read_null_terminated_string()
-        apellido = self.__read_null_terminated_string()
-        documento = self.__read_uint32()
-        fecha_nacimiento = self.__read_null_terminated_string()
-        numero = self.__read_uint32()
-        documento_str = str(documento)
-        numero_str = str(numero)
-        return Bet(agency=agency, first_name=nombre, last_name=apellido, document=documento_str, birthdate=fecha_nacimiento, number=numero_str)
-
     def send_confirmacion_recepcion_ok(self):
         mensaje = ConfirmacionRecepcionMessage(confirmacion=0)
         self.escribir_mensaje_socket(mensaje)
@@ -174,39 +850,44 @@ class Communication:
         mensaje = ConfirmacionRecepcionMessage(confirmacion=error)
         self.escribir_mensaje_socket(mensaje)
 
+    def send_confirmacion_secuencia(self, secuencia: int, acumulada: int, confirmacion: int = 0):
+        mensaje = ConfirmacionSecuenciaMessage(secuencia=secuencia, acumulada=acumulada, confirmacion=confirmacion)
+        self.escribir_mensaje_socket(mensaje)
+
+    def encolar_confirmacion_secuencia(self, secuencia: int, acumulada: int, confirmacion: int = 0):
+        """Como send_confirmacion_secuencia, pero la confirmacion se envia con el proximo vaciar_salida()."""
+        mensaje = ConfirmacionSecuenciaMessage(secuencia=secuencia, acumulada=acumulada, confirmacion=confirmacion)
+        self.encolar_bytes_socket(mensaje.serialize())
+
+    def send_progreso(self, acumulada: int, apuestas: int, completada: bool):
+        self.escribir_mensaje_socket(ProgresoMessage(acumulada=acumulada, apuestas=apuestas, completada=completada))
+
+    def send_conexion_rechazada(self, motivo: int):
+        self.escribir_mensaje_socket(ConexionRechazadaMessage(motivo=motivo))
+
     def close(self):
         if self.__socket:
-            self.__socket.shutdown(socket.SHUT_RDWR)
+            try:
+                self.__socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # El cliente ya cerró o reseteó la conexion: igual hay que liberar el descriptor
+                pass
             self.__socket.close()
             self.__socket = None
 
-    def __read_one_byte(self):
-        byte = self.__recvall(1)
-        if not byte:
-            raise ValueError("Failed to read byte")
-        return byte[0]
-
-    def __read_null_terminated_string(self):
-        string_bytes = bytearray()
-        while True:
-            byte = self.__recvall(1)
-            if byte == b'\x00':
-                break
-            string_bytes.extend(byte)
-        return string_bytes.decode("utf-8")
-
-    def __read_uint32(self):
-        data = self.__recvall(4)
-        return int.from_bytes(data, byteorder='big')
-
-    def __recvall(self, n):
-        data = bytearray()
-        while len(data) < n:
-            packet = self.__socket.recv(n - len(data))
-            if not packet:
-                if len(data) == 0:
-                    raise EOFError("Connection closed by the client")
-                
-                raise ValueError("Failed to read all bytes")
-            data.extend(packet)
-        return data
+    def __llenar_buffer(self):
+        pendientes = self.__decodificador.hay_datos_pendientes
+        espera = self.__espera_lectura if pendientes else self.__espera_inactividad
+        if espera != self.__espera_actual:
+            # El timeout del socket tambien acota los envios: un cliente que no lee no retiene al handler
+            self.__socket.settimeout(espera)
+            self.__espera_actual = espera
+        try:
+            leidos = self.__socket.recv_into(self.__decodificador.espacio_libre())
+        except socket.timeout:
+            raise ConexionInactiva(f"No data received for {espera}s {'with a partial message' if pendientes else 'between messages'}")
+        if not leidos:
+            if not self.__decodificador.hay_datos_pendientes:
+                raise ConexionCerradaPorCliente("Connection closed by the client")
+            raise ValueError("Failed to read all bytes")
+        self.__decodificador.datos_recibidos(leidos)
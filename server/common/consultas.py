@@ -0,0 +1,197 @@
+"""
+Consultas sobre las apuestas almacenadas, sin recorrer el archivo de apuestas.
+
+IndiceApuestas mantiene en memoria la cantidad de apuestas por agencia y las
+apuestas por documento y por numero, y se actualiza a medida que el BetWriter
+escribe cada batch, igual que el IndiceGanadores. Con ADMIN_PORT el servidor
+lo publica por HTTP, solo en localhost:
+
+    GET /apuestas/agencias               cantidad de apuestas de cada agencia
+    GET /apuestas/agencias/<agencia>     cantidad de apuestas de la agencia
+    GET /apuestas/documentos/<documento> apuestas (agencia, numero) del documento
+    GET /apuestas/numeros/<numero>       apuestas (agencia, documento) al numero
+
+Al detenerse, el servidor guarda el indice en un archivo junto al de
+apuestas (p. ej. ./bets.csv.indice), con el tamaño del archivo de apuestas
+que cubre. Al iniciar lo carga si ese tamaño coincide; si no, lo reconstruye
+recorriendo el archivo de apuestas.
+"""
+import logging
+import marshal
+import os
+import threading
+from array import array
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from common.utils import Bet, BetBatch
+
+if TYPE_CHECKING:
+    import http.server
+
+# Version del formato del archivo del indice, para descartar archivos de versiones anteriores
+VERSION_ARCHIVO_INDICE = 1
+
+# Apuestas que devuelve como maximo una consulta por documento o por numero
+MAX_RESULTADOS_CONSULTA = 10000
+
+
+def ruta_indice(filepath: str) -> str:
+    """Archivo del indice de las apuestas de filepath."""
+    return filepath + ".indice"
+
+
+class IndiceApuestas:
+    """
+    Indices de las apuestas almacenadas. Cada apuesta se guarda como un unico
+    int en cada indice (la agencia en los 32 bits altos), para no crear una
+    tupla por apuesta.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cantidades: Dict[int, int] = {}
+        # documento -> agencia << 32 | numero, o una lista si el documento apostó más de una vez
+        self._por_documento: Dict[int, Union[int, List[int]]] = {}
+        # numero -> array('Q') de agencia << 32 | documento
+        self._por_numero: Dict[int, array] = {}
+
+    def agregar(self, bets: Sequence[Bet]):
+        if isinstance(bets, BetBatch):
+            self.agregar_registros(zip(bets.agencies, bets.documents, bets.numbers))
+        else:
+            self.agregar_registros((bet.agency, int(bet.document), bet.number) for bet in bets)
+
+    def agregar_registros(self, registros: Iterable[Tuple[int, int, int]]) -> int:
+        """Agrega tuplas (agencia, documento, numero), p. ej. StorageFormat.scan_bets(). Devuelve cuántas agregó."""
+        cantidad = 0
+        with self._lock:
+            cantidades, por_documento, por_numero = self._cantidades, self._por_documento, self._por_numero
+            for agencia, documento, numero in registros:
+                cantidades[agencia] = cantidades.get(agencia, 0) + 1
+                previa = por_documento.get(documento)
+                apuesta = agencia << 32 | numero
+                if previa is None:
+                    por_documento[documento] = apuesta
+                elif isinstance(previa, list):
+                    previa.append(apuesta)
+                else:
+                    por_documento[documento] = [previa, apuesta]
+                apuestas_al_numero = por_numero.get(numero)
+                if apuestas_al_numero is None:
+                    apuestas_al_numero = por_numero[numero] = array('Q')
+                apuestas_al_numero.append(agencia << 32 | documento)
+                cantidad += 1
+        return cantidad
+
+    def cantidades_por_agencia(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._cantidades)
+
+    def cantidad_de_agencia(self, agencia: int) -> int:
+        with self._lock:
+            return self._cantidades.get(agencia, 0)
+
+    def por_documento(self, documento: int) -> List[Tuple[int, int]]:
+        """Apuestas (agencia, numero) del documento, en orden de almacenamiento."""
+        with self._lock:
+            apuestas = self._por_documento.get(documento, [])
+            apuestas = apuestas[:MAX_RESULTADOS_CONSULTA] if isinstance(apuestas, list) else [apuestas]
+        return [_separar(apuesta) for apuesta in apuestas]
+
+    def por_numero(self, numero: int) -> List[Tuple[int, int]]:
+        """Apuestas (agencia, documento) al numero, en orden de almacenamiento."""
+        with self._lock:
+            apuestas = self._por_numero.get(numero, array('Q'))[:MAX_RESULTADOS_CONSULTA]
+        return [_separar(apuesta) for apuesta in apuestas]
+
+    def guardar(self, filepath: str, tamanio_log: int):
+        """Guarda el indice en filepath, como el de las apuestas de un log de tamanio_log bytes."""
+        with self._lock:
+            por_numero = {numero: apuestas.tobytes() for numero, apuestas in self._por_numero.items()}
+            contenido = marshal.dumps((VERSION_ARCHIVO_INDICE, tamanio_log, self._cantidades, self._por_documento, por_numero))
+        # Se escribe aparte y se renombra, para que un corte no deje un indice a medio escribir
+        temporal = filepath + ".tmp"
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, filepath)
+
+    @classmethod
+    def cargar(cls, filepath: str, tamanio_log: int) -> Optional['IndiceApuestas']:
+        """El indice guardado en filepath, o None si no existe o no corresponde a un log de tamanio_log bytes."""
+        try:
+            with open(filepath, 'rb') as archivo:
+                version, tamanio, cantidades, por_documento, por_numero = marshal.loads(archivo.read())
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError) as e:
+            logging.warning(f"action: cargar_indice_apuestas | result: fail | error: {e} | file: {filepath}")
+            return None
+        if version != VERSION_ARCHIVO_INDICE or tamanio != tamanio_log:
+            return None
+        indice = cls()
+        indice._cantidades = cantidades
+        indice._por_documento = por_documento
+        for numero, apuestas in por_numero.items():
+            indice._por_numero[numero] = array('Q', apuestas)
+        return indice
+
+
+def _separar(apuesta: int) -> Tuple[int, int]:
+    return apuesta >> 32, apuesta & 0xFFFFFFFF
+
+
+def _handler_consultas(indice: IndiceApuestas) -> type:
+    # Como en metricas: http.server solo se importa si el servidor publica las consultas
+    import http.server
+    import json
+
+    class HandlerConsultas(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            partes = self.path.strip('/').split('/')
+            if len(partes) < 2 or partes[0] != "apuestas":
+                self.send_error(404)
+                return
+            try:
+                argumentos = [int(parte) for parte in partes[2:]]
+            except ValueError:
+                self.send_error(400, "expected an integer")
+                return
+
+            recurso = partes[1]
+            if recurso == "agencias" and not argumentos:
+                respuesta = {str(agencia): cantidad for agencia, cantidad in sorted(indice.cantidades_por_agencia().items())}
+            elif recurso == "agencias" and len(argumentos) == 1:
+                respuesta = {"agencia": argumentos[0], "apuestas": indice.cantidad_de_agencia(argumentos[0])}
+            elif recurso == "documentos" and len(argumentos) == 1:
+                apuestas = indice.por_documento(argumentos[0])
+                respuesta = {"documento": argumentos[0], "apuestas": [{"agencia": agencia, "numero": numero} for agencia, numero in apuestas]}
+            elif recurso == "numeros" and len(argumentos) == 1:
+                apuestas = indice.por_numero(argumentos[0])
+                respuesta = {"numero": argumentos[0], "apuestas": [{"agencia": agencia, "documento": documento} for agencia, documento in apuestas]}
+            else:
+                self.send_error(404)
+                return
+
+            cuerpo = json.dumps(respuesta).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, format, *args):
+            # Los operadores consultan seguido: cada consulta no merece una linea de log
+            pass
+
+    return HandlerConsultas
+
+
+def iniciar_servidor_http(puerto: int, indice: IndiceApuestas) -> 'http.server.ThreadingHTTPServer':
+    """Publica las consultas del indice en localhost:puerto desde un thread daemon."""
+    import http.server
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', puerto), _handler_consultas(indice))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="consultas-http", daemon=True).start()
+    logging.info(f"action: iniciar_consultas | result: success | port: {servidor.server_address[1]}")
+    return servidor
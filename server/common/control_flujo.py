@@ -0,0 +1,134 @@
+"""
+Control de flujo entre la recepcion y el almacenamiento.
+
+ControlFlujo cuenta los bytes y las apuestas de los batches encolados en el
+BetWriter que todavía no son durables. Cuando alguno supera su marca alta
+se pausa la lectura de todas las conexiones, y recien se reanuda cuando
+ambos bajan de su marca baja: con el disco lento o trabado los clientes
+quedan frenados por TCP, en vez de acumular batches decodificados en el
+servidor hasta que el proceso se queda sin memoria.
+
+Los bytes de un batch son los del mensaje recibido (sin comprimir, si llegó
+en un FRAME_COMPRIMIDO). Los valores actuales se publican en las metricas.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from common import metricas
+
+# Marcas por defecto. Con batches de ~100 apuestas, la cola del BetWriter
+# (MAX_BATCHES_ENCOLADOS) llena son ~100000 apuestas: las marcas solo se
+# alcanzan con el almacenamiento atrasado o con batches v2 grandes
+MAX_BYTES_PENDIENTES = 64 * 1024 * 1024
+MAX_APUESTAS_PENDIENTES = 1000000
+
+
+@dataclass(frozen=True)
+class LimitesPendientes:
+    # Marcas altas, a partir de las cuales se pausa la lectura. 0 no limita esa cantidad
+    bytes_alto: int = MAX_BYTES_PENDIENTES
+    apuestas_alto: int = MAX_APUESTAS_PENDIENTES
+    # Marcas bajas, por debajo de las cuales se reanuda. None usa la mitad de la marca alta
+    bytes_bajo: Optional[int] = None
+    apuestas_bajo: Optional[int] = None
+
+    def __post_init__(self):
+        for nombre, alto, bajo in (("bytes", self.bytes_alto, self.bytes_bajo), ("apuestas", self.apuestas_alto, self.apuestas_bajo)):
+            if alto < 0:
+                raise ValueError(f"{nombre}_alto must not be negative, got {alto}")
+            if bajo is not None and not 0 <= bajo <= alto:
+                raise ValueError(f"{nombre}_bajo must be between 0 and {nombre}_alto ({alto}), got {bajo}")
+
+
+class ControlFlujo:
+    """
+    Bytes y apuestas pendientes de almacenar, con histeresis entre las marcas
+    para no pausar y reanudar la lectura con cada batch.
+
+    El motor con threads espera en esperar_reanudacion() antes de leer cada
+    mensaje. El motor asyncio se suscribe para pausar y reanudar sus
+    transportes: los suscriptores se llaman sin el lock tomado, desde el
+    thread que provocó el cambio (un handler o el BetWriter).
+    """
+
+    def __init__(self, limites: Optional[LimitesPendientes] = None):
+        limites = limites or LimitesPendientes()
+        self._bytes_alto = limites.bytes_alto
+        self._apuestas_alto = limites.apuestas_alto
+        self._bytes_bajo = limites.bytes_bajo if limites.bytes_bajo is not None else limites.bytes_alto // 2
+        self._apuestas_bajo = limites.apuestas_bajo if limites.apuestas_bajo is not None else limites.apuestas_alto // 2
+        self._cond = threading.Condition()
+        self._bytes = 0
+        self._apuestas = 0
+        self._pausado = False
+        self._detenido = False
+        self._suscriptores: List[Callable[[], None]] = []
+
+    @property
+    def pausado(self) -> bool:
+        return self._pausado
+
+    def pendientes(self) -> Tuple[int, int]:
+        """(bytes, apuestas) encolados que todavía no son durables."""
+        with self._cond:
+            return self._bytes, self._apuestas
+
+    def suscribir(self, al_cambiar: Callable[[], None]):
+        """al_cambiar se llama cada vez que se pausa o se reanuda la lectura; el estado nuevo es pausado."""
+        self._suscriptores.append(al_cambiar)
+
+    def agregar(self, bytes_batch: int, apuestas: int):
+        with self._cond:
+            self._bytes += bytes_batch
+            self._apuestas += apuestas
+            cambio = not self._pausado and self._supera_marca_alta()
+            if cambio:
+                self._pausado = True
+            pendientes = self._publicar()
+        if cambio:
+            metricas.PAUSAS_LECTURA.inc()
+            logging.warning("action: pausar_lectura | result: success | bytes_pendientes: %s | apuestas_pendientes: %s", *pendientes)
+            self._notificar()
+
+    def quitar(self, bytes_batch: int, apuestas: int):
+        with self._cond:
+            self._bytes -= bytes_batch
+            self._apuestas -= apuestas
+            cambio = self._pausado and self._bajo_marca_baja()
+            if cambio:
+                self._pausado = False
+                self._cond.notify_all()
+            pendientes = self._publicar()
+        if cambio:
+            logging.info("action: reanudar_lectura | result: success | bytes_pendientes: %s | apuestas_pendientes: %s", *pendientes)
+            self._notificar()
+
+    def esperar_reanudacion(self):
+        """Bloquea mientras la lectura está pausada, o hasta que se llame a detener()."""
+        with self._cond:
+            while self._pausado and not self._detenido:
+                self._cond.wait()
+
+    def detener(self):
+        """Libera a los que esperan en esperar_reanudacion, para que el servidor pueda detenerse."""
+        with self._cond:
+            self._detenido = True
+            self._cond.notify_all()
+
+    def _supera_marca_alta(self) -> bool:
+        return (self._bytes_alto > 0 and self._bytes >= self._bytes_alto) or (self._apuestas_alto > 0 and self._apuestas >= self._apuestas_alto)
+
+    def _bajo_marca_baja(self) -> bool:
+        return (self._bytes_alto == 0 or self._bytes <= self._bytes_bajo) and (self._apuestas_alto == 0 or self._apuestas <= self._apuestas_bajo)
+
+    def _publicar(self) -> Tuple[int, int]:
+        metricas.BYTES_PENDIENTES.set(self._bytes)
+        metricas.APUESTAS_PENDIENTES.set(self._apuestas)
+        metricas.LECTURA_PAUSADA.set(1 if self._pausado else 0)
+        return self._bytes, self._apuestas
+
+    def _notificar(self):
+        for al_cambiar in self._suscriptores:
+            al_cambiar()
@@ -0,0 +1,140 @@
+"""
+Escaneo del archivo de apuestas para reconstruir el indice de ganadores al
+iniciar el servidor.
+
+El bets.csv se mapea en memoria y se divide en porciones que terminan en un
+fin de linea, que se recorren en paralelo con un pool de procesos. Cada
+porcion no se parsea fila por fila: se buscan las apariciones de
+",<numero ganador>" al final de una linea (una busqueda de bytes, en C) y
+solo de esas lineas se extraen la agencia y el documento. La cantidad de
+apuestas es la cantidad de fines de linea. Cada proceso devuelve los
+ganadores de su porcion en orden de almacenamiento, y al unirlas en el orden
+de las porciones el resultado es el mismo que el del recorrido secuencial.
+
+Esto vale mientras ninguna fila tenga campos entre comillas (un nombre con
+una coma o un salto de linea): en ese caso, o con el log binario, cuyos
+registros de largo variable no se pueden partir sin recorrerlos, se usa el
+recorrido secuencial de StorageFormat.scan_bets.
+"""
+import concurrent.futures
+import mmap
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from common.bet_log import StorageFormat
+from common.sorteo import ColumnasApuestas, evaluar_sorteo
+from common.utils import LOTTERY_WINNER_NUMBER
+
+# Debajo de este tamaño levantar procesos cuesta más de lo que se gana al repartir el archivo
+TAMANIO_MINIMO_PARALELO = 64 * 1024 * 1024
+# Tamaño minimo de cada porcion, para no repartir de más entre muchos procesos
+TAMANIO_MINIMO_PORCION = 16 * 1024 * 1024
+
+# (cantidad de apuestas, ganadores (agencia, documento) en orden de almacenamiento)
+ResultadoPorcion = Tuple[int, List[Tuple[int, int]]]
+
+
+def escanear_ganadores(formato: StorageFormat, procesos: int = 0, numeros_ganadores: Sequence[int] = (LOTTERY_WINNER_NUMBER,)) -> Tuple[int, Dict[int, List[int]]]:
+    """
+    Recorre el archivo de apuestas de formato y devuelve la cantidad de
+    apuestas y los DNIs ganadores por agencia, en orden de almacenamiento.
+    procesos es la cantidad maxima de procesos del pool, 0 para usar uno
+    por CPU.
+    """
+    if procesos < 0:
+        raise ValueError(f"procesos must be 0 (one per CPU) or positive, got {procesos}")
+    if not formato.binary:
+        porciones = _dividir_csv(formato.filepath, procesos or os.cpu_count() or 1)
+        if porciones is not None:
+            return _unir(_escanear_porciones(formato.filepath, porciones, tuple(numeros_ganadores)))
+
+    columnas = ColumnasApuestas.desde_registros(formato.scan_bets(formato.filepath))
+    return len(columnas), {agencia: list(dnis) for agencia, dnis in evaluar_sorteo(columnas, numeros_ganadores).items()}
+
+
+def _dividir_csv(filepath: str, procesos: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Porciones [inicio, fin) del archivo que terminan en un fin de linea, o
+    None si el archivo tiene campos entre comillas y no se puede partir por lineas.
+    """
+    with open(filepath, 'rb') as file:
+        tamanio = os.fstat(file.fileno()).st_size
+        if tamanio == 0:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            if datos.find(b'"') != -1:
+                return None
+            cantidad = 1
+            if tamanio >= TAMANIO_MINIMO_PARALELO:
+                cantidad = max(1, min(procesos, tamanio // TAMANIO_MINIMO_PORCION))
+            porciones = []
+            inicio = 0
+            for numero in range(1, cantidad):
+                fin_linea = datos.find(b'\n', max(inicio, tamanio * numero // cantidad))
+                if fin_linea == -1:
+                    break
+                porciones.append((inicio, fin_linea + 1))
+                inicio = fin_linea + 1
+            if inicio < tamanio:
+                porciones.append((inicio, tamanio))
+            return porciones
+
+
+def _escanear_porciones(filepath: str, porciones: List[Tuple[int, int]], numeros_ganadores: Tuple[int, ...]) -> List[ResultadoPorcion]:
+    if len(porciones) <= 1:
+        return [escanear_porcion(filepath, inicio, fin, numeros_ganadores) for inicio, fin in porciones]
+    # multiprocessing se importa solo si hay que repartir el archivo, no en cada arranque
+    import multiprocessing
+    # Como los workers de SERVER_WORKERS: fork no vuelve a importar el modulo principal en cada proceso
+    contexto = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(porciones), mp_context=contexto) as pool:
+        futuros = [pool.submit(escanear_porcion, filepath, inicio, fin, numeros_ganadores) for inicio, fin in porciones]
+        return [futuro.result() for futuro in futuros]
+
+
+def escanear_porcion(filepath: str, inicio: int, fin: int, numeros_ganadores: Tuple[int, ...] = (LOTTERY_WINNER_NUMBER,)) -> ResultadoPorcion:
+    """
+    Recorre las lineas completas del bets.csv entre inicio y fin, sin campos
+    entre comillas. Solo se parsean la agencia y el documento de las
+    apuestas ganadoras.
+    """
+    with open(filepath, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+        porcion = datos[inicio:fin]
+
+    cantidad = porcion.count(b'\n')
+    if porcion and not porcion.endswith(b'\n'):
+        # Una ultima linea sin fin de linea también es una apuesta, como para csv.reader
+        cantidad += 1
+
+    posiciones: List[int] = []
+    for numero in set(numeros_ganadores):
+        posiciones.extend(_buscar_al_final_de_linea(porcion, b',%d' % numero))
+    if len(numeros_ganadores) > 1:
+        posiciones.sort()
+
+    ganadores = []
+    for posicion in posiciones:
+        inicio_linea = porcion.rfind(b'\n', 0, posicion) + 1
+        campos = porcion[inicio_linea:posicion].split(b',', 4)
+        ganadores.append((int(campos[0]), int(campos[3])))
+    return cantidad, ganadores
+
+
+def _buscar_al_final_de_linea(porcion: bytes, patron: bytes):
+    """Posiciones de patron que ocupan el final de una linea, es decir, el ultimo campo de la fila."""
+    posicion = porcion.find(patron)
+    while posicion != -1:
+        siguiente = posicion + len(patron)
+        if siguiente == len(porcion) or porcion[siguiente] in b'\r\n':
+            yield posicion
+        posicion = porcion.find(patron, siguiente)
+
+
+def _unir(resultados: List[ResultadoPorcion]) -> Tuple[int, Dict[int, List[int]]]:
+    cantidad = 0
+    dnis_por_agencia: Dict[int, List[int]] = {}
+    for cantidad_porcion, ganadores in resultados:
+        cantidad += cantidad_porcion
+        for agencia, documento in ganadores:
+            dnis_por_agencia.setdefault(agencia, []).append(documento)
+    return cantidad, dnis_por_agencia
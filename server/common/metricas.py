@@ -0,0 +1,187 @@
+"""
+Metricas del servidor: contadores, medidores e histogramas en memoria,
+exportados en el formato de texto de Prometheus.
+
+Registrar una muestra es un lock y unas pocas operaciones, así que las
+metricas están siempre activas. Con METRICS_PORT el servidor las publica por
+HTTP en http://localhost:<METRICS_PORT>/metrics.
+"""
+import bisect
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import http.server
+
+PREFIJO = "loteria_"
+
+# Limites de los buckets de los histogramas de latencia, en segundos
+BUCKETS_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Limites de los buckets de cantidades (p. ej. batches por escritura agrupada)
+BUCKETS_CANTIDAD = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# Valores de las etiquetas de una muestra, en el orden de las etiquetas de la metrica
+Etiquetas = Tuple[object, ...]
+
+
+class _Metrica(ABC):
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = PREFIJO + nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+
+    def _formatear_etiquetas(self, valores: Etiquetas) -> str:
+        pares = [f'{etiqueta}="{valor}"' for etiqueta, valor in zip(self.etiquetas, valores)]
+        return "{" + ",".join(pares) + "}" if pares else ""
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"] + self._muestras()
+
+    @abstractmethod
+    def _muestras(self) -> List[str]:
+        """Lineas de las muestras, en el formato de texto de Prometheus."""
+
+
+class Contador(_Metrica):
+    """Valor que solo crece, p. ej. apuestas almacenadas."""
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[Etiquetas, float] = {}
+
+    def inc(self, valor: float = 1, etiquetas: Etiquetas = ()):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def valor(self, etiquetas: Etiquetas = ()) -> float:
+        return self._valores.get(etiquetas, 0)
+
+    def _muestras(self) -> List[str]:
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{self._formatear_etiquetas(etiquetas)} {valor}" for etiquetas, valor in valores]
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja, p. ej. handlers activos."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str):
+        super().__init__(nombre, ayuda)
+        self._valor = 0.0
+
+    def inc(self, valor: float = 1):
+        with self._lock:
+            self._valor += valor
+
+    def dec(self, valor: float = 1):
+        self.inc(-valor)
+
+    def set(self, valor: float):
+        self._valor = valor
+
+    def valor(self) -> float:
+        return self._valor
+
+    def _muestras(self) -> List[str]:
+        return [f"{self.nombre} {self._valor}"]
+
+
+class Histograma(_Metrica):
+    """Distribucion de muestras en buckets acumulativos, con su suma y cantidad."""
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, buckets: Sequence[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda)
+        self._limites = tuple(buckets)
+        # El ultimo bucket es +Inf
+        self._cantidades = [0] * (len(self._limites) + 1)
+        self._suma = 0.0
+
+    def observar(self, valor: float):
+        indice = bisect.bisect_left(self._limites, valor)
+        with self._lock:
+            self._cantidades[indice] += 1
+            self._suma += valor
+
+    @property
+    def cantidad(self) -> int:
+        return sum(self._cantidades)
+
+    def _muestras(self) -> List[str]:
+        with self._lock:
+            cantidades = list(self._cantidades)
+            suma = self._suma
+        muestras = []
+        acumulada = 0
+        for limite, cantidad in zip(self._limites + (float('inf'),), cantidades):
+            acumulada += cantidad
+            le = "+Inf" if limite == float('inf') else repr(limite)
+            muestras.append(f'{self.nombre}_bucket{{le="{le}"}} {acumulada}')
+        muestras.append(f"{self.nombre}_sum {suma}")
+        muestras.append(f"{self.nombre}_count {acumulada}")
+        return muestras
+
+
+BYTES_RECIBIDOS = Contador("bytes_recibidos_total", "Bytes de mensajes recibidos, por agencia.", ("agencia",))
+APUESTAS_ALMACENADAS = Contador("apuestas_almacenadas_total", "Apuestas almacenadas, por agencia.", ("agencia",))
+DECODIFICACION = Histograma("decodificacion_segundos", "Tiempo de decodificacion de cada mensaje completo.")
+ESPERA_COLA_WRITER = Histograma("espera_cola_writer_segundos", "Tiempo que espera cada batch en la cola del BetWriter hasta que se escribe.")
+ESCRITURA_AGRUPADA = Histograma("escritura_agrupada_segundos", "Duracion de cada escritura agrupada del BetWriter, incluido el fsync.")
+BATCHES_POR_ESCRITURA = Histograma("batches_por_escritura", "Batches de cada escritura agrupada del BetWriter.", BUCKETS_CANTIDAD)
+ALMACENAMIENTO = Histograma("almacenamiento_segundos", "Tiempo desde que se encola un batch hasta que es durable e indexado.")
+SORTEO = Histograma("sorteo_segundos", "Duracion de cada sorteo.")
+HANDLERS_ACTIVOS = Medidor("handlers_activos", "Conexiones de clientes abiertas.")
+BYTES_PENDIENTES = Medidor("bytes_pendientes", "Bytes de los batches encolados para almacenar que todavía no son durables.")
+APUESTAS_PENDIENTES = Medidor("apuestas_pendientes", "Apuestas encoladas para almacenar que todavía no son durables.")
+LECTURA_PAUSADA = Medidor("lectura_pausada", "1 si la lectura de las conexiones está pausada por el control de flujo.")
+PAUSAS_LECTURA = Contador("pausas_lectura_total", "Veces que se pausó la lectura por superar una marca alta de pendientes.")
+
+METRICAS: Tuple[_Metrica, ...] = (BYTES_RECIBIDOS, APUESTAS_ALMACENADAS, DECODIFICACION, ESPERA_COLA_WRITER,
+                                  ESCRITURA_AGRUPADA, BATCHES_POR_ESCRITURA, ALMACENAMIENTO, SORTEO, HANDLERS_ACTIVOS,
+                                  BYTES_PENDIENTES, APUESTAS_PENDIENTES, LECTURA_PAUSADA, PAUSAS_LECTURA)
+
+
+def exportar_texto() -> str:
+    """Todas las metricas en el formato de texto de Prometheus."""
+    return "\n".join(linea for metrica in METRICAS for linea in metrica.exportar()) + "\n"
+
+
+def _handler_metricas() -> type:
+    # http.server arrastra http.client, email y ssl: se importa recien al publicar las metricas
+    import http.server
+
+    class HandlerMetricas(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = exportar_texto().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, format, *args):
+            # Cada scrape no merece una linea de log
+            pass
+
+    return HandlerMetricas
+
+
+def iniciar_servidor_http(puerto: int) -> 'http.server.ThreadingHTTPServer':
+    """Publica las metricas en /metrics desde un thread daemon."""
+    import http.server
+    servidor = http.server.ThreadingHTTPServer(('', puerto), _handler_metricas())
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    logging.info(f"action: iniciar_metricas | result: success | port: {servidor.server_address[1]}")
+    return servidor
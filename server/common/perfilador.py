@@ -0,0 +1,242 @@
+"""
+Perfilador por muestreo para el servidor en produccion.
+
+Una captura dura una ventana acotada (PROFILE_DURATION_S) y se pide con
+SIGUSR1, o al iniciar con PROFILE_ON_START. Mientras dura, un thread toma
+cada PROFILE_INTERVAL_MS la pila de todos los demás threads con
+sys._current_frames(), sin instrumentar el codigo, y al terminar escribe en
+PROFILE_DIR:
+
+- perfil-<fecha>-<pid>-<n>.folded: pilas colapsadas (una linea "hilo;funcion;...
+  muestras" por pila), para flamegraph.pl o speedscope.
+- perfil-<fecha>-<pid>-<n>.speedscope.json: un perfil por grupo de threads, para
+  https://www.speedscope.app. Los threads se agrupan por nombre sin numeros,
+  así que todos los handler-N quedan en "handler".
+- perfil-<fecha>-<pid>-<n>.fases.json: los spans de las fases (ingesta, sorteo,
+  ganadores, progreso) registrados con fase(), en el formato de eventos de
+  Chrome (chrome://tracing, Perfetto o speedscope).
+
+La fecha tiene milisegundos y n numera las capturas del proceso, así que
+dos capturas seguidas no se pisan.
+
+Fuera de una captura, fase() solo crea un objeto y lee una variable global.
+"""
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Duracion de cada captura y periodo del muestreo, por defecto
+DURACION_CAPTURA_S = 30.0
+INTERVALO_MUESTREO_S = 0.01
+# Spans que se registran como maximo en una captura, para acotar su memoria
+MAX_FASES_POR_CAPTURA = 100000
+
+# Numero de cada captura del proceso, para el nombre de sus archivos
+_numeros_captura = itertools.count(1)
+
+# nombre de la fase, pista (thread o conexion), inicio y fin en segundos de perf_counter
+Span = Tuple[str, str, float, float]
+
+
+class _Captura:
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.fases: List[Span] = []
+
+    def registrar_fase(self, nombre: str, pista: str, inicio: float, fin: float):
+        # list.append es atomico: los handlers registran sin lock
+        if len(self.fases) < MAX_FASES_POR_CAPTURA:
+            self.fases.append((nombre, pista, inicio, fin))
+
+
+# Captura en curso, None fuera de una captura
+_captura_activa: Optional[_Captura] = None
+
+
+class _Fase:
+    __slots__ = ('_nombre', '_pista', '_captura', '_inicio')
+
+    def __init__(self, nombre: str, pista: Optional[str]):
+        self._nombre = nombre
+        self._pista = pista
+
+    def __enter__(self):
+        self._captura = _captura_activa
+        if self._captura is not None:
+            self._inicio = time.perf_counter()
+
+    def __exit__(self, *excepcion):
+        if self._captura is not None:
+            pista = self._pista if self._pista is not None else threading.current_thread().name
+            self._captura.registrar_fase(self._nombre, pista, self._inicio, time.perf_counter())
+
+
+def fase(nombre: str, pista: Optional[str] = None) -> _Fase:
+    """
+    Span de una fase, que solo se registra si hay una captura en curso. La
+    pista es donde se muestra el span; por defecto, el nombre del thread.
+    """
+    return _Fase(nombre, pista)
+
+
+class Perfilador:
+    """
+    Toma capturas de duracion acotada, de a una por vez. La captura la hace
+    un thread daemon que espera las solicitudes, y que recien se inicia con
+    la primera: si nunca se pide una captura, el perfilador no agrega ningun
+    thread.
+    """
+
+    def __init__(self, duracion: float = DURACION_CAPTURA_S, intervalo: float = INTERVALO_MUESTREO_S, directorio: str = "."):
+        if duracion <= 0:
+            raise ValueError(f"duracion must be positive, got {duracion}")
+        if intervalo <= 0:
+            raise ValueError(f"intervalo must be positive, got {intervalo}")
+        self._duracion = duracion
+        self._intervalo = intervalo
+        self._directorio = directorio
+        self._solicitud = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        """Prepara el perfilador para atender solicitudes, tambien en los procesos que se forkeen despues."""
+        os.register_at_fork(after_in_child=self._reiniciar_en_hijo)
+
+    def _reiniciar_en_hijo(self):
+        # El thread no sobrevive al fork: cada proceso hijo (p. ej. un worker) inicia el suyo con su primera solicitud
+        self._solicitud = threading.Event()
+        self._thread = None
+
+    def solicitar_captura(self):
+        """
+        Pide una captura. Se llama desde el thread principal (el signal handler
+        de SIGUSR1 o el arranque), así que iniciar el thread no necesita lock.
+        """
+        self._solicitud.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._atender_solicitudes, name="perfilador", daemon=True)
+            self._thread.start()
+
+    def _atender_solicitudes(self):
+        while True:
+            self._solicitud.wait()
+            try:
+                self.capturar()
+            except Exception as e:
+                logging.error(f"action: perfil | result: fail | error: {e}")
+            # Las solicitudes que llegaron durante la captura ya quedaron cubiertas por ella
+            self._solicitud.clear()
+
+    def capturar(self) -> str:
+        """Muestrea durante la ventana, escribe los archivos y devuelve su ruta sin extension."""
+        global _captura_activa
+        logging.info(f"action: perfil | result: in_progress | duracion_s: {self._duracion} | intervalo_ms: {self._intervalo * 1000:g}")
+        captura = _captura_activa = _Captura()
+        pilas: Counter = Counter()
+        muestras = 0
+        try:
+            propio = threading.get_ident()
+            fin = time.monotonic() + self._duracion
+            siguiente = time.monotonic()
+            while siguiente < fin:
+                self._muestrear(pilas, propio)
+                muestras += 1
+                siguiente += self._intervalo
+                time.sleep(max(0.0, siguiente - time.monotonic()))
+        finally:
+            _captura_activa = None
+        duracion = time.perf_counter() - captura.inicio
+
+        os.makedirs(self._directorio, exist_ok=True)
+        ahora = time.time()
+        fecha = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(ahora))}.{int(ahora * 1000) % 1000:03d}"
+        ruta = os.path.join(self._directorio, f"perfil-{fecha}-{os.getpid()}-{next(_numeros_captura)}")
+        self._escribir(ruta, pilas, captura, duracion)
+        logging.info(f"action: perfil | result: success | muestras: {muestras} | pilas: {len(pilas)} | fases: {len(captura.fases)} | archivo: {ruta}")
+        for nombre, (cantidad, total, maximo) in sorted(_resumen_fases(captura.fases).items()):
+            logging.info(f"action: perfil_fase | result: success | fase: {nombre} | cantidad: {cantidad} | total_s: {total:.6f} | media_s: {total / cantidad:.6f} | max_s: {maximo:.6f}")
+        return ruta
+
+    @staticmethod
+    def _muestrear(pilas: Counter, propio: int):
+        nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == propio:
+                continue
+            # Los code objects se convierten a texto recien al escribir
+            codigos = []
+            while frame is not None:
+                codigos.append(frame.f_code)
+                frame = frame.f_back
+            codigos.reverse()
+            pilas[(_grupo_de_thread(nombres.get(ident, "desconocido")), tuple(codigos))] += 1
+
+    def _escribir(self, ruta: str, pilas: Counter, captura: _Captura, duracion: float):
+        # Como en metricas: json solo se importa si se toma una captura
+        import json
+
+        with open(ruta + ".folded", 'w') as archivo:
+            for (grupo, codigos), cantidad in sorted(pilas.items(), key=lambda item: item[0][0]):
+                archivo.write(";".join([grupo] + [_nombre_frame(codigo) for codigo in codigos]) + f" {cantidad}\n")
+
+        # Frames compartidos por los perfiles de speedscope, y un perfil por grupo de threads
+        indices: Dict[object, int] = {}
+        frames = []
+        perfiles: Dict[str, dict] = {}
+        for (grupo, codigos), cantidad in pilas.items():
+            pila = []
+            for codigo in codigos:
+                if codigo not in indices:
+                    indices[codigo] = len(frames)
+                    frames.append({"name": codigo.co_name, "file": codigo.co_filename, "line": codigo.co_firstlineno})
+                pila.append(indices[codigo])
+            perfil = perfiles.setdefault(grupo, {"type": "sampled", "name": grupo, "unit": "seconds", "startValue": 0,
+                                                 "endValue": 0, "samples": [], "weights": []})
+            perfil["samples"].append(pila)
+            perfil["weights"].append(cantidad * self._intervalo)
+            perfil["endValue"] += cantidad * self._intervalo
+        speedscope = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": os.path.basename(ruta),
+            "exporter": "loteria-perfilador",
+            "shared": {"frames": frames},
+            "profiles": [perfiles[grupo] for grupo in sorted(perfiles)],
+        }
+        with open(ruta + ".speedscope.json", 'w') as archivo:
+            json.dump(speedscope, archivo)
+
+        pid = os.getpid()
+        pistas: Dict[str, int] = {}
+        eventos = []
+        for nombre, pista, inicio, fin in captura.fases:
+            if pista not in pistas:
+                pistas[pista] = len(pistas) + 1
+                eventos.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": pistas[pista], "args": {"name": pista}})
+            eventos.append({"name": nombre, "cat": "fase", "ph": "X", "pid": pid, "tid": pistas[pista],
+                            "ts": (inicio - captura.inicio) * 1e6, "dur": (fin - inicio) * 1e6})
+        with open(ruta + ".fases.json", 'w') as archivo:
+            json.dump({"traceEvents": eventos, "displayTimeUnit": "ms", "otherData": {"duracion_s": duracion}}, archivo)
+
+
+def _grupo_de_thread(nombre: str) -> str:
+    """Nombre del thread sin sus partes numericas: handler-3-confirmador -> handler-confirmador."""
+    return "-".join(parte for parte in nombre.split("-") if not parte.isdigit()) or nombre
+
+
+def _nombre_frame(codigo) -> str:
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _resumen_fases(fases: List[Span]) -> Dict[str, Tuple[int, float, float]]:
+    """Cantidad, duracion total y duracion maxima de los spans de cada fase."""
+    resumen: Dict[str, Tuple[int, float, float]] = {}
+    for nombre, _, inicio, fin in fases:
+        cantidad, total, maximo = resumen.get(nombre, (0, 0.0, 0.0))
+        resumen[nombre] = (cantidad + 1, total + fin - inicio, max(maximo, fin - inicio))
+    return resumen
@@ -0,0 +1,131 @@
+"""
+Pool acotado de threads que atienden las conexiones de clientes, y control
+de admision de conexiones.
+
+El thread que acepta conexiones las admite con PoolHandlers.admitir(): si
+hay lugar, la conexion espera en una cola hasta que la toma uno de los
+threads del pool, que la atiende con un ClientHandler hasta que se cierra.
+Hay lugar mientras las conexiones atendidas más las que esperan no superen
+handlers + cola; si no, se responde CONEXION_RECHAZADA y se cierra. Así la
+cantidad de threads y de conexiones abiertas queda acotada aunque lleguen
+muchas conexiones juntas.
+
+Los threads se crean a medida que hacen falta, hasta el tamaño del pool, y
+despues se reutilizan.
+"""
+import logging
+import queue
+import socket
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional, Set
+
+from common.client_handler import ClientHandler
+from common.communication import RECHAZO_SERVIDOR_SATURADO, Communication
+
+if TYPE_CHECKING:
+    from common.server import Server
+
+
+@dataclass(frozen=True)
+class LimitesConexiones:
+    # Threads que atienden conexiones. None usa CLIENT_AMOUNT: cada agencia mantiene
+    # su conexion abierta hasta recibir los ganadores, así que con menos no se llega al sorteo
+    handlers: Optional[int] = None
+    # Conexiones aceptadas que pueden esperar un thread libre. None usa CLIENT_AMOUNT
+    cola: Optional[int] = None
+    # Conexiones simultaneas de una misma agencia, 0 para no limitarlas
+    por_agencia: int = 0
+    # Segundos que una conexion puede pasar sin empezar un mensaje, o sin enviar
+    # nada con un mensaje a medio recibir. None espera indefinidamente
+    espera_inactividad: Optional[float] = 60.0
+    espera_lectura: Optional[float] = 10.0
+
+
+class PoolHandlers:
+
+    def __init__(self, server: "Server", handlers: int, cola: int, limites: LimitesConexiones):
+        if handlers < 1:
+            raise ValueError(f"handlers must be at least 1, got {handlers}")
+        if cola < 0:
+            raise ValueError(f"cola must not be negative, got {cola}")
+        self._server = server
+        self._max_hilos = handlers
+        self._limites = limites
+        # Lugares para conexiones atendidas o en espera: se libera uno cuando se cierra una conexion
+        self._lugares = threading.BoundedSemaphore(handlers + cola)
+        self._pendientes: "queue.Queue[Optional[socket.socket]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._hilos: List[threading.Thread] = []
+        self._libres = 0
+        self._activos: Set[ClientHandler] = set()
+        self._detenido = False
+
+    def admitir(self, client_socket: socket.socket) -> bool:
+        """Encola la conexion para que la atienda el pool, o la rechaza si no hay lugar."""
+        if self._detenido or not self._lugares.acquire(blocking=False):
+            logging.warning("action: admitir_conexion | result: fail | motivo: servidor_saturado")
+            rechazo = Communication(client_socket)
+            try:
+                rechazo.send_conexion_rechazada(RECHAZO_SERVIDOR_SATURADO)
+                rechazo.close()
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            if self._libres == 0 and len(self._hilos) < self._max_hilos:
+                hilo = threading.Thread(target=self._atender, name=f"handler-{len(self._hilos) + 1}")
+                self._hilos.append(hilo)
+                self._libres += 1
+                hilo.start()
+            self._libres -= 1
+        self._pendientes.put(client_socket)
+        return True
+
+    def _atender(self):
+        while True:
+            client_socket = self._pendientes.get()
+            if client_socket is None:
+                return
+            handler = ClientHandler(client_socket, self._server, threading.current_thread().name,
+                                    self._limites.espera_inactividad, self._limites.espera_lectura)
+            with self._lock:
+                # Una parada que llegó mientras la conexion esperaba en la cola
+                detenido = self._detenido
+                if not detenido:
+                    self._activos.add(handler)
+            try:
+                if detenido:
+                    handler.communication.close()
+                else:
+                    handler.run()
+            except Exception as e:
+                # El thread sigue atendiendo otras conexiones aunque falle el cierre de esta
+                logging.error(f"action: atender_conexion | result: fail | error: {e} | thread: {handler.name}")
+            finally:
+                with self._lock:
+                    self._activos.discard(handler)
+                    self._libres += 1
+                self._lugares.release()
+
+    def detener(self):
+        """Cierra las conexiones atendidas y las que esperan, y espera a los threads del pool."""
+        with self._lock:
+            self._detenido = True
+            activos = list(self._activos)
+        for handler in activos:
+            handler.stop()
+        self.cerrar()
+
+    def cerrar(self):
+        """Espera a que se cierren todas las conexiones admitidas y terminen los threads del pool."""
+        with self._lock:
+            hilos = list(self._hilos)
+        for _ in hilos:
+            self._pendientes.put(None)
+        for hilo in hilos:
+            hilo.join()
+        with self._lock:
+            self._hilos.clear()
+            self._libres = 0
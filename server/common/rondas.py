@@ -0,0 +1,319 @@
+"""
+Servidor persistente con multiples rondas (LOTTERY_ROUNDS distinto de 1).
+
+En vez de atender CLIENT_AMOUNT conexiones, realizar un sorteo y terminar, el
+servidor sigue aceptando conexiones y realiza un sorteo por ronda. Una ronda
+se sortea cuando CLIENT_AMOUNT agencias completaron su envio en ella.
+
+Cada agencia envia sus apuestas a su ronda abierta: la siguiente a la ultima
+que completó, o la menor ronda sin sortear si todavía no completó ninguna.
+Así una agencia que ya completó puede empezar a enviar la ronda siguiente
+mientras las demás terminan la actual, o mientras se sirven sus resultados.
+
+Cada ronda tiene su propio BetWriter, indice de ganadores y registro de
+secuencias, y escribe sus apuestas en su propio archivo (p. ej.
+./bets.ronda-3.csv). De las rondas ya sorteadas solo se retienen en memoria
+los ganadores de las ultimas ROUNDS_RETAINED.
+"""
+import glob
+import logging
+import os
+import queue
+import re
+import socket
+import time
+from collections import deque
+from types import MappingProxyType
+from typing import Deque, Dict, FrozenSet, Optional, Sequence, Tuple
+
+from common import metricas, perfilador
+from common.bet_log import CSV_STORAGE, StorageFormat
+from common.bet_writer import FSYNC_BATCH, BetWriter
+from common.communication import RondaNoDisponible
+from common.control_flujo import ControlFlujo, LimitesPendientes
+from common.pool_handlers import LimitesConexiones
+from common.secuencias import RegistroSecuencias
+from common.server import MAX_ESPERA_GANADORES_MS, Server, completar_al_escribir
+from common.utils import Bet
+from common.winners import IndiceGanadores, ResultadoSorteo
+
+# Cantidad de rondas ya sorteadas cuyos ganadores se retienen en memoria
+RONDAS_RETENIDAS = 8
+
+# Resultado que se responde a una agencia cuya ronda consultada todavía no se sorteó
+_SIN_RESULTADO = ResultadoSorteo(MappingProxyType({}))
+
+
+class Ronda:
+    """
+    Estado de una ronda. Los atributos publicados (agencias_que_completaron_envio
+    y ganadores) son snapshots inmutables que se reemplazan con el lock del
+    servidor tomado, así que se leen sin lock.
+    """
+
+    def __init__(self, numero: int, storage_format: StorageFormat, fsync_policy: str, fsync_interval_ms: int, control_flujo: Optional[ControlFlujo] = None):
+        self.numero = numero
+        # Todas las rondas cuentan lo pendiente en el control de flujo del servidor
+        self.bet_writer = BetWriter(fsync_policy=fsync_policy, fsync_interval_ms=fsync_interval_ms, storage_format=storage_format.ronda(numero), control_flujo=control_flujo)
+        self.bet_writer.start()
+        self.indice_ganadores = IndiceGanadores()
+        self.secuencias = RegistroSecuencias()
+        self.agencias_que_completaron_envio: FrozenSet[int] = frozenset()
+        # Con el lock del servidor: si ya no acepta apuestas porque se completó, y cuantos batches se están encolando
+        self.cerrada = False
+        self.encolando = 0
+        # Ganadores por agencia y sus respuestas serializadas, None hasta que se realiza el sorteo de la ronda
+        self.resultado: Optional[ResultadoSorteo] = None
+
+    def almacenar_bets_secuenciadas(self, agencia: int, secuencia: int, bets: Sequence[Bet], bloquear: bool = True, tamanio: int = 0):
+        encolado = time.perf_counter()
+        escritura = self.bet_writer.encolar(bets, bloquear=bloquear, tamanio=tamanio)
+        escritura.add_done_callback(completar_al_escribir(self.secuencias, (self.indice_ganadores,), agencia, secuencia, bets, encolado))
+
+
+class ServidorRondas(Server):
+    """
+    Server que no termina despues del primer sorteo: realiza rondas hasta
+    recibir SIGTERM, o hasta sortear la cantidad de rondas pedida.
+
+    Atiende las conexiones con el pool de handlers, igual que Server. SOLICITUD_GANADORES
+    y SUSCRIPCION_GANADORES responden los ganadores de la ultima ronda que
+    completó la agencia, y SOLICITUD_GANADORES_RONDA los de cualquier ronda
+    retenida.
+    """
+
+    def __init__(self, port, listen_backlog, client_amount, fsync_policy=FSYNC_BATCH, fsync_interval_ms=10, storage_format: StorageFormat = CSV_STORAGE, max_espera_ganadores_ms: int = MAX_ESPERA_GANADORES_MS, rondas: int = 0, rondas_retenidas: int = RONDAS_RETENIDAS, limites: Optional[LimitesConexiones] = None, pendientes: Optional[LimitesPendientes] = None):
+        if rondas_retenidas < 1:
+            raise ValueError(f"rondas_retenidas must be at least 1, got {rondas_retenidas}")
+        # Cantidad de rondas a realizar antes de terminar, 0 para no terminar
+        self._rondas_totales = rondas
+        self._rondas_retenidas = rondas_retenidas
+        super().__init__(port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, max_espera_ganadores_ms, limites=limites, pendientes=pendientes)
+        self._listener_cerrado = False
+
+    def _iniciar_almacenamiento(self):
+        # Rondas abiertas y rondas sorteadas retenidas, por numero
+        self._rondas: Dict[int, Ronda] = {}
+        # Rondas sorteadas retenidas, de la más vieja a la más nueva
+        self._rondas_sorteadas: Deque[int] = deque()
+        # Ronda a la que van las proximas apuestas de cada agencia que ya completó alguna
+        self._ronda_por_agencia: Dict[int, int] = {}
+        # Ronda en la que se reservó cada secuencia pipelined que todavía no se encoló
+        self._reservas: Dict[Tuple[int, int], Ronda] = {}
+        # Las rondas de una ejecucion anterior ya tienen su archivo: se continua la numeracion
+        self._primera_ronda = self.__ultima_ronda_almacenada() + 1
+        self._menor_ronda_abierta = self._primera_ronda
+
+    def __ultima_ronda_almacenada(self) -> int:
+        raiz, extension = os.path.splitext(self._storage_format.filepath)
+        patron = re.compile(re.escape(raiz) + r'\.ronda-(\d+)' + re.escape(extension) + '$')
+        numeros = [0]
+        for ruta in glob.glob(f"{glob.escape(raiz)}.ronda-*{extension}"):
+            coincidencia = patron.match(ruta)
+            if coincidencia:
+                numeros.append(int(coincidencia.group(1)))
+        return max(numeros)
+
+    def run(self):
+        logging.info(f"action: iniciar_rondas | result: success | primera_ronda: {self._primera_ronda} | rondas: {self._rondas_totales or 'sin_limite'}")
+        while not self._stopped and not self._listener_cerrado:
+            servidor = self._server_socket
+            if servidor is None:
+                break
+            try:
+                logging.info('action: accept_connections | result: in_progress')
+                client_socket, addr = servidor.accept()
+            except OSError:
+                break
+            logging.info(f'action: accept_connections | result: success | ip: {addr[0]}')
+
+            self._pool_handlers.admitir(client_socket)
+
+        self._pool_handlers.cerrar()
+        with self._cond_sorteo:
+            abiertas = [ronda for ronda in self._rondas.values() if ronda.resultado is None]
+            for ronda in abiertas:
+                ronda.cerrada = True
+        for ronda in abiertas:
+            ronda.bet_writer.cerrar()
+        logging.info("action: stop_server | result: success")
+
+    def _cerrar_listener(self):
+        self._listener_cerrado = True
+        servidor, self._server_socket = self._server_socket, None
+        if servidor:
+            try:
+                servidor.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            servidor.close()
+
+    def _numero_ronda_abierta(self, agencia: int) -> int:
+        return max(self._ronda_por_agencia.get(agencia, 0), self._menor_ronda_abierta)
+
+    def _ronda_existente(self, agencia: int) -> Optional[Ronda]:
+        """Ronda a la que van las apuestas de la agencia, o None si todavía no recibió ninguna. No la crea."""
+        with self._cond_sorteo:
+            return self._rondas.get(self._numero_ronda_abierta(agencia))
+
+    def _ronda_abierta(self, agencia: int) -> Ronda:
+        """
+        Ronda a la que van las apuestas de la agencia. Se crea con la primera
+        apuesta que recibe: solo se llama al almacenar o completar, nunca desde
+        una consulta.
+        """
+        with self._cond_sorteo:
+            numero = self._numero_ronda_abierta(agencia)
+            ronda = self._rondas.get(numero)
+            if ronda is None:
+                ronda = Ronda(numero, self._storage_format, self._fsync_policy, self._fsync_interval_ms, self.control_flujo)
+                self._rondas[numero] = ronda
+                logging.info(f"action: abrir_ronda | result: success | ronda: {numero}")
+            return ronda
+
+    def _ronda_consultada(self, agencia: Optional[int]) -> Optional[int]:
+        """
+        Ronda cuyos ganadores se le responden a la agencia: la ultima que
+        completó, o la ultima sorteada. Se llama con _cond_sorteo tomado.
+        """
+        proxima = self._ronda_por_agencia.get(agencia) if agencia is not None else None
+        if proxima is not None:
+            return proxima - 1
+        return self._rondas_sorteadas[-1] if self._rondas_sorteadas else None
+
+    def _ultima_ronda(self) -> Optional[int]:
+        return self._primera_ronda + self._rondas_totales - 1 if self._rondas_totales else None
+
+    def acepta_apuestas_de(self, agencia: int) -> bool:
+        ultima = self._ultima_ronda()
+        with self._cond_sorteo:
+            return ultima is None or self._numero_ronda_abierta(agencia) <= ultima
+
+    def marcar_agencia_completada(self, agencia: int):
+        with self._cond_sorteo:
+            ronda = self._ronda_abierta(agencia)
+            ronda.agencias_que_completaron_envio = ronda.agencias_que_completaron_envio | {agencia}
+            # Las proximas apuestas de la agencia ya son de la ronda siguiente
+            self._ronda_por_agencia[agencia] = ronda.numero + 1
+            completa = len(ronda.agencias_que_completaron_envio) == self._agencias_totales
+            if completa:
+                # Un batch de otra agencia que llegue ahora ya no entra en el sorteo: se rechaza
+                ronda.cerrada = True
+            self._cond_sorteo.notify_all()
+        if completa:
+            with perfilador.fase("sorteo"):
+                self._realizar_sorteo_de_ronda(ronda)
+
+    def _realizar_sorteo_de_ronda(self, ronda: Ronda):
+        logging.info(f"action: realizar_sorteo | result: in_progress | ronda: {ronda.numero}")
+        inicio_sorteo = time.perf_counter()
+        # Cada agencia esperó a que sus batches fueran durables antes de completar,
+        # y la ronda ya está cerrada: una vez encolados los batches que ya pasaron
+        # el chequeo, su writer se puede cerrar
+        with self._cond_sorteo:
+            self._cond_sorteo.wait_for(lambda: ronda.encolando == 0)
+        ronda.bet_writer.cerrar()
+        resultado = ResultadoSorteo(ronda.indice_ganadores.ganadores_por_agencia())
+        with self._cond_sorteo:
+            ronda.resultado = resultado
+            self._rondas_sorteadas.append(ronda.numero)
+            self._menor_ronda_abierta = max(self._menor_ronda_abierta, ronda.numero + 1)
+            while len(self._rondas_sorteadas) > self._rondas_retenidas:
+                del self._rondas[self._rondas_sorteadas.popleft()]
+            self._cond_sorteo.notify_all()
+        metricas.SORTEO.observar(time.perf_counter() - inicio_sorteo)
+        logging.info(f"action: realizar_sorteo | result: success | ronda: {ronda.numero}")
+
+        if ronda.numero == self._ultima_ronda():
+            self._cerrar_listener()
+
+    def almacenar_bets(self, bets: Sequence[Bet], tamanio: int = 0):
+        # Todas las apuestas de un batch son de la misma agencia
+        agencia = bets[0].agency
+        ronda = self._ronda_abierta(agencia)
+        secuencia, futuro = ronda.secuencias.reservar_siguiente(agencia, len(bets))
+        self._encolar_en_ronda(ronda, agencia, secuencia, bets, True, tamanio)
+        futuro.result()
+
+    def reservar_secuencia(self, agencia: int, secuencia: int, apuestas: int = 0):
+        ronda = self._ronda_abierta(agencia)
+        futuro, duplicado = ronda.secuencias.reservar(agencia, secuencia, apuestas)
+        if not duplicado:
+            with self._cond_sorteo:
+                self._reservas[(agencia, secuencia)] = ronda
+        return futuro, duplicado
+
+    def almacenar_bets_secuenciadas(self, agencia: int, secuencia: int, bets: Sequence[Bet], bloquear: bool = True, tamanio: int = 0):
+        # El batch va a la ronda donde se reservó su secuencia, aunque la agencia ya tenga otra
+        with self._cond_sorteo:
+            ronda = self._reservas.pop((agencia, secuencia))
+        try:
+            self._encolar_en_ronda(ronda, agencia, secuencia, bets, bloquear, tamanio)
+        except queue.Full:
+            # Con queue.Full la reserva sigue en curso y el llamador reintenta
+            with self._cond_sorteo:
+                self._reservas[(agencia, secuencia)] = ronda
+            raise
+
+    def _encolar_en_ronda(self, ronda: Ronda, agencia: int, secuencia: int, bets: Sequence[Bet], bloquear: bool, tamanio: int):
+        """
+        Encola el batch de una secuencia reservada, salvo que la ronda ya esté
+        cerrada: en ese caso el writer puede estar terminado, y la reserva se
+        completa con un error para que se rechace el batch.
+        """
+        with self._cond_sorteo:
+            cerrada = ronda.cerrada
+            if not cerrada:
+                ronda.encolando += 1
+        if cerrada:
+            logging.warning(f"action: apuesta_recibida | result: fail | motivo: ronda_cerrada | ronda: {ronda.numero} | agencia: {agencia}")
+            ronda.secuencias.completar(agencia, secuencia, ValueError(f"round {ronda.numero} is already closed"))
+            return
+        try:
+            ronda.almacenar_bets_secuenciadas(agencia, secuencia, bets, bloquear, tamanio)
+        finally:
+            with self._cond_sorteo:
+                ronda.encolando -= 1
+                self._cond_sorteo.notify_all()
+
+    def secuencia_acumulada(self, agencia: int) -> int:
+        ronda = self._ronda_existente(agencia)
+        return ronda.secuencias.acumulada(agencia) if ronda is not None else 0
+
+    def progreso_agencia(self, agencia: int) -> Tuple[int, int, bool]:
+        # El progreso es el de la ronda abierta de la agencia, que todavía no completó
+        ronda = self._ronda_existente(agencia)
+        if ronda is None:
+            return 0, 0, False
+        acumulada, apuestas = ronda.secuencias.progreso(agencia)
+        return acumulada, apuestas, False
+
+    def sorteo_fue_realizado(self, agencia: Optional[int] = None) -> bool:
+        with self._cond_sorteo:
+            numero = self._ronda_consultada(agencia)
+            if numero is None:
+                return False
+            ronda = self._rondas.get(numero)
+            if ronda is None:
+                # Una ronda que ya no se retiene se sorteó hace rato
+                return numero < self._menor_ronda_abierta
+            return ronda.resultado is not None
+
+    def _resultado_consultado(self, agencia: int) -> ResultadoSorteo:
+        with self._cond_sorteo:
+            numero = self._ronda_consultada(agencia)
+            ronda = self._rondas.get(numero) if numero is not None else None
+        if ronda is None or ronda.resultado is None:
+            return _SIN_RESULTADO
+        return ronda.resultado
+
+    def _resultado_de_ronda(self, ronda: int) -> Optional[ResultadoSorteo]:
+        with self._cond_sorteo:
+            estado = self._rondas.get(ronda)
+            if estado is None:
+                ultima = self._ultima_ronda()
+                if ronda < self._menor_ronda_abierta or (ultima is not None and ronda > ultima):
+                    raise RondaNoDisponible(ronda)
+                # La ronda todavía no recibió apuestas
+                return None
+            return estado.resultado
@@ -0,0 +1,125 @@
+import concurrent.futures
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+
+@dataclass
+class _SecuenciasAgencia:
+    # Todas las secuencias <= acumulada ya están almacenadas (las secuencias empiezan en 1)
+    acumulada: int = 0
+    # Cantidad de apuestas de las secuencias <= acumulada
+    apuestas_acumuladas: int = 0
+    # Secuencias mayores a acumulada ya almacenadas, que llegaron fuera de orden, con su cantidad de apuestas
+    almacenadas: Dict[int, int] = field(default_factory=dict)
+    # Secuencias cuyo batch se está almacenando, con el Future que se resuelve al terminar y su cantidad de apuestas
+    en_curso: Dict[int, Tuple[concurrent.futures.Future, int]] = field(default_factory=dict)
+
+    def avanzar_acumulada(self):
+        while self.acumulada + 1 in self.almacenadas:
+            self.acumulada += 1
+            self.apuestas_acumuladas += self.almacenadas.pop(self.acumulada)
+
+
+class RegistroSecuencias:
+    """
+    Numeros de secuencia de los batches almacenados, por agencia.
+
+    Permite descartar un batch que ya se almacenó (o se está almacenando)
+    cuando el cliente lo reenvía, p. ej. despues de reconectarse sin haber
+    recibido su confirmacion, y responder hasta donde llegó cada agencia.
+    Se mantiene en memoria mientras viva el servidor, y con checkpoint se
+    restaura al iniciar.
+
+    al_almacenar(agencia, secuencia, apuestas), si se pasa, se llama sin el
+    lock tomado con cada secuencia almacenada, antes de resolver su Future.
+    """
+
+    def __init__(self, al_almacenar: Optional[Callable[[int, int, int], None]] = None):
+        self._por_agencia: Dict[int, _SecuenciasAgencia] = {}
+        self._lock = threading.Lock()
+        self._al_almacenar = al_almacenar
+
+    def reservar(self, agencia: int, secuencia: int, apuestas: int = 0) -> Tuple[concurrent.futures.Future, bool]:
+        """
+        Devuelve (futuro, duplicado). Si la secuencia es nueva, queda en curso y
+        quien la reservó debe almacenar el batch y llamar a completar(). Si es
+        un duplicado, el Future es el del batch original.
+        """
+        with self._lock:
+            estado = self._por_agencia.setdefault(agencia, _SecuenciasAgencia())
+            if secuencia <= estado.acumulada or secuencia in estado.almacenadas:
+                futuro = concurrent.futures.Future()
+                futuro.set_result(None)
+                return futuro, True
+            if secuencia in estado.en_curso:
+                return estado.en_curso[secuencia][0], True
+            futuro = concurrent.futures.Future()
+            estado.en_curso[secuencia] = (futuro, apuestas)
+            return futuro, False
+
+    def reservar_siguiente(self, agencia: int, apuestas: int) -> Tuple[int, concurrent.futures.Future]:
+        """
+        Reserva la secuencia siguiente a todas las conocidas de la agencia, para
+        un batch enviado sin secuencia. Devuelve (secuencia, futuro).
+        """
+        with self._lock:
+            estado = self._por_agencia.setdefault(agencia, _SecuenciasAgencia())
+            secuencia = max((estado.acumulada, *estado.almacenadas, *estado.en_curso)) + 1
+            futuro = concurrent.futures.Future()
+            estado.en_curso[secuencia] = (futuro, apuestas)
+            return secuencia, futuro
+
+    def completar(self, agencia: int, secuencia: int, error: Optional[BaseException] = None):
+        """
+        Marca como terminado el almacenamiento de una secuencia reservada. Si
+        falló, la secuencia se libera para que un reenvio la vuelva a almacenar.
+        """
+        with self._lock:
+            estado = self._por_agencia[agencia]
+            futuro, apuestas = estado.en_curso.pop(secuencia)
+            if error is None:
+                estado.almacenadas[secuencia] = apuestas
+                estado.avanzar_acumulada()
+        if error is None:
+            if self._al_almacenar is not None:
+                self._al_almacenar(agencia, secuencia, apuestas)
+            futuro.set_result(None)
+        else:
+            futuro.set_exception(error)
+
+    def restaurar(self, agencia: int, almacenadas: Mapping[int, int]):
+        """Registra como ya almacenadas las secuencias recuperadas de un checkpoint, con su cantidad de apuestas."""
+        with self._lock:
+            estado = self._por_agencia.setdefault(agencia, _SecuenciasAgencia())
+            estado.almacenadas.update((secuencia, apuestas) for secuencia, apuestas in almacenadas.items() if secuencia > estado.acumulada)
+            estado.avanzar_acumulada()
+
+    def fusionar(self, agencia: int, acumulada: int, apuestas: int, almacenadas: Mapping[int, int]):
+        """Incorpora el progreso de la agencia registrado en otro lado (p. ej. en otro worker), como lo devuelve exportar()."""
+        with self._lock:
+            estado = self._por_agencia.setdefault(agencia, _SecuenciasAgencia())
+            if acumulada > estado.acumulada:
+                estado.acumulada = acumulada
+                estado.apuestas_acumuladas = apuestas
+                estado.almacenadas = {secuencia: cantidad for secuencia, cantidad in estado.almacenadas.items() if secuencia > acumulada}
+            estado.almacenadas.update((secuencia, cantidad) for secuencia, cantidad in almacenadas.items() if secuencia > estado.acumulada)
+            estado.avanzar_acumulada()
+
+    def exportar(self, agencia: int) -> Tuple[int, int, Dict[int, int]]:
+        """Devuelve (acumulada, apuestas, almacenadas): todo lo almacenado de la agencia, para fusionarlo en otro registro."""
+        with self._lock:
+            estado = self._por_agencia.get(agencia)
+            return (estado.acumulada, estado.apuestas_acumuladas, dict(estado.almacenadas)) if estado else (0, 0, {})
+
+    def acumulada(self, agencia: int) -> int:
+        """Mayor secuencia tal que esa y todas las anteriores de la agencia ya están almacenadas."""
+        with self._lock:
+            estado = self._por_agencia.get(agencia)
+            return estado.acumulada if estado else 0
+
+    def progreso(self, agencia: int) -> Tuple[int, int]:
+        """Devuelve (acumulada, apuestas): la secuencia acumulada y la cantidad de apuestas de esos batches."""
+        with self._lock:
+            estado = self._por_agencia.get(agencia)
+            return (estado.acumulada, estado.apuestas_acumuladas) if estado else (0, 0)
@@ -1,45 +1,134 @@
 import threading            
             
+import os
 import socket
 import logging
 import signal
-from common.client_handler import ClientHandler
-from typing import Callable, Dict, List, Optional
-
-from common.communication import Communication, EnvioBatchMessage, Message, MessageType, SolicitudGanadoresMessage
-from common.utils import has_won, load_bets, store_bets, Bet
-import traceback
-import copy
+import time
+import concurrent.futures
+from common.pool_handlers import LimitesConexiones, PoolHandlers
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, Optional, Sequence, Tuple
+
+from common import checkpoint, metricas, perfilador
+from common.bet_log import CSV_STORAGE, StorageFormat
+from common.bet_writer import FSYNC_BATCH, BetWriter
+from common.consultas import IndiceApuestas, ruta_indice
+from common.control_flujo import ControlFlujo, LimitesPendientes
+from common.secuencias import RegistroSecuencias
+from common.communication import Communication, EnvioBatchMessage, Message, MessageType, RondaNoDisponible, SolicitudGanadoresMessage
+from common.utils import Bet
+from common.winners import IndiceGanadores, ResultadoSorteo
 from typing import Generic, TypeVar
 
+# Espera maxima de una SUSCRIPCION_GANADORES, aunque el cliente pida más
+MAX_ESPERA_GANADORES_MS = 30000
+
+
+def completar_al_escribir(secuencias: RegistroSecuencias, indices: Sequence, agencia: int, secuencia: int, bets: Sequence[Bet], encolado: float) -> Callable[[concurrent.futures.Future], None]:
+    """
+    Devuelve el done-callback de la escritura de un batch pipelined: agrega el
+    batch a los indices, registra las metricas y completa su secuencia. La
+    secuencia se completa siempre, con el error de la escritura o del indexado,
+    para que el handler que espera su futuro no quede bloqueado.
+    """
+    def al_escribir(escritura: concurrent.futures.Future):
+        error = escritura.exception()
+        try:
+            if error is None:
+                for indice in indices:
+                    indice.agregar(bets)
+                metricas.ALMACENAMIENTO.observar(time.perf_counter() - encolado)
+                metricas.APUESTAS_ALMACENADAS.inc(len(bets), (agencia,))
+        except Exception as e:
+            logging.error(f"action: indexar_apuestas | result: fail | agencia: {agencia} | secuencia: {secuencia} | error: {e}")
+            error = e
+        finally:
+            secuencias.completar(agencia, secuencia, error)
+
+    return al_escribir
+
+
 class Server:
-    def __init__(self, port, listen_backlog, client_amount):
+    def __init__(self, port, listen_backlog, client_amount, fsync_policy=FSYNC_BATCH, fsync_interval_ms=10, storage_format: StorageFormat = CSV_STORAGE, max_espera_ganadores_ms: int = MAX_ESPERA_GANADORES_MS, checkpoint: bool = False, limites: Optional[LimitesConexiones] = None, procesos_escaneo: int = 0, indice_apuestas: bool = False, pendientes: Optional[LimitesPendientes] = None):
         # Initialize server socket
-        self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._server_socket.bind(('', port))
-        self._server_socket.listen(listen_backlog)
+        self._server_socket = self._crear_socket_servidor(port, listen_backlog)
 
         self._current_client_communication = None
         self._stopped = False
 
-        self._client_handlers: List[ClientHandler] = []  # lista de ClientHandler activos
-
-        self._lock_store_bets = threading.Lock()
+        # Pool acotado de threads que atienden las conexiones, con su control de admision
+        self._limites = limites or LimitesConexiones()
+        self._pool_handlers = PoolHandlers(
+            self,
+            self._limites.handlers or client_amount,
+            self._limites.cola if self._limites.cola is not None else client_amount,
+            self._limites,
+        )
+        self._conexiones_por_agencia: Dict[int, int] = {}
+        # Conexiones admitidas por el pool que no fueron rechazadas, protegidas por _cond_sorteo
+        self._conexiones_admitidas = 0
+        self._lock_conexiones = threading.Lock()
 
         self._agencias_totales = client_amount
-        self._agencias_que_completaron_envio: ThreadSafeValue[set[int]] = ThreadSafeValue(set())
-        self._sorteo_realizado: ThreadSafeValue[bool] = ThreadSafeValue(False)
-        self._dnis_ganadores_por_agencia: ThreadSafeValue[Dict[int, list[int]]] = ThreadSafeValue(dict())  
+        self._agencias_que_completaron_envio: SnapshotValue[FrozenSet[int]] = SnapshotValue(frozenset())
+        self._sorteo_realizado: SnapshotValue[bool] = SnapshotValue(False)
+        self._resultado_sorteo: SnapshotValue[ResultadoSorteo] = SnapshotValue(ResultadoSorteo(MappingProxyType({})))
+
+        self._storage_format = storage_format
+        self._fsync_policy = fsync_policy
+        self._fsync_interval_ms = fsync_interval_ms
+        self._checkpoint = checkpoint
+        # Procesos para recorrer el archivo de apuestas al reconstruir el indice, 0 para uno por CPU
+        self._procesos_escaneo = procesos_escaneo
+        # Indice para las consultas de los operadores (ADMIN_PORT), None si no está habilitado
+        self._con_indice_apuestas = indice_apuestas
+        self.indice_apuestas: Optional[IndiceApuestas] = None
+        # Bytes y apuestas encolados sin almacenar: por encima de las marcas altas se deja de leer
+        self.control_flujo = ControlFlujo(pendientes)
+        self._iniciar_almacenamiento()
 
         self._cond_sorteo = threading.Condition()
+        self._max_espera_ganadores_ms = max_espera_ganadores_ms
 
         signal.signal(signal.SIGTERM, self.__stop_server)
 
+    def _iniciar_almacenamiento(self):
+        # Secuencias de los batches ya almacenados, para descartar reenvios e informar el progreso de cada agencia
+        self._secuencias = RegistroSecuencias()
+        if self._checkpoint:
+            # Antes de abrir el writer, porque puede truncar el archivo de apuestas
+            self.__recuperar_checkpoint()
+
+        # Ganadores por agencia, actualizados a medida que se almacenan las apuestas. Se
+        # reconstruye antes de iniciar el writer, para que el escaneo no forkee con él corriendo
+        self._indice_ganadores = IndiceGanadores()
+        self.__recuperar_indice_ganadores()
+        if self._con_indice_apuestas:
+            self.indice_apuestas = self.__recuperar_indice_apuestas()
+
+        # Unico escritor del archivo de apuestas, compartido por todos los handlers
+        self._bet_writer = BetWriter(fsync_policy=self._fsync_policy, fsync_interval_ms=self._fsync_interval_ms, storage_format=self._storage_format, checkpoint=self._checkpoint, control_flujo=self.control_flujo)
+        self._bet_writer.start()
+
+    def _crear_socket_servidor(self, port, listen_backlog) -> socket.socket:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind(('', port))
+        server_socket.listen(listen_backlog)
+        return server_socket
+
     def __stop_server(self, signum, frame):
         # Parar loop
         logging.info("action: stop_server | result: in_progress")
         self._stopped = True
 
+        # Despertar el thread principal si está esperando el sorteo, y a los
+        # handlers que esperan el sorteo para responder una suscripcion
+        with self._cond_sorteo:
+            self._cond_sorteo.notify_all()
+        # Y a los que esperan que baje lo pendiente de almacenar para volver a leer
+        self.control_flujo.detener()
+
         # Cerrar socket servidor
         logging.debug("action: stop_server_socket | result: in_progress")
         if self._server_socket:
@@ -50,80 +139,123 @@ class Server:
 
         # Parar y joinear todos los handlers de clientes
         logging.debug("action: stop_client_handlers | result: in_progress")
-        for handler in self._client_handlers:
-            handler.stop()
-        for handler in self._client_handlers:
-            handler.join()
-        self._client_handlers.clear()
+        self._pool_handlers.detener()
         logging.debug("action: stop_client_handlers | result: success")
 
-        # Despertar el thread principal si está esperando el sorteo
-        with self._cond_sorteo:
-            self._cond_sorteo.notify_all()
-
     def run(self):
         """
-        Server loop con multithreading: cada conexión se atiende en un thread.
-        El thread principal guarda los handlers de clientes para cierre ordenado.
+        Server loop con multithreading: cada conexión se atiende en un thread
+        del pool de handlers, que el thread principal cierra ordenadamente.
         """
-        clientes_atendidos = 0
-
-        while not self._stopped and clientes_atendidos < self._agencias_totales:
-            try:
-                client_socket = self.__accept_new_connection()
-
-                clientes_atendidos += 1
-                handler = ClientHandler(client_socket, self)
-                handler.start()
-                self._client_handlers.append(handler)
-
-            except OSError:
-                self._stopped = True
+        while not self._stopped:
+            self.__aceptar_conexiones()
+            # Espera bloqueante hasta que se pueda realizar el sorteo o se reciba SIGTERM. Si se
+            # rechaza una conexion ya admitida (p. ej. por el limite de su agencia), vuelve a aceptar
+            if self._stopped or self.__monitor_esperar_hasta_poder_realizar_sorteo():
                 break
 
-        # Espera bloqueante hasta que se pueda realizar el sorteo o se reciba SIGTERM
-        if not self._stopped:
-            self.__monitor_esperar_hasta_poder_realizar_sorteo()
-
         if not self._stopped:
             logging.info("action: realizar_sorteo | result: in_progress")
-            self._realizar_sorteo()
-            self._sorteo_realizado.set(True)
+            inicio_sorteo = time.perf_counter()
+            with perfilador.fase("sorteo"):
+                self._realizar_sorteo()
+            metricas.SORTEO.observar(time.perf_counter() - inicio_sorteo)
+            # Los handlers con una suscripcion pendiente responden apenas se publica el resultado
+            with self._cond_sorteo:
+                self._sorteo_realizado.set(True)
+                self._cond_sorteo.notify_all()
             logging.info("action: realizar_sorteo | result: success")
         else:
             self.__stop_server(None, None)
 
-        # Al salir, join a todos los handlers restantes
-        for handler in self._client_handlers:
-            handler.join()
+        # Al salir, esperar a que se cierren las conexiones restantes
+        self._pool_handlers.cerrar()
+        self._cerrar_almacenamiento()
         logging.info("action: stop_server | result: success")
 
+    def _cerrar_almacenamiento(self):
+        """Cierra el BetWriter y guarda el indice de las consultas, para cargarlo al volver a iniciar."""
+        self._bet_writer.cerrar()
+        if self.indice_apuestas is not None:
+            filepath = self._storage_format.filepath
+            self.indice_apuestas.guardar(ruta_indice(filepath), os.path.getsize(filepath))
+
+
+    def __aceptar_conexiones(self):
+        """Acepta conexiones hasta haber admitido una por agencia."""
+        while not self._stopped and self._conexiones_admitidas < self._agencias_totales:
+            try:
+                client_socket = self.__accept_new_connection()
+            except OSError:
+                self._stopped = True
+                break
+            # Una conexion rechazada no cuenta como agencia atendida
+            if self._pool_handlers.admitir(client_socket):
+                with self._cond_sorteo:
+                    self._conexiones_admitidas += 1
 
-    def __monitor_esperar_hasta_poder_realizar_sorteo(self):
+    def __monitor_esperar_hasta_poder_realizar_sorteo(self) -> bool:
         """
-        Monitor que bloquea hasta que se pueda realizar el sorteo o se reciba SIGTERM.
+        Monitor que bloquea hasta que se pueda realizar el sorteo, se reciba
+        SIGTERM, o se rechace una conexion que ya se habia admitido. Devuelve
+        si se puede realizar el sorteo.
         """
         with self._cond_sorteo:
-            while not self._stopped and (self._sorteo_realizado.get() or len(self._agencias_que_completaron_envio.get()) < self._agencias_totales):
+            while not self._stopped and self._conexiones_admitidas >= self._agencias_totales and not self.__puede_realizar_sorteo():
                 self._cond_sorteo.wait()
+            return not self._stopped and self.__puede_realizar_sorteo()
 
-    def _realizar_sorteo(self):
-        # No necesito hacer load bets thread safe, porque esta funcion se llama unicamente cuando ya todos los clientes enviaron sus apuestas.
-        # Y ningun ClientHandler va a poder almacenar niguna apuesta extra, por lo que no es necesario protegerlo.
-        bets: List[Bet] = load_bets()
-        bets_ganadores = filter(has_won, bets)
+    def __puede_realizar_sorteo(self) -> bool:
+        return not self._sorteo_realizado.get() and len(self._agencias_que_completaron_envio.get()) >= self._agencias_totales
 
-        dnis_ganadores_por_agencia: Dict[int, List[int]] = dict()
-        
-        for bet in bets_ganadores:
-            agencia = bet.agency
-            dni = bet.document
+    def _realizar_sorteo(self):
+        # El indice de ganadores ya está completo: ningun ClientHandler puede almacenar apuestas
+        # extra una vez que todas las agencias completaron su envio. Solo publico un snapshot,
+        # con las respuestas de cada agencia ya serializadas.
+        self._resultado_sorteo.set(ResultadoSorteo(self._indice_ganadores.ganadores_por_agencia()))
 
-            if agencia not in dnis_ganadores_por_agencia:
-                dnis_ganadores_por_agencia[agencia] = []
-            dnis_ganadores_por_agencia[agencia].append(int(dni))
+    def __recuperar_indice_ganadores(self):
+        """
+        Si ya hay apuestas almacenadas (p. ej. el servidor se reinició), reconstruye
+        el indice de ganadores a partir de ellas, para que el sorteo las tenga en cuenta.
+        """
+        if not os.path.exists(self._storage_format.filepath):
+            return
+        logging.info("action: recuperar_indice_ganadores | result: in_progress")
+        cantidad = self._indice_ganadores.reconstruir_desde_archivo(self._storage_format, self._procesos_escaneo)
+        logging.info(f"action: recuperar_indice_ganadores | result: success | apuestas: {cantidad}")
 
-        self._dnis_ganadores_por_agencia.set(dnis_ganadores_por_agencia)
+    def __recuperar_indice_apuestas(self) -> IndiceApuestas:
+        """
+        Carga el indice de las consultas guardado al detenerse, si corresponde
+        al archivo de apuestas actual; si no, lo reconstruye recorriendo el archivo.
+        """
+        filepath = self._storage_format.filepath
+        tamanio = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        indice = IndiceApuestas.cargar(ruta_indice(filepath), tamanio)
+        if indice is not None:
+            logging.info(f"action: recuperar_indice_apuestas | result: success | origen: {ruta_indice(filepath)}")
+            return indice
+        indice = IndiceApuestas()
+        if tamanio:
+            logging.info("action: recuperar_indice_apuestas | result: in_progress")
+            cantidad = indice.agregar_registros(self._storage_format.scan_bets(filepath))
+            logging.info(f"action: recuperar_indice_apuestas | result: success | apuestas: {cantidad}")
+        return indice
+
+    def __recuperar_checkpoint(self):
+        """
+        Restaura las secuencias almacenadas y las agencias que completaron su
+        envio antes de que el servidor se detuviera, para que los reenvios se
+        descarten y los clientes retomen desde su ultimo batch confirmado.
+        """
+        estado = checkpoint.recuperar(self._storage_format.filepath)
+        if estado is None:
+            return
+        for agencia, secuencias in estado.secuencias.items():
+            self._secuencias.restaurar(agencia, secuencias)
+        self._agencias_que_completaron_envio.set(frozenset(estado.completadas))
+        logging.info(f"action: recuperar_checkpoint | result: success | agencias: {len(estado.secuencias)} | completadas: {len(estado.completadas)}")
 
     def __accept_new_connection(self) -> socket.socket:
         """
@@ -136,42 +268,183 @@ class Server:
         logging.info(f'action: accept_connections | result: success | ip: {addr[0]}')
         return sock
 
+    def registrar_conexion_de_agencia(self, agencia: int) -> bool:
+        """Cuenta una conexion más de la agencia, salvo que ya tenga el maximo de conexiones simultaneas."""
+        with self._lock_conexiones:
+            conexiones = self._conexiones_por_agencia.get(agencia, 0)
+            admitida = not self._limites.por_agencia or conexiones < self._limites.por_agencia
+            if admitida:
+                self._conexiones_por_agencia[agencia] = conexiones + 1
+        if not admitida:
+            # La conexion no cuenta como agencia atendida: el servidor vuelve a aceptar otra
+            with self._cond_sorteo:
+                self._conexiones_admitidas -= 1
+                self._cond_sorteo.notify_all()
+        return admitida
+
+    def liberar_conexion_de_agencia(self, agencia: int):
+        with self._lock_conexiones:
+            conexiones = self._conexiones_por_agencia.pop(agencia) - 1
+            if conexiones:
+                self._conexiones_por_agencia[agencia] = conexiones
+
+    def acepta_apuestas_de(self, agencia: int) -> bool:
+        # Si ya completó envio, o el servidor ya hizo el sorteo, no debería enviarme más apuestas
+        return not (self.agencia_completo_envio(agencia) or self.sorteo_fue_realizado())
+
+    def admite_bets(self, bets: Sequence[Bet]) -> bool:
+        """
+        Si el formato de almacenamiento puede guardar el batch. Uno que no
+        (p. ej. un nombre de más de 255 bytes en el log binario) se rechaza
+        antes de encolarlo, en vez de fallar en el BetWriter.
+        """
+        return self._storage_format.admite_bets(bets)
+
     def agencia_completo_envio(self, agencia: int) -> bool:
         agencias_que_completaron_envio_value = self._agencias_que_completaron_envio.get()
         return agencia in agencias_que_completaron_envio_value
     
     def marcar_agencia_completada(self, agencia: int):
+        futuro = self.persistir_agencia_completada(agencia)
+        if futuro is not None:
+            futuro.result()
+        self._publicar_agencia_completada(agencia)
+
+    def persistir_agencia_completada(self, agencia: int, bloquear: bool = True) -> Optional[concurrent.futures.Future]:
+        """
+        Con checkpoint, encola el registro de que la agencia completó su envio,
+        y devuelve el Future que se resuelve cuando es durable. Sin checkpoint
+        no hay nada que persistir y devuelve None.
+        """
+        if not self._checkpoint:
+            return None
+        return self._bet_writer.encolar((), bloquear=bloquear, progreso=checkpoint.progreso_completada(agencia))
+
+    def _publicar_agencia_completada(self, agencia: int):
         with self._cond_sorteo:
-            self._agencias_que_completaron_envio.update(lambda s: s.union({agencia}))
+            self._agencias_que_completaron_envio.update(lambda s: s | {agencia})
             self._cond_sorteo.notify_all()
 
-    def almacenar_bets(self, bets: List[Bet]):
-        # Varios threads podrían intentar llamar store_bets al mismo tiempo, así que lo protejo.
-        with self._lock_store_bets:
-            store_bets(bets)
+    def almacenar_bets(self, bets: Sequence[Bet], tamanio: int = 0):
+        # Varios threads almacenan al mismo tiempo, pero el unico que escribe el archivo es el BetWriter.
+        # Espero a que el batch sea durable antes de devolver, para que recien ahí se confirme al cliente.
+        secuencia, futuro = self.reservar_siguiente_secuencia(bets)
+        self.almacenar_bets_secuenciadas(bets[0].agency, secuencia, bets, tamanio=tamanio)
+        futuro.result()
+
+    def reservar_siguiente_secuencia(self, bets: Sequence[Bet]) -> Tuple[int, concurrent.futures.Future]:
+        """
+        Un ENVIO_BATCH sin secuencia es el siguiente batch de su agencia, porque
+        el cliente espera cada confirmacion antes de enviar otro. Se le reserva
+        la secuencia siguiente, para que cuente en el progreso de la agencia.
+        Todas las apuestas de un batch son de la misma agencia.
+        """
+        return self._secuencias.reservar_siguiente(bets[0].agency, len(bets))
+
+    def reservar_secuencia(self, agencia: int, secuencia: int, apuestas: int = 0) -> Tuple[concurrent.futures.Future, bool]:
+        """
+        Reserva la secuencia de un batch pipelined. Devuelve (futuro, duplicado):
+        si es un duplicado no hay que almacenarlo, solo confirmarlo cuando se
+        resuelva el futuro; si no, hay que llamar a almacenar_bets_secuenciadas.
+        """
+        return self._secuencias.reservar(agencia, secuencia, apuestas)
+
+    def almacenar_bets_secuenciadas(self, agencia: int, secuencia: int, bets: Sequence[Bet], bloquear: bool = True, tamanio: int = 0):
+        """
+        Encola un batch pipelined sin esperar a que sea durable: el futuro de
+        reservar_secuencia se resuelve cuando ya está escrito e indexado. Si
+        bloquear es False y la cola del BetWriter está llena, eleva queue.Full
+        sin modificar la reserva. tamanio son los bytes del mensaje recibido.
+        """
+        progreso = checkpoint.progreso_batch(agencia, secuencia, len(bets)) if self._checkpoint else None
+        encolado = time.perf_counter()
+        escritura = self._bet_writer.encolar(bets, bloquear=bloquear, progreso=progreso, tamanio=tamanio)
+        indices = (self._indice_ganadores,) if self.indice_apuestas is None else (self._indice_ganadores, self.indice_apuestas)
+        escritura.add_done_callback(completar_al_escribir(self._secuencias, indices, agencia, secuencia, bets, encolado))
+
+    def secuencia_acumulada(self, agencia: int) -> int:
+        return self._secuencias.acumulada(agencia)
 
-    def sorteo_fue_realizado(self) -> bool:
+    def progreso_agencia(self, agencia: int) -> Tuple[int, int, bool]:
+        """
+        Devuelve (acumulada, apuestas, completada): hasta qué batch ya está
+        almacenado el envio de la agencia, cuantas apuestas suman esos batches,
+        y si ya lo completó. Un cliente que se reconecta retoma desde ahí.
+        """
+        acumulada, apuestas = self._secuencias.progreso(agencia)
+        return acumulada, apuestas, self.agencia_completo_envio(agencia)
+
+    def sorteo_fue_realizado(self, agencia: Optional[int] = None) -> bool:
+        """
+        Si ya se realizó el sorteo cuyos ganadores se le responden a la agencia.
+        Este servidor realiza un unico sorteo, así que la agencia no cambia nada.
+        """
         return self._sorteo_realizado.get()
 
-    def obtener_ganadores_de_agencia(self, agencia: int) -> List[int]:
-        dnis_ganadores_por_agencia = self._dnis_ganadores_por_agencia.get()
-        return dnis_ganadores_por_agencia.get(agencia, [])
+    def esperar_sorteo(self, agencia: int, espera_ms: int) -> bool:
+        """
+        Bloquea hasta que se realice el sorteo de la agencia, se detenga el
+        servidor o pasen espera_ms (acotado por max_espera_ganadores_ms).
+        Devuelve si el sorteo fue realizado.
+        """
+        if self.sorteo_fue_realizado(agencia):
+            return True
+        espera = min(espera_ms, self._max_espera_ganadores_ms) / 1000
+        with self._cond_sorteo:
+            self._cond_sorteo.wait_for(lambda: self._stopped or self.sorteo_fue_realizado(agencia), timeout=espera)
+        return self.sorteo_fue_realizado(agencia)
 
+    def _resultado_consultado(self, agencia: int) -> ResultadoSorteo:
+        """Resultado del sorteo cuyos ganadores se le responden a la agencia."""
+        return self._resultado_sorteo.get()
 
-# Clase genérica para encapsular un valor y su lock
+    def _resultado_de_ronda(self, ronda: int) -> Optional[ResultadoSorteo]:
+        """
+        Resultado de una ronda, o None si esa ronda todavía no se sorteó. Este
+        servidor realiza una unica ronda, la 1: cualquier otra eleva RondaNoDisponible.
+        """
+        if ronda != 1:
+            raise RondaNoDisponible(ronda)
+        if not self.sorteo_fue_realizado():
+            return None
+        return self._resultado_sorteo.get()
+
+    def obtener_ganadores_de_agencia(self, agencia: int) -> Sequence[int]:
+        return self._resultado_consultado(agencia).ganadores(agencia)
+
+    def obtener_respuesta_ganadores(self, agencia: int) -> bytes:
+        """Como obtener_ganadores_de_agencia, pero el frame RESPUESTA_GANADORES ya serializado."""
+        return self._resultado_consultado(agencia).respuesta(agencia)
+
+    def obtener_ganadores_de_ronda(self, agencia: int, ronda: int) -> Optional[Sequence[int]]:
+        """Ganadores de la agencia en una ronda, o None si esa ronda todavía no se sorteó."""
+        resultado = self._resultado_de_ronda(ronda)
+        return resultado.ganadores(agencia) if resultado is not None else None
+
+    def obtener_respuesta_ganadores_de_ronda(self, agencia: int, ronda: int) -> Optional[bytes]:
+        resultado = self._resultado_de_ronda(ronda)
+        return resultado.respuesta(agencia) if resultado is not None else None
+
+
+# Clase genérica para encapsular un valor compartido entre threads
 T = TypeVar('T')
 
-# Clase para proteger valores con locks, y que no acceda accidentalmente al valor de manera no protegida
-class ThreadSafeValue(Generic[T]):
+# Valor compartido publicado como snapshot inmutable (frozenset, tuple, MappingProxyType, etc.).
+# Como el valor publicado nunca se modifica, los lectores usan la referencia actual directamente,
+# sin lock ni copia: leer un atributo es atomico, asi que siempre ven un snapshot completo.
+# Los escritores publican un valor nuevo reemplazando la referencia; el lock solo los ordena
+# entre sí, para que update no pierda una actualizacion concurrente.
+class SnapshotValue(Generic[T]):
+    __slots__ = ('_value', '_lock_escritura')
+
     def __init__(self, value: T):
         self._value: T = value
-        self._lock = threading.Lock()
+        self._lock_escritura = threading.Lock()
     def get(self) -> T:
-        with self._lock:
-            return copy.deepcopy(self._value)
+        return self._value
     def set(self, value: T):
-        with self._lock:
+        with self._lock_escritura:
             self._value = value
     def update(self, func: 'Callable[[T], T]'):
-        with self._lock:
-            self._value = func(self._value)
\ No newline at end of file
+        with self._lock_escritura:
+            self._value = func(self._value)
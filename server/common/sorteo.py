@@ -0,0 +1,115 @@
+"""
+Evaluacion del sorteo sobre todas las apuestas almacenadas, en columnas.
+
+Las apuestas se cargan como columnas paralelas (agencia, documento, numero)
+y los ganadores se calculan con una unica pasada vectorizada sobre la columna
+de numeros, en vez de evaluar has_won() apuesta por apuesta.
+
+Si NumPy está instalado se usa una mascara de ganadores y un ordenamiento
+estable por agencia. Si no, la columna de numeros se recorre como bytes
+buscando el numero ganador con bytes.find, que tambien corre en C.
+"""
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common.utils import LOTTERY_WINNER_NUMBER
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# DNIs ganadores por agencia, en el orden en que se almacenaron las apuestas
+GanadoresPorAgencia = Dict[int, Tuple[int, ...]]
+
+_TAMANIO_ITEM = array('I').itemsize
+
+
+class ColumnasApuestas:
+    """Columnas array('I') paralelas con la agencia, el documento y el numero de cada apuesta."""
+
+    __slots__ = ('agencias', 'documentos', 'numeros')
+
+    def __init__(self):
+        self.agencias = array('I')
+        self.documentos = array('I')
+        self.numeros = array('I')
+
+    @classmethod
+    def desde_registros(cls, registros: Iterable[Tuple[int, int, int]]) -> 'ColumnasApuestas':
+        """Arma las columnas a partir de tuplas (agencia, documento, numero), p. ej. StorageFormat.scan_bets()."""
+        columnas = cls()
+        agregar_agencia = columnas.agencias.append
+        agregar_documento = columnas.documentos.append
+        agregar_numero = columnas.numeros.append
+        for agencia, documento, numero in registros:
+            agregar_agencia(agencia)
+            agregar_documento(documento)
+            agregar_numero(numero)
+        return columnas
+
+    def __len__(self) -> int:
+        return len(self.numeros)
+
+
+def evaluar_sorteo(columnas: ColumnasApuestas, numeros_ganadores: Sequence[int] = (LOTTERY_WINNER_NUMBER,), usar_numpy: Optional[bool] = None) -> GanadoresPorAgencia:
+    """
+    Devuelve los DNIs ganadores por agencia. Por defecto usa NumPy si está
+    disponible; usar_numpy permite forzar uno u otro camino.
+    """
+    if usar_numpy is None:
+        usar_numpy = numpy is not None
+    if usar_numpy:
+        if numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        return _evaluar_numpy(columnas, numeros_ganadores)
+    return _evaluar_python(columnas, numeros_ganadores)
+
+
+def _evaluar_numpy(columnas: ColumnasApuestas, numeros_ganadores: Sequence[int]) -> GanadoresPorAgencia:
+    # frombuffer no copia: las columnas se comparten con los array('I')
+    numeros = numpy.frombuffer(columnas.numeros, dtype=numpy.uint32)
+    if len(numeros_ganadores) == 1:
+        mascara = numeros == numeros_ganadores[0]
+    else:
+        mascara = numpy.isin(numeros, numpy.asarray(numeros_ganadores, dtype=numpy.uint32))
+
+    agencias = numpy.frombuffer(columnas.agencias, dtype=numpy.uint32)[mascara]
+    documentos = numpy.frombuffer(columnas.documentos, dtype=numpy.uint32)[mascara]
+
+    # El ordenamiento estable conserva el orden de almacenamiento dentro de cada agencia
+    orden = numpy.argsort(agencias, kind='stable')
+    agencias = agencias[orden]
+    documentos = documentos[orden]
+    agencias_con_ganadores, inicios = numpy.unique(agencias, return_index=True)
+    grupos = numpy.split(documentos, inicios[1:])
+    return {int(agencia): tuple(grupo.tolist()) for agencia, grupo in zip(agencias_con_ganadores, grupos)}
+
+
+def _evaluar_python(columnas: ColumnasApuestas, numeros_ganadores: Sequence[int]) -> GanadoresPorAgencia:
+    posiciones: List[int] = []
+    datos = columnas.numeros.tobytes()
+    for numero in set(numeros_ganadores):
+        posiciones.extend(_buscar(datos, numero))
+    if len(numeros_ganadores) > 1:
+        posiciones.sort()
+
+    agencias, documentos = columnas.agencias, columnas.documentos
+    ganadores: Dict[int, List[int]] = {}
+    for posicion in posiciones:
+        ganadores.setdefault(agencias[posicion], []).append(documentos[posicion])
+    return {agencia: tuple(dnis) for agencia, dnis in ganadores.items()}
+
+
+def _buscar(datos: bytes, numero: int) -> Iterable[int]:
+    """Posiciones (en items) de la columna serializada en datos cuyo valor es numero."""
+    patron = numero.to_bytes(_TAMANIO_ITEM, sys.byteorder)
+    inicio = datos.find(patron)
+    while inicio >= 0:
+        # Una coincidencia que no está alineada cruza dos items y no cuenta
+        if inicio % _TAMANIO_ITEM == 0:
+            yield inicio // _TAMANIO_ITEM
+            inicio = datos.find(patron, inicio + _TAMANIO_ITEM)
+        else:
+            inicio = datos.find(patron, inicio + 1)
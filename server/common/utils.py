@@ -1,6 +1,12 @@
 import csv
 import datetime
+import functools
+import io
+import sys
 import time
+from array import array
+from collections.abc import Sequence
+from typing import Iterator, Optional, Tuple
 
 
 """ Bets storage location. """
@@ -11,6 +17,8 @@ LOTTERY_WINNER_NUMBER = 7574
 
 """ A lottery bet registry. """
 class Bet:
+    __slots__ = ('agency', 'first_name', 'last_name', 'document', 'birthdate', 'number')
+
     def __init__(self, agency: int, first_name: str, last_name: str, document: int, birthdate: str, number: int):
         """
         agency must be passed with integer format.
@@ -24,27 +32,130 @@ class Bet:
         self.birthdate = datetime.date.fromisoformat(birthdate)
         self.number = int(number)
 
+""" Validates a 'YYYY-MM-DD' birthdate once per distinct value, and returns it interned. """
+@functools.lru_cache(maxsize=64 * 1024)
+def _interned_birthdate(birthdate: str) -> str:
+    datetime.date.fromisoformat(birthdate)
+    return sys.intern(birthdate)
+
+"""
+Columnar container for the bets of a batch.
+
+Agencies, documents and numbers are stored as parallel array('I') columns,
+and names and birthdates as interned strings, so a batch does not allocate
+one object per bet. Indexing or iterating it builds Bet objects on demand.
+"""
+class BetBatch(Sequence):
+    __slots__ = ('agencies', 'first_names', 'last_names', 'documents', 'birthdates', 'numbers')
+
+    def __init__(self):
+        self.agencies = array('I')
+        self.first_names: list[str] = []
+        self.last_names: list[str] = []
+        self.documents = array('I')
+        self.birthdates: list[str] = []
+        self.numbers = array('I')
+
+    @classmethod
+    def from_bets(cls, bets) -> 'BetBatch':
+        batch = cls()
+        for bet in bets:
+            batch.append(bet.agency, bet.first_name, bet.last_name, int(bet.document), bet.birthdate.isoformat(), bet.number)
+        return batch
+
+    def append(self, agency: int, first_name: str, last_name: str, document: int, birthdate: str, number: int):
+        """
+        document and number must be passed as integers.
+        birthdate must be passed with format: 'YYYY-MM-DD'.
+        """
+        birthdate = _interned_birthdate(birthdate)
+        self.agencies.append(agency)
+        self.first_names.append(sys.intern(first_name))
+        self.last_names.append(sys.intern(last_name))
+        self.documents.append(document)
+        self.birthdates.append(birthdate)
+        self.numbers.append(number)
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __getitem__(self, index: int) -> Bet:
+        if isinstance(index, slice):
+            raise TypeError("BetBatch does not support slicing")
+        return Bet(self.agencies[index], self.first_names[index], self.last_names[index],
+                   str(self.documents[index]), self.birthdates[index], self.numbers[index])
+
+    def __iter__(self) -> Iterator[Bet]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def rows(self) -> Iterator[tuple]:
+        """ Bets as tuples in STORAGE_FILEPATH column order, without building Bet objects. """
+        return zip(self.agencies, self.first_names, self.last_names, self.documents, self.birthdates, self.numbers)
+
+    def winners(self) -> Iterator[Tuple[int, int]]:
+        """
+        (agency, document) of every winning bet. The raw bytes of the numbers column are
+        searched with bytes.find; matches that are not aligned to an item are skipped.
+        """
+        itemsize = self.numbers.itemsize
+        data = self.numbers.tobytes()
+        pattern = LOTTERY_WINNER_NUMBER.to_bytes(itemsize, sys.byteorder)
+        start = data.find(pattern)
+        while start >= 0:
+            if start % itemsize == 0:
+                index = start // itemsize
+                yield self.agencies[index], self.documents[index]
+                start = data.find(pattern, start + itemsize)
+            else:
+                start = data.find(pattern, start + 1)
+
 """ Checks whether a bet won the prize or not. """
 def has_won(bet: Bet) -> bool:
     return bet.number == LOTTERY_WINNER_NUMBER
 
+
+def exception_origin(e: BaseException) -> Tuple[Optional[str], Optional[int]]:
+    """
+    File and line where e was raised. Unlike traceback.extract_tb, it does
+    not read the source of each frame.
+    """
+    tb = e.__traceback__
+    if tb is None:
+        return None, None
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return tb.tb_frame.f_code.co_filename, tb.tb_lineno
+
+"""
+Formats the bets as rows of the STORAGE_FILEPATH file, so that they can be
+written with a single write call.
+"""
+def format_bets(bets: Sequence) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_MINIMAL)
+    if isinstance(bets, BetBatch):
+        writer.writerows(bets.rows())
+        return buffer.getvalue()
+    for bet in bets:
+        writer.writerow([bet.agency, bet.first_name, bet.last_name,
+                         bet.document, bet.birthdate, bet.number])
+    return buffer.getvalue()
+
 """
 Persist the information of each bet in the STORAGE_FILEPATH file.
 Not thread-safe/process-safe.
 """
-def store_bets(bets: list[Bet]) -> None:
+def store_bets(bets: Sequence) -> None:
     with open(STORAGE_FILEPATH, 'a+') as file:
-        writer = csv.writer(file, quoting=csv.QUOTE_MINIMAL)
-        for bet in bets:
-            writer.writerow([bet.agency, bet.first_name, bet.last_name,
-                             bet.document, bet.birthdate, bet.number])
+        file.write(format_bets(bets))
 
 """
 Loads the information all the bets in the STORAGE_FILEPATH file.
 Not thread-safe/process-safe.
 """
-def load_bets() -> list[Bet]:
-    with open(STORAGE_FILEPATH, 'r') as file:
+def load_bets(filepath: str = STORAGE_FILEPATH) -> list[Bet]:
+    with open(filepath, 'r') as file:
         reader = csv.reader(file, quoting=csv.QUOTE_MINIMAL)
         for row in reader:
             yield Bet(row[0], row[1], row[2], row[3], row[4], row[5])
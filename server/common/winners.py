@@ -0,0 +1,89 @@
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from common.bet_log import StorageFormat
+from common.communication import serializar_respuesta_ganadores
+from common.escaneo import escanear_ganadores
+from common.sorteo import ColumnasApuestas, evaluar_sorteo
+from common.utils import Bet, BetBatch, has_won
+
+
+class IndiceGanadores:
+    """
+    Indice de DNIs ganadores por agencia, que se mantiene a medida que se
+    almacenan las apuestas. Así el sorteo no necesita releer el archivo de
+    apuestas: solo publica un snapshot del indice.
+    """
+
+    def __init__(self):
+        self._dnis_por_agencia: Dict[int, List[int]] = dict()
+        self._lock = threading.Lock()
+
+    def agregar(self, bets: Sequence[Bet]):
+        # El filtrado se hace fuera del lock, solo el agregado al indice es compartido
+        if isinstance(bets, BetBatch):
+            ganadores = list(bets.winners())
+        else:
+            ganadores = [(bet.agency, int(bet.document)) for bet in bets if has_won(bet)]
+        if not ganadores:
+            return
+        with self._lock:
+            for agencia, dni in ganadores:
+                self._dnis_por_agencia.setdefault(agencia, []).append(dni)
+
+    def reconstruir(self, bets: Iterable[Bet]) -> int:
+        """
+        Reconstruye el indice a partir del log de apuestas, p. ej. load_bets()
+        al iniciar el servidor. Devuelve la cantidad de apuestas recorridas.
+        """
+        return self.reconstruir_desde_registros((bet.agency, int(bet.document), bet.number) for bet in bets)
+
+    def reconstruir_desde_registros(self, registros: Iterable[Tuple[int, int, int]]) -> int:
+        """
+        Igual que reconstruir(), pero a partir de tuplas (agencia, documento,
+        numero), sin construir un Bet por apuesta (ver StorageFormat.scan_bets).
+        Los ganadores se evaluan sobre columnas con common.sorteo.
+        """
+        columnas = ColumnasApuestas.desde_registros(registros)
+        dnis_por_agencia = {agencia: list(dnis) for agencia, dnis in evaluar_sorteo(columnas).items()}
+        with self._lock:
+            self._dnis_por_agencia = dnis_por_agencia
+        return len(columnas)
+
+    def reconstruir_desde_archivo(self, formato: StorageFormat, procesos: int = 0) -> int:
+        """
+        Igual que reconstruir(), pero recorriendo el archivo de formato con
+        common.escaneo, en paralelo con hasta procesos procesos.
+        """
+        cantidad, dnis_por_agencia = escanear_ganadores(formato, procesos)
+        with self._lock:
+            self._dnis_por_agencia = dnis_por_agencia
+        return cantidad
+
+    def ganadores_por_agencia(self) -> Mapping[int, Tuple[int, ...]]:
+        """Snapshot inmutable del indice, que se puede publicar sin copiarlo de nuevo."""
+        with self._lock:
+            return MappingProxyType({agencia: tuple(dnis) for agencia, dnis in self._dnis_por_agencia.items()})
+
+
+class ResultadoSorteo:
+    """
+    Ganadores de un sorteo ya realizado, con el frame RESPUESTA_GANADORES de
+    cada agencia serializado una unica vez al armarlo. Como el resultado no
+    cambia, cada consulta se responde enviando esos bytes tal cual.
+    """
+    __slots__ = ('ganadores_por_agencia', '_respuestas')
+
+    # Frame de las agencias sin ganadores, compartido por todas
+    _RESPUESTA_SIN_GANADORES = serializar_respuesta_ganadores(())
+
+    def __init__(self, ganadores_por_agencia: Mapping[int, Tuple[int, ...]]):
+        self.ganadores_por_agencia = ganadores_por_agencia
+        self._respuestas = {agencia: serializar_respuesta_ganadores(dnis) for agencia, dnis in ganadores_por_agencia.items()}
+
+    def ganadores(self, agencia: int) -> Tuple[int, ...]:
+        return self.ganadores_por_agencia.get(agencia, ())
+
+    def respuesta(self, agencia: int) -> bytes:
+        return self._respuestas.get(agencia, self._RESPUESTA_SIN_GANADORES)
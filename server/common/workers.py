@@ -0,0 +1,323 @@
+"""
+Modo multiproceso del servidor (SERVER_WORKERS=N).
+
+El proceso principal (WorkerPool) no atiende clientes: reserva el puerto y
+forkea N workers. Cada worker abre su propio socket de escucha en ese puerto
+con SO_REUSEPORT, para que el kernel reparta las conexiones entre ellos, y
+escribe las apuestas que recibe en su propio shard (p. ej. ./bets.1.csv).
+
+El coordinador mantiene el estado global por un Pipe con cada worker:
+
+    worker -> coordinador
+        (ESCUCHANDO,)              el worker ya acepta conexiones
+        (CONEXION,)                el worker aceptó una conexion
+        (COMPLETADA, agencia)      una agencia terminó de enviar sus apuestas
+        (GANADORES, ganadores)     ganadores por agencia del shard del worker
+        (ALMACENADA, agencia, secuencia, apuestas)
+                                   un batch de la agencia ya es durable en el shard del worker
+        (CONSULTAR_PROGRESO, agencia)
+                                   un cliente de la agencia se conectó y consulta su progreso
+
+    coordinador -> worker
+        (COMPLETADA, agencia)      otra agencia completó (en cualquier worker)
+        (CERRAR_LISTENER,)         ya se aceptaron CLIENT_AMOUNT conexiones en total
+        (PEDIR_GANADORES,)         todas las agencias completaron: pide el indice del shard
+        (RESULTADO, ganadores)     ganadores globales del sorteo, para responder a las agencias
+        (PROGRESO, agencia, acumulada, apuestas, almacenadas)
+                                   respuesta a cada CONSULTAR_PROGRESO, en el mismo orden
+
+Las secuencias de los batches de cada agencia se registran en el worker que
+los almacena, y además en el coordinador. Un cliente que se reconecta puede
+caer en otro worker: al consultar su progreso, ese worker incorpora lo que
+tiene el coordinador, para responder el progreso global y descartar los
+reenvios de batches almacenados en otro shard.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import threading
+from types import MappingProxyType
+from typing import Dict, List, Optional, Set, Tuple
+
+from common.bet_log import CSV_STORAGE, StorageFormat
+from common.bet_writer import FSYNC_BATCH
+from common.control_flujo import LimitesPendientes
+from common.pool_handlers import LimitesConexiones
+from common.secuencias import RegistroSecuencias
+from common.server import MAX_ESPERA_GANADORES_MS, Server
+from common.winners import ResultadoSorteo
+
+# Mensajes entre el coordinador y los workers
+ESCUCHANDO = "escuchando"
+CONEXION = "conexion"
+COMPLETADA = "completada"
+GANADORES = "ganadores"
+CERRAR_LISTENER = "cerrar_listener"
+PEDIR_GANADORES = "pedir_ganadores"
+RESULTADO = "resultado"
+ALMACENADA = "almacenada"
+CONSULTAR_PROGRESO = "consultar_progreso"
+PROGRESO = "progreso"
+
+
+class WorkerServer(Server):
+    """
+    Server de un worker: atiende con su pool de handlers las conexiones que
+    el kernel le asigna, pero delega en el coordinador el conteo de
+    conexiones, las agencias que completaron y el sorteo.
+    """
+
+    def __init__(self, numero: int, coordinador: multiprocessing.connection.Connection, port, listen_backlog, client_amount, fsync_policy=FSYNC_BATCH, fsync_interval_ms=10, storage_format: StorageFormat = CSV_STORAGE, max_espera_ganadores_ms: int = MAX_ESPERA_GANADORES_MS, limites: Optional[LimitesConexiones] = None, procesos_escaneo: int = 0, pendientes: Optional[LimitesPendientes] = None):
+        super().__init__(port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format.shard(numero), max_espera_ganadores_ms, limites=limites, procesos_escaneo=procesos_escaneo, pendientes=pendientes)
+        self._numero = numero
+        self._coordinador = coordinador
+        # Los handlers y el thread de control envian por el mismo Pipe
+        self._lock_coordinador = threading.Lock()
+        # Consultas de progreso enviadas al coordinador que esperan respuesta, por agencia y en orden
+        self._consultas_progreso: Dict[int, List[concurrent.futures.Future]] = {}
+        self._lock_consultas = threading.Lock()
+        self._listener_cerrado = False
+
+    def _iniciar_almacenamiento(self):
+        super()._iniciar_almacenamiento()
+        # Cada secuencia almacenada en el shard se registra tambien en el coordinador
+        self._secuencias = RegistroSecuencias(al_almacenar=lambda *almacenada: self._enviar_al_coordinador(ALMACENADA, *almacenada))
+
+    def _crear_socket_servidor(self, port, listen_backlog) -> socket.socket:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind(('', port))
+        server_socket.listen(listen_backlog)
+        return server_socket
+
+    def _enviar_al_coordinador(self, *mensaje):
+        with self._lock_coordinador:
+            self._coordinador.send(mensaje)
+
+    def run(self):
+        threading.Thread(target=self._atender_coordinador, name=f"worker-{self._numero}-control", daemon=True).start()
+        self._enviar_al_coordinador(ESCUCHANDO)
+
+        while not self._stopped and not self._listener_cerrado:
+            try:
+                logging.info('action: accept_connections | result: in_progress')
+                client_socket, addr = self._server_socket.accept()
+            except OSError:
+                break
+            logging.info(f'action: accept_connections | result: success | ip: {addr[0]} | worker: {self._numero}')
+            if self._pool_handlers.admitir(client_socket):
+                self._enviar_al_coordinador(CONEXION)
+
+        # El sorteo lo realiza el coordinador: espero su resultado o SIGTERM
+        with self._cond_sorteo:
+            while not self._stopped and not self._sorteo_realizado.get():
+                self._cond_sorteo.wait()
+
+        self._pool_handlers.cerrar()
+        self._cerrar_almacenamiento()
+        logging.info(f"action: stop_worker | result: success | worker: {self._numero}")
+
+    def _atender_coordinador(self):
+        while True:
+            try:
+                mensaje = self._coordinador.recv()
+            except (EOFError, OSError):
+                self._fallar_consultas_progreso()
+                return
+            if mensaje[0] == COMPLETADA:
+                with self._cond_sorteo:
+                    self._agencias_que_completaron_envio.update(lambda s: s | {mensaje[1]})
+            elif mensaje[0] == CERRAR_LISTENER:
+                self._cerrar_listener()
+            elif mensaje[0] == PEDIR_GANADORES:
+                self._enviar_al_coordinador(GANADORES, dict(self._indice_ganadores.ganadores_por_agencia()))
+            elif mensaje[0] == RESULTADO:
+                with self._cond_sorteo:
+                    self._resultado_sorteo.set(ResultadoSorteo(MappingProxyType(mensaje[1])))
+                    self._sorteo_realizado.set(True)
+                    self._cond_sorteo.notify_all()
+            elif mensaje[0] == PROGRESO:
+                with self._lock_consultas:
+                    futuro = self._consultas_progreso[mensaje[1]].pop(0)
+                futuro.set_result(mensaje[2:])
+
+    def _fallar_consultas_progreso(self):
+        with self._lock_consultas:
+            pendientes = [futuro for futuros in self._consultas_progreso.values() for futuro in futuros]
+            self._consultas_progreso.clear()
+        for futuro in pendientes:
+            futuro.set_exception(ConnectionError("the coordinator is gone"))
+
+    def _cerrar_listener(self):
+        self._listener_cerrado = True
+        if self._server_socket:
+            try:
+                self._server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server_socket.close()
+
+    def marcar_agencia_completada(self, agencia: int):
+        super().marcar_agencia_completada(agencia)
+        self._enviar_al_coordinador(COMPLETADA, agencia)
+
+    def progreso_agencia(self, agencia: int) -> Tuple[int, int, bool]:
+        """
+        Antes de responder incorpora las secuencias que la agencia almacenó en
+        otros workers: así el cliente retoma desde el progreso global, y los
+        batches que reenvíe y ya estén en otro shard se descartan como duplicados.
+        """
+        futuro = concurrent.futures.Future()
+        # Se registra y se envia con el lock del Pipe, para que las respuestas lleguen en el orden de la lista
+        with self._lock_coordinador:
+            with self._lock_consultas:
+                self._consultas_progreso.setdefault(agencia, []).append(futuro)
+            self._coordinador.send((CONSULTAR_PROGRESO, agencia))
+        self._secuencias.fusionar(agencia, *futuro.result())
+        return super().progreso_agencia(agencia)
+
+
+def _correr_worker(numero: int, coordinador: multiprocessing.connection.Connection, argumentos: tuple):
+    WorkerServer(numero, coordinador, *argumentos).run()
+
+
+class WorkerPool:
+    """
+    Coordinador del modo multiproceso: forkea los workers y agrega sus
+    conexiones, las agencias que completaron y los ganadores de cada shard,
+    para que el sorteo y las respuestas de ganadores sean globales.
+    """
+
+    def __init__(self, workers: int, port, listen_backlog, client_amount, fsync_policy=FSYNC_BATCH, fsync_interval_ms=10, storage_format: StorageFormat = CSV_STORAGE, max_espera_ganadores_ms: int = MAX_ESPERA_GANADORES_MS, limites: Optional[LimitesConexiones] = None, procesos_escaneo: int = 0, pendientes: Optional[LimitesPendientes] = None):
+        # Reserva el puerto (sin escuchar en él) para que todos los workers usen el
+        # mismo, aunque se pida el puerto 0
+        self._reserva = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._reserva.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._reserva.bind(('', port))
+        self.puerto = self._reserva.getsockname()[1]
+
+        self._cantidad_workers = workers
+        self._argumentos = (self.puerto, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, max_espera_ganadores_ms, limites, procesos_escaneo, pendientes)
+        self._agencias_totales = client_amount
+        self._procesos: List[multiprocessing.Process] = []
+        self._stopped = False
+        # Se setea cuando todos los workers ya aceptan conexiones
+        self.listo = threading.Event()
+
+    def run(self):
+        contexto = multiprocessing.get_context('fork')
+        conexiones: Dict[multiprocessing.connection.Connection, int] = {}
+        for numero in range(1, self._cantidad_workers + 1):
+            extremo_coordinador, extremo_worker = contexto.Pipe()
+            proceso = contexto.Process(target=_correr_worker, args=(numero, extremo_worker, self._argumentos), name=f"worker-{numero}")
+            proceso.start()
+            extremo_worker.close()
+            self._procesos.append(proceso)
+            conexiones[extremo_coordinador] = numero
+
+        signal.signal(signal.SIGTERM, self._detener)
+        logging.info(f"action: iniciar_workers | result: success | workers: {self._cantidad_workers} | port: {self.puerto}")
+        try:
+            self._coordinar(conexiones)
+        finally:
+            for proceso in self._procesos:
+                proceso.join()
+            self._reserva.close()
+        logging.info("action: stop_server | result: success")
+
+    def _detener(self, signum, frame):
+        logging.info("action: stop_server | result: in_progress")
+        self._stopped = True
+        # Cada worker se detiene ordenadamente con su propio handler de SIGTERM
+        for proceso in self._procesos:
+            if proceso.is_alive():
+                proceso.terminate()
+
+    def _coordinar(self, conexiones: Dict[multiprocessing.connection.Connection, int]):
+        abiertas = set(conexiones)
+        escuchando = 0
+        conexiones_aceptadas = 0
+        agencias_completadas: Set[int] = set()
+        # Ganadores de cada shard mientras se realiza el sorteo, por numero de worker
+        ganadores_por_worker: Dict[int, Dict[int, Tuple[int, ...]]] = {}
+        sorteo_iniciado = False
+        sorteo_realizado = False
+        # Secuencias almacenadas en todos los shards, para las consultas de progreso
+        secuencias = RegistroSecuencias()
+
+        while abiertas:
+            consultas: List[Tuple[multiprocessing.connection.Connection, int]] = []
+            for conexion in multiprocessing.connection.wait(list(abiertas)):
+                mensajes, cerrada = _recibir_disponibles(conexion)
+                for mensaje in mensajes:
+                    if mensaje[0] == ESCUCHANDO:
+                        escuchando += 1
+                        if escuchando == self._cantidad_workers:
+                            self.listo.set()
+                    elif mensaje[0] == CONEXION:
+                        conexiones_aceptadas += 1
+                        # Igual que en el motor con threads, solo se aceptan CLIENT_AMOUNT conexiones en total
+                        if conexiones_aceptadas == self._agencias_totales:
+                            self._difundir(abiertas, CERRAR_LISTENER)
+                    elif mensaje[0] == COMPLETADA:
+                        agencias_completadas.add(mensaje[1])
+                        self._difundir(abiertas, COMPLETADA, mensaje[1])
+                        if len(agencias_completadas) == self._agencias_totales and not sorteo_iniciado:
+                            sorteo_iniciado = True
+                            logging.info("action: realizar_sorteo | result: in_progress")
+                            self._difundir(abiertas, PEDIR_GANADORES)
+                    elif mensaje[0] == GANADORES:
+                        ganadores_por_worker[conexiones[conexion]] = mensaje[1]
+                        if len(ganadores_por_worker) == self._cantidad_workers:
+                            self._difundir(abiertas, RESULTADO, _unir_ganadores(ganadores_por_worker))
+                            sorteo_realizado = True
+                            logging.info("action: realizar_sorteo | result: success")
+                    elif mensaje[0] == ALMACENADA:
+                        secuencias.restaurar(mensaje[1], {mensaje[2]: mensaje[3]})
+                    elif mensaje[0] == CONSULTAR_PROGRESO:
+                        consultas.append((conexion, mensaje[1]))
+
+                if cerrada:
+                    abiertas.discard(conexion)
+                    if not sorteo_realizado and not self._stopped:
+                        logging.error(f"action: coordinar_workers | result: fail | error: worker {conexiones[conexion]} terminó antes del sorteo")
+                        self._detener(None, None)
+
+            # Se responden despues de leer todo lo recibido: el ALMACENADA de un batch que otro
+            # worker ya le confirmó al cliente está antes que la consulta que hizo al reconectarse
+            for conexion, agencia in consultas:
+                try:
+                    conexion.send((PROGRESO, agencia, *secuencias.exportar(agencia)))
+                except OSError:
+                    pass
+
+    def _difundir(self, conexiones: Set[multiprocessing.connection.Connection], *mensaje):
+        for conexion in conexiones:
+            try:
+                conexion.send(mensaje)
+            except OSError:
+                pass
+
+
+def _recibir_disponibles(conexion: multiprocessing.connection.Connection) -> Tuple[List[tuple], bool]:
+    """Lee todos los mensajes que ya llegaron por la conexion. Devuelve (mensajes, cerrada)."""
+    mensajes = []
+    try:
+        mensajes.append(conexion.recv())
+        while conexion.poll():
+            mensajes.append(conexion.recv())
+    except (EOFError, OSError):
+        return mensajes, True
+    return mensajes, False
+
+
+def _unir_ganadores(ganadores_por_worker: Dict[int, Dict[int, Tuple[int, ...]]]) -> Dict[int, Tuple[int, ...]]:
+    """Une los ganadores de los shards, en orden de worker, por si una agencia se conectó a más de uno."""
+    unidos: Dict[int, Tuple[int, ...]] = {}
+    for numero in sorted(ganadores_por_worker):
+        for agencia, dnis in ganadores_por_worker[numero].items():
+            unidos[agencia] = unidos.get(agencia, ()) + tuple(dnis)
+    return unidos
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-from configparser import ConfigParser
-from common.server import Server
+import functools
 import logging
 import os
+import signal
+
+# Motores de servidor disponibles: un thread por conexion, o un unico event loop
+SERVER_ENGINES = ("threads", "asyncio")
 
 
 def initialize_config():
@@ -13,20 +16,100 @@ def initialize_config():
     program environment variables first and the in a config file. 
     If at least one of the config parameters is not found a KeyError exception 
     is thrown. If a parameter could not be parsed, a ValueError is thrown. 
-    If parsing succeeded, the function returns a ConfigParser object 
-    with config parameters
+    If parsing succeeded, the function returns a dict with config parameters
     """
-
-    config = ConfigParser(os.environ)
-    # If config.ini does not exists original config object is not modified
-    config.read("config.ini")
+    # Only the modules that define the accepted values and defaults. Each
+    # engine imports the rest of the server once the config is valid.
+    from common.bet_log import STORAGE_FORMATS
+    from common.bet_writer import FSYNC_POLICIES
+    from common.control_flujo import MAX_APUESTAS_PENDIENTES, MAX_BYTES_PENDIENTES
+    from common.perfilador import DURACION_CAPTURA_S, INTERVALO_MUESTREO_S
 
     config_params = {}
     try:
-        config_params["port"] = int(os.getenv('SERVER_PORT', config["DEFAULT"]["SERVER_PORT"]))
-        config_params["listen_backlog"] = int(os.getenv('SERVER_LISTEN_BACKLOG', config["DEFAULT"]["SERVER_LISTEN_BACKLOG"]))
-        config_params["logging_level"] = os.getenv('LOGGING_LEVEL', config["DEFAULT"]["LOGGING_LEVEL"])
+        config_params["port"] = int(config_value('SERVER_PORT'))
+        config_params["listen_backlog"] = int(config_value('SERVER_LISTEN_BACKLOG'))
+        config_params["logging_level"] = config_value('LOGGING_LEVEL')
         config_params["client_amount"] = int(os.getenv('CLIENT_AMOUNT', "5"))
+        config_params["engine"] = os.getenv('SERVER_ENGINE', "threads")
+        if config_params["engine"] not in SERVER_ENGINES:
+            raise ValueError(f"SERVER_ENGINE must be one of {SERVER_ENGINES}, got '{config_params['engine']}'")
+        config_params["fsync_policy"] = os.getenv('BETS_FSYNC_POLICY', "batch")
+        if config_params["fsync_policy"] not in FSYNC_POLICIES:
+            raise ValueError(f"BETS_FSYNC_POLICY must be one of {FSYNC_POLICIES}, got '{config_params['fsync_policy']}'")
+        config_params["fsync_interval_ms"] = int(os.getenv('BETS_FSYNC_INTERVAL_MS', "10"))
+        config_params["workers"] = int(os.getenv('SERVER_WORKERS', "1"))
+        if config_params["workers"] < 1:
+            raise ValueError(f"SERVER_WORKERS must be at least 1, got {config_params['workers']}")
+        if config_params["workers"] > 1 and config_params["engine"] != "threads":
+            raise ValueError("SERVER_WORKERS > 1 is only supported with SERVER_ENGINE=threads")
+        config_params["storage_format"] = os.getenv('BETS_STORAGE_FORMAT', "csv")
+        if config_params["storage_format"] not in STORAGE_FORMATS:
+            raise ValueError(f"BETS_STORAGE_FORMAT must be one of {tuple(STORAGE_FORMATS)}, got '{config_params['storage_format']}'")
+        config_params["winners_max_wait_ms"] = int(os.getenv('WINNERS_MAX_WAIT_MS', "30000"))
+        config_params["rounds"] = int(os.getenv('LOTTERY_ROUNDS', "1"))
+        if config_params["rounds"] < 0:
+            raise ValueError(f"LOTTERY_ROUNDS must be 0 (no limit) or positive, got {config_params['rounds']}")
+        if config_params["rounds"] != 1 and (config_params["engine"] != "threads" or config_params["workers"] > 1):
+            raise ValueError("LOTTERY_ROUNDS other than 1 is only supported with SERVER_ENGINE=threads and SERVER_WORKERS=1")
+        config_params["rounds_retained"] = int(os.getenv('ROUNDS_RETAINED', "8"))
+        if config_params["rounds_retained"] < 1:
+            raise ValueError(f"ROUNDS_RETAINED must be at least 1, got {config_params['rounds_retained']}")
+        config_params["checkpoint"] = os.getenv('BETS_CHECKPOINT', "false").lower() == "true"
+        if config_params["checkpoint"] and (config_params["workers"] > 1 or config_params["rounds"] != 1):
+            raise ValueError("BETS_CHECKPOINT is only supported with SERVER_WORKERS=1 and LOTTERY_ROUNDS=1")
+        config_params["metrics_port"] = int(os.getenv('METRICS_PORT', "0"))
+        if config_params["metrics_port"] < 0:
+            raise ValueError(f"METRICS_PORT must not be negative, got {config_params['metrics_port']}")
+        if config_params["metrics_port"] and config_params["workers"] > 1:
+            raise ValueError("METRICS_PORT is only supported with SERVER_WORKERS=1")
+        config_params["admin_port"] = int(os.getenv('ADMIN_PORT', "0"))
+        if config_params["admin_port"] < 0:
+            raise ValueError(f"ADMIN_PORT must not be negative, got {config_params['admin_port']}")
+        if config_params["admin_port"] and (config_params["workers"] > 1 or config_params["rounds"] != 1):
+            raise ValueError("ADMIN_PORT is only supported with SERVER_WORKERS=1 and LOTTERY_ROUNDS=1")
+        config_params["scan_processes"] = int(os.getenv('BETS_SCAN_PROCESSES', "0"))
+        if config_params["scan_processes"] < 0:
+            raise ValueError(f"BETS_SCAN_PROCESSES must be 0 (one per CPU) or positive, got {config_params['scan_processes']}")
+        # Pool de handlers y control de admision del motor de threads
+        admission_env = ('SERVER_HANDLERS', 'SERVER_ACCEPT_QUEUE', 'MAX_CONNECTIONS_PER_AGENCY', 'CLIENT_IDLE_TIMEOUT_MS', 'CLIENT_READ_TIMEOUT_MS')
+        if config_params["engine"] != "threads" and any(os.getenv(variable) is not None for variable in admission_env):
+            raise ValueError(f"{', '.join(admission_env)} are only supported with SERVER_ENGINE=threads")
+        config_params["handlers"] = int(os.getenv('SERVER_HANDLERS', "0"))
+        if config_params["handlers"] < 0:
+            raise ValueError(f"SERVER_HANDLERS must be 0 (CLIENT_AMOUNT) or positive, got {config_params['handlers']}")
+        accept_queue = os.getenv('SERVER_ACCEPT_QUEUE')
+        config_params["accept_queue"] = int(accept_queue) if accept_queue is not None else None
+        if config_params["accept_queue"] is not None and config_params["accept_queue"] < 0:
+            raise ValueError(f"SERVER_ACCEPT_QUEUE must not be negative, got {config_params['accept_queue']}")
+        config_params["max_connections_per_agency"] = int(os.getenv('MAX_CONNECTIONS_PER_AGENCY', "0"))
+        if config_params["max_connections_per_agency"] and config_params["workers"] > 1:
+            raise ValueError("MAX_CONNECTIONS_PER_AGENCY is only supported with SERVER_WORKERS=1")
+        config_params["idle_timeout_ms"] = int(os.getenv('CLIENT_IDLE_TIMEOUT_MS', "60000"))
+        config_params["read_timeout_ms"] = int(os.getenv('CLIENT_READ_TIMEOUT_MS', "10000"))
+        for key, variable in (("max_connections_per_agency", 'MAX_CONNECTIONS_PER_AGENCY'), ("idle_timeout_ms", 'CLIENT_IDLE_TIMEOUT_MS'), ("read_timeout_ms", 'CLIENT_READ_TIMEOUT_MS')):
+            if config_params[key] < 0:
+                raise ValueError(f"{variable} must not be negative, got {config_params[key]}")
+        # Control de flujo: marcas altas y bajas de lo pendiente de almacenar
+        config_params["pending_high_bytes"] = int(os.getenv('PENDING_HIGH_WATERMARK_BYTES', str(MAX_BYTES_PENDIENTES)))
+        config_params["pending_high_bets"] = int(os.getenv('PENDING_HIGH_WATERMARK_BETS', str(MAX_APUESTAS_PENDIENTES)))
+        for key, variable in (("pending_high_bytes", 'PENDING_HIGH_WATERMARK_BYTES'), ("pending_high_bets", 'PENDING_HIGH_WATERMARK_BETS')):
+            if config_params[key] < 0:
+                raise ValueError(f"{variable} must be 0 (no limit) or positive, got {config_params[key]}")
+        for key, variable, high in (("pending_low_bytes", 'PENDING_LOW_WATERMARK_BYTES', "pending_high_bytes"), ("pending_low_bets", 'PENDING_LOW_WATERMARK_BETS', "pending_high_bets")):
+            low = os.getenv(variable)
+            config_params[key] = int(low) if low is not None else None
+            if config_params[key] is not None and not 0 <= config_params[key] <= config_params[high]:
+                raise ValueError(f"{variable} must be between 0 and the high watermark ({config_params[high]}), got {config_params[key]}")
+        # Perfilador: cada captura se pide con SIGUSR1, o al iniciar con PROFILE_ON_START
+        config_params["profile_on_start"] = os.getenv('PROFILE_ON_START', "false").lower() == "true"
+        config_params["profile_duration_s"] = float(os.getenv('PROFILE_DURATION_S', str(DURACION_CAPTURA_S)))
+        if config_params["profile_duration_s"] <= 0:
+            raise ValueError(f"PROFILE_DURATION_S must be positive, got {config_params['profile_duration_s']}")
+        config_params["profile_interval_ms"] = float(os.getenv('PROFILE_INTERVAL_MS', str(INTERVALO_MUESTREO_S * 1000)))
+        if config_params["profile_interval_ms"] <= 0:
+            raise ValueError(f"PROFILE_INTERVAL_MS must be positive, got {config_params['profile_interval_ms']}")
+        config_params["profile_dir"] = os.getenv('PROFILE_DIR', "profiles")
     except KeyError as e:
         raise KeyError("Key was not found. Error: {} .Aborting server".format(e))
     except ValueError as e:
@@ -35,12 +118,66 @@ def initialize_config():
     return config_params
 
 
+def config_value(key):
+    """ Value of the env variable key, or of key in config.ini if the variable is not set """
+    value = os.getenv(key)
+    if value is None:
+        value = config_file()["DEFAULT"][key]
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def config_file():
+    """
+    config.ini, read once and only if some variable is missing from the
+    environment, so a server configured by env variables starts without
+    importing configparser.
+    """
+    from configparser import ConfigParser
+    config = ConfigParser()
+    # If config.ini does not exists the config object is empty
+    config.read("config.ini")
+    return config
+
+
 def main():
+    from common.bet_log import STORAGE_FORMATS
+    from common.control_flujo import LimitesPendientes
+    from common.perfilador import Perfilador
+    from common.pool_handlers import LimitesConexiones
+
     config_params = initialize_config()
     logging_level = config_params["logging_level"]
     port = config_params["port"]
     listen_backlog = config_params["listen_backlog"]
     client_amount = config_params["client_amount"]
+    engine = config_params["engine"]
+    fsync_policy = config_params["fsync_policy"]
+    fsync_interval_ms = config_params["fsync_interval_ms"]
+    storage_format = STORAGE_FORMATS[config_params["storage_format"]]
+    workers = config_params["workers"]
+    winners_max_wait_ms = config_params["winners_max_wait_ms"]
+    rounds = config_params["rounds"]
+    rounds_retained = config_params["rounds_retained"]
+    checkpoint = config_params["checkpoint"]
+    metrics_port = config_params["metrics_port"]
+    scan_processes = config_params["scan_processes"]
+    admin_port = config_params["admin_port"]
+    limites = LimitesConexiones(
+        handlers=config_params["handlers"] or None,
+        cola=config_params["accept_queue"],
+        por_agencia=config_params["max_connections_per_agency"],
+        # 0 deshabilita la espera
+        espera_inactividad=config_params["idle_timeout_ms"] / 1000 or None,
+        espera_lectura=config_params["read_timeout_ms"] / 1000 or None,
+    )
+    pendientes = LimitesPendientes(
+        bytes_alto=config_params["pending_high_bytes"],
+        apuestas_alto=config_params["pending_high_bets"],
+        # None usa la mitad de la marca alta
+        bytes_bajo=config_params["pending_low_bytes"],
+        apuestas_bajo=config_params["pending_low_bets"],
+    )
 
     initialize_log(logging_level)
 
@@ -48,10 +185,47 @@ def main():
     # of the component
     logging.debug(f"action: config | result: success | port: {port} | "
                   f"listen_backlog: {listen_backlog} | logging_level: {logging_level} | "
-                  f"client_amount: {client_amount}")
+                  f"client_amount: {client_amount} | engine: {engine} | "
+                  f"fsync_policy: {fsync_policy} | fsync_interval_ms: {fsync_interval_ms} | "
+                  f"storage_format: {storage_format.name} | workers: {workers} | "
+                  f"winners_max_wait_ms: {winners_max_wait_ms} | rounds: {rounds} | "
+                  f"rounds_retained: {rounds_retained} | checkpoint: {checkpoint} | "
+                  f"metrics_port: {metrics_port} | admin_port: {admin_port} | scan_processes: {scan_processes} | handlers: {config_params['handlers'] or client_amount} | "
+                  f"accept_queue: {client_amount if limites.cola is None else limites.cola} | "
+                  f"max_connections_per_agency: {limites.por_agencia} | "
+                  f"idle_timeout_ms: {config_params['idle_timeout_ms']} | read_timeout_ms: {config_params['read_timeout_ms']} | "
+                  f"pending_high_watermark_bytes: {pendientes.bytes_alto} | pending_high_watermark_bets: {pendientes.apuestas_alto} | "
+                  f"profile_on_start: {config_params['profile_on_start']} | profile_duration_s: {config_params['profile_duration_s']} | "
+                  f"profile_interval_ms: {config_params['profile_interval_ms']} | profile_dir: {config_params['profile_dir']}")
+
+    # Cada SIGUSR1 pide una captura del perfilador, de duracion acotada. Su thread se inicia con la primera
+    perfilador = Perfilador(config_params["profile_duration_s"], config_params["profile_interval_ms"] / 1000, config_params["profile_dir"])
+    perfilador.iniciar()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: perfilador.solicitar_captura())
+    if config_params["profile_on_start"]:
+        perfilador.solicitar_captura()
+
+    if metrics_port:
+        from common import metricas
+        metricas.iniciar_servidor_http(metrics_port)
 
     # Initialize server and start server loop
-    server = Server(port, listen_backlog, client_amount)
+    if workers > 1:
+        from common.workers import WorkerPool
+        server = WorkerPool(workers, port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, winners_max_wait_ms, limites, scan_processes, pendientes)
+    elif rounds != 1:
+        from common.rondas import ServidorRondas
+        server = ServidorRondas(port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, winners_max_wait_ms, rounds, rounds_retained, limites, pendientes)
+    elif engine == "asyncio":
+        from common.async_server import AsyncServer
+        server = AsyncServer(port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, winners_max_wait_ms, checkpoint, procesos_escaneo=scan_processes, indice_apuestas=bool(admin_port), pendientes=pendientes)
+    else:
+        from common.server import Server
+        server = Server(port, listen_backlog, client_amount, fsync_policy, fsync_interval_ms, storage_format, winners_max_wait_ms, checkpoint, limites, scan_processes, bool(admin_port), pendientes)
+
+    if admin_port:
+        from common import consultas
+        consultas.iniciar_servidor_http(admin_port, server.indice_apuestas)
     server.run()
 
 def initialize_log(logging_level):
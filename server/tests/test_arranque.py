@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+DIRECTORIO_SERVIDOR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modulos que el servidor usa solo fuera del camino comun, y que no se deben importar al arrancar
+MODULOS_DIFERIDOS = ('configparser', 'http.server', 'json', 'multiprocessing')
+
+
+def _ejecutar(codigo, directorio, **entorno):
+    entorno = {variable: valor for variable, valor in dict(os.environ, PYTHONPATH=DIRECTORIO_SERVIDOR, **entorno).items() if valor is not None}
+    resultado = subprocess.run([sys.executable, '-c', codigo], cwd=directorio, env=entorno, capture_output=True, text=True, check=True)
+    return resultado.stdout.split()
+
+
+class TestArranque(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directorio.cleanup()
+
+    def test_importar_main_no_carga_modulos_diferidos(self):
+        codigo = f"import sys, main; main.initialize_config(); print(*[m for m in {MODULOS_DIFERIDOS!r} if m in sys.modules])"
+        cargados = _ejecutar(codigo, self.directorio.name, SERVER_PORT='12345', SERVER_LISTEN_BACKLOG='5', LOGGING_LEVEL='INFO')
+        self.assertEqual([], cargados)
+
+    def test_importar_main_no_carga_el_servidor(self):
+        # El servidor y sus dependencias se importan recien al elegir el motor, en main()
+        modulos = MODULOS_DIFERIDOS + ('common.server', 'common.bet_writer', 'concurrent.futures', 'queue')
+        codigo = f"import sys, main; print(*[m for m in {modulos!r} if m in sys.modules])"
+        self.assertEqual([], _ejecutar(codigo, self.directorio.name))
+
+    def test_variables_faltantes_se_leen_de_config_ini(self):
+        with open(os.path.join(self.directorio.name, 'config.ini'), 'w') as archivo:
+            archivo.write("[DEFAULT]\nSERVER_PORT = 12345\nSERVER_LISTEN_BACKLOG = 5\nLOGGING_LEVEL = INFO\n")
+        codigo = "import main; config = main.initialize_config(); print(config['port'], config['listen_backlog'], config['logging_level'])"
+        # La variable de entorno tiene prioridad sobre config.ini
+        valores = _ejecutar(codigo, self.directorio.name, SERVER_PORT='23456', SERVER_LISTEN_BACKLOG=None, LOGGING_LEVEL=None)
+        self.assertEqual(['23456', '5', 'INFO'], valores)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+from common.async_server import AsyncServer
+from common.communication import MessageType
+from common.utils import STORAGE_FILEPATH, LOTTERY_WINNER_NUMBER
+import os
+import socket
+import threading
+import unittest
+
+
+def _envio_batch(id_agencia, apuestas):
+    frame = bytes([MessageType.ENVIO_BATCH]) + id_agencia.to_bytes(4, 'big') + bytes([len(apuestas)])
+    for documento, numero in apuestas:
+        frame += b'nombre\x00apellido\x00' + documento.to_bytes(4, 'big') + b'2000-01-01\x00' + numero.to_bytes(4, 'big')
+    return frame
+
+
+def _cerrar_socket_servidor(server):
+    """Cierra el socket de escucha, que run() no cierra si termina con el sorteo realizado."""
+    if server._server_socket is not None:
+        server._server_socket.close()
+
+
+def _recv_exacto(sock, n):
+    data = b''
+    while len(data) < n:
+        data += sock.recv(n - len(data))
+    return data
+
+
+def _agencia(puerto, id_agencia, apuestas, resultados):
+    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+        sock.sendall(_envio_batch(id_agencia, apuestas))
+        confirmaciones = [_recv_exacto(sock, 2)]
+        sock.sendall(_envio_batch(id_agencia, []))
+        confirmaciones.append(_recv_exacto(sock, 2))
+
+        while True:
+            sock.sendall(bytes([MessageType.SOLICITUD_GANADORES]) + id_agencia.to_bytes(4, 'big'))
+            tipo = _recv_exacto(sock, 1)[0]
+            if tipo == MessageType.RESPUESTA_GANADORES:
+                break
+        cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+        dnis = [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)]
+        resultados[id_agencia] = (confirmaciones, dnis)
+
+
+class TestAsyncServer(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(STORAGE_FILEPATH):
+            os.remove(STORAGE_FILEPATH)
+
+    def test_sorteo_con_motor_asyncio(self):
+        server = AsyncServer(0, 5, 2)
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+        agencias = [
+            threading.Thread(target=_agencia, args=(puerto, 1, [(111, LOTTERY_WINNER_NUMBER), (112, 1)], resultados)),
+            threading.Thread(target=_agencia, args=(puerto, 2, [(221, 2), (222, LOTTERY_WINNER_NUMBER)], resultados)),
+        ]
+        for agencia in agencias:
+            agencia.start()
+        server.run()
+        for agencia in agencias:
+            agencia.join()
+
+        ok = bytes([MessageType.CONFIRMACION_RECEPCION, 0])
+        self.assertEqual(([ok, ok], [111]), resultados[1])
+        self.assertEqual(([ok, ok], [222]), resultados[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+from common.bet_log import *
+from common.bet_writer import BetWriter
+from common.communication import MessageType
+from common.server import Server
+from common.utils import Bet, BetBatch
+from test_async_server import _cerrar_socket_servidor, _recv_exacto
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+
+def _envio_batch(id_agencia, apuestas):
+    frame = bytes([MessageType.ENVIO_BATCH]) + id_agencia.to_bytes(4, 'big') + bytes([len(apuestas)])
+    for nombre, documento in apuestas:
+        frame += nombre.encode('utf-8') + b'\x00apellido\x00' + documento.to_bytes(4, 'big') + b'2000-01-01\x00' + (1).to_bytes(4, 'big')
+    return frame
+
+
+def _agencia_con_nombre_largo(puerto, confirmaciones):
+    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+        for apuestas in ([('corto', 1), ('n' * 256, 2)], [('corto', 3)], []):
+            sock.sendall(_envio_batch(1, apuestas))
+            confirmaciones.append(_recv_exacto(sock, 2)[1])
+        while True:
+            sock.sendall(bytes([MessageType.SOLICITUD_GANADORES]) + (1).to_bytes(4, 'big'))
+            if _recv_exacto(sock, 1)[0] == MessageType.RESPUESTA_GANADORES:
+                break
+        _recv_exacto(sock, 4)
+
+
+def _bets():
+    return [
+        Bet('1', 'Santiago Lionel', 'Lorca', '30904465', '1999-03-17', '7574'),
+        Bet('2', 'José', 'Muñoz', '12345678', '1965-01-01', '1'),
+        Bet('3', '', 'Sin Nombre', '99999999', '1970-01-01', '9999'),
+    ]
+
+
+class TestBetLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.binario = os.path.join(self.directorio.name, 'bets.bin')
+        self.csv = os.path.join(self.directorio.name, 'bets.csv')
+
+    def tearDown(self):
+        self.directorio.cleanup()
+
+    def _escribir_binario(self, bets):
+        with open(self.binario, 'wb') as file:
+            file.write(MAGIC + format_bets_binary(bets))
+
+    def _assert_bets_iguales(self, esperadas, obtenidas):
+        self.assertEqual(len(esperadas), len(obtenidas))
+        for esperada, obtenida in zip(esperadas, obtenidas):
+            for campo in ('agency', 'first_name', 'last_name', 'document', 'birthdate', 'number'):
+                self.assertEqual(getattr(esperada, campo), getattr(obtenida, campo))
+
+    def test_round_trip_conserva_todos_los_campos(self):
+        self._escribir_binario(_bets())
+        self._assert_bets_iguales(_bets(), list(load_bets_binary(self.binario)))
+
+    def test_recorrido_sin_nombres_no_decodifica_nombres(self):
+        self._escribir_binario(_bets())
+        registros = list(iter_registros(self.binario, con_nombres=False))
+        self.assertEqual([(1, '', '', 30904465, 10667, 7574)], registros[:1])
+        self.assertEqual([3, 99999999, 9999], [registros[2][0], registros[2][3], registros[2][5]])
+
+    def test_bet_writer_escribe_magic_una_sola_vez(self):
+        for _ in range(2):
+            writer = BetWriter(self.binario, storage_format=BINARY_STORAGE)
+            writer.start()
+            writer.encolar(_bets()).result(timeout=5)
+            writer.cerrar()
+        self._assert_bets_iguales(_bets() * 2, list(load_bets_binary(self.binario)))
+
+    def test_conversion_csv_binario_csv(self):
+        writer = BetWriter(self.csv)
+        writer.start()
+        writer.encolar(_bets()).result(timeout=5)
+        writer.cerrar()
+
+        self.assertEqual(3, convertir_csv_a_binario(self.csv, self.binario))
+        self._assert_bets_iguales(_bets(), list(load_bets_binary(self.binario)))
+
+        otro_csv = os.path.join(self.directorio.name, 'otro.csv')
+        self.assertEqual(3, convertir_binario_a_csv(self.binario, otro_csv))
+        with open(self.csv) as original, open(otro_csv) as convertido:
+            self.assertEqual(original.read(), convertido.read())
+
+    def test_registro_final_incompleto_se_ignora(self):
+        self._escribir_binario(_bets())
+        with open(self.binario, 'r+b') as file:
+            file.truncate(os.path.getsize(self.binario) - 3)
+        with self.assertLogs(level='WARNING'):
+            bets = list(load_bets_binary(self.binario))
+        self._assert_bets_iguales(_bets()[:2], bets)
+
+    def test_archivo_sin_magic_es_rechazado(self):
+        with open(self.binario, 'wb') as file:
+            file.write(b'1,first,last,1,2000-01-01,1\n')
+        with self.assertRaises(ValueError):
+            list(load_bets_binary(self.binario))
+
+    def test_batch_columnar_se_serializa_igual(self):
+        self.assertEqual(format_bets_binary(_bets()), format_bets_binary(BetBatch.from_bets(_bets())))
+
+    def test_nombre_demasiado_largo_es_rechazado(self):
+        with self.assertRaises(ValueError):
+            format_bets_binary([Bet('1', 'a' * 256, 'b', '1', '2000-01-01', '1')])
+
+    def test_admite_nombres_de_hasta_255_bytes(self):
+        self.assertTrue(admite_bets_binary(_bets()))
+        self.assertTrue(admite_bets_binary([Bet('1', 'ñ' * 127, 'b', '1', '2000-01-01', '1')]))
+        self.assertFalse(admite_bets_binary([Bet('1', 'ñ' * 128, 'b', '1', '2000-01-01', '1')]))
+        self.assertFalse(admite_bets_binary(BetBatch.from_bets([Bet('1', 'a', 'b' * 256, '1', '2000-01-01', '1')])))
+
+    def test_servidor_rechaza_solo_el_batch_con_un_nombre_demasiado_largo(self):
+        directorio_original = os.getcwd()
+        os.chdir(self.directorio.name)
+        try:
+            server = Server(0, 5, 1, storage_format=BINARY_STORAGE)
+            self.addCleanup(_cerrar_socket_servidor, server)
+            confirmaciones = []
+            agencia = threading.Thread(target=_agencia_con_nombre_largo, args=(server._server_socket.getsockname()[1], confirmaciones))
+            agencia.start()
+            server.run()
+            agencia.join()
+        finally:
+            os.chdir(directorio_original)
+
+        # El batch con el nombre de 256 bytes se rechaza, y los siguientes se siguen almacenando
+        self.assertEqual([1, 0, 0], confirmaciones)
+        self.assertEqual(['3'], [bet.document for bet in load_bets_binary(self.binario)])
+
+
+if __name__ == '__main__':
+    unittest.main()
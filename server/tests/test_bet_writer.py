@@ -0,0 +1,111 @@
+from common.bet_log import CSV_STORAGE
+from common.bet_writer import *
+from common.utils import Bet, format_bets
+import csv
+import dataclasses
+import os
+import tempfile
+import threading
+import unittest
+
+
+class TestBetWriter(unittest.TestCase):
+
+    def setUp(self):
+        descriptor, self.filepath = tempfile.mkstemp(suffix='.csv')
+        os.close(descriptor)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def _filas(self):
+        with open(self.filepath) as file:
+            return list(csv.reader(file))
+
+    def _escribir_desde_varios_threads(self, writer, threads, batches):
+        def handler(agencia):
+            for i in range(batches):
+                writer.encolar([Bet(agencia, 'first', 'last', str(i), '2000-12-20', i)]).result(timeout=5)
+
+        hilos = [threading.Thread(target=handler, args=(agencia,)) for agencia in range(threads)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    def test_batches_de_varios_threads_se_escriben_todos(self):
+        for politica in FSYNC_POLICIES:
+            with self.subTest(politica=politica):
+                open(self.filepath, 'w').close()
+                writer = BetWriter(self.filepath, fsync_policy=politica, fsync_interval_ms=1)
+                writer.start()
+                self._escribir_desde_varios_threads(writer, threads=8, batches=20)
+                writer.cerrar()
+
+                filas = self._filas()
+                self.assertEqual(160, len(filas))
+                for agencia in range(8):
+                    documentos = [fila[3] for fila in filas if fila[0] == str(agencia)]
+                    self.assertEqual([str(i) for i in range(20)], documentos)
+
+    def test_formato_igual_a_store_bets(self):
+        writer = BetWriter(self.filepath)
+        writer.start()
+        writer.encolar([Bet('1', 'first, with comma', 'last', '10000000', '2000-12-20', 7500)]).result(timeout=5)
+        writer.cerrar()
+
+        self.assertEqual([['1', 'first, with comma', 'last', '10000000', '2000-12-20', '7500']], self._filas())
+
+    def test_error_al_abrir_falla_los_batches(self):
+        writer = BetWriter(os.path.join(self.filepath, 'no_existe', 'bets.csv'))
+        writer.start()
+        futuro = writer.encolar([Bet('1', 'first', 'last', '1', '2000-12-20', 1)])
+        with self.assertRaises(OSError):
+            futuro.result(timeout=5)
+        writer.cerrar()
+
+    def test_batch_que_no_se_puede_formatear_falla_solo(self):
+        def formatear(bets):
+            if bets[0].first_name == 'invalido':
+                raise ValueError("batch invalido")
+            return format_bets(bets)
+        almacenamiento = dataclasses.replace(CSV_STORAGE, filepath=self.filepath, format_bets=formatear)
+
+        for politica in FSYNC_POLICIES:
+            with self.subTest(politica=politica):
+                open(self.filepath, 'w').close()
+                writer = BetWriter(self.filepath, fsync_policy=politica, fsync_interval_ms=1, storage_format=almacenamiento)
+                # Los tres batches se encolan antes de iniciar el writer, para que vayan en el mismo grupo
+                futuros = [writer.encolar([Bet('1', nombre, 'last', str(i), '2000-12-20', i)]) for i, nombre in enumerate(('first', 'invalido', 'first'))]
+                writer.start()
+                with self.assertRaises(ValueError):
+                    futuros[1].result(timeout=5)
+                futuros[0].result(timeout=5)
+                futuros[2].result(timeout=5)
+                # El writer sigue escribiendo los batches siguientes
+                writer.encolar([Bet('1', 'first', 'last', '3', '2000-12-20', 3)]).result(timeout=5)
+                writer.cerrar()
+                self.assertEqual(['0', '2', '3'], [fila[3] for fila in self._filas()])
+
+    def test_error_inesperado_falla_los_batches_sin_sincronizar(self):
+        writer = BetWriter(self.filepath, fsync_policy=FSYNC_INTERVAL, fsync_interval_ms=50)
+        def sincronizar(file):
+            raise RuntimeError("fsync roto")
+        writer._sincronizar = sincronizar
+        writer.start()
+        # El batch queda escrito esperando el fsync del intervalo, que termina el writer con un error
+        futuro = writer.encolar([Bet('1', 'first', 'last', '1', '2000-12-20', 1)])
+        with self.assertRaises(RuntimeError):
+            futuro.result(timeout=5)
+        siguiente = writer.encolar([Bet('1', 'first', 'last', '2', '2000-12-20', 2)])
+        with self.assertRaises(RuntimeError):
+            siguiente.result(timeout=5)
+        writer.cerrar()
+
+    def test_politica_invalida(self):
+        with self.assertRaises(ValueError):
+            BetWriter(self.filepath, fsync_policy='siempre')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+from common import checkpoint
+from common.async_server import AsyncServer
+from common.bet_writer import BetWriter
+from common.communication import MessageType
+from common.server import Server
+from common.utils import LOTTERY_WINNER_NUMBER, Bet, load_bets
+from test_async_server import _cerrar_socket_servidor, _envio_batch, _recv_exacto
+from test_communication import _envio_batch_secuenciado
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+_PROGRESO = struct.Struct('>BII?')
+_CONFIRMACION_SECUENCIA = struct.Struct('>BIIB')
+
+
+def _apuestas(agencia, *documentos, numero=1):
+    return [Bet(agencia, 'nombre', 'apellido', documento, '2000-01-01', numero) for documento in documentos]
+
+
+def _consultar_progreso(sock, id_agencia):
+    sock.sendall(bytes([MessageType.CONSULTA_PROGRESO]) + id_agencia.to_bytes(4, 'big'))
+    return _PROGRESO.unpack(_recv_exacto(sock, _PROGRESO.size))
+
+
+def _pedir_ganadores(sock, id_agencia):
+    while True:
+        sock.sendall(bytes([MessageType.SOLICITUD_GANADORES]) + id_agencia.to_bytes(4, 'big'))
+        if _recv_exacto(sock, 1)[0] == MessageType.RESPUESTA_GANADORES:
+            break
+    cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+    return [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)]
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def test_recuperar_trunca_apuestas_sin_confirmar(self):
+        writer = BetWriter(checkpoint=True)
+        writer.start()
+        writer.encolar(_apuestas(1, 11), progreso=checkpoint.progreso_batch(1, 1, 1)).result(timeout=5)
+        writer.encolar(_apuestas(1, 12, 13), progreso=checkpoint.progreso_batch(1, 2, 2)).result(timeout=5)
+        writer.encolar((), progreso=checkpoint.progreso_completada(2)).result(timeout=5)
+        writer.cerrar()
+        with open('bets.csv', 'rb') as archivo:
+            confirmadas = archivo.read()
+
+        # Una escritura de apuestas que no llegó a confirmarse, y un registro del checkpoint a medio escribir
+        with open('bets.csv', 'a') as archivo:
+            archivo.write('1,nombre,apellido,99,2000-01-01,1\n')
+        with open('bets.checkpoint', 'ab') as archivo:
+            archivo.write(checkpoint.formatear_registros([checkpoint.progreso_batch(1, 3, 1)], 10 ** 6)[:7])
+
+        estado = checkpoint.recuperar('bets.csv')
+
+        self.assertEqual({1: {1: 1, 2: 2}}, estado.secuencias)
+        self.assertEqual({2}, estado.completadas)
+        with open('bets.csv', 'rb') as archivo:
+            self.assertEqual(confirmadas, archivo.read())
+
+    def test_registro_de_apuestas_que_no_llegaron_al_disco_se_descarta(self):
+        with open('bets.csv', 'w') as archivo:
+            archivo.write('1,nombre,apellido,11,2000-01-01,1\n')
+        with open('bets.checkpoint', 'wb') as archivo:
+            archivo.write(checkpoint.formatear_registros([checkpoint.progreso_batch(1, 1, 1)], 34))
+            archivo.write(checkpoint.formatear_registros([checkpoint.progreso_batch(1, 2, 1)], 68))
+
+        estado = checkpoint.recuperar('bets.csv')
+
+        self.assertEqual({1: {1: 1}}, estado.secuencias)
+        self.assertEqual(['11'], [bet.document for bet in load_bets()])
+
+    def test_servidor_retoma_despues_de_una_caida(self):
+        for clase_servidor in (Server, AsyncServer):
+            with self.subTest(motor=clase_servidor.__name__):
+                self._simular_caida()
+                server = clase_servidor(0, 5, 2, checkpoint=True)
+                self.addCleanup(_cerrar_socket_servidor, server)
+                puerto = server._server_socket.getsockname()[1]
+                resultados = {}
+
+                def agencia_incompleta():
+                    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+                        resultados['progreso_1'] = _consultar_progreso(sock, 1)
+                        # Reenvia el ultimo batch confirmado, como si no hubiera recibido su confirmacion
+                        sock.sendall(_envio_batch_secuenciado(1, 2, [('n', 'a', 12, '2000-01-01', LOTTERY_WINNER_NUMBER)]))
+                        sock.sendall(_envio_batch_secuenciado(1, 3, [('n', 'a', 13, '2000-01-01', LOTTERY_WINNER_NUMBER)]))
+                        for _ in range(2):
+                            _recv_exacto(sock, _CONFIRMACION_SECUENCIA.size)
+                        sock.sendall(_envio_batch(1, []))
+                        _recv_exacto(sock, 2)
+                        resultados[1] = _pedir_ganadores(sock, 1)
+
+                def agencia_completa():
+                    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+                        resultados['progreso_2'] = _consultar_progreso(sock, 2)
+                        resultados[2] = _pedir_ganadores(sock, 2)
+
+                hilos = [threading.Thread(target=agencia_incompleta), threading.Thread(target=agencia_completa)]
+                for hilo in hilos:
+                    hilo.start()
+                server.run()
+                for hilo in hilos:
+                    hilo.join()
+
+                self.assertEqual((MessageType.PROGRESO, 2, 3, False), resultados['progreso_1'])
+                self.assertEqual((MessageType.PROGRESO, 1, 1, True), resultados['progreso_2'])
+                self.assertEqual([12, 13, 14], sorted(resultados[1]))
+                self.assertEqual([21], resultados[2])
+                self.assertEqual(['11', '12', '14', '21', '13'], [bet.document for bet in load_bets()])
+                os.remove('bets.csv')
+                os.remove('bets.checkpoint')
+
+    def _simular_caida(self):
+        """Estado en disco de un servidor que se detuvo con la agencia 1 a mitad de su envio."""
+        previo = Server(0, 5, 2, checkpoint=True)
+        previo.almacenar_bets(_apuestas(1, 11))
+        previo.almacenar_bets(_apuestas(1, 12, 14, numero=LOTTERY_WINNER_NUMBER))
+        previo.almacenar_bets(_apuestas(2, 21, numero=LOTTERY_WINNER_NUMBER))
+        previo.marcar_agencia_completada(2)
+        previo._bet_writer.cerrar()
+        previo._server_socket.close()
+        # Un batch que se escribió pero nunca se confirmó
+        with open('bets.csv', 'a') as archivo:
+            archivo.write('1,nombre,apellido,99,2000-01-01,1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 from common.utils import *
+from array import array
 import os
+import sys
 import unittest
 
 class TestUtils(unittest.TestCase):
@@ -18,10 +20,10 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(7500, b.number)
 
     def test_has_won_with_winner_number_must_be_true(self):
-        b = bet('1', 'first', 'last', 10000000,'2000-12-20', LOTTERY_WINNER_NUMBER)
+        b = Bet('1', 'first', 'last', 10000000,'2000-12-20', LOTTERY_WINNER_NUMBER)
         self.assertTrue(has_won(b))
 
-    def test_has_won_with_winner_number_must_be_true(self):
+    def test_has_won_without_winner_number_must_be_false(self):
         b = Bet('1', 'first', 'last', 10000000,'2000-12-20', LOTTERY_WINNER_NUMBER + 1)
         self.assertFalse(has_won(b))
 
@@ -54,6 +56,48 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(b1.birthdate, b2.birthdate)
         self.assertEqual(b1.number, b2.number)
 
+class TestBetBatch(unittest.TestCase):
+
+    def _bets(self):
+        return [
+            Bet('1', 'first_0', 'last_0', '10000000', '2000-12-20', 7500),
+            Bet('1', 'first_1', 'last_1', '10000001', '2000-12-21', LOTTERY_WINNER_NUMBER),
+            Bet('2', 'first_2', 'last,2', '10000002', '2000-12-22', LOTTERY_WINNER_NUMBER),
+        ]
+
+    def test_bet_has_no_instance_dict(self):
+        self.assertFalse(hasattr(Bet('1', 'first', 'last', '10000000', '2000-12-20', 7500), '__dict__'))
+
+    def test_batch_items_keep_fields(self):
+        batch = BetBatch.from_bets(self._bets())
+        self.assertEqual(3, len(batch))
+        for expected, bet in zip(self._bets(), batch):
+            self.assertEqual(expected.agency, bet.agency)
+            self.assertEqual(expected.first_name, bet.first_name)
+            self.assertEqual(expected.last_name, bet.last_name)
+            self.assertEqual(expected.document, bet.document)
+            self.assertEqual(expected.birthdate, bet.birthdate)
+            self.assertEqual(expected.number, bet.number)
+
+    def test_format_bets_of_batch_matches_list(self):
+        self.assertEqual(format_bets(self._bets()), format_bets(BetBatch.from_bets(self._bets())))
+
+    def test_winners_matches_has_won(self):
+        expected = [(bet.agency, int(bet.document)) for bet in self._bets() if has_won(bet)]
+        self.assertEqual(expected, list(BetBatch.from_bets(self._bets()).winners()))
+
+    def test_winners_skips_unaligned_matches(self):
+        batch = BetBatch()
+        batch.append(1, 'first_0', 'last_0', 10000000, '2000-12-20', 0)
+        batch.append(2, 'first_1', 'last_1', 10000001, '2000-12-21', 0)
+        raw = b'\0' + LOTTERY_WINNER_NUMBER.to_bytes(batch.numbers.itemsize, sys.byteorder)
+        batch.numbers = array('I', raw.ljust(2 * batch.numbers.itemsize, b'\0'))
+        self.assertEqual([], list(batch.winners()))
+
+    def test_append_with_invalid_birthdate_must_fail(self):
+        with self.assertRaises(ValueError):
+            BetBatch().append(1, 'first', 'last', 10000000, '2000-13-40', 7500)
+
 if __name__ == '__main__':
     unittest.main()
 
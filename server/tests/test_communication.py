@@ -0,0 +1,307 @@
+from common.communication import *
+from common.communication import _descartar_enviados
+import datetime
+import socket
+import threading
+import unittest
+import zlib
+
+
+def _string(s):
+    return s.encode('utf-8') + b'\x00'
+
+
+def _envio_batch(id_agencia, apuestas):
+    frame = bytes([MessageType.ENVIO_BATCH]) + id_agencia.to_bytes(4, 'big') + bytes([len(apuestas)])
+    for nombre, apellido, documento, nacimiento, numero in apuestas:
+        frame += _string(nombre) + _string(apellido) + documento.to_bytes(4, 'big') + _string(nacimiento) + numero.to_bytes(4, 'big')
+    return frame
+
+
+def _envio_batch_v2(id_agencia, apuestas):
+    body = id_agencia.to_bytes(4, 'big') + len(apuestas).to_bytes(4, 'big')
+    for nombre, apellido, documento, nacimiento, numero in apuestas:
+        campos = [nombre.encode('utf-8'), apellido.encode('utf-8'), nacimiento.encode('utf-8')]
+        body += documento.to_bytes(4, 'big') + numero.to_bytes(4, 'big') + bytes(len(c) for c in campos) + b''.join(campos)
+    return (len(body) + 1).to_bytes(4, 'big') + bytes([MessageType.ENVIO_BATCH]) + body
+
+
+def _envio_batch_secuenciado(id_agencia, secuencia, apuestas):
+    frame = bytearray(_envio_batch(id_agencia, apuestas))
+    frame[0] = MessageType.ENVIO_BATCH_SECUENCIADO
+    return bytes(frame[:5]) + secuencia.to_bytes(4, 'big') + bytes(frame[5:])
+
+
+def _envio_batch_secuenciado_v2(id_agencia, secuencia, apuestas):
+    frame = _envio_batch_v2(id_agencia, apuestas)
+    body = frame[5:9] + secuencia.to_bytes(4, 'big') + frame[9:]
+    return (len(body) + 1).to_bytes(4, 'big') + bytes([MessageType.ENVIO_BATCH_SECUENCIADO]) + body
+
+
+def _frame_comprimido(compresor, frame):
+    datos = compresor.compress(frame) + compresor.flush(zlib.Z_SYNC_FLUSH)
+    return bytes([MessageType.FRAME_COMPRIMIDO]) + len(datos).to_bytes(4, 'big') + datos
+
+
+def _frame_comprimido_v2(compresor, frame):
+    datos = compresor.compress(frame) + compresor.flush(zlib.Z_SYNC_FLUSH)
+    return (len(datos) + 1).to_bytes(4, 'big') + bytes([MessageType.FRAME_COMPRIMIDO]) + datos
+
+
+class TestCommunication(unittest.TestCase):
+
+    def setUp(self):
+        self.cliente, servidor = socket.socketpair()
+        self.communication = Communication(servidor)
+
+    def tearDown(self):
+        self.cliente.close()
+        self.communication.close()
+
+    def test_leer_envio_batch_must_keep_fields(self):
+        self.cliente.sendall(_envio_batch(3, [('Juan', 'Pérez', 30904465, '1999-03-17', 7574)]))
+        mensaje = self.communication.leer_mensaje_socket()
+
+        self.assertEqual(MessageType.ENVIO_BATCH, mensaje.tipo_mensaje)
+        self.assertEqual(3, mensaje.id_agencia)
+        self.assertEqual(1, mensaje.numero_apuestas)
+        bet = mensaje.apuestas[0]
+        self.assertEqual(3, bet.agency)
+        self.assertEqual('Juan', bet.first_name)
+        self.assertEqual('Pérez', bet.last_name)
+        self.assertEqual('30904465', bet.document)
+        self.assertEqual(datetime.date(1999, 3, 17), bet.birthdate)
+        self.assertEqual(7574, bet.number)
+
+    def test_leer_envio_batch_fragmentado_byte_a_byte(self):
+        frame = _envio_batch(1, [('a', 'b', 1, '2000-01-01', 2), ('c', 'd', 3, '2000-01-02', 4)])
+
+        def enviar():
+            for i in range(len(frame)):
+                self.cliente.sendall(frame[i:i + 1])
+
+        hilo = threading.Thread(target=enviar)
+        hilo.start()
+        mensaje = self.communication.leer_mensaje_socket()
+        hilo.join()
+
+        self.assertEqual(2, mensaje.numero_apuestas)
+        self.assertEqual(['a', 'c'], [bet.first_name for bet in mensaje.apuestas])
+        self.assertEqual([2, 4], [bet.number for bet in mensaje.apuestas])
+
+    def test_batch_v1_incompleto_se_recorre_una_sola_vez(self):
+        decodificador = DecodificadorMensajes(tamanio_buffer=16)
+        solicitud = bytes([MessageType.SOLICITUD_GANADORES]) + (1).to_bytes(4, 'big')
+        apuestas = [('a', 'b', i, '2000-01-01', i) for i in range(3)]
+        frame = _envio_batch_secuenciado(1, 7, apuestas)
+        largo_apuesta = (len(frame) - 10) // len(apuestas)
+
+        def recibir(datos):
+            espacio = decodificador.espacio_libre()
+            espacio[:len(datos)] = datos
+            decodificador.datos_recibidos(len(datos))
+
+        # La solicitud deja el batch desplazado en el buffer, que se compacta en la siguiente lectura
+        recibir(solicitud + frame[:1])
+        self.assertIsInstance(decodificador.siguiente_mensaje(), SolicitudGanadoresMessage)
+        for i in range(1, len(frame)):
+            self.assertIsNone(decodificador.siguiente_mensaje())
+            recibir(frame[i:i + 1])
+            if i >= 10:
+                # Solo las apuestas que llegaron enteras quedan recorridas
+                self.assertEqual((10 + (i - 10) // largo_apuesta * largo_apuesta, (i - 10) // largo_apuesta), decodificador._recorrido_v1)
+
+        mensaje = decodificador.siguiente_mensaje()
+        self.assertEqual(7, mensaje.secuencia)
+        self.assertEqual([0, 1, 2], [bet.number for bet in mensaje.apuestas])
+        self.assertIsNone(decodificador._recorrido_v1)
+        self.assertFalse(decodificador.hay_datos_pendientes)
+
+    def test_leer_varios_mensajes_de_un_mismo_envio(self):
+        self.cliente.sendall(_envio_batch(2, []) + bytes([MessageType.SOLICITUD_GANADORES]) + (2).to_bytes(4, 'big'))
+
+        envio = self.communication.leer_mensaje_socket()
+        solicitud = self.communication.leer_mensaje_socket()
+
+        self.assertEqual(0, envio.numero_apuestas)
+        self.assertIsInstance(solicitud, SolicitudGanadoresMessage)
+        self.assertEqual(2, solicitud.id_agencia)
+
+    def test_frame_mayor_al_buffer_de_lectura(self):
+        apuestas = [('n' * 29, 'a' * 29, i, '2000-01-01', i) for i in range(255)]
+        frames = _envio_batch(1, apuestas) * 5
+
+        hilo = threading.Thread(target=self.cliente.sendall, args=(frames,))
+        hilo.start()
+        mensajes = [self.communication.leer_mensaje_socket() for _ in range(5)]
+        hilo.join()
+
+        self.assertTrue(all(m.numero_apuestas == 255 for m in mensajes))
+        self.assertEqual(254, mensajes[-1].apuestas[-1].number)
+
+    def test_cierre_entre_mensajes_es_conexion_cerrada(self):
+        self.cliente.close()
+        with self.assertRaises(ConexionCerradaPorCliente):
+            self.communication.leer_mensaje_socket()
+
+    def test_cierre_en_medio_de_un_mensaje_es_error(self):
+        self.cliente.sendall(_envio_batch(1, [('a', 'b', 1, '2000-01-01', 2)])[:-3])
+        self.cliente.shutdown(socket.SHUT_WR)
+        with self.assertRaises(ValueError):
+            self.communication.leer_mensaje_socket()
+
+    def test_mensaje_del_servidor_es_invalido(self):
+        self.cliente.sendall(bytes([MessageType.CONFIRMACION_RECEPCION, 0]))
+        with self.assertRaises(InvalidServerMessage):
+            self.communication.leer_mensaje_socket()
+
+
+    def _negociar(self, version):
+        self.cliente.sendall(bytes([MessageType.NEGOCIACION_PROTOCOLO, version]))
+
+    def test_negociacion_responde_version_acordada(self):
+        self._negociar(7)
+        self.cliente.sendall(_envio_batch_v2(1, []))
+        self.communication.leer_mensaje_socket()
+
+        self.assertEqual(bytes([MessageType.NEGOCIACION_PROTOCOLO, PROTOCOLO_VERSION_MAXIMA]), self.cliente.recv(2))
+        self.assertEqual(PROTOCOLO_V2, self.communication.version_protocolo)
+
+    def test_leer_envio_batch_v2_con_mas_de_255_apuestas(self):
+        apuestas = [('Nombre', 'Apellido', 1000 + i, '2000-01-01', i) for i in range(3000)]
+        self._negociar(PROTOCOLO_V2)
+        hilo = threading.Thread(target=self.cliente.sendall, args=(_envio_batch_v2(4, apuestas),))
+        hilo.start()
+        mensaje = self.communication.leer_mensaje_socket()
+        hilo.join()
+
+        self.assertEqual(4, mensaje.id_agencia)
+        self.assertEqual(3000, mensaje.numero_apuestas)
+        self.assertEqual('3999', mensaje.apuestas[-1].document)
+        self.assertEqual(2999, mensaje.apuestas[-1].number)
+
+    def test_leer_solicitud_ganadores_v2(self):
+        self._negociar(PROTOCOLO_V2)
+        self.cliente.sendall((5).to_bytes(4, 'big') + bytes([MessageType.SOLICITUD_GANADORES]) + (9).to_bytes(4, 'big'))
+        mensaje = self.communication.leer_mensaje_socket()
+
+        self.assertIsInstance(mensaje, SolicitudGanadoresMessage)
+        self.assertEqual(9, mensaje.id_agencia)
+
+    def test_leer_suscripcion_ganadores_v1_y_v2(self):
+        self.cliente.sendall(bytes([MessageType.SUSCRIPCION_GANADORES]) + (4).to_bytes(4, 'big') + (2500).to_bytes(4, 'big'))
+        self._negociar(PROTOCOLO_V2)
+        self.cliente.sendall((9).to_bytes(4, 'big') + bytes([MessageType.SUSCRIPCION_GANADORES]) + (5).to_bytes(4, 'big') + (0).to_bytes(4, 'big'))
+
+        for id_agencia, espera_ms in ((4, 2500), (5, 0)):
+            mensaje = self.communication.leer_mensaje_socket()
+            self.assertIsInstance(mensaje, SuscripcionGanadoresMessage)
+            self.assertEqual((id_agencia, espera_ms), (mensaje.id_agencia, mensaje.espera_ms))
+
+    def test_leer_solicitud_ganadores_ronda(self):
+        self.cliente.sendall(bytes([MessageType.SOLICITUD_GANADORES_RONDA]) + (4).to_bytes(4, 'big') + (12).to_bytes(4, 'big'))
+        mensaje = self.communication.leer_mensaje_socket()
+
+        self.assertIsInstance(mensaje, SolicitudGanadoresRondaMessage)
+        self.assertEqual((4, 12), (mensaje.id_agencia, mensaje.ronda))
+
+    def test_consulta_progreso_y_respuesta(self):
+        self.cliente.sendall(bytes([MessageType.CONSULTA_PROGRESO]) + (3).to_bytes(4, 'big'))
+        mensaje = self.communication.leer_mensaje_socket()
+        self.assertIsInstance(mensaje, ConsultaProgresoMessage)
+        self.assertEqual(3, mensaje.id_agencia)
+
+        self.communication.send_progreso(7, 700, True)
+        self.assertEqual(bytes([MessageType.PROGRESO]) + (7).to_bytes(4, 'big') + (700).to_bytes(4, 'big') + b'\x01', self.cliente.recv(10))
+
+    def test_frame_v2_con_longitud_inconsistente_es_error(self):
+        frame = bytearray(_envio_batch_v2(1, [('a', 'b', 1, '2000-01-01', 2)]))
+        frame[3] += 1
+        self._negociar(PROTOCOLO_V2)
+        self.cliente.sendall(bytes(frame) + b'\x00')
+        with self.assertRaises(ValueError):
+            self.communication.leer_mensaje_socket()
+
+    def test_sin_negociacion_se_mantiene_v1(self):
+        self.cliente.sendall(_envio_batch(1, []))
+        self.communication.leer_mensaje_socket()
+        self.assertEqual(PROTOCOLO_V1, self.communication.version_protocolo)
+
+    def test_leer_envio_batch_secuenciado_v1_y_v2(self):
+        apuestas = [('Juan', 'Pérez', 30904465, '1999-03-17', 7574), ('Ana', 'Gómez', 30904466, '1999-03-18', 1)]
+        self.cliente.sendall(_envio_batch_secuenciado(3, 41, apuestas))
+        self._negociar(PROTOCOLO_V2)
+        self.cliente.sendall(_envio_batch_secuenciado_v2(3, 42, apuestas))
+
+        for secuencia in (41, 42):
+            mensaje = self.communication.leer_mensaje_socket()
+            self.assertIsInstance(mensaje, EnvioBatchSecuenciadoMessage)
+            self.assertEqual((3, secuencia, 2), (mensaje.id_agencia, mensaje.secuencia, mensaje.numero_apuestas))
+            self.assertEqual(['30904465', '30904466'], [bet.document for bet in mensaje.apuestas])
+
+    def test_batches_comprimidos_v1_y_v2(self):
+        apuestas = [('Juan', 'Pérez', 30904465 + i, '1999-03-17', i) for i in range(50)]
+        compresor = zlib.compressobj()
+        self.cliente.sendall(bytes([MessageType.NEGOCIACION_COMPRESION, COMPRESION_ZLIB]))
+        # El stream zlib es uno solo para toda la conexion, aunque cambie la version
+        self.cliente.sendall(_frame_comprimido(compresor, _envio_batch(3, apuestas)))
+        self.cliente.sendall(_frame_comprimido(compresor, _envio_batch_secuenciado(3, 8, apuestas)))
+        self._negociar(PROTOCOLO_V2)
+        self.cliente.sendall(_frame_comprimido_v2(compresor, _envio_batch_v2(3, apuestas)))
+
+        mensajes = [self.communication.leer_mensaje_socket() for _ in range(3)]
+
+        self.assertEqual(bytes([MessageType.NEGOCIACION_COMPRESION, COMPRESION_ZLIB]), self.cliente.recv(2))
+        self.assertEqual([MessageType.ENVIO_BATCH, MessageType.ENVIO_BATCH_SECUENCIADO, MessageType.ENVIO_BATCH],
+                         [mensaje.tipo_mensaje for mensaje in mensajes])
+        self.assertEqual(8, mensajes[1].secuencia)
+        for mensaje in mensajes:
+            self.assertEqual([str(30904465 + i) for i in range(50)], [bet.document for bet in mensaje.apuestas])
+            self.assertEqual('Pérez', mensaje.apuestas[49].last_name)
+
+    def test_codec_desconocido_se_responde_sin_compresion(self):
+        self.cliente.sendall(bytes([MessageType.NEGOCIACION_COMPRESION, 99]))
+        self.cliente.sendall(_frame_comprimido(zlib.compressobj(), _envio_batch(1, [])))
+
+        with self.assertRaises(InvalidServerMessage):
+            self.communication.leer_mensaje_socket()
+        self.assertEqual(bytes([MessageType.NEGOCIACION_COMPRESION, COMPRESION_NINGUNA]), self.cliente.recv(2))
+
+    def test_frame_comprimido_solo_admite_batches(self):
+        compresor = zlib.compressobj()
+        self.cliente.sendall(bytes([MessageType.NEGOCIACION_COMPRESION, COMPRESION_ZLIB]))
+        self.cliente.sendall(_frame_comprimido(compresor, bytes([MessageType.SOLICITUD_GANADORES]) + (2).to_bytes(4, 'big')))
+        with self.assertRaises(ValueError):
+            self.communication.leer_mensaje_socket()
+
+    def test_confirmacion_secuencia_serializada(self):
+        self.communication.send_confirmacion_secuencia(7, 5, 1)
+        self.assertEqual(bytes([MessageType.CONFIRMACION_SECUENCIA]) + (7).to_bytes(4, 'big') + (5).to_bytes(4, 'big') + b'\x01',
+                         self.cliente.recv(10))
+
+    def test_respuesta_ganadores_serializada(self):
+        dnis = [30904465, 1, 2 ** 32 - 1]
+        self.communication.send_ganadores_serializados(serializar_respuesta_ganadores(dnis))
+        esperado = bytes([MessageType.RESPUESTA_GANADORES]) + (3).to_bytes(4, 'big') + b''.join(dni.to_bytes(4, 'big') for dni in dnis)
+        self.assertEqual(esperado, self.cliente.recv(len(esperado) + 1))
+
+    def test_salida_encolada_se_envia_junta_y_en_orden(self):
+        self.communication.encolar_confirmacion_secuencia(1, 1)
+        self.communication.encolar_confirmacion_secuencia(2, 2)
+        self.communication.send_confirmacion_recepcion_ok()
+
+        esperado = b''.join(bytes([MessageType.CONFIRMACION_SECUENCIA]) + (secuencia).to_bytes(4, 'big') * 2 + b'\x00' for secuencia in (1, 2))
+        esperado += bytes([MessageType.CONFIRMACION_RECEPCION, 0])
+        recibido = b''
+        while len(recibido) < len(esperado):
+            recibido += self.cliente.recv(len(esperado))
+        self.assertEqual(esperado, recibido)
+
+    def test_envio_parcial_descarta_solo_lo_enviado(self):
+        restantes = [bytes(b) for b in _descartar_enviados([b'abc', b'de', b'fgh'], 4)]
+        self.assertEqual([b'e', b'fgh'], restantes)
+        self.assertEqual([b'fgh'], _descartar_enviados([b'abc', b'de', b'fgh'], 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
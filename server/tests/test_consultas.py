@@ -0,0 +1,96 @@
+from common import consultas
+from common.consultas import IndiceApuestas, ruta_indice
+from common.server import Server
+from common.utils import LOTTERY_WINNER_NUMBER, Bet, BetBatch, store_bets
+import json
+import os
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+
+def _bet(agencia, documento, numero):
+    return Bet(agencia, 'nombre', 'apellido', str(documento), '2000-01-01', numero)
+
+
+def _consultar(puerto, ruta):
+    with urllib.request.urlopen(f"http://127.0.0.1:{puerto}{ruta}") as respuesta:
+        return json.loads(respuesta.read())
+
+
+class TestConsultas(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def test_indice_por_agencia_documento_y_numero(self):
+        indice = IndiceApuestas()
+        indice.agregar([_bet(1, 100, 5), _bet(1, 101, LOTTERY_WINNER_NUMBER)])
+        indice.agregar(BetBatch.from_bets([_bet(2, 100, 7), _bet(2, 200, 5)]))
+
+        self.assertEqual({1: 2, 2: 2}, indice.cantidades_por_agencia())
+        self.assertEqual(0, indice.cantidad_de_agencia(3))
+        # Un documento que apostó en dos agencias
+        self.assertEqual([(1, 5), (2, 7)], indice.por_documento(100))
+        self.assertEqual([(1, LOTTERY_WINNER_NUMBER)], indice.por_documento(101))
+        self.assertEqual([], indice.por_documento(999))
+        self.assertEqual([(1, 100), (2, 200)], indice.por_numero(5))
+
+    def test_indice_guardado_solo_se_carga_para_el_mismo_log(self):
+        indice = IndiceApuestas()
+        indice.agregar([_bet(1, 100, 5), _bet(1, 100, 6), _bet(2, 2 ** 32 - 1, 5)])
+        indice.guardar('bets.csv.indice', 1234)
+
+        cargado = IndiceApuestas.cargar('bets.csv.indice', 1234)
+        self.assertEqual({1: 2, 2: 1}, cargado.cantidades_por_agencia())
+        self.assertEqual([(1, 5), (1, 6)], cargado.por_documento(100))
+        self.assertEqual([(1, 100), (2, 2 ** 32 - 1)], cargado.por_numero(5))
+        self.assertIsNone(IndiceApuestas.cargar('bets.csv.indice', 1235))
+        self.assertIsNone(IndiceApuestas.cargar('otro.indice', 1234))
+
+    def test_servidor_publica_y_guarda_el_indice(self):
+        store_bets([_bet(1, 100, 5)])
+        server = Server(0, 5, 1, indice_apuestas=True)
+        http = consultas.iniciar_servidor_http(0, server.indice_apuestas)
+        puerto = http.server_address[1]
+        try:
+            # La apuesta que ya estaba en el archivo, y las que se almacenan despues
+            server.almacenar_bets([_bet(1, 101, 5), _bet(1, 102, LOTTERY_WINNER_NUMBER)])
+            server.almacenar_bets([_bet(2, 100, 9)])
+
+            self.assertEqual({"1": 3, "2": 1}, _consultar(puerto, "/apuestas/agencias"))
+            self.assertEqual({"agencia": 2, "apuestas": 1}, _consultar(puerto, "/apuestas/agencias/2"))
+            self.assertEqual({"documento": 100, "apuestas": [{"agencia": 1, "numero": 5}, {"agencia": 2, "numero": 9}]},
+                             _consultar(puerto, "/apuestas/documentos/100"))
+            self.assertEqual({"numero": 5, "apuestas": [{"agencia": 1, "documento": 100}, {"agencia": 1, "documento": 101}]},
+                             _consultar(puerto, "/apuestas/numeros/5"))
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                _consultar(puerto, "/apuestas/numeros/x")
+            self.assertEqual(400, error.exception.code)
+        finally:
+            http.shutdown()
+            http.server_close()
+            server._cerrar_almacenamiento()
+            server._server_socket.close()
+
+        self.assertTrue(os.path.exists(ruta_indice('bets.csv')))
+        with self.assertLogs(level='INFO') as logs:
+            reiniciado = Server(0, 5, 1, indice_apuestas=True)
+        try:
+            # Se carga el indice guardado, sin recorrer el archivo de apuestas
+            self.assertTrue(any('recuperar_indice_apuestas | result: success | origen:' in linea for linea in logs.output))
+            self.assertEqual({1: 3, 2: 1}, reiniciado.indice_apuestas.cantidades_por_agencia())
+        finally:
+            reiniciado._bet_writer.cerrar()
+            reiniciado._server_socket.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
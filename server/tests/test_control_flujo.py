@@ -0,0 +1,102 @@
+from common.bet_writer import BetWriter
+from common.client_handler import ClientHandler
+from common.communication import MessageType
+from common.control_flujo import ControlFlujo, LimitesPendientes
+from common.server import Server
+from common.utils import Bet
+from test_async_server import _recv_exacto
+from test_pool_handlers import _PROGRESO, _consulta_progreso
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+
+def _bets(cantidad):
+    return [Bet(1, 'first', 'last', str(i), '2000-12-20', i) for i in range(cantidad)]
+
+
+class TestControlFlujo(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def test_pausa_en_la_marca_alta_y_reanuda_en_la_baja(self):
+        control = ControlFlujo(LimitesPendientes(bytes_alto=1000, apuestas_alto=0, bytes_bajo=200))
+        cambios = []
+        control.suscribir(lambda: cambios.append(control.pausado))
+
+        control.agregar(600, 10)
+        self.assertFalse(control.pausado)
+        # Sin marca alta de apuestas, solo cuentan los bytes
+        control.agregar(400, 10 ** 9)
+        self.assertTrue(control.pausado)
+        control.quitar(600, 10)
+        # Por encima de la marca baja sigue pausado
+        self.assertTrue(control.pausado)
+
+        esperando = threading.Thread(target=control.esperar_reanudacion)
+        esperando.start()
+        esperando.join(0.05)
+        self.assertTrue(esperando.is_alive())
+
+        control.quitar(300, 10 ** 9)
+        esperando.join(5)
+        self.assertFalse(esperando.is_alive())
+        self.assertEqual((100, 0), control.pendientes())
+        self.assertEqual([True, False], cambios)
+
+    def test_limites_invalidos(self):
+        with self.assertRaises(ValueError):
+            LimitesPendientes(bytes_alto=-1)
+        with self.assertRaises(ValueError):
+            LimitesPendientes(apuestas_alto=10, apuestas_bajo=11)
+
+    def test_bet_writer_cuenta_los_batches_hasta_que_son_durables(self):
+        control = ControlFlujo(LimitesPendientes(bytes_alto=0, apuestas_alto=5, apuestas_bajo=0))
+        writer = BetWriter('bets.csv', control_flujo=control)
+        # El writer todavía no escribe: es un almacenamiento trabado
+        futuros = [writer.encolar(_bets(2), tamanio=100) for _ in range(3)]
+        self.assertEqual((300, 6), control.pendientes())
+        self.assertTrue(control.pausado)
+
+        writer.start()
+        for futuro in futuros:
+            futuro.result(timeout=5)
+        writer.cerrar()
+        self.assertEqual((0, 0), control.pendientes())
+        self.assertFalse(control.pausado)
+
+    def test_handler_no_lee_la_conexion_mientras_la_lectura_esta_pausada(self):
+        server = Server(0, 5, 1)
+        cliente, servidor = socket.socketpair()
+        handler = ClientHandler(servidor, server, "handler-prueba")
+        hilo = threading.Thread(target=handler.run)
+        try:
+            server.control_flujo.agregar(10 ** 9, 0)
+            hilo.start()
+            cliente.sendall(_consulta_progreso(1))
+            cliente.settimeout(0.2)
+            with self.assertRaises(socket.timeout):
+                cliente.recv(1)
+
+            # Al bajar lo pendiente, el handler lee la consulta que esperaba en el socket
+            server.control_flujo.quitar(10 ** 9, 0)
+            cliente.settimeout(5)
+            self.assertEqual(MessageType.PROGRESO, _recv_exacto(cliente, _PROGRESO.size)[0])
+        finally:
+            cliente.close()
+            hilo.join(5)
+            server._cerrar_almacenamiento()
+            server._server_socket.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from common import escaneo
+from common.bet_log import BINARY_STORAGE, CSV_STORAGE, MAGIC, format_bets_binary
+from common.sorteo import ColumnasApuestas, evaluar_sorteo
+from common.utils import LOTTERY_WINNER_NUMBER, Bet, format_bets
+import os
+import random
+import tempfile
+import unittest
+
+
+def _apuestas(cantidad):
+    aleatorio = random.Random(7574)
+    # Numeros que contienen al ganador sin serlo, que no deben contar
+    numeros = (LOTTERY_WINNER_NUMBER, 1, LOTTERY_WINNER_NUMBER * 10, int(f"1{LOTTERY_WINNER_NUMBER}"))
+    return [Bet(aleatorio.randrange(1, 6), 'nombre', 'apellido', 10000000 + i, '2000-01-01', aleatorio.choice(numeros)) for i in range(cantidad)]
+
+
+def _secuencial(formato):
+    columnas = ColumnasApuestas.desde_registros(formato.scan_bets(formato.filepath))
+    return len(columnas), {agencia: list(dnis) for agencia, dnis in evaluar_sorteo(columnas).items()}
+
+
+class TestEscaneo(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+        self.umbrales = (escaneo.TAMANIO_MINIMO_PARALELO, escaneo.TAMANIO_MINIMO_PORCION)
+
+    def tearDown(self):
+        escaneo.TAMANIO_MINIMO_PARALELO, escaneo.TAMANIO_MINIMO_PORCION = self.umbrales
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def test_escaneo_en_paralelo_coincide_con_el_secuencial(self):
+        with open(CSV_STORAGE.filepath, 'w') as archivo:
+            archivo.write(format_bets(_apuestas(3000)))
+            # Filas escritas a mano con fin de linea \n, y una ultima sin fin de linea
+            archivo.write(f"2,n,a,1,2000-01-01,{LOTTERY_WINNER_NUMBER}\n3,n,a,2,2000-01-01,{LOTTERY_WINNER_NUMBER}")
+        escaneo.TAMANIO_MINIMO_PARALELO = escaneo.TAMANIO_MINIMO_PORCION = 1024
+
+        esperado = _secuencial(CSV_STORAGE)
+        for procesos in (1, 3):
+            with self.subTest(procesos=procesos):
+                self.assertEqual(esperado, escaneo.escanear_ganadores(CSV_STORAGE, procesos))
+        self.assertEqual(3002, esperado[0])
+
+    def test_campos_entre_comillas_usan_el_recorrido_secuencial(self):
+        apuestas = _apuestas(100) + [Bet(1, 'nombre, con coma', f"x,{LOTTERY_WINNER_NUMBER}\r\n", 1, '2000-01-01', 1)]
+        with open(CSV_STORAGE.filepath, 'w') as archivo:
+            archivo.write(format_bets(apuestas))
+        escaneo.TAMANIO_MINIMO_PARALELO = escaneo.TAMANIO_MINIMO_PORCION = 1024
+
+        self.assertEqual(_secuencial(CSV_STORAGE), escaneo.escanear_ganadores(CSV_STORAGE, 3))
+
+    def test_log_binario(self):
+        with open(BINARY_STORAGE.filepath, 'wb') as archivo:
+            archivo.write(MAGIC + format_bets_binary(_apuestas(500)))
+
+        self.assertEqual(_secuencial(BINARY_STORAGE), escaneo.escanear_ganadores(BINARY_STORAGE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+from common import metricas
+from common.server import Server
+from common.utils import LOTTERY_WINNER_NUMBER
+from test_async_server import _agencia, _cerrar_socket_servidor
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+
+class TestMetricas(unittest.TestCase):
+
+    def test_contador_por_etiqueta(self):
+        contador = metricas.Contador("prueba_total", "Contador de prueba.", ("agencia",))
+        contador.inc(3, (2,))
+        contador.inc(1, (1,))
+        contador.inc(2, (2,))
+
+        self.assertEqual(5, contador.valor((2,)))
+        self.assertEqual([
+            "# HELP loteria_prueba_total Contador de prueba.",
+            "# TYPE loteria_prueba_total counter",
+            'loteria_prueba_total{agencia="1"} 1',
+            'loteria_prueba_total{agencia="2"} 5',
+        ], contador.exportar())
+
+    def test_histograma_acumula_buckets(self):
+        histograma = metricas.Histograma("prueba_segundos", "Histograma de prueba.", (0.1, 1.0))
+        for valor in (0.05, 0.1, 0.5, 3.0):
+            histograma.observar(valor)
+
+        self.assertEqual(4, histograma.cantidad)
+        self.assertEqual([
+            'loteria_prueba_segundos_bucket{le="0.1"} 2',
+            'loteria_prueba_segundos_bucket{le="1.0"} 3',
+            'loteria_prueba_segundos_bucket{le="+Inf"} 4',
+            "loteria_prueba_segundos_sum 3.65",
+            "loteria_prueba_segundos_count 4",
+        ], histograma.exportar()[2:])
+
+    def test_endpoint_http_con_metricas_del_servidor(self):
+        directorio_original = os.getcwd()
+        with tempfile.TemporaryDirectory() as directorio:
+            os.chdir(directorio)
+            try:
+                apuestas_previas = metricas.APUESTAS_ALMACENADAS.valor((7,))
+                sorteos_previos = metricas.SORTEO.cantidad
+                server = Server(0, 5, 1)
+                self.addCleanup(_cerrar_socket_servidor, server)
+                puerto = server._server_socket.getsockname()[1]
+                resultados = {}
+                hilo = threading.Thread(target=_agencia, args=(puerto, 7, [(1, LOTTERY_WINNER_NUMBER), (2, 1)], resultados))
+                hilo.start()
+                server.run()
+                hilo.join()
+            finally:
+                os.chdir(directorio_original)
+
+        self.assertEqual(apuestas_previas + 2, metricas.APUESTAS_ALMACENADAS.valor((7,)))
+        self.assertEqual(sorteos_previos + 1, metricas.SORTEO.cantidad)
+        self.assertEqual(0, metricas.HANDLERS_ACTIVOS.valor())
+
+        servidor_http = metricas.iniciar_servidor_http(0)
+        try:
+            url = f"http://127.0.0.1:{servidor_http.server_address[1]}"
+            with urllib.request.urlopen(url + "/metrics", timeout=5) as respuesta:
+                cuerpo = respuesta.read().decode('utf-8')
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/otra", timeout=5)
+        finally:
+            servidor_http.shutdown()
+            servidor_http.server_close()
+
+        self.assertIn('loteria_apuestas_almacenadas_total{agencia="7"}', cuerpo)
+        self.assertIn('loteria_bytes_recibidos_total{agencia="7"}', cuerpo)
+        self.assertIn("# TYPE loteria_sorteo_segundos histogram", cuerpo)
+        self.assertIn("loteria_handlers_activos 0", cuerpo)
+
+
+if __name__ == '__main__':
+    unittest.main()
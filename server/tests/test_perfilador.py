@@ -0,0 +1,101 @@
+from common import perfilador
+from common.perfilador import Perfilador
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+def _ocupado(hasta):
+    while time.monotonic() < hasta:
+        pass
+
+
+class TestPerfilador(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directorio.cleanup()
+
+    def test_captura_escribe_pilas_colapsadas_speedscope_y_fases(self):
+        fin = time.monotonic() + 0.3
+        hilos = [threading.Thread(target=_ocupado, args=(fin,), name=f"handler-{numero}") for numero in (1, 2)]
+        for hilo in hilos:
+            hilo.start()
+
+        def ingesta():
+            time.sleep(0.05)
+            with perfilador.fase("ingesta"):
+                time.sleep(0.01)
+            with perfilador.fase("ganadores", "conexion-1"):
+                pass
+        registrador = threading.Thread(target=ingesta, name="handler-3")
+        registrador.start()
+
+        ruta = Perfilador(0.2, 0.005, self.directorio.name).capturar()
+        registrador.join()
+        for hilo in hilos:
+            hilo.join()
+
+        with open(ruta + ".folded") as archivo:
+            lineas = archivo.read().splitlines()
+        # Los threads handler-N se agrupan en una unica raiz
+        ocupado = [linea for linea in lineas if linea.startswith("handler;") and "_ocupado (test_perfilador.py:" in linea]
+        self.assertTrue(ocupado)
+        self.assertTrue(all(int(linea.rsplit(" ", 1)[1]) > 0 for linea in lineas))
+
+        with open(ruta + ".speedscope.json") as archivo:
+            speedscope = json.load(archivo)
+        perfil = next(perfil for perfil in speedscope["profiles"] if perfil["name"] == "handler")
+        self.assertEqual(len(perfil["samples"]), len(perfil["weights"]))
+        nombres = {speedscope["shared"]["frames"][indice]["name"] for pila in perfil["samples"] for indice in pila}
+        self.assertIn("_ocupado", nombres)
+
+        with open(ruta + ".fases.json") as archivo:
+            eventos = json.load(archivo)["traceEvents"]
+        pistas = {evento["tid"]: evento["args"]["name"] for evento in eventos if evento["ph"] == "M"}
+        spans = {evento["name"]: evento for evento in eventos if evento["ph"] == "X"}
+        self.assertEqual({"ingesta", "ganadores"}, set(spans))
+        self.assertEqual("handler-3", pistas[spans["ingesta"]["tid"]])
+        self.assertEqual("conexion-1", pistas[spans["ganadores"]["tid"]])
+        self.assertGreaterEqual(spans["ingesta"]["dur"], 10000)
+
+    def test_fase_fuera_de_una_captura_no_registra_nada(self):
+        with perfilador.fase("sorteo"):
+            pass
+        ruta = Perfilador(0.01, 0.005, self.directorio.name).capturar()
+        with open(ruta + ".fases.json") as archivo:
+            self.assertEqual([], json.load(archivo)["traceEvents"])
+        self.assertIsNone(perfilador._captura_activa)
+
+    def test_capturas_seguidas_no_se_pisan(self):
+        perfilador = Perfilador(0.01, 0.005, self.directorio.name)
+        rutas = {perfilador.capturar() for _ in range(3)}
+        self.assertEqual(3, len(rutas))
+        self.assertEqual(9, len(os.listdir(self.directorio.name)))
+
+    def test_thread_se_inicia_con_la_primera_solicitud(self):
+        perfilador = Perfilador(0.01, 0.005, self.directorio.name)
+        perfilador.iniciar()
+        self.assertNotIn("perfilador", [hilo.name for hilo in threading.enumerate()])
+
+        perfilador.solicitar_captura()
+        fin = time.monotonic() + 5
+        while len(os.listdir(self.directorio.name)) < 3 and time.monotonic() < fin:
+            time.sleep(0.01)
+        self.assertEqual(3, len(os.listdir(self.directorio.name)))
+        self.assertIn("perfilador", [hilo.name for hilo in threading.enumerate()])
+
+    def test_parametros_invalidos(self):
+        with self.assertRaises(ValueError):
+            Perfilador(duracion=0)
+        with self.assertRaises(ValueError):
+            Perfilador(intervalo=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+from common.async_server import AsyncServer
+from common.communication import MessageType
+from common.secuencias import RegistroSecuencias
+from common.server import Server, completar_al_escribir
+from common.utils import LOTTERY_WINNER_NUMBER, Bet, load_bets
+from test_async_server import _cerrar_socket_servidor, _recv_exacto
+from test_communication import _envio_batch_secuenciado
+import concurrent.futures
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+_CONFIRMACION = struct.Struct('>BIIB')
+
+
+def _agencia_pipelined(puerto, secuencias, resultados):
+    """Envia todos los batches sin esperar confirmaciones, y despues lee todas."""
+    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+        for secuencia in secuencias:
+            numero = LOTTERY_WINNER_NUMBER if secuencia == 2 else secuencia
+            sock.sendall(_envio_batch_secuenciado(1, secuencia, [('n', 'a', 1000 + secuencia, '2000-01-01', numero)]))
+        confirmaciones = [_CONFIRMACION.unpack(_recv_exacto(sock, _CONFIRMACION.size)) for _ in secuencias]
+
+        fin = max(secuencias) + 1
+        sock.sendall(_envio_batch_secuenciado(1, fin, []))
+        confirmaciones.append(_CONFIRMACION.unpack(_recv_exacto(sock, _CONFIRMACION.size)))
+
+        while True:
+            sock.sendall(bytes([MessageType.SOLICITUD_GANADORES]) + (1).to_bytes(4, 'big'))
+            if _recv_exacto(sock, 1)[0] == MessageType.RESPUESTA_GANADORES:
+                break
+        cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+        resultados['confirmaciones'] = confirmaciones
+        resultados['ganadores'] = [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)]
+
+
+class TestPipelined(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def _correr(self, clase_servidor):
+        server = clase_servidor(0, 5, 1)
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+        # La secuencia 3 se reenvia, como si el cliente no hubiera recibido su confirmacion
+        agencia = threading.Thread(target=_agencia_pipelined, args=(puerto, [1, 2, 3, 3, 4, 5], resultados))
+        agencia.start()
+        server.run()
+        agencia.join()
+        return resultados
+
+    def test_pipelined_descarta_duplicados(self):
+        for clase_servidor in (Server, AsyncServer):
+            with self.subTest(motor=clase_servidor.__name__):
+                resultados = self._correr(clase_servidor)
+
+                confirmaciones = resultados['confirmaciones']
+                self.assertEqual([1, 2, 3, 3, 4, 5, 6], sorted(secuencia for _, secuencia, _, _ in confirmaciones))
+                self.assertTrue(all(tipo == MessageType.CONFIRMACION_SECUENCIA and estado == 0 for tipo, _, _, estado in confirmaciones))
+                # Al completar la agencia, todos sus batches ya son durables
+                self.assertEqual(5, confirmaciones[-1][2])
+                self.assertEqual([1002], resultados['ganadores'])
+                self.assertEqual([1001, 1002, 1003, 1004, 1005], sorted(int(bet.document) for bet in load_bets()))
+                os.remove('bets.csv')
+
+
+class TestRegistroSecuencias(unittest.TestCase):
+
+    def test_acumulada_avanza_con_secuencias_fuera_de_orden(self):
+        registro = RegistroSecuencias()
+        for secuencia in (2, 1, 4):
+            futuro, duplicado = registro.reservar(1, secuencia)
+            self.assertFalse(duplicado)
+            registro.completar(1, secuencia)
+            futuro.result(timeout=1)
+        self.assertEqual(2, registro.acumulada(1))
+
+        registro.reservar(1, 3)
+        registro.completar(1, 3)
+        self.assertEqual(4, registro.acumulada(1))
+        self.assertEqual(0, registro.acumulada(2))
+
+    def test_reenvio_de_secuencia_en_curso_espera_al_original(self):
+        registro = RegistroSecuencias()
+        original, _ = registro.reservar(1, 1)
+        reenvio, duplicado = registro.reservar(1, 1)
+        self.assertTrue(duplicado)
+        self.assertIs(original, reenvio)
+
+    def test_secuencia_fallida_se_puede_reenviar(self):
+        registro = RegistroSecuencias()
+        futuro, _ = registro.reservar(1, 1)
+        registro.completar(1, 1, OSError("disk full"))
+        self.assertIsInstance(futuro.exception(timeout=1), OSError)
+        _, duplicado = registro.reservar(1, 1)
+        self.assertFalse(duplicado)
+
+    def test_fallo_al_indexar_completa_la_secuencia_con_el_error(self):
+        class IndiceRoto:
+            def agregar(self, bets):
+                raise MemoryError("indice lleno")
+
+        registro = RegistroSecuencias()
+        futuro, _ = registro.reservar(1, 1)
+        escritura = concurrent.futures.Future()
+        escritura.add_done_callback(completar_al_escribir(registro, (IndiceRoto(),), 1, 1, [Bet(1, 'n', 'a', '1', '2000-01-01', 1)], 0.0))
+        escritura.set_result(None)
+
+        self.assertIsInstance(futuro.exception(timeout=1), MemoryError)
+        self.assertEqual(0, registro.acumulada(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+from common.communication import RECHAZO_LIMITE_AGENCIA, RECHAZO_SERVIDOR_SATURADO, MessageType
+from common.pool_handlers import LimitesConexiones
+from common.server import Server
+from common.utils import LOTTERY_WINNER_NUMBER
+from test_async_server import _cerrar_socket_servidor, _envio_batch, _recv_exacto
+import os
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+_PROGRESO = struct.Struct('>BII?')
+
+
+def _consulta_progreso(id_agencia):
+    return bytes([MessageType.CONSULTA_PROGRESO]) + id_agencia.to_bytes(4, 'big')
+
+
+def _conectar_admitida(puerto, id_agencia):
+    """Conecta la agencia, reintentando mientras el servidor la rechace por estar saturado."""
+    while True:
+        sock = socket.create_connection(('127.0.0.1', puerto))
+        sock.sendall(_consulta_progreso(id_agencia))
+        tipo = _recv_exacto(sock, 1)[0]
+        if tipo == MessageType.PROGRESO:
+            _recv_exacto(sock, _PROGRESO.size - 1)
+            return sock
+        sock.close()
+        time.sleep(0.01)
+
+
+def _completar(sock, id_agencia, apuestas):
+    sock.sendall(_envio_batch(id_agencia, apuestas))
+    _recv_exacto(sock, 2)
+    sock.sendall(_envio_batch(id_agencia, []))
+    _recv_exacto(sock, 2)
+
+
+def _pedir_ganadores(sock, id_agencia):
+    while True:
+        sock.sendall(bytes([MessageType.SOLICITUD_GANADORES]) + id_agencia.to_bytes(4, 'big'))
+        if _recv_exacto(sock, 1)[0] == MessageType.RESPUESTA_GANADORES:
+            break
+    cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+    return [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)]
+
+
+class TestPoolHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def _correr(self, server, *agencias):
+        hilos = [threading.Thread(target=agencia) for agencia in agencias]
+        for hilo in hilos:
+            hilo.start()
+        server.run()
+        for hilo in hilos:
+            hilo.join()
+
+    def test_servidor_saturado_rechaza_la_conexion(self):
+        server = Server(0, 5, 2, limites=LimitesConexiones(handlers=1, cola=0))
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+
+        def agencias():
+            with _conectar_admitida(puerto, 1) as primera:
+                # El unico handler está ocupado y no hay cola: la conexion se rechaza sin leer nada
+                with socket.create_connection(('127.0.0.1', puerto)) as rechazada:
+                    resultados['rechazo'] = _recv_exacto(rechazada, 2)
+                    resultados['cierre'] = rechazada.recv(1)
+                _completar(primera, 1, [(11, LOTTERY_WINNER_NUMBER)])
+
+            # Al cerrarse la primera conexion se libera el handler para la segunda agencia
+            with _conectar_admitida(puerto, 2) as segunda:
+                _completar(segunda, 2, [(21, LOTTERY_WINNER_NUMBER)])
+                resultados[2] = _pedir_ganadores(segunda, 2)
+
+        self._correr(server, agencias)
+
+        self.assertEqual(bytes([MessageType.CONEXION_RECHAZADA, RECHAZO_SERVIDOR_SATURADO]), resultados['rechazo'])
+        self.assertEqual(b'', resultados['cierre'])
+        self.assertEqual([21], resultados[2])
+
+    def test_limite_de_conexiones_por_agencia(self):
+        server = Server(0, 5, 2, limites=LimitesConexiones(por_agencia=1))
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+
+        def agencias():
+            with _conectar_admitida(puerto, 1) as primera:
+                with socket.create_connection(('127.0.0.1', puerto)) as repetida:
+                    repetida.sendall(_consulta_progreso(1))
+                    resultados['rechazo'] = _recv_exacto(repetida, 2)
+                # La conexion rechazada no cuenta: el servidor acepta la de la segunda agencia
+                with _conectar_admitida(puerto, 2) as segunda:
+                    _completar(primera, 1, [(11, LOTTERY_WINNER_NUMBER)])
+                    _completar(segunda, 2, [(21, LOTTERY_WINNER_NUMBER)])
+                    resultados[1] = _pedir_ganadores(primera, 1)
+
+        self._correr(server, agencias)
+
+        self.assertEqual(bytes([MessageType.CONEXION_RECHAZADA, RECHAZO_LIMITE_AGENCIA]), resultados['rechazo'])
+        self.assertEqual([11], resultados[1])
+
+    def test_conexion_trabada_se_cierra_por_timeout(self):
+        server = Server(0, 5, 1, limites=LimitesConexiones(espera_inactividad=5, espera_lectura=0.1))
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+
+        def agencia():
+            with socket.create_connection(('127.0.0.1', puerto)) as trabada:
+                # Un mensaje a medio enviar: el servidor la cierra al vencer la espera de lectura
+                trabada.sendall(_envio_batch(1, [(11, 1)])[:7])
+                inicio = time.monotonic()
+                resultados['cierre'] = trabada.recv(1)
+                resultados['espera'] = time.monotonic() - inicio
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        self._correr(server, agencia)
+
+        self.assertEqual(b'', resultados['cierre'])
+        self.assertLess(resultados['espera'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+from common.communication import MessageType, RondaNoDisponible
+from common.rondas import ServidorRondas
+from common.utils import LOTTERY_WINNER_NUMBER, Bet, load_bets
+from test_async_server import _agencia, _cerrar_socket_servidor, _envio_batch, _recv_exacto
+import glob
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+
+def _solicitud_ganadores_ronda(id_agencia, ronda):
+    return bytes([MessageType.SOLICITUD_GANADORES_RONDA]) + id_agencia.to_bytes(4, 'big') + ronda.to_bytes(4, 'big')
+
+
+def _agencia_adelantada(puerto, rondas, consultadas, resultados):
+    """Completa todas sus rondas sin esperar los sorteos, y despues pide los ganadores de algunas."""
+    with socket.create_connection(('127.0.0.1', puerto)) as sock:
+        for ronda in rondas:
+            sock.sendall(_envio_batch(1, [(100 + ronda, LOTTERY_WINNER_NUMBER), (200 + ronda, 1)]))
+            _recv_exacto(sock, 2)
+            sock.sendall(_envio_batch(1, []))
+            _recv_exacto(sock, 2)
+
+        for ronda in consultadas:
+            while True:
+                sock.sendall(_solicitud_ganadores_ronda(1, ronda))
+                tipo = _recv_exacto(sock, 1)[0]
+                if tipo != MessageType.SORTEO_NO_REALIZADO:
+                    break
+            cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+            resultados[ronda] = (tipo, [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)])
+
+
+class TestServidorRondas(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def _correr(self, server, *agencias):
+        hilos = [threading.Thread(target=agencia) for agencia in agencias]
+        for hilo in hilos:
+            hilo.start()
+        server.run()
+        for hilo in hilos:
+            hilo.join()
+
+    def test_rondas_con_ingesta_adelantada_y_retencion(self):
+        server = ServidorRondas(0, 5, 2, rondas=3, rondas_retenidas=2)
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        adelantada = {}
+        por_ronda = {}
+
+        def agencia_por_ronda():
+            # Una conexion por ronda, consultando los ganadores con SOLICITUD_GANADORES como el cliente Go
+            for ronda in (1, 2, 3):
+                resultados = {}
+                _agencia(puerto, 2, [(300 + ronda, LOTTERY_WINNER_NUMBER)], resultados)
+                por_ronda[ronda] = resultados[2][1]
+
+        self._correr(server, lambda: _agencia_adelantada(puerto, (1, 2, 3), (2, 3), adelantada), agencia_por_ronda)
+
+        self.assertEqual({2: (MessageType.RESPUESTA_GANADORES, [102]), 3: (MessageType.RESPUESTA_GANADORES, [103])}, adelantada)
+        self.assertEqual({1: [301], 2: [302], 3: [303]}, por_ronda)
+        self.assertEqual([103, 203, 303], sorted(int(bet.document) for bet in load_bets('bets.ronda-3.csv')))
+
+        # Solo se retienen las ultimas dos rondas, y no hay ronda 4
+        with self.assertRaises(RondaNoDisponible):
+            server.obtener_ganadores_de_ronda(1, 1)
+        self.assertEqual((103,), server.obtener_ganadores_de_ronda(1, 3))
+        with self.assertRaises(RondaNoDisponible):
+            server.obtener_ganadores_de_ronda(1, 4)
+
+    def test_numeracion_continua_despues_de_reiniciar(self):
+        open('bets.ronda-4.csv', 'w').close()
+        server = ServidorRondas(0, 5, 1, rondas=1)
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+
+        self._correr(server, lambda: _agencia(puerto, 1, [(111, LOTTERY_WINNER_NUMBER)], resultados))
+
+        self.assertEqual([111], resultados[1][1])
+        self.assertEqual(['111'], [bet.document for bet in load_bets('bets.ronda-5.csv')])
+        with self.assertRaises(RondaNoDisponible):
+            server.obtener_ganadores_de_ronda(1, 4)
+
+    def test_consultar_progreso_no_abre_una_ronda(self):
+        server = ServidorRondas(0, 5, 1, rondas=1)
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        resultados = {}
+
+        self._correr(server, lambda: _agencia(puerto, 1, [(111, 1)], resultados))
+
+        # Como el cliente Go al reconectarse despues de su ultima ronda
+        self.assertEqual((0, 0, False), server.progreso_agencia(1))
+        self.assertEqual(0, server.secuencia_acumulada(1))
+        self.assertEqual(['bets.ronda-1.csv'], glob.glob('bets.ronda-*.csv'))
+
+    def test_batch_de_una_ronda_ya_cerrada_se_rechaza(self):
+        server = ServidorRondas(0, 5, 1)
+        try:
+            # La agencia 2 no es de las que completan la ronda: reserva y la ronda se sortea antes de que encole
+            futuro, duplicado = server.reservar_secuencia(2, 1, 1)
+            self.assertFalse(duplicado)
+            server.marcar_agencia_completada(1)
+            self.assertTrue(server.sorteo_fue_realizado(1))
+
+            server.almacenar_bets_secuenciadas(2, 1, [Bet(2, 'n', 'a', '1', '2000-01-01', 1)])
+            with self.assertRaises(ValueError):
+                futuro.result(timeout=5)
+            self.assertEqual(0, server.secuencia_acumulada(2))
+        finally:
+            server._cerrar_listener()
+
+
+if __name__ == '__main__':
+    unittest.main()
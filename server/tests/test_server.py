@@ -0,0 +1,38 @@
+from common.server import SnapshotValue
+import threading
+import unittest
+
+
+class TestSnapshotValue(unittest.TestCase):
+
+    def test_get_devuelve_el_valor_publicado_sin_copiarlo(self):
+        valor = frozenset({1, 2})
+        snapshot = SnapshotValue(valor)
+        self.assertIs(valor, snapshot.get())
+
+    def test_update_concurrente_no_pierde_actualizaciones(self):
+        snapshot = SnapshotValue(frozenset())
+
+        def agregar(desde):
+            for i in range(desde, desde + 200):
+                snapshot.update(lambda s: s | {i})
+
+        hilos = [threading.Thread(target=agregar, args=(t * 200,)) for t in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(frozenset(range(1600)), snapshot.get())
+
+    def test_lector_conserva_su_snapshot_despues_de_un_set(self):
+        snapshot = SnapshotValue((1, 2))
+        leido = snapshot.get()
+        snapshot.set((3,))
+
+        self.assertEqual((1, 2), leido)
+        self.assertEqual((3,), snapshot.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
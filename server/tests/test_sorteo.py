@@ -0,0 +1,55 @@
+from common.sorteo import *
+from common.utils import LOTTERY_WINNER_NUMBER
+import random
+import unittest
+
+
+def _registros():
+    aleatorio = random.Random(7574)
+    registros = [(aleatorio.randrange(1, 6), 10000000 + i, aleatorio.choice((LOTTERY_WINNER_NUMBER, 1, 2, 3))) for i in range(2000)]
+    # Dos numeros consecutivos cuyos bytes contienen al numero ganador desalineado, que no debe contar
+    registros.append((1, 1, LOTTERY_WINNER_NUMBER << 8))
+    registros.append((1, 2, 256))
+    return registros
+
+
+def _esperados(registros, numeros_ganadores):
+    esperados = {}
+    for agencia, documento, numero in registros:
+        if numero in numeros_ganadores:
+            esperados.setdefault(agencia, []).append(documento)
+    return {agencia: tuple(dnis) for agencia, dnis in esperados.items()}
+
+
+class TestEvaluarSorteo(unittest.TestCase):
+
+    def _caminos(self):
+        return (False, True) if numpy is not None else (False,)
+
+    def test_un_numero_ganador_coincide_con_has_won(self):
+        registros = _registros()
+        columnas = ColumnasApuestas.desde_registros(registros)
+        for usar_numpy in self._caminos():
+            with self.subTest(usar_numpy=usar_numpy):
+                self.assertEqual(_esperados(registros, {LOTTERY_WINNER_NUMBER}), evaluar_sorteo(columnas, usar_numpy=usar_numpy))
+
+    def test_varios_numeros_ganadores_conservan_el_orden(self):
+        registros = _registros()
+        columnas = ColumnasApuestas.desde_registros(registros)
+        for usar_numpy in self._caminos():
+            with self.subTest(usar_numpy=usar_numpy):
+                self.assertEqual(_esperados(registros, {LOTTERY_WINNER_NUMBER, 2}), evaluar_sorteo(columnas, (LOTTERY_WINNER_NUMBER, 2), usar_numpy=usar_numpy))
+
+    def test_sin_apuestas_no_hay_ganadores(self):
+        for usar_numpy in self._caminos():
+            with self.subTest(usar_numpy=usar_numpy):
+                self.assertEqual({}, evaluar_sorteo(ColumnasApuestas(), usar_numpy=usar_numpy))
+
+    @unittest.skipIf(numpy is not None, "NumPy is installed")
+    def test_forzar_numpy_sin_numpy_falla(self):
+        with self.assertRaises(RuntimeError):
+            evaluar_sorteo(ColumnasApuestas(), usar_numpy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
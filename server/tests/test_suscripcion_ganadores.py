@@ -0,0 +1,97 @@
+from common.async_server import AsyncServer
+from common.communication import MessageType
+from common.server import Server
+from common.utils import LOTTERY_WINNER_NUMBER, STORAGE_FILEPATH
+from test_async_server import _agencia, _cerrar_socket_servidor, _envio_batch, _recv_exacto
+import os
+import socket
+import threading
+import time
+import unittest
+
+
+def _suscripcion(id_agencia, espera_ms):
+    return bytes([MessageType.SUSCRIPCION_GANADORES]) + id_agencia.to_bytes(4, 'big') + espera_ms.to_bytes(4, 'big')
+
+
+def _completar_envio(sock, id_agencia, apuestas):
+    sock.sendall(_envio_batch(id_agencia, apuestas))
+    _recv_exacto(sock, 2)
+    sock.sendall(_envio_batch(id_agencia, []))
+    _recv_exacto(sock, 2)
+
+
+def _leer_ganadores(sock):
+    cantidad = int.from_bytes(_recv_exacto(sock, 4), 'big')
+    return [int.from_bytes(_recv_exacto(sock, 4), 'big') for _ in range(cantidad)]
+
+
+class TestSuscripcionGanadores(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(STORAGE_FILEPATH):
+            os.remove(STORAGE_FILEPATH)
+
+    def _correr(self, server, agencia_suscripta):
+        self.addCleanup(_cerrar_socket_servidor, server)
+        puerto = server._server_socket.getsockname()[1]
+        # La agencia 2 recien se conecta cuando la 1 ya está suscripta
+        suscripta = threading.Event()
+        resultados = {}
+
+        def agencia_tardia():
+            suscripta.wait()
+            _agencia(puerto, 2, [(221, 2)], resultados)
+
+        hilos = [threading.Thread(target=agencia_suscripta, args=(puerto, suscripta, resultados)),
+                 threading.Thread(target=agencia_tardia)]
+        for hilo in hilos:
+            hilo.start()
+        server.run()
+        for hilo in hilos:
+            hilo.join()
+        return resultados
+
+    def test_suscripcion_recibe_ganadores_al_realizarse_el_sorteo(self):
+        def agencia_suscripta(puerto, suscripta, resultados):
+            with socket.create_connection(('127.0.0.1', puerto)) as sock:
+                _completar_envio(sock, 1, [(111, LOTTERY_WINNER_NUMBER)])
+                sock.sendall(_suscripcion(1, 10000))
+                suscripta.set()
+                # Una unica suscripcion: la respuesta llega cuando se realiza el sorteo
+                resultados['tipo'] = _recv_exacto(sock, 1)[0]
+                resultados['ganadores'] = _leer_ganadores(sock)
+
+        for clase_servidor in (Server, AsyncServer):
+            with self.subTest(motor=clase_servidor.__name__):
+                resultados = self._correr(clase_servidor(0, 5, 2), agencia_suscripta)
+                self.assertEqual(MessageType.RESPUESTA_GANADORES, resultados['tipo'])
+                self.assertEqual([111], resultados['ganadores'])
+                os.remove(STORAGE_FILEPATH)
+
+    def test_suscripcion_vence_con_la_espera_maxima_del_servidor(self):
+        def agencia_suscripta(puerto, suscripta, resultados):
+            with socket.create_connection(('127.0.0.1', puerto)) as sock:
+                _completar_envio(sock, 1, [(111, LOTTERY_WINNER_NUMBER)])
+                inicio = time.monotonic()
+                sock.sendall(_suscripcion(1, 60000))
+                resultados['vencida'] = (_recv_exacto(sock, 1)[0], time.monotonic() - inicio)
+                suscripta.set()
+                while True:
+                    sock.sendall(_suscripcion(1, 60000))
+                    if _recv_exacto(sock, 1)[0] == MessageType.RESPUESTA_GANADORES:
+                        break
+                resultados['ganadores'] = _leer_ganadores(sock)
+
+        for clase_servidor in (Server, AsyncServer):
+            with self.subTest(motor=clase_servidor.__name__):
+                resultados = self._correr(clase_servidor(0, 5, 2, max_espera_ganadores_ms=50), agencia_suscripta)
+                tipo, demora = resultados['vencida']
+                self.assertEqual(MessageType.SORTEO_NO_REALIZADO, tipo)
+                self.assertLess(demora, 10)
+                self.assertEqual([111], resultados['ganadores'])
+                os.remove(STORAGE_FILEPATH)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+from common.bet_log import BINARY_STORAGE, MAGIC, format_bets_binary
+from common.server import Server
+from common.utils import *
+from common.communication import serializar_respuesta_ganadores
+from common.winners import IndiceGanadores, ResultadoSorteo
+import os
+import unittest
+
+
+def _bet(agencia, documento, numero):
+    return Bet(str(agencia), 'first', 'last', str(documento), '2000-12-20', numero)
+
+
+class TestIndiceGanadores(unittest.TestCase):
+
+    def tearDown(self):
+        for filepath in (STORAGE_FILEPATH, BINARY_STORAGE.filepath):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def test_agregar_indexa_solo_ganadores_por_agencia(self):
+        indice = IndiceGanadores()
+        indice.agregar([_bet(1, 100, LOTTERY_WINNER_NUMBER), _bet(1, 101, 1), _bet(2, 200, LOTTERY_WINNER_NUMBER)])
+        indice.agregar([_bet(1, 102, LOTTERY_WINNER_NUMBER)])
+
+        self.assertEqual({1: (100, 102), 2: (200,)}, dict(indice.ganadores_por_agencia()))
+
+    def test_ganadores_por_agencia_es_un_snapshot(self):
+        indice = IndiceGanadores()
+        indice.agregar([_bet(1, 100, LOTTERY_WINNER_NUMBER)])
+        snapshot = indice.ganadores_por_agencia()
+        indice.agregar([_bet(1, 101, LOTTERY_WINNER_NUMBER), _bet(2, 200, LOTTERY_WINNER_NUMBER)])
+
+        self.assertEqual({1: (100,)}, dict(snapshot))
+        with self.assertRaises(TypeError):
+            snapshot[2] = (200,)
+
+    def test_reconstruir_desde_el_log_coincide_con_el_incremental(self):
+        batches = [[_bet(a, a * 1000 + i, LOTTERY_WINNER_NUMBER if i % 3 == 0 else i) for i in range(10)] for a in range(1, 4)]
+        incremental = IndiceGanadores()
+        for batch in batches:
+            store_bets(batch)
+            incremental.agregar(batch)
+
+        reconstruido = IndiceGanadores()
+        cantidad = reconstruido.reconstruir(load_bets())
+
+        self.assertEqual(30, cantidad)
+        self.assertEqual(dict(incremental.ganadores_por_agencia()), dict(reconstruido.ganadores_por_agencia()))
+
+    def test_server_recupera_el_indice_al_iniciar(self):
+        store_bets([_bet(1, 100, LOTTERY_WINNER_NUMBER), _bet(2, 200, 1)])
+        server = Server(0, 1, 1)
+        try:
+            self.assertEqual({1: (100,)}, dict(server._indice_ganadores.ganadores_por_agencia()))
+        finally:
+            server._bet_writer.cerrar()
+            server._server_socket.close()
+
+    def test_server_recupera_el_indice_desde_el_log_binario(self):
+        with open(BINARY_STORAGE.filepath, 'wb') as file:
+            file.write(MAGIC + format_bets_binary([_bet(1, 100, LOTTERY_WINNER_NUMBER), _bet(2, 200, 1)]))
+        server = Server(0, 1, 1, storage_format=BINARY_STORAGE)
+        try:
+            self.assertEqual({1: (100,)}, dict(server._indice_ganadores.ganadores_por_agencia()))
+        finally:
+            server._bet_writer.cerrar()
+            server._server_socket.close()
+
+    def test_resultado_sorteo_serializa_la_respuesta_de_cada_agencia(self):
+        indice = IndiceGanadores()
+        indice.agregar([_bet(1, 100, LOTTERY_WINNER_NUMBER), _bet(1, 101, LOTTERY_WINNER_NUMBER), _bet(2, 200, 1)])
+        resultado = ResultadoSorteo(indice.ganadores_por_agencia())
+
+        self.assertEqual((100, 101), resultado.ganadores(1))
+        self.assertEqual(serializar_respuesta_ganadores((100, 101)), resultado.respuesta(1))
+        # Se reutiliza el mismo frame en cada consulta
+        self.assertIs(resultado.respuesta(1), resultado.respuesta(1))
+        self.assertEqual((), resultado.ganadores(2))
+        self.assertEqual(serializar_respuesta_ganadores(()), resultado.respuesta(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from common.bet_log import CSV_STORAGE
+from common.secuencias import RegistroSecuencias
+from common.utils import LOTTERY_WINNER_NUMBER, load_bets
+from common.workers import WorkerPool, _unir_ganadores
+from test_async_server import _agencia, _recv_exacto
+from test_communication import _envio_batch_secuenciado
+from test_pipelined import _CONFIRMACION
+from test_pool_handlers import _PROGRESO, _consulta_progreso
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio_original = os.getcwd()
+        self.directorio = tempfile.TemporaryDirectory()
+        os.chdir(self.directorio.name)
+
+    def tearDown(self):
+        os.chdir(self.directorio_original)
+        self.directorio.cleanup()
+
+    def test_sorteo_global_con_varios_workers(self):
+        pool = WorkerPool(2, 0, 5, 4)
+        resultados = {}
+
+        def agencia(id_agencia, apuestas):
+            pool.listo.wait(timeout=10)
+            _agencia(pool.puerto, id_agencia, apuestas, resultados)
+
+        agencias = [threading.Thread(target=agencia, args=(i, [(i * 100 + 1, LOTTERY_WINNER_NUMBER), (i * 100 + 2, 1)]))
+                    for i in range(1, 5)]
+        for hilo in agencias:
+            hilo.start()
+        pool.run()
+        for hilo in agencias:
+            hilo.join()
+
+        for i in range(1, 5):
+            self.assertEqual([i * 100 + 1], resultados[i][1])
+
+        # Entre todos los shards están todas las apuestas, cada una una sola vez
+        documentos = []
+        for numero in (1, 2):
+            shard = CSV_STORAGE.shard(numero).filepath
+            if os.path.exists(shard):
+                documentos.extend(int(bet.document) for bet in load_bets(shard))
+        self.assertEqual(sorted(i * 100 + j for i in range(1, 5) for j in (1, 2)), sorted(documentos))
+
+    def _documentos_en_shards(self, workers):
+        documentos = []
+        for numero in range(1, workers + 1):
+            shard = CSV_STORAGE.shard(numero).filepath
+            if os.path.exists(shard):
+                documentos.extend(int(bet.document) for bet in load_bets(shard))
+        return sorted(documentos)
+
+    def test_reconexion_en_otro_worker_retoma_el_progreso_global(self):
+        # Cada reconexion puede caer en cualquier worker
+        pool = WorkerPool(2, 0, 5, 8)
+        progresos = []
+        confirmaciones = []
+
+        def agencia():
+            try:
+                pool.listo.wait(timeout=10)
+                with socket.create_connection(('127.0.0.1', pool.puerto)) as sock:
+                    sock.sendall(_envio_batch_secuenciado(1, 1, [('n', 'a', 101, '2000-01-01', 1), ('n', 'a', 102, '2000-01-01', 1)]))
+                    sock.sendall(_envio_batch_secuenciado(1, 2, [('n', 'a', 103, '2000-01-01', 1)]))
+                    for _ in range(2):
+                        _recv_exacto(sock, _CONFIRMACION.size)
+                for _ in range(6):
+                    with socket.create_connection(('127.0.0.1', pool.puerto)) as sock:
+                        sock.sendall(_consulta_progreso(1))
+                        progresos.append(_PROGRESO.unpack(_recv_exacto(sock, _PROGRESO.size))[1:])
+                        # Reenvia el ultimo batch, como si no hubiera recibido su confirmacion
+                        sock.sendall(_envio_batch_secuenciado(1, 2, [('n', 'a', 103, '2000-01-01', 1)]))
+                        confirmaciones.append(_CONFIRMACION.unpack(_recv_exacto(sock, _CONFIRMACION.size))[1:])
+            finally:
+                pool._detener(None, None)
+
+        hilo = threading.Thread(target=agencia)
+        hilo.start()
+        pool.run()
+        hilo.join()
+
+        self.assertEqual([(2, 3, False)] * 6, progresos)
+        self.assertEqual([(2, 2, 0)] * 6, confirmaciones)
+        self.assertEqual([101, 102, 103], self._documentos_en_shards(2))
+
+    def test_fusionar_incorpora_el_progreso_de_otro_registro(self):
+        otro = RegistroSecuencias()
+        otro.restaurar(1, {1: 10, 2: 20, 4: 40})
+        registro = RegistroSecuencias()
+        registro.restaurar(1, {1: 10, 3: 30})
+        registro.fusionar(1, *otro.exportar(1))
+        self.assertEqual((4, 100), registro.progreso(1))
+        self.assertTrue(registro.reservar(1, 4)[1])
+
+    def test_unir_ganadores_concatena_en_orden_de_worker(self):
+        self.assertEqual({1: (10, 11, 12), 2: (20,)}, _unir_ganadores({2: {1: (12,)}, 1: {1: (10, 11), 2: (20,)}}))
+
+
+if __name__ == '__main__':
+    unittest.main()